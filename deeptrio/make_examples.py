@@ -1655,8 +1655,7 @@ class OutputsWriter(object):
   def _write(self, writer_name, *protos):
     writer = self._writers[writer_name]
     if writer:
-      for proto in protos:
-        writer.write(proto)
+      writer.write_many(protos)
 
 
 def get_example_counts(examples):
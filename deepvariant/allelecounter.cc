@@ -274,28 +274,34 @@ ReadAllele AlleleCounter::MakeIndelReadAllele(const Read& read,
   return ReadAllele(interval_offset - 1, StrCat(prev_base, bases), type);
 }
 
+bool AlleleCounter::IsCountedReadAllele(
+    const std::vector<ReadAllele>& read_alleles, const size_t i) {
+  const ReadAllele& read_allele = read_alleles[i];
+
+  // The read can span beyond and after the interval, so don't add counts
+  // outside our interval boundaries.
+  if (read_allele.skip() || !IsValidRefOffset(read_allele.position())) {
+    return false;
+  }
+
+  // If sequential alleles have the same position, skip the first one. This
+  // occurs, for example, when we observe a base at position p on the genome
+  // which is enqueued as the ith element of our to_add vector. But the next
+  // allele is an indel allele which, because of VCF convention, occurs at
+  // position p, is enqueued at i+1 and supersedes the previous base
+  // substitution. Resolving these conflicts here allows us to keep the
+  // Read => ReadAllele algorithm logic simple.
+  return !(i + 1 < read_alleles.size() &&
+           read_allele.position() == read_alleles[i + 1].position());
+}
+
 void AlleleCounter::AddReadAlleles(const Read& read, const string& sample,
                                    const std::vector<ReadAllele>& to_add) {
   for (size_t i = 0; i < to_add.size(); ++i) {
-    const ReadAllele& to_add_i = to_add[i];
-
-    // The read can span beyond and after the interval, so don't add counts
-    // outside our interval boundaries.
-    if (to_add_i.skip() || !IsValidRefOffset(to_add_i.position())) {
-      continue;
-    }
-
-    // If sequential alleles have the same position, skip the first one. This
-    // occurs, for example, when we observe a base at position p on the genome
-    // which is enqueued as the ith element of our to_add vector. But the next
-    // allele is an indel allele which, because of VCF convention, occurs at
-    // position p, is enqueued at i+1 and supersedes the previous base
-    // substitution. Resolving these conflicts here allows us to keep the
-    // Read => ReadAllele algorithm logic simple.
-    if (i + 1 < to_add.size() &&
-        to_add_i.position() == to_add[i + 1].position()) {
+    if (!IsCountedReadAllele(to_add, i)) {
       continue;
     }
+    const ReadAllele& to_add_i = to_add[i];
 
     AlleleCount& allele_count = counts_[to_add_i.position()];
 
@@ -330,6 +336,47 @@ void AlleleCounter::AddReadAlleles(const Read& read, const string& sample,
   }
 }
 
+void AlleleCounter::RemoveReadAlleles(
+    const Read& read, const string& sample,
+    const std::vector<ReadAllele>& to_remove) {
+  for (size_t i = 0; i < to_remove.size(); ++i) {
+    if (!IsCountedReadAllele(to_remove, i)) {
+      continue;
+    }
+    const ReadAllele& to_remove_i = to_remove[i];
+
+    AlleleCount& allele_count = counts_[to_remove_i.position()];
+
+    if (to_remove_i.type() == AlleleType::REFERENCE) {
+      const int prev_count = allele_count.ref_supporting_read_count();
+      CHECK_GT(prev_count, 0) << "Removing a read that wasn't added at "
+                              << allele_count.position().ShortDebugString();
+      allele_count.set_ref_supporting_read_count(prev_count - 1);
+    } else {
+      allele_count.mutable_read_alleles()->erase(ReadKey(read));
+
+      // Remove one matching allele of this sample, keeping the order of the
+      // others, and drop the sample entirely once it has no alleles left.
+      auto* sample_alleles = allele_count.mutable_sample_alleles();
+      auto it = sample_alleles->find(sample);
+      if (it == sample_alleles->end()) {
+        continue;
+      }
+      auto* alleles = it->second.mutable_alleles();
+      for (int j = 0; j < alleles->size(); ++j) {
+        if (alleles->Get(j).bases() == to_remove_i.bases() &&
+            alleles->Get(j).type() == to_remove_i.type()) {
+          alleles->DeleteSubrange(j, 1);
+          break;
+        }
+      }
+      if (alleles->empty()) {
+        sample_alleles->erase(it);
+      }
+    }
+  }
+}
+
 void AlleleCounter::Add(const Read& read, const string& sample) {
   // redacted
   // Make sure our incoming read has a mapping quality above our min. threshold.
@@ -338,6 +385,22 @@ void AlleleCounter::Add(const Read& read, const string& sample) {
     return;
   }
 
+  AddReadAlleles(read, sample, MakeReadAlleles(read));
+  ++n_reads_counted_;
+}
+
+void AlleleCounter::Remove(const Read& read, const string& sample) {
+  // Reads below our mapping quality threshold were never added.
+  if (read.alignment().mapping_quality() <
+      options_.read_requirements().min_mapping_quality()) {
+    return;
+  }
+
+  RemoveReadAlleles(read, sample, MakeReadAlleles(read));
+  --n_reads_counted_;
+}
+
+std::vector<ReadAllele> AlleleCounter::MakeReadAlleles(const Read& read) {
   const LinearAlignment& aln = read.alignment();
   std::vector<ReadAllele> to_add;
   to_add.reserve(read.aligned_quality_size());
@@ -397,8 +460,7 @@ void AlleleCounter::Add(const Read& read, const string& sample) {
     }
   }
 
-  AddReadAlleles(read, sample, to_add);
-  ++n_reads_counted_;
+  return to_add;
 }
 
 string AlleleCounter::ReadKey(const Read& read) {
@@ -236,6 +236,20 @@ class AlleleCounter {
     Add(*(wrapped.p_), sample);
   }
 
+  // Removes the alleles of read, which must have been added with Add() for the
+  // same sample, from our AlleleCounts. Together with Add() this allows a read
+  // whose alignment changed to be recounted without recounting every read.
+  void Remove(const ::nucleus::genomics::v1::Read& read, const string& sample);
+
+  // Simple wrapper around Remove() that allows us to efficiently pass large
+  // protobufs in from Python. Simply unwraps the ConstProtoPtr objects and
+  // calls Remove(read).
+  void RemovePython(const nucleus::ConstProtoPtr<
+                        const ::nucleus::genomics::v1::Read>& wrapped,
+                    const string& sample) {
+    Remove(*(wrapped.p_), sample);
+  }
+
   // Gets the options in use by this AlleleCounter
   const AlleleCounterOptions& Options() const { return options_; }
 
@@ -304,11 +318,27 @@ class AlleleCounter {
       const ::nucleus::genomics::v1::Read& read, int interval_offset,
       int read_offset, const ::nucleus::genomics::v1::CigarUnit& cigar);
 
+  // Computes the ReadAlleles of read, one for each position it covers, in
+  // order. Positions can fall outside of our interval.
+  std::vector<ReadAllele> MakeReadAlleles(
+      const ::nucleus::genomics::v1::Read& read);
+
   // Adds the ReadAlleles in to_add to our AlleleCounts.
   void AddReadAlleles(const ::nucleus::genomics::v1::Read& read,
                       const string& sample,
                       const std::vector<ReadAllele>& to_add);
 
+  // Removes the ReadAlleles in to_remove, which were previously passed to
+  // AddReadAlleles for read and sample, from our AlleleCounts.
+  void RemoveReadAlleles(const ::nucleus::genomics::v1::Read& read,
+                         const string& sample,
+                         const std::vector<ReadAllele>& to_remove);
+
+  // Returns true if the ReadAllele at index i of read_alleles is counted, that
+  // is if it falls within our interval and isn't superseded by the next one.
+  bool IsCountedReadAllele(const std::vector<ReadAllele>& read_alleles,
+                           size_t i);
+
   // Our GenomeReference, which we use to get information about the reference
   // bases in our interval.
   const nucleus::GenomeReference* const ref_;
@@ -66,6 +66,7 @@ using tensorflow::strings::StrCat;
 using ::testing::Contains;
 using ::testing::Eq;
 using ::testing::IsEmpty;
+using ::testing::Pointwise;
 using ::testing::SizeIs;
 using ::testing::UnorderedPointwise;
 
@@ -995,6 +996,47 @@ TEST_F(AlleleCounterTest, TestAlleleSamplSupport_one_sample_three_reads) {
   }
 }
 
+TEST_F(AlleleCounterTest, TestRemoveRead) {
+  const Read read_1 = MakeRead(chr_, start_, "TCTGT", {"5M"});
+  const Read read_2 = MakeRead(chr_, start_ + 1, "CAG", {"3M"});
+  const Read read_3 = MakeRead(chr_, start_, "TCCAT", {"2M", "1I", "2M"});
+
+  auto allele_counter = MakeCounter(chr_, start_, end_);
+  allele_counter->Add(read_1, "sample_1");
+  allele_counter->Add(read_2, "sample_1");
+  allele_counter->Add(read_3, "sample_2");
+  allele_counter->Remove(read_2, "sample_1");
+  allele_counter->Remove(read_3, "sample_2");
+
+  auto expected_counter = MakeCounter(chr_, start_, end_);
+  expected_counter->Add(read_1, "sample_1");
+
+  EXPECT_EQ(allele_counter->NCountedReads(), expected_counter->NCountedReads());
+  EXPECT_THAT(allele_counter->Counts(),
+              Pointwise(EqualsProto(), expected_counter->Counts()));
+}
+
+TEST_F(AlleleCounterTest, TestRemoveLowMapqReadIsIgnored) {
+  Range range = MakeRange(chr_, start_, end_);
+  AlleleCounterOptions options;
+  options.mutable_read_requirements()->set_min_mapping_quality(10);
+  AlleleCounter allele_counter(ref_.get(), range, options);
+  auto read = MakeRead(chr_, start_, "TCTGT", {"5M"});
+  allele_counter.Add(read, "sample_id");
+  auto low_mapq_read = MakeRead(chr_, start_, "TCAGT", {"5M"});
+  low_mapq_read.mutable_alignment()->set_mapping_quality(0);
+  allele_counter.Add(low_mapq_read, "sample_id");
+
+  // The low mapq read was never counted, so removing it changes nothing.
+  allele_counter.Remove(low_mapq_read, "sample_id");
+  EXPECT_THAT(allele_counter.NCountedReads(), Eq(1));
+  allele_counter.Remove(read, "sample_id");
+  EXPECT_THAT(allele_counter.NCountedReads(), Eq(0));
+  for (int i = 0; i < 5; i++) {
+    EXPECT_THAT(TotalAlleleCounts(allele_counter.Counts()[i]), Eq(0));
+  }
+}
+
 }  // namespace deepvariant
 }  // namespace genomics
 }  // namespace learning
@@ -36,7 +36,13 @@ if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
   del sys.modules['google']
 
 
+import collections
+import functools
+import multiprocessing
 import os
+import resource
+import shutil
+import tempfile
 import time
 
 
@@ -47,17 +53,22 @@ import numpy as np
 import six
 import tensorflow as tf
 
+from third_party.nucleus.io import sharded_file_utils
 from third_party.nucleus.io import tfrecord
 from third_party.nucleus.protos import variants_pb2
 from third_party.nucleus.util import errors
 from third_party.nucleus.util import proto_utils
 from third_party.nucleus.util import variant_utils
 from deepvariant import data_providers
+from deepvariant import example_stream
 from deepvariant import logging_level
 from deepvariant import modeling
+from deepvariant import prediction_cache
+from deepvariant import saved_model_utils
 from deepvariant import tf_utils
 from deepvariant.protos import deepvariant_pb2
 from google.protobuf import text_format
+from tensorflow.core.example import example_pb2
 
 tf.compat.v1.disable_eager_execution()
 
@@ -90,8 +101,9 @@ flags.DEFINE_string(
     'CallVariantsOutput protos.')
 flags.DEFINE_string(
     'checkpoint', None,
-    'Required. Path to the TensorFlow model checkpoint to use to evaluate '
-    'candidate variant calls.')
+    'Path to the TensorFlow model checkpoint to use to evaluate candidate '
+    'variant calls. Exactly one of --checkpoint, --saved_model and '
+    '--quantized_model is required.')
 flags.DEFINE_integer(
     'batch_size', 512,
     'Number of candidate variant tensors to batch together during inference. '
@@ -128,6 +140,70 @@ flags.DEFINE_string(
     'key: value pairs, such as "allow_soft_placement: True". The value can '
     'itself be another message, such as '
     '"gpu_options: {per_process_gpu_memory_fraction: 0.5}".')
+flags.DEFINE_string(
+    'saved_model', None,
+    'Path to a SavedModel written by export_model, used instead of '
+    '--checkpoint. Batches of examples are fed directly to the exported '
+    'graph rather than through Estimator.predict, which avoids rebuilding '
+    'the model and restoring its moving averages at startup. Not supported '
+    'with --use_tpu.')
+flags.DEFINE_string(
+    'quantized_model', None,
+    'Path to an int8 TensorFlow Lite model written by quantize_model, used '
+    'instead of --checkpoint for faster inference on CPUs. Not supported with '
+    '--use_tpu.')
+flags.DEFINE_string(
+    'prediction_cache', None,
+    'Optional. Path to a local file caching genotype probabilities by pileup '
+    'image and model. Examples whose image was already called by the same '
+    'model are not run through it again, and new probabilities are added to '
+    'the file at the end. The hit rate is logged. Requires --saved_model or '
+    '--quantized_model, and cannot be used with --num_workers.')
+flags.DEFINE_boolean(
+    'stream_examples', False,
+    'If true, --examples names named pipes, such as '
+    '/tmp/examples.tfrecord@16, that make_examples shards are writing '
+    'uncompressed examples into. Missing pipes are created. Examples are '
+    'called as they arrive, overlapping inference with make_examples. Not '
+    'supported with --use_tpu.')
+flags.DEFINE_boolean(
+    'benchmark', False,
+    'If true, instead of calling all of --examples, measure the throughput of '
+    'call_variants on a sample of them while sweeping --batch_size, '
+    '--num_readers, --num_mappers and --kmp_blocktime over the values of the '
+    '--benchmark_* flags. The examples/sec and peak RSS of each configuration '
+    'are logged and the best settings are written to --benchmark_flagfile. '
+    '--outfile is not needed in this mode.')
+flags.DEFINE_integer(
+    'benchmark_examples', 4096,
+    'Number of examples to call for each --benchmark configuration.')
+flags.DEFINE_string(
+    'benchmark_flagfile', None,
+    'Path where --benchmark writes the best settings, as a file that can be '
+    'passed to call_variants with --flagfile.')
+flags.DEFINE_list('benchmark_batch_sizes', ['64', '128', '256', '512', '1024'],
+                  'Values of --batch_size tried by --benchmark.')
+flags.DEFINE_list('benchmark_num_readers', ['2', '4', '8', '16'],
+                  'Values of --num_readers tried by --benchmark.')
+flags.DEFINE_list('benchmark_num_mappers', ['8', '16', '32', '48', '96'],
+                  'Values of --num_mappers tried by --benchmark.')
+flags.DEFINE_list('benchmark_kmp_blocktimes', ['0', '1', '10'],
+                  'Values of --kmp_blocktime tried by --benchmark.')
+flags.DEFINE_integer(
+    'num_workers', 1,
+    'Number of processes to call variants with. If greater than 1, the files '
+    'of --examples are split across the workers, each pinned to its own share '
+    'of the CPUs, and --outfile must be a sharded file spec with this many '
+    'shards, such as call_variants_output@4.tfrecord.gz. postprocess_variants '
+    'accepts that spec as its --infile.')
+flags.DEFINE_integer(
+    'intra_op_parallelism_threads', 0,
+    'Number of threads used within an individual op, such as a convolution. '
+    '0 lets TensorFlow pick an appropriate number.')
+flags.DEFINE_integer(
+    'inter_op_parallelism_threads', 0,
+    'Number of threads used to run independent ops concurrently. 0 lets '
+    'TensorFlow pick an appropriate number.')
 
 # Cloud TPU Cluster Resolvers
 flags.DEFINE_string(
@@ -243,62 +319,249 @@ def round_gls(gls, precision=None):
   return rounded_gls
 
 
-def write_variant_call(writer, prediction, use_tpu):
-  """Write the variant call based on prediction.
+def round_gls_batch(gls, precision=None):
+  """Returns a batch of genotype likelihoods rounded to the desired precision.
+
+  This is the vectorized equivalent of round_gls, applied to each row of gls.
+  The rounding is done by NumPy, so the result may differ from round_gls in
+  the last bit of some values.
 
   Args:
-    writer: A object with a write() function that will be called for each
-      encoded_variant and genotype likelihoods.
-    prediction: A [3] tensor of floats. These are the predicted genotype
-      likelihoods (p00, p0x, pxx) for some alt allele x, in the same order as
-      encoded_variants.
-      use_tpu: bool.  Decode the tpu specific encoding of prediction.
+    gls: A [batch_size, num_genotypes] array of floats. The input genotype
+      likelihoods at any precision.
+    precision: Positive int. The number of places past the decimal point to
+      round to. If None, no rounding is performed.
 
   Returns:
-    The return status from writer.
+    A [batch_size, num_genotypes] np.array of float64 rounded to the desired
+    precision.
+
+  Raises:
+    ValueError: Some of the input gls do not sum to nearly 1.
   """
-  encoded_variant = prediction['variant']
-  if use_tpu:
-    encoded_variant = tf_utils.int_tensor_to_string(encoded_variant)
+  gls = np.asarray(gls, dtype=np.float64)
+  invalid = np.flatnonzero(np.abs(gls.sum(axis=1) - 1) > 1e-6)
+  if invalid.size:
+    bad_gls = gls[invalid[0]].tolist()
+    raise ValueError(
+        'Invalid genotype likelihoods do not sum to one: sum({}) = {}'.format(
+            bad_gls, sum(bad_gls)))
+  if precision is None:
+    return gls
 
-  encoded_alt_allele_indices = prediction['alt_allele_indices']
-  if use_tpu:
-    encoded_alt_allele_indices = tf_utils.int_tensor_to_string(
-        encoded_alt_allele_indices)
+  rows = np.arange(gls.shape[0])
+  min_ix = np.argmin(gls, axis=1)
+  rounded_gls = np.round(gls, precision)
+  rounded_gls[rows, min_ix] = 0.0
+  rounded_gls[rows, min_ix] = np.maximum(
+      0.0, np.round(1 - rounded_gls.sum(axis=1), precision))
+  return rounded_gls
+
+
+def _varint_bytes(value):
+  """Returns the protocol buffer varint encoding of a non-negative int."""
+  encoded = bytearray()
+  while value > 0x7f:
+    encoded.append((value & 0x7f) | 0x80)
+    value >>= 7
+  encoded.append(value)
+  return bytes(encoded)
 
-  rounded_gls = round_gls(prediction['probabilities'], precision=_GL_PRECISION)
 
-  # Write it out.
-  true_labels = prediction['label'] if FLAGS.debugging_true_label_mode else None
-  cvo = _create_cvo_proto(encoded_variant, rounded_gls,
-                          encoded_alt_allele_indices, true_labels)
-  return writer.write(cvo)
+def _length_delimited_field(tag, value):
+  """Returns the wire encoding of bytes value for the field with tag."""
+  return tag + _varint_bytes(len(value)) + value
 
 
-def _create_cvo_proto(encoded_variant,
-                      gls,
-                      encoded_alt_allele_indices,
-                      true_labels=None):
-  """Returns a CallVariantsOutput proto from the relevant input information."""
+# The wire format tags of the length-delimited CallVariantsOutput fields.
+_CVO_VARIANT_TAG = b'\x0a'  # variant = 1.
+_CVO_ALT_ALLELE_INDICES_TAG = b'\x12'  # alt_allele_indices = 2.
+_CVO_GENOTYPE_PROBABILITIES_TAG = b'\x1a'  # packed genotype_probabilities = 3.
+_CVO_DEBUG_INFO_TAG = b'\x22'  # debug_info = 4.
+
+
+def _serialize_cvo(encoded_variant,
+                   gls,
+                   encoded_alt_allele_indices,
+                   debug_info=None):
+  """Returns a serialized CallVariantsOutput built from its encoded parts.
+
+  The variant and alt allele indices are already serialized protos, so they
+  are embedded as is rather than being parsed and serialized again.
+
+  Args:
+    encoded_variant: bytes. A serialized nucleus.genomics.v1.Variant.
+    gls: A np.array of float64. The genotype probabilities.
+    encoded_alt_allele_indices: bytes. A serialized
+      CallVariantsOutput.AltAlleleIndices.
+    debug_info: CallVariantsOutput.DebugInfo or None.
+
+  Returns:
+    bytes. The CallVariantsOutput in wire format.
+  """
+  parts = [
+      _length_delimited_field(_CVO_VARIANT_TAG, encoded_variant),
+      _length_delimited_field(_CVO_ALT_ALLELE_INDICES_TAG,
+                              encoded_alt_allele_indices),
+      _length_delimited_field(_CVO_GENOTYPE_PROBABILITIES_TAG,
+                              gls.astype('<f8').tobytes()),
+  ]
+  if debug_info is not None:
+    parts.append(
+        _length_delimited_field(_CVO_DEBUG_INFO_TAG,
+                                debug_info.SerializeToString()))
+  return b''.join(parts)
+
+
+def _create_debug_info(encoded_variant, gls, true_label=None):
+  """Returns the CallVariantsOutput.DebugInfo for a single call."""
   variant = variants_pb2.Variant.FromString(encoded_variant)
-  alt_allele_indices = (
-      deepvariant_pb2.CallVariantsOutput.AltAlleleIndices.FromString(
-          encoded_alt_allele_indices))
-  debug_info = None
-  if FLAGS.include_debug_info or FLAGS.debugging_true_label_mode:
-    debug_info = deepvariant_pb2.CallVariantsOutput.DebugInfo(
-        has_insertion=variant_utils.has_insertion(variant),
-        has_deletion=variant_utils.has_deletion(variant),
-        is_snp=variant_utils.is_snp(variant),
-        predicted_label=np.argmax(gls),
-        true_label=true_labels,
-    )
-  call_variants_output = deepvariant_pb2.CallVariantsOutput(
-      variant=variant,
-      alt_allele_indices=alt_allele_indices,
-      genotype_probabilities=gls,
-      debug_info=debug_info)
-  return call_variants_output
+  return deepvariant_pb2.CallVariantsOutput.DebugInfo(
+      has_insertion=variant_utils.has_insertion(variant),
+      has_deletion=variant_utils.has_deletion(variant),
+      is_snp=variant_utils.is_snp(variant),
+      predicted_label=np.argmax(gls),
+      true_label=true_label,
+  )
+
+
+def write_variant_calls(writer, predictions, use_tpu):
+  """Writes the variant calls for a batch of predictions.
+
+  Args:
+    writer: A tfrecord.Writer. write_serialized() is called once with all of
+      the serialized CallVariantsOutput protos of the batch.
+    predictions: A dict of equal-length arrays, with keys 'variant',
+      'alt_allele_indices', 'probabilities' and, in debugging_true_label_mode,
+      'label'. The probabilities are the predicted genotype likelihoods
+      (p00, p0x, pxx) for some alt allele x of each variant.
+    use_tpu: bool.  Decode the tpu specific encoding of the variants and alt
+      allele indices.
+
+  Returns:
+    The number of calls written.
+  """
+  encoded_variants = predictions['variant']
+  encoded_alt_allele_indices = predictions['alt_allele_indices']
+  if use_tpu:
+    encoded_variants = [
+        tf_utils.int_tensor_to_string(x) for x in encoded_variants
+    ]
+    encoded_alt_allele_indices = [
+        tf_utils.int_tensor_to_string(x) for x in encoded_alt_allele_indices
+    ]
+
+  rounded_gls = round_gls_batch(
+      predictions['probabilities'], precision=_GL_PRECISION)
+  true_labels = (
+      predictions['label']
+      if FLAGS.debugging_true_label_mode else [None] * len(rounded_gls))
+  with_debug_info = FLAGS.include_debug_info or FLAGS.debugging_true_label_mode
+
+  serialized_cvos = []
+  for encoded_variant, gls, alt_allele_indices, true_label in zip(
+      encoded_variants, rounded_gls, encoded_alt_allele_indices, true_labels):
+    debug_info = None
+    if with_debug_info:
+      debug_info = _create_debug_info(encoded_variant, gls, true_label)
+    serialized_cvos.append(
+        _serialize_cvo(encoded_variant, gls, alt_allele_indices, debug_info))
+  writer.write_serialized(serialized_cvos)
+  return len(serialized_cvos)
+
+
+def _check_predictor_image_shape(predictor, example_shape):
+  """Raises a ValueError if predictor wasn't exported for example_shape."""
+  if tuple(predictor.image_shape) != tuple(example_shape):
+    raise ValueError('The model was exported for images of shape {} but '
+                     'the examples have shape {}. Rerun export_model with '
+                     'these examples.'.format(
+                         list(predictor.image_shape), list(example_shape)))
+
+
+def _predict_with_cache(predictor, images, cache):
+  """Returns the probabilities of images, only running predictor on misses."""
+  keys = cache.keys(images)
+  probabilities, hits = cache.lookup(keys)
+  misses = ~hits
+  if misses.any():
+    probabilities[misses] = predictor.predict(images[misses])
+    cache.add([key for key, miss in zip(keys, misses) if miss],
+              probabilities[misses])
+  return probabilities
+
+
+def _call_variants_with_predictor(tf_dataset,
+                                  make_predictor,
+                                  example_shape,
+                                  output_file,
+                                  config,
+                                  batch_size,
+                                  max_batches,
+                                  cache=None):
+  """Writes the calls for the examples of tf_dataset using an exported model.
+
+  Each batch of examples is decoded into NumPy arrays by the input pipeline
+  and run through the exported model in a single call.
+
+  Args:
+    tf_dataset: A PREDICT mode input_fn, such as returned by prepare_inputs.
+    make_predictor: callable returning a context manager with the interface of
+      saved_model_utils.SavedModelPredictor.
+    example_shape: list of three ints. The image shape of the examples.
+    output_file: str. Path of the CallVariantsOutput TFRecord to write.
+    config: tf.compat.v1.ConfigProto used for both the input pipeline and the
+      model.
+    batch_size: int. The number of examples in each batch.
+    max_batches: int or None. If not None, the maximum number of batches to
+      evaluate.
+    cache: prediction_cache.PredictionCache or None. If given, images found in
+      the cache aren't run through the model, and the probabilities of the
+      others are saved to the cache at the end.
+
+  Raises:
+    ValueError: if the exported model doesn't match the examples.
+  """
+  with tf.Graph().as_default():
+    features = tf.compat.v1.data.make_one_shot_iterator(
+        tf_dataset(dict(batch_size=batch_size))).get_next()
+
+    with make_predictor() as predictor:
+      _check_predictor_image_shape(predictor, example_shape)
+
+      logging.info('Writing calls to %s', output_file)
+      with tf.compat.v1.Session(config=config) as input_sess, \
+          tfrecord.Writer(output_file) as writer:
+        start_time = time.time()
+        n_examples, n_batches, duration = 0, 0, 0
+        while max_batches is None or n_batches < max_batches:
+          try:
+            batch = input_sess.run(features)
+          except tf.errors.OutOfRangeError:
+            break
+          if cache is None:
+            batch['probabilities'] = predictor.predict(batch['image'])
+          else:
+            batch['probabilities'] = _predict_with_cache(
+                predictor, batch['image'], cache)
+          n_examples += write_variant_calls(writer, batch, use_tpu=False)
+          n_batches += 1
+          duration = time.time() - start_time
+          logging.log_every_n(
+              logging.INFO,
+              'Processed %s examples in %s batches [%.3f sec per 100]',
+              max(1, _LOG_EVERY_N // batch_size), n_examples, n_batches,
+              (100 * duration) / n_examples)
+        if n_examples:
+          logging.info('Processed %s examples in %s batches [%.3f sec per 100]',
+                       n_examples, n_batches, (100 * duration) / n_examples)
+        logging.info('Done calling variants from a total of %d examples.',
+                     n_examples)
+
+  if cache is not None:
+    logging.info('Found %d of %d examples in the prediction cache (%.2f%%).',
+                 cache.n_hits, cache.n_lookups, 100 * cache.hit_rate)
+    cache.save()
 
 
 def call_variants(examples_filename,
@@ -309,15 +572,39 @@ def call_variants(examples_filename,
                   batch_size=16,
                   max_batches=None,
                   use_tpu=False,
-                  master=''):
+                  master='',
+                  saved_model_dir=None,
+                  quantized_model_path=None,
+                  stream_examples=False,
+                  prediction_cache_path=None):
   """Main driver of call_variants."""
+  if (saved_model_dir is not None or
+      quantized_model_path is not None) and use_tpu:
+    raise ValueError(
+        'saved_model_dir and quantized_model_path cannot be used with use_tpu.')
+  if stream_examples and use_tpu:
+    raise ValueError('stream_examples cannot be used with use_tpu.')
+  if (prediction_cache_path is not None and saved_model_dir is None and
+      quantized_model_path is None):
+    raise ValueError('prediction_cache_path requires saved_model_dir or '
+                     'quantized_model_path.')
+
   if FLAGS.kmp_blocktime:
     os.environ['KMP_BLOCKTIME'] = FLAGS.kmp_blocktime
     logging.vlog(3,
                  'Set KMP_BLOCKTIME to {}'.format(os.environ['KMP_BLOCKTIME']))
 
   # Read a single TFExample to make sure we're not loading an older version.
-  first_example = tf_utils.get_one_example_from_examples_path(examples_filename)
+  if stream_examples:
+    stream = example_stream.ExampleStream(
+        example_stream.create_pipes(examples_filename))
+    first_record = stream.peek()
+    first_example = (
+        example_pb2.Example.FromString(first_record)
+        if first_record is not None else None)
+  else:
+    first_example = tf_utils.get_one_example_from_examples_path(
+        examples_filename)
   if first_example is None:
     logging.warning(
         'Unable to read any records from %s. Output will contain '
@@ -381,6 +668,10 @@ def call_variants(examples_filename,
   config = tf.compat.v1.ConfigProto()
   if FLAGS.config_string is not None:
     text_format.Parse(FLAGS.config_string, config)
+  if FLAGS.intra_op_parallelism_threads:
+    config.intra_op_parallelism_threads = FLAGS.intra_op_parallelism_threads
+  if FLAGS.inter_op_parallelism_threads:
+    config.inter_op_parallelism_threads = FLAGS.inter_op_parallelism_threads
   if execution_hardware == 'cpu':
     # Don't overwrite entire dictionary.
     config.device_count['GPU'] = 0
@@ -399,8 +690,45 @@ def call_variants(examples_filename,
     # work later, after the device (on the other VM) has been initialized,
     # which is generally not yet.
 
-  # Prepare input stream and estimator.
-  tf_dataset = prepare_inputs(source_path=examples_filename, use_tpu=use_tpu)
+  if saved_model_dir is not None:
+    make_predictor = functools.partial(
+        saved_model_utils.SavedModelPredictor,
+        saved_model_dir,
+        session_config=config)
+  elif quantized_model_path is not None:
+    make_predictor = functools.partial(saved_model_utils.TFLitePredictor,
+                                       quantized_model_path)
+  else:
+    make_predictor = None
+  if prediction_cache_path is not None:
+    cache = prediction_cache.PredictionCache(
+        prediction_cache_path, prediction_cache.model_fingerprint(
+            saved_model_dir or quantized_model_path))
+  else:
+    cache = None
+  if stream_examples:
+    tf_dataset = example_stream.StreamingPredictionInput(
+        stream,
+        input_file_spec=examples_filename,
+        tensor_shape=example_shape,
+        input_map_threads=FLAGS.num_mappers,
+        debugging_true_label_mode=FLAGS.debugging_true_label_mode)
+  else:
+    tf_dataset = prepare_inputs(source_path=examples_filename, use_tpu=use_tpu)
+
+  if make_predictor is not None:
+    _call_variants_with_predictor(
+        tf_dataset=tf_dataset,
+        make_predictor=make_predictor,
+        example_shape=example_shape,
+        output_file=output_file,
+        config=config,
+        batch_size=batch_size,
+        max_batches=max_batches,
+        cache=cache)
+    return
+
+  # Prepare estimator.
   estimator = model.make_estimator(
       batch_size=batch_size,
       master=master,
@@ -420,36 +748,258 @@ def call_variants(examples_filename,
       estimator.predict(
           input_fn=tf_dataset,
           checkpoint_path=checkpoint_path,
-          hooks=predict_hooks))
+          hooks=predict_hooks,
+          yield_single_examples=False))
 
-  # Consume predictions one at a time and write them to output_file.
+  # Consume predictions a batch at a time and write them to output_file.
   logging.info('Writing calls to %s', output_file)
   writer = tfrecord.Writer(output_file)
   with writer:
     start_time = time.time()
-    n_examples, n_batches = 0, 0
-    while max_batches is None or n_batches <= max_batches:
+    n_examples, n_batches, duration = 0, 0, 0
+    while max_batches is None or n_batches < max_batches:
       try:
-        prediction = next(predictions)
+        batch = next(predictions)
       except (StopIteration, tf.errors.OutOfRangeError):
         break
-      write_variant_call(writer, prediction, use_tpu)
-      n_examples += 1
-      n_batches = n_examples // batch_size + 1
+      n_examples += write_variant_calls(writer, batch, use_tpu)
+      n_batches += 1
       duration = time.time() - start_time
 
       logging.log_every_n(
           logging.INFO,
           ('Processed %s examples in %s batches [%.3f sec per 100]'),
-          _LOG_EVERY_N, n_examples, n_batches, (100 * duration) / n_examples)
+          max(1, _LOG_EVERY_N // batch_size), n_examples, n_batches,
+          (100 * duration) / n_examples)
     # One last log to capture the extra examples.
-    logging.info('Processed %s examples in %s batches [%.3f sec per 100]',
-                 n_examples, n_batches, (100 * duration) / n_examples)
+    if n_examples:
+      logging.info('Processed %s examples in %s batches [%.3f sec per 100]',
+                   n_examples, n_batches, (100 * duration) / n_examples)
 
     logging.info('Done calling variants from a total of %d examples.',
                  n_examples)
 
 
+def _worker_cpus(worker_index, num_workers):
+  """Returns the CPUs worker_index should be pinned to, or None.
+
+  The CPUs available to this process are split into num_workers contiguous
+  slices of nearly equal size.
+
+  Args:
+    worker_index: int. The index of the worker, in [0, num_workers).
+    num_workers: int. The total number of workers.
+
+  Returns:
+    A list of CPU ids, or None if CPU affinity isn't supported or there are
+    fewer CPUs than workers.
+  """
+  if not hasattr(os, 'sched_getaffinity'):
+    return None
+  cpus = sorted(os.sched_getaffinity(0))
+  if len(cpus) < num_workers:
+    return None
+  return cpus[worker_index * len(cpus) // num_workers:(worker_index + 1) *
+              len(cpus) // num_workers]
+
+
+def _call_variants_worker(worker_index, num_workers, examples, output_file,
+                          call_variants_kwargs):
+  """Calls the variants of examples in a forked worker process."""
+  cpus = _worker_cpus(worker_index, num_workers)
+  if cpus:
+    os.sched_setaffinity(0, cpus)
+    # The flags are copies private to this process, so this doesn't affect
+    # the other workers.
+    if not FLAGS.intra_op_parallelism_threads:
+      FLAGS.intra_op_parallelism_threads = len(cpus)
+    if not FLAGS.inter_op_parallelism_threads:
+      FLAGS.inter_op_parallelism_threads = min(2, len(cpus))
+    FLAGS.num_readers = min(FLAGS.num_readers, len(cpus))
+    FLAGS.num_mappers = min(FLAGS.num_mappers, len(cpus))
+  logging.info('Worker %d calling variants in %d files with CPUs %s',
+               worker_index, len(examples), cpus)
+
+  if not examples:
+    tfrecord.write_tfrecords([], output_file)
+    return
+  call_variants(
+      examples_filename=','.join(examples),
+      output_file=output_file,
+      **call_variants_kwargs)
+
+
+def call_variants_in_workers(examples_filename, output_file, num_workers,
+                             **call_variants_kwargs):
+  """Runs call_variants in num_workers processes, each on a subset of files.
+
+  The input files are dealt round-robin to the workers, and worker i writes
+  the i-th shard of output_file. Each worker is pinned to its own slice of the
+  available CPUs, and its TensorFlow thread pools are sized to match unless
+  --intra_op_parallelism_threads or --inter_op_parallelism_threads are set.
+
+  Args:
+    examples_filename: str. The examples to call, as for call_variants.
+    output_file: str. A sharded file spec with num_workers shards, such as
+      call_variants_output@4.tfrecord.gz.
+    num_workers: int. The number of worker processes.
+    **call_variants_kwargs: Other arguments of call_variants.
+
+  Raises:
+    ValueError: if output_file doesn't have num_workers shards.
+    RuntimeError: if any of the workers failed.
+  """
+  output_files = sharded_file_utils.maybe_generate_sharded_filenames(
+      output_file)
+  if len(output_files) != num_workers:
+    raise ValueError('output_file must be a sharded file spec with {} shards, '
+                     'one per worker, but got {}.'.format(
+                         num_workers, output_file))
+  if call_variants_kwargs.get('stream_examples'):
+    input_files = example_stream.create_pipes(examples_filename)
+  else:
+    input_files = sharded_file_utils.glob_list_sharded_file_patterns(
+        examples_filename)
+
+  context = multiprocessing.get_context('fork')
+  workers = [
+      context.Process(
+          target=_call_variants_worker,
+          args=(i, num_workers, input_files[i::num_workers], output_files[i],
+                call_variants_kwargs)) for i in range(num_workers)
+  ]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  failed = [i for i, worker in enumerate(workers) if worker.exitcode != 0]
+  if failed:
+    raise RuntimeError('call_variants workers {} failed.'.format(failed))
+
+
+# The flags swept by --benchmark, in the order they are tuned.
+_BENCHMARK_KNOBS = ('batch_size', 'num_readers', 'num_mappers', 'kmp_blocktime')
+
+# The outcome of running call_variants with one configuration of
+# _BENCHMARK_KNOBS on a sample of the examples.
+BenchmarkResult = collections.namedtuple(
+    'BenchmarkResult',
+    ['settings', 'n_examples', 'seconds', 'examples_per_sec', 'peak_rss_mb'])
+
+
+def _benchmark_worker(settings, n_examples, output_file, call_variants_kwargs,
+                      connection):
+  """Runs call_variants with settings in a forked process and reports back."""
+  for knob, value in settings.items():
+    FLAGS[knob].value = value
+  batch_size = settings['batch_size']
+  start_time = time.time()
+  call_variants(
+      output_file=output_file,
+      batch_size=batch_size,
+      max_batches=(n_examples + batch_size - 1) // batch_size,
+      **call_variants_kwargs)
+  seconds = time.time() - start_time
+  n_written = sum(1 for _ in tfrecord.read_tfrecords(output_file))
+  # ru_maxrss is in kilobytes on Linux.
+  peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  connection.send((n_written, seconds, peak_rss_mb))
+
+
+def _run_benchmark_configuration(settings, n_examples, output_file,
+                                 call_variants_kwargs):
+  """Returns the BenchmarkResult of settings, measured in a fresh process.
+
+  Each configuration runs in its own process, so that KMP_BLOCKTIME is read
+  at startup and the peak RSS isn't inflated by earlier configurations.
+
+  Args:
+    settings: dict from each of _BENCHMARK_KNOBS to its value.
+    n_examples: int. The number of examples to call.
+    output_file: str. Where to write the calls, which are then discarded.
+    call_variants_kwargs: dict. Other arguments of call_variants.
+
+  Returns:
+    BenchmarkResult.
+
+  Raises:
+    RuntimeError: if call_variants failed.
+  """
+  context = multiprocessing.get_context('fork')
+  receiver, sender = context.Pipe(duplex=False)
+  worker = context.Process(
+      target=_benchmark_worker,
+      args=(settings, n_examples, output_file, call_variants_kwargs, sender))
+  worker.start()
+  sender.close()
+  report = receiver.recv() if receiver.poll(None) else None
+  worker.join()
+  if worker.exitcode != 0 or report is None:
+    raise RuntimeError(
+        'Benchmark of configuration {} failed.'.format(settings))
+  n_written, seconds, peak_rss_mb = report
+  return BenchmarkResult(
+      settings=settings,
+      n_examples=n_written,
+      seconds=seconds,
+      examples_per_sec=n_written / seconds if seconds else 0.0,
+      peak_rss_mb=peak_rss_mb)
+
+
+def run_benchmark(sweep, n_examples, flagfile, **call_variants_kwargs):
+  """Tunes _BENCHMARK_KNOBS for throughput and writes the best as flags.
+
+  The knobs are tuned one at a time, in the order of _BENCHMARK_KNOBS: each
+  value of a knob in sweep is tried with the best values found so far for the
+  other knobs, starting from their current flag values. Every configuration
+  calls the first n_examples examples, so the measured throughput includes
+  the startup cost of call_variants.
+
+  Args:
+    sweep: dict from each of _BENCHMARK_KNOBS to the list of values to try.
+    n_examples: int. The number of examples to call per configuration.
+    flagfile: str. Path where the best settings are written as a flags file,
+      which can be passed to call_variants with --flagfile.
+    **call_variants_kwargs: Other arguments of call_variants, except
+      output_file, batch_size and max_batches.
+
+  Returns:
+    The list of BenchmarkResult of every configuration tried.
+  """
+  best = {knob: FLAGS[knob].value for knob in _BENCHMARK_KNOBS}
+  results = {}
+  output_dir = tempfile.mkdtemp()
+  try:
+    for knob in _BENCHMARK_KNOBS:
+      best_result = None
+      for value in sweep[knob]:
+        settings = dict(best)
+        settings[knob] = value
+        key = tuple(sorted(settings.items()))
+        if key not in results:
+          results[key] = _run_benchmark_configuration(
+              settings, n_examples,
+              os.path.join(output_dir, 'benchmark.tfrecord'),
+              call_variants_kwargs)
+          logging.info(
+              'Benchmark %s: %d examples in %.2fs, %.1f examples/sec, '
+              'peak RSS %.0f MB', settings, results[key].n_examples,
+              results[key].seconds, results[key].examples_per_sec,
+              results[key].peak_rss_mb)
+        if (best_result is None or
+            results[key].examples_per_sec > best_result.examples_per_sec):
+          best_result = results[key]
+      best = best_result.settings
+  finally:
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+  with tf.io.gfile.GFile(flagfile, 'w') as f:
+    for knob in _BENCHMARK_KNOBS:
+      f.write('--{}={}\n'.format(knob, best[knob]))
+  logging.info('Best settings, written to %s: %s', flagfile, best)
+  return list(results.values())
+
+
 def main(argv=()):
   with errors.clean_commandline_error_exit():
     if len(argv) > 1:
@@ -468,8 +1018,85 @@ def main(argv=()):
     else:
       master = ''
 
+    model_sources = [FLAGS.checkpoint, FLAGS.saved_model, FLAGS.quantized_model]
+    if sum(source is not None for source in model_sources) != 1:
+      errors.log_and_raise(
+          'Exactly one of --checkpoint, --saved_model and --quantized_model '
+          'must be specified.', errors.CommandLineError)
+    if FLAGS.checkpoint is None and FLAGS.use_tpu:
+      errors.log_and_raise(
+          '--saved_model and --quantized_model are not supported with '
+          '--use_tpu.', errors.CommandLineError)
+    for flag_name in ('intra_op_parallelism_threads',
+                      'inter_op_parallelism_threads'):
+      if FLAGS[flag_name].value < 0:
+        errors.log_and_raise(
+            '--{} must be non-negative.'.format(flag_name),
+            errors.CommandLineError)
+
+    if FLAGS.benchmark:
+      if FLAGS.stream_examples or FLAGS.num_workers > 1 or FLAGS.use_tpu:
+        errors.log_and_raise(
+            '--benchmark is not supported with --stream_examples, '
+            '--num_workers or --use_tpu.', errors.CommandLineError)
+      if not FLAGS.benchmark_flagfile:
+        errors.log_and_raise('--benchmark requires --benchmark_flagfile.',
+                             errors.CommandLineError)
+      if FLAGS.benchmark_examples <= 0:
+        errors.log_and_raise('--benchmark_examples must be positive.',
+                             errors.CommandLineError)
+    elif not FLAGS.outfile:
+      errors.log_and_raise('--outfile is required.', errors.CommandLineError)
+
+    if FLAGS.num_workers < 1:
+      errors.log_and_raise('--num_workers must be at least 1.',
+                           errors.CommandLineError)
+    if FLAGS.prediction_cache:
+      if FLAGS.checkpoint is not None:
+        errors.log_and_raise(
+            '--prediction_cache requires --saved_model or --quantized_model.',
+            errors.CommandLineError)
+      if FLAGS.num_workers > 1:
+        errors.log_and_raise(
+            '--prediction_cache is not supported with --num_workers.',
+            errors.CommandLineError)
+    if FLAGS.num_workers > 1:
+      if FLAGS.use_tpu:
+        errors.log_and_raise('--num_workers is not supported with --use_tpu.',
+                             errors.CommandLineError)
+      if (len(sharded_file_utils.maybe_generate_sharded_filenames(
+          FLAGS.outfile)) != FLAGS.num_workers):
+        errors.log_and_raise(
+            '--outfile must be a sharded file spec with --num_workers={} '
+            'shards, such as call_variants_output@{}.tfrecord.gz.'.format(
+                FLAGS.num_workers, FLAGS.num_workers), errors.CommandLineError)
+
     model = modeling.get_model(FLAGS.model_name)
-    call_variants(
+    if FLAGS.benchmark:
+      sweep = {
+          'batch_size': [int(v) for v in FLAGS.benchmark_batch_sizes],
+          'num_readers': [int(v) for v in FLAGS.benchmark_num_readers],
+          'num_mappers': [int(v) for v in FLAGS.benchmark_num_mappers],
+          'kmp_blocktime': FLAGS.benchmark_kmp_blocktimes,
+      }
+      run_benchmark(
+          sweep,
+          n_examples=FLAGS.benchmark_examples,
+          flagfile=FLAGS.benchmark_flagfile,
+          examples_filename=FLAGS.examples,
+          checkpoint_path=FLAGS.checkpoint,
+          model=model,
+          execution_hardware=FLAGS.execution_hardware,
+          saved_model_dir=FLAGS.saved_model,
+          quantized_model_path=FLAGS.quantized_model)
+      return
+
+    if FLAGS.num_workers > 1:
+      run_call_variants = functools.partial(
+          call_variants_in_workers, num_workers=FLAGS.num_workers)
+    else:
+      run_call_variants = call_variants
+    run_call_variants(
         examples_filename=FLAGS.examples,
         checkpoint_path=FLAGS.checkpoint,
         model=model,
@@ -479,13 +1106,15 @@ def main(argv=()):
         batch_size=FLAGS.batch_size,
         master=master,
         use_tpu=FLAGS.use_tpu,
+        saved_model_dir=FLAGS.saved_model,
+        quantized_model_path=FLAGS.quantized_model,
+        stream_examples=FLAGS.stream_examples,
+        prediction_cache_path=FLAGS.prediction_cache,
     )
 
 
 if __name__ == '__main__':
   flags.mark_flags_as_required([
       'examples',
-      'outfile',
-      'checkpoint',
   ])
   tf.compat.v1.app.run()
@@ -39,6 +39,7 @@ if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
 import collections
 import errno
 import sys
+import threading
 
 
 
@@ -55,7 +56,9 @@ from third_party.nucleus.io import tfrecord
 from third_party.nucleus.testing import test_utils
 from third_party.nucleus.util import variant_utils
 from deepvariant import call_variants
+from deepvariant import example_stream
 from deepvariant import modeling
+from deepvariant import saved_model_utils
 from deepvariant import testdata
 from deepvariant import tf_utils
 from deepvariant.protos import deepvariant_pb2
@@ -318,6 +321,235 @@ class CallVariantsEndToEndTests(
       self.assertTrue(
           0 <= gp <= 1 for gp in call_variants_output.genotype_probabilities)
 
+  @parameterized.parameters(False, True)
+  @flagsaver.FlagSaver
+  def test_call_end2end_with_saved_model(self, debugging_true_label_mode):
+    FLAGS.debugging_true_label_mode = debugging_true_label_mode
+    examples_path = testdata.GOLDEN_TRAINING_EXAMPLES
+    examples = list(tfrecord.read_tfrecords(examples_path))
+    saved_model_dir = test_utils.test_tmpfile('constant_saved_model')
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model('constant'),
+        checkpoint_path=None,
+        export_dir=saved_model_dir,
+        image_shape=tf_utils.example_image_shape(examples[0]))
+
+    outfile = test_utils.test_tmpfile('saved_model.call_variants.tfrecord')
+    call_variants.call_variants(
+        examples_filename=examples_path,
+        checkpoint_path=None,
+        model=None,
+        output_file=outfile,
+        batch_size=4,
+        saved_model_dir=saved_model_dir,
+    )
+
+    call_variants_outputs = list(
+        tfrecord.read_tfrecords(outfile, deepvariant_pb2.CallVariantsOutput))
+    six.assertCountEqual(self, [cvo.variant for cvo in call_variants_outputs],
+                         [tf_utils.example_variant(ex) for ex in examples])
+    for cvo in call_variants_outputs:
+      self.assertEqual(list(cvo.genotype_probabilities), [0.0, 1.0, 0.0])
+    if debugging_true_label_mode:
+      self.assertTrue(
+          any(cvo.debug_info.true_label > 0 for cvo in call_variants_outputs))
+
+  def test_call_end2end_with_prediction_cache(self):
+    examples_path = testdata.GOLDEN_CALLING_EXAMPLES
+    examples = list(tfrecord.read_tfrecords(examples_path))
+    saved_model_dir = test_utils.test_tmpfile('cached_saved_model')
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model('constant'),
+        checkpoint_path=None,
+        export_dir=saved_model_dir,
+        image_shape=tf_utils.example_image_shape(examples[0]))
+    cache_path = test_utils.test_tmpfile('prediction_cache.npy')
+
+    def _run(outfile):
+      call_variants.call_variants(
+          examples_filename=examples_path,
+          checkpoint_path=None,
+          model=None,
+          output_file=outfile,
+          batch_size=4,
+          saved_model_dir=saved_model_dir,
+          prediction_cache_path=cache_path,
+      )
+      return list(
+          tfrecord.read_tfrecords(outfile, deepvariant_pb2.CallVariantsOutput))
+
+    with mock.patch.object(
+        saved_model_utils.SavedModelPredictor, 'predict',
+        autospec=True,
+        side_effect=saved_model_utils.SavedModelPredictor.predict) as predict:
+      uncached = _run(test_utils.test_tmpfile('uncached.tfrecord'))
+      self.assertTrue(predict.called)
+      predict.reset_mock()
+      cached = _run(test_utils.test_tmpfile('cached.tfrecord'))
+      predict.assert_not_called()
+
+    self.assertEqual(cached, uncached)
+    self.assertLen(cached, len(examples))
+
+  def test_call_end2end_with_quantized_model(self):
+    examples_path = testdata.GOLDEN_CALLING_EXAMPLES
+    examples = list(tfrecord.read_tfrecords(examples_path))
+    saved_model_dir = test_utils.test_tmpfile('constant_to_quantize')
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model('constant'),
+        checkpoint_path=None,
+        export_dir=saved_model_dir,
+        image_shape=tf_utils.example_image_shape(examples[0]))
+    quantized_model_path = test_utils.test_tmpfile('constant.tflite')
+    saved_model_utils.quantize_saved_model(saved_model_dir,
+                                           quantized_model_path)
+
+    outfile = test_utils.test_tmpfile('quantized.call_variants.tfrecord')
+    call_variants.call_variants(
+        examples_filename=examples_path,
+        checkpoint_path=None,
+        model=None,
+        output_file=outfile,
+        batch_size=4,
+        quantized_model_path=quantized_model_path,
+    )
+
+    call_variants_outputs = list(
+        tfrecord.read_tfrecords(outfile, deepvariant_pb2.CallVariantsOutput))
+    six.assertCountEqual(self, [cvo.variant for cvo in call_variants_outputs],
+                         [tf_utils.example_variant(ex) for ex in examples])
+    for cvo in call_variants_outputs:
+      self.assertEqual(list(cvo.genotype_probabilities), [0.0, 1.0, 0.0])
+
+  @parameterized.parameters(False, True)
+  def test_call_end2end_with_streamed_examples(self, use_saved_model):
+    examples = list(tfrecord.read_tfrecords(testdata.GOLDEN_CALLING_EXAMPLES))
+    saved_model_dir = None
+    if use_saved_model:
+      saved_model_dir = test_utils.test_tmpfile('streamed_saved_model')
+      saved_model_utils.export_saved_model(
+          model=modeling.get_model('constant'),
+          checkpoint_path=None,
+          export_dir=saved_model_dir,
+          image_shape=tf_utils.example_image_shape(examples[0]))
+    examples_spec = test_utils.test_tmpfile(
+        'streamed{}.tfrecord@3'.format(int(use_saved_model)))
+
+    # Play make_examples: write the shards into the pipes concurrently.
+    def _write_shard(path, shard_examples):
+      tfrecord.write_tfrecords(shard_examples, path)
+
+    threads = [
+        threading.Thread(target=_write_shard, args=(path, examples[i::3]))
+        for i, path in enumerate(example_stream.create_pipes(examples_spec))
+    ]
+    for thread in threads:
+      thread.start()
+
+    outfile = test_utils.test_tmpfile('streamed.call_variants.tfrecord')
+    call_variants.call_variants(
+        examples_filename=examples_spec,
+        checkpoint_path=_LEAVE_MODEL_UNINITIALIZED,
+        model=modeling.get_model('random_guess'),
+        output_file=outfile,
+        batch_size=4,
+        saved_model_dir=saved_model_dir,
+        stream_examples=True,
+    )
+    for thread in threads:
+      thread.join()
+
+    call_variants_outputs = list(
+        tfrecord.read_tfrecords(outfile, deepvariant_pb2.CallVariantsOutput))
+    six.assertCountEqual(self, [cvo.variant for cvo in call_variants_outputs],
+                         [tf_utils.example_variant(ex) for ex in examples])
+
+  @parameterized.parameters(2, 4)
+  def test_call_variants_in_workers(self, num_workers):
+    examples = list(tfrecord.read_tfrecords(testdata.GOLDEN_CALLING_EXAMPLES))
+    source_path = test_utils.test_tmpfile(
+        'workers{}.tfrecord@3.gz'.format(num_workers))
+    tfrecord.write_tfrecords(examples, source_path)
+    outfile = test_utils.test_tmpfile(
+        'workers.call_variants@{}.tfrecord.gz'.format(num_workers))
+
+    call_variants.call_variants_in_workers(
+        examples_filename=source_path,
+        output_file=outfile,
+        num_workers=num_workers,
+        checkpoint_path=_LEAVE_MODEL_UNINITIALIZED,
+        model=modeling.get_model('random_guess'),
+        batch_size=4,
+    )
+
+    # Each worker wrote its own shard, even without any input files.
+    call_variants_outputs = list(
+        tfrecord.read_tfrecords(outfile, deepvariant_pb2.CallVariantsOutput))
+    six.assertCountEqual(self, [cvo.variant for cvo in call_variants_outputs],
+                         [tf_utils.example_variant(ex) for ex in examples])
+
+  def test_call_variants_in_workers_requires_one_shard_per_worker(self):
+    with six.assertRaisesRegex(self, ValueError, 'with 2 shards'):
+      call_variants.call_variants_in_workers(
+          examples_filename=testdata.GOLDEN_CALLING_EXAMPLES,
+          output_file=test_utils.test_tmpfile('unsharded.tfrecord.gz'),
+          num_workers=2,
+          checkpoint_path=_LEAVE_MODEL_UNINITIALIZED,
+          model=modeling.get_model('random_guess'))
+
+  @flagsaver.FlagSaver
+  def test_run_benchmark(self):
+    FLAGS.kmp_blocktime = '0'
+    flagfile = test_utils.test_tmpfile('benchmark.flags')
+    sweep = {
+        'batch_size': [2, 4],
+        'num_readers': [1],
+        'num_mappers': [1, 2],
+        'kmp_blocktime': ['0'],
+    }
+
+    results = call_variants.run_benchmark(
+        sweep,
+        n_examples=8,
+        flagfile=flagfile,
+        examples_filename=testdata.GOLDEN_CALLING_EXAMPLES,
+        checkpoint_path=_LEAVE_MODEL_UNINITIALIZED,
+        model=modeling.get_model('random_guess'))
+
+    # The last kmp_blocktime configuration repeats the best one, which isn't
+    # run again.
+    self.assertLen(results, 5)
+    for result in results:
+      self.assertEqual(result.n_examples, 8)
+      self.assertGreater(result.examples_per_sec, 0)
+      self.assertGreater(result.peak_rss_mb, 0)
+    # The best settings are the fastest of the last knob with more than one
+    # value, num_mappers, whose configurations were run last.
+    best = max(results[3:], key=lambda r: r.examples_per_sec).settings
+    with tf.io.gfile.GFile(flagfile) as f:
+      self.assertEqual(f.read().splitlines(), [
+          '--batch_size={}'.format(best['batch_size']),
+          '--num_readers={}'.format(best['num_readers']),
+          '--num_mappers={}'.format(best['num_mappers']),
+          '--kmp_blocktime={}'.format(best['kmp_blocktime']),
+      ])
+
+  def test_call_variants_with_saved_model_for_other_shape(self):
+    saved_model_dir = test_utils.test_tmpfile('wrong_shape_saved_model')
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model('constant'),
+        checkpoint_path=None,
+        export_dir=saved_model_dir,
+        image_shape=(300, 221, 6))
+    with six.assertRaisesRegex(self, ValueError, 'exported for images'):
+      call_variants.call_variants(
+          examples_filename=testdata.GOLDEN_CALLING_EXAMPLES,
+          checkpoint_path=None,
+          model=None,
+          output_file=test_utils.test_tmpfile('wrong_shape.tfrecord'),
+          saved_model_dir=saved_model_dir,
+      )
+
   # pylint: disable=g-complex-comprehension
   @parameterized.parameters(
       (model, bad_format)
@@ -392,6 +624,7 @@ class CallVariantsUnitTests(
       ('sharded@3', 'sharded@3'),
       ('sharded@3', 'sharded-?????-of-00003'),
       ('asterisks@2', 'asterisks-*-of-00002'),
+      ('comma@2', 'comma-00000-of-00002,comma-00001-of-00002'),
   )
   def test_prepare_inputs(self, filename_to_write, file_string_input):
     source_path = test_utils.test_tmpfile(filename_to_write)
@@ -428,6 +661,64 @@ class CallVariantsUnitTests(
     actual = call_variants.round_gls(test_data, precision)
     self.assertEqual(actual, expected)
 
+  @parameterized.parameters(None, 2, 10)
+  def test_round_gls_batch_matches_round_gls(self, precision):
+    gls = np.random.RandomState(42).dirichlet([0.1, 0.5, 0.1], size=100)
+    actual = call_variants.round_gls_batch(gls, precision)
+    self.assertEqual(actual.shape, gls.shape)
+    for row, actual_row in zip(gls, actual):
+      np.testing.assert_allclose(
+          actual_row,
+          call_variants.round_gls(row.tolist(), precision),
+          rtol=0,
+          atol=1e-15)
+
+  def test_round_gls_batch_rejects_invalid_gls(self):
+    with six.assertRaisesRegex(self, ValueError, 'do not sum to one'):
+      call_variants.round_gls_batch([[0.2, 0.8, 0.0], [0.5, 0.5, 0.5]])
+
+  @parameterized.parameters(False, True)
+  @flagsaver.FlagSaver
+  def test_write_variant_calls(self, include_debug_info):
+    FLAGS.include_debug_info = include_debug_info
+    alt_allele_indices = [
+        deepvariant_pb2.CallVariantsOutput.AltAlleleIndices(indices=[i])
+        for i in range(3)
+    ]
+    predictions = {
+        'variant':
+            np.array([v.SerializeToString() for v in self.variants[:3]],
+                     dtype=object),
+        'alt_allele_indices':
+            np.array([a.SerializeToString() for a in alt_allele_indices],
+                     dtype=object),
+        'probabilities':
+            np.array([[0.1, 0.7, 0.2], [0.0, 0.0, 1.0], [0.5, 0.25, 0.25]],
+                     dtype=np.float32),
+    }
+    writer = mock.Mock()
+
+    self.assertEqual(
+        call_variants.write_variant_calls(writer, predictions, use_tpu=False),
+        3)
+
+    (serialized_cvos,), _ = writer.write_serialized.call_args
+    actual = [
+        deepvariant_pb2.CallVariantsOutput.FromString(cvo)
+        for cvo in serialized_cvos
+    ]
+    expected_gls = call_variants.round_gls_batch(
+        predictions['probabilities'], precision=10)
+    for cvo, variant, indices, gls in zip(actual, self.variants,
+                                          alt_allele_indices, expected_gls):
+      self.assertEqual(cvo.variant, variant)
+      self.assertEqual(cvo.alt_allele_indices, indices)
+      self.assertEqual(list(cvo.genotype_probabilities), list(gls))
+      self.assertEqual(cvo.HasField('debug_info'), include_debug_info)
+      if include_debug_info:
+        self.assertEqual(cvo.debug_info.is_snp, variant_utils.is_snp(variant))
+        self.assertEqual(cvo.debug_info.predicted_label, np.argmax(gls))
+
   @parameterized.parameters('auto', 'cpu')
   def test_call_variants_non_accelerated_execution_runs(self,
                                                         execution_hardware):
@@ -517,6 +808,63 @@ class CallVariantsUnitTests(
         '"[\'call_variants.py\', \'extra_arg\']".')
     mock_exit.assert_called_once_with(errno.ENOENT)
 
+  @parameterized.parameters(
+      dict(worker_index=0, num_workers=2, expected=[0, 1, 2]),
+      dict(worker_index=1, num_workers=2, expected=[3, 4, 5, 6]),
+      dict(worker_index=2, num_workers=3, expected=[4, 5, 6]),
+      dict(worker_index=0, num_workers=8, expected=None),
+  )
+  def test_worker_cpus(self, worker_index, num_workers, expected):
+    with mock.patch.object(
+        call_variants.os, 'sched_getaffinity', return_value=set(range(7)),
+        create=True):
+      self.assertEqual(
+          call_variants._worker_cpus(worker_index, num_workers), expected)
+
+  @parameterized.parameters(
+      dict(checkpoint=None, saved_model=None),
+      dict(checkpoint='model.ckpt', saved_model='saved_model'),
+  )
+  @flagsaver.FlagSaver
+  def test_requires_exactly_one_model_source(self, checkpoint, saved_model):
+    FLAGS.checkpoint = checkpoint
+    FLAGS.saved_model = saved_model
+    with mock.patch.object(logging, 'error') as mock_logging, mock.patch.object(
+        sys, 'exit') as mock_exit:
+      call_variants.main(['call_variants.py'])
+    mock_logging.assert_called_once_with(
+        'Exactly one of --checkpoint, --saved_model and --quantized_model '
+        'must be specified.')
+    mock_exit.assert_called_once_with(errno.ENOENT)
+
+
+  @parameterized.parameters(
+      dict(
+          checkpoint='model.ckpt',
+          saved_model=None,
+          num_workers=1,
+          message='--prediction_cache requires --saved_model or '
+          '--quantized_model.'),
+      dict(
+          checkpoint=None,
+          saved_model='saved_model',
+          num_workers=2,
+          message='--prediction_cache is not supported with --num_workers.'),
+  )
+  @flagsaver.FlagSaver
+  def test_prediction_cache_flag_validation(self, checkpoint, saved_model,
+                                            num_workers, message):
+    FLAGS.checkpoint = checkpoint
+    FLAGS.saved_model = saved_model
+    FLAGS.num_workers = num_workers
+    FLAGS.outfile = 'calls.tfrecord'
+    FLAGS.prediction_cache = 'cache.npy'
+    with mock.patch.object(logging, 'error') as mock_logging, mock.patch.object(
+        sys, 'exit') as mock_exit:
+      call_variants.main(['call_variants.py'])
+    mock_logging.assert_called_once_with(message)
+    mock_exit.assert_called_once_with(errno.ENOENT)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -361,11 +361,13 @@ class DeepVariantInput(object):
 
     batch_size = params['batch_size']
     compression_type = tf_utils.compression_type_of_files(self.input_files)
-    files = tf.data.Dataset.list_files(
-        sharded_file_utils.normalize_to_sharded_file_pattern(
-            self.input_file_spec),
-        shuffle=False,
-    )
+    files = None
+    for pattern in self.input_file_spec.split(','):
+      one_files = tf.data.Dataset.list_files(
+          sharded_file_utils.normalize_to_sharded_file_pattern(pattern),
+          shuffle=False,
+      )
+      files = one_files if files is None else files.concatenate(one_files)
     logging.vlog(3,
                  'self.input_read_threads={}'.format(self.input_read_threads))
     dataset = files.apply(
@@ -0,0 +1,296 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Streams examples from make_examples to call_variants through named pipes.
+
+In streaming mode, each make_examples shard writes uncompressed TFRecords into
+a named pipe (FIFO) instead of a file on disk, and a single call_variants
+process reads from all of the pipes while the shards are still running. This
+overlaps inference with example generation and skips compressing, writing,
+reading and decompressing the examples.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import stat
+import struct
+import threading
+
+from six.moves import queue
+import tensorflow as tf
+
+from third_party.nucleus.io import sharded_file_utils
+from deepvariant import data_providers
+
+# A TFRecord is framed by a uint64 length and a uint32 masked CRC of that
+# length before the data, and a uint32 masked CRC of the data after it.
+_HEADER = struct.Struct('<QI')
+_FOOTER_SIZE = 4
+
+# Maximum number of records read ahead of the consumer across all pipes.
+_MAX_BUFFERED_RECORDS = 4096
+
+# Marks the end of the records of one pipe in ExampleStream's queue.
+_END_OF_PIPE = object()
+
+# Default number of seconds ExampleStream waits for a writer to open each pipe.
+_CONNECT_TIMEOUT_SECONDS = 60 * 60
+
+
+def create_pipes(filespec):
+  """Creates a named pipe for each shard of filespec.
+
+  Existing named pipes are reused.
+
+  Args:
+    filespec: str. A file name or sharded file spec such as
+      /tmp/examples.tfrecord@16, or a comma-separated list of them. They must
+      not end in .gz, as the records are streamed uncompressed.
+
+  Returns:
+    A list of the paths of the named pipes.
+
+  Raises:
+    ValueError: if filespec is compressed or names an existing regular file.
+  """
+  paths = []
+  for spec in filespec.split(','):
+    if spec.endswith('.gz'):
+      raise ValueError(
+          'Streamed examples cannot be compressed: {}'.format(spec))
+    paths.extend(sharded_file_utils.maybe_generate_sharded_filenames(spec))
+  for path in paths:
+    if os.path.exists(path):
+      if not stat.S_ISFIFO(os.stat(path).st_mode):
+        raise ValueError('{} exists and is not a named pipe.'.format(path))
+    else:
+      os.mkfifo(path)
+  return paths
+
+
+def read_records(stream):
+  """Yields the records of a TFRecord stream as they become available.
+
+  The CRCs are not checked, since the records only go through a local pipe.
+
+  Args:
+    stream: A binary file-like object with uncompressed TFRecords.
+
+  Yields:
+    bytes. The serialized records, in order.
+
+  Raises:
+    IOError: if the stream ends in the middle of a record.
+  """
+  while True:
+    header = stream.read(_HEADER.size)
+    if not header:
+      return
+    if len(header) != _HEADER.size:
+      raise IOError('Truncated TFRecord header in stream.')
+    length, _ = _HEADER.unpack(header)
+    record = stream.read(length + _FOOTER_SIZE)
+    if len(record) != length + _FOOTER_SIZE:
+      raise IOError('Truncated TFRecord in stream.')
+    yield record[:length]
+
+
+def _open_pipe(path, timeout):
+  """Opens a named pipe for reading once a writer opens it.
+
+  Args:
+    path: str. The named pipe to open.
+    timeout: float or None. The number of seconds to wait for a writer. If
+      None, waits indefinitely.
+
+  Returns:
+    A binary file-like object reading from the pipe.
+
+  Raises:
+    IOError: if no writer opened the pipe within timeout seconds.
+  """
+  lock = threading.Lock()
+  state = {'opened': False, 'timed_out': False}
+
+  def _give_up():
+    with lock:
+      if state['opened']:
+        return
+      state['timed_out'] = True
+    # Opening the pipe for writing releases the blocked open below, and closing
+    # it right away leaves nothing to read.
+    try:
+      os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+    except OSError:
+      pass
+
+  timer = None
+  if timeout is not None:
+    timer = threading.Timer(timeout, _give_up)
+    timer.daemon = True
+    timer.start()
+  stream = open(path, 'rb')
+  if timer is not None:
+    timer.cancel()
+  with lock:
+    state['opened'] = True
+    timed_out = state['timed_out']
+  if timed_out:
+    stream.close()
+    raise IOError('No writer opened {} within {} seconds.'.format(
+        path, timeout))
+  return stream
+
+
+class ExampleStream(object):
+  """Serialized examples read concurrently from a set of named pipes.
+
+  Each pipe is read by its own thread as soon as the stream is created, so
+  writers never block on a pipe that the consumer isn't reading yet. Records
+  of a pipe are yielded in order, but records of different pipes interleave
+  in the order they arrive.
+  """
+
+  def __init__(self, paths, connect_timeout=_CONNECT_TIMEOUT_SECONDS):
+    """Starts reading from paths.
+
+    Args:
+      paths: list of str. The named pipes to read. Reading finishes once the
+        writers of all of them have closed their end.
+      connect_timeout: float or None. Reading fails if a pipe isn't opened by a
+        writer within this many seconds, such as when the writer failed before
+        opening it. If None, waits indefinitely.
+    """
+    self._connect_timeout = connect_timeout
+    self._records = queue.Queue(maxsize=_MAX_BUFFERED_RECORDS)
+    self._n_open_pipes = len(paths)
+    self._first = None
+    self._started = False
+    for path in paths:
+      thread = threading.Thread(target=self._read_pipe, args=(path,))
+      thread.daemon = True
+      thread.start()
+
+  def _read_pipe(self, path):
+    try:
+      with _open_pipe(path, self._connect_timeout) as stream:
+        for record in read_records(stream):
+          self._records.put(record)
+    except Exception as e:  # pylint: disable=broad-except
+      self._records.put(e)
+    finally:
+      self._records.put(_END_OF_PIPE)
+
+  def _next_record(self):
+    """Returns the next record, or None once all pipes are exhausted."""
+    while self._n_open_pipes:
+      record = self._records.get()
+      if record is _END_OF_PIPE:
+        self._n_open_pipes -= 1
+      elif isinstance(record, Exception):
+        raise record
+      else:
+        return record
+    return None
+
+  def peek(self):
+    """Returns the first record without consuming it, or None if empty."""
+    if not self._started:
+      self._first = self._next_record()
+      self._started = True
+    return self._first
+
+  def __iter__(self):
+    first = self.peek()
+    self._first = None
+    if first is None:
+      return
+    yield first
+    while True:
+      record = self._next_record()
+      if record is None:
+        return
+      yield record
+
+
+class StreamingPredictionInput(object):
+  """A PREDICT mode input_fn reading examples from an ExampleStream.
+
+  The batches have the same features as those of
+  data_providers.DeepVariantInput, so this can replace it in call_variants.
+  """
+
+  def __init__(self,
+               stream,
+               input_file_spec,
+               tensor_shape,
+               input_map_threads=48,
+               debugging_true_label_mode=False):
+    """Creates an input_fn over stream.
+
+    Args:
+      stream: ExampleStream. The examples to read. It can only be consumed
+        once.
+      input_file_spec: str. The named pipes stream reads from.
+      tensor_shape: list of int [height, width, channel] of the images.
+      input_map_threads: number of threads for parsing examples.
+      debugging_true_label_mode: boolean. If true, also parse the 'label' of
+        the examples.
+    """
+    self.mode = tf.estimator.ModeKeys.PREDICT
+    self.tensor_shape = tensor_shape
+    self.input_map_threads = input_map_threads
+    self._stream = stream
+    self._parser = data_providers.DeepVariantInput(
+        mode=tf.estimator.ModeKeys.PREDICT,
+        input_file_spec=input_file_spec,
+        tensor_shape=tensor_shape,
+        debugging_true_label_mode=debugging_true_label_mode)
+
+  def __call__(self, params):
+    """Interface to get a data batch, fulfilling `input_fn` contract.
+
+    Args:
+      params: a dict containing an integer value for key 'batch_size'.
+
+    Returns:
+      A dataset of batched features, as DeepVariantInput returns in PREDICT
+      mode.
+    """
+    dataset = tf.data.Dataset.from_generator(
+        lambda: iter(self._stream),
+        output_types=tf.string,
+        output_shapes=tf.TensorShape([]))
+    dataset = dataset.map(
+        self._parser.parse_tfexample,
+        num_parallel_calls=self.input_map_threads)
+    dataset = dataset.batch(params['batch_size'])
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
@@ -0,0 +1,177 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Tests for deepvariant.example_stream."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
+  del sys.modules['google']
+
+
+import io
+import threading
+
+from absl.testing import absltest
+import six
+import tensorflow as tf
+
+from third_party.nucleus.io import tfrecord
+from third_party.nucleus.protos import reference_pb2
+from third_party.nucleus.protos import variants_pb2
+from third_party.nucleus.testing import test_utils
+from deepvariant import example_stream
+from deepvariant import testdata
+from deepvariant import tf_utils
+
+tf.compat.v1.disable_eager_execution()
+
+
+def setUpModule():
+  testdata.init()
+
+
+def _write_records_in_thread(path, records):
+  """Writes records to path, which may be a named pipe, from a new thread."""
+
+  def _write():
+    with tfrecord.Writer(path) as writer:
+      writer.write_serialized(records)
+
+  thread = threading.Thread(target=_write)
+  thread.start()
+  return thread
+
+
+class ExampleStreamTest(absltest.TestCase):
+
+  def test_read_records(self):
+    protos = [reference_pb2.ContigInfo(name=str(i)) for i in range(5)]
+    path = test_utils.test_tmpfile('records.tfrecord')
+    tfrecord.write_tfrecords(protos, path)
+    with open(path, 'rb') as stream:
+      records = list(example_stream.read_records(stream))
+    self.assertEqual([p.SerializeToString() for p in protos], records)
+
+  def test_read_records_truncated(self):
+    path = test_utils.test_tmpfile('truncated.tfrecord')
+    tfrecord.write_tfrecords([reference_pb2.ContigInfo(name='chr1')], path)
+    with open(path, 'rb') as stream:
+      data = stream.read()
+    with self.assertRaises(IOError):
+      list(example_stream.read_records(io.BytesIO(data[:-1])))
+
+  def test_create_pipes(self):
+    spec = test_utils.test_tmpfile('pipes.tfrecord@3')
+    paths = example_stream.create_pipes(spec)
+    self.assertLen(paths, 3)
+    # Existing pipes are reused.
+    self.assertEqual(paths, example_stream.create_pipes(spec))
+
+  def test_create_pipes_rejects_compressed_and_regular_files(self):
+    with six.assertRaisesRegex(self, ValueError, 'cannot be compressed'):
+      example_stream.create_pipes(test_utils.test_tmpfile('pipes@2.gz'))
+    path = test_utils.test_tmpfile('regular.tfrecord')
+    tfrecord.write_tfrecords([], path)
+    with six.assertRaisesRegex(self, ValueError, 'not a named pipe'):
+      example_stream.create_pipes(path)
+
+  def test_example_stream(self):
+    paths = example_stream.create_pipes(
+        test_utils.test_tmpfile('stream.tfrecord@3'))
+    shards = [[b'a', b'b'], [], [b'c', b'd', b'e']]
+    threads = [
+        _write_records_in_thread(path, shard)
+        for path, shard in zip(paths, shards)
+    ]
+    stream = example_stream.ExampleStream(paths)
+    self.assertIsNotNone(stream.peek())
+    records = list(stream)
+    for thread in threads:
+      thread.join()
+    six.assertCountEqual(self, records, [b'a', b'b', b'c', b'd', b'e'])
+    # Records of a single pipe stay in order.
+    self.assertLess(records.index(b'c'), records.index(b'd'))
+
+  def test_empty_example_stream(self):
+    paths = example_stream.create_pipes(
+        test_utils.test_tmpfile('empty_stream.tfrecord@2'))
+    threads = [_write_records_in_thread(path, []) for path in paths]
+    stream = example_stream.ExampleStream(paths)
+    self.assertIsNone(stream.peek())
+    self.assertEqual(list(stream), [])
+    for thread in threads:
+      thread.join()
+
+  def test_example_stream_fails_without_writer(self):
+    paths = example_stream.create_pipes(
+        test_utils.test_tmpfile('unopened_stream.tfrecord@2'))
+    thread = _write_records_in_thread(paths[0], [b'a'])
+    stream = example_stream.ExampleStream(paths, connect_timeout=0.5)
+    with six.assertRaisesRegex(self, IOError, 'No writer opened'):
+      list(stream)
+    thread.join()
+
+  def test_streaming_prediction_input(self):
+    examples = list(tfrecord.read_tfrecords(testdata.GOLDEN_CALLING_EXAMPLES))
+    spec = test_utils.test_tmpfile('golden.tfrecord@2')
+    paths = example_stream.create_pipes(spec)
+    serialized_examples = [ex.SerializeToString() for ex in examples]
+    threads = [
+        _write_records_in_thread(path, serialized_examples[i::2])
+        for i, path in enumerate(paths)
+    ]
+    input_fn = example_stream.StreamingPredictionInput(
+        example_stream.ExampleStream(paths),
+        input_file_spec=spec,
+        tensor_shape=tf_utils.example_image_shape(examples[0]))
+    features = tf.compat.v1.data.make_one_shot_iterator(
+        input_fn(dict(batch_size=8))).get_next()
+
+    seen_variants = []
+    with tf.compat.v1.Session() as sess:
+      try:
+        while True:
+          batch = sess.run(features)
+          self.assertEqual(
+              list(batch['image'].shape[1:]),
+              list(tf_utils.example_image_shape(examples[0])))
+          seen_variants.extend(batch['variant'])
+      except tf.errors.OutOfRangeError:
+        pass
+    for thread in threads:
+      thread.join()
+    six.assertCountEqual(
+        self, [variants_pb2.Variant.FromString(v) for v in seen_variants],
+        [tf_utils.example_variant(ex) for ex in examples])
+
+
+if __name__ == '__main__':
+  absltest.main()
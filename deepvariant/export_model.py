@@ -0,0 +1,113 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+r"""Exports a DeepVariant checkpoint as a SavedModel for call_variants.
+
+The exported model can be passed to call_variants with --saved_model in place
+of --checkpoint. Example usage:
+
+export_model \
+  --checkpoint model.ckpt \
+  --examples examples.tfrecord.gz \
+  --saved_model_dir /tmp/saved_model
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
+  del sys.modules['google']
+
+
+from absl import flags
+from absl import logging
+import tensorflow as tf
+
+from third_party.nucleus.util import errors
+from deepvariant import logging_level
+from deepvariant import modeling
+from deepvariant import saved_model_utils
+from deepvariant import tf_utils
+
+tf.compat.v1.disable_eager_execution()
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'checkpoint', None,
+    'Required. Path to the TensorFlow model checkpoint to export.')
+flags.DEFINE_string(
+    'examples', None,
+    'Required. tf.Example protos in TFRecord format, as emitted by '
+    'make_examples. The model is exported for the image shape of these '
+    'examples. Can be a comma-separated list of files, and the file names can '
+    'contain wildcard characters.')
+flags.DEFINE_string(
+    'saved_model_dir', None,
+    'Required. Directory to write the SavedModel to. It must not exist yet.')
+flags.DEFINE_string('model_name', 'inception_v3',
+                    'The name of the model architecture of --checkpoint.')
+
+
+def main(argv=()):
+  with errors.clean_commandline_error_exit():
+    if len(argv) > 1:
+      errors.log_and_raise(
+          'Command line parsing failure: export_model does not accept '
+          'positional arguments but some are present on the command line: '
+          '"{}".'.format(str(argv)), errors.CommandLineError)
+    del argv  # Unused.
+
+    logging_level.set_from_flag()
+
+    first_example = tf_utils.get_one_example_from_examples_path(FLAGS.examples)
+    if first_example is None:
+      errors.log_and_raise(
+          'Unable to read any records from {}.'.format(FLAGS.examples),
+          errors.CommandLineError)
+    image_shape = tf_utils.example_image_shape(first_example)
+    logging.info('Exporting %s for images of shape %s', FLAGS.checkpoint,
+                 image_shape)
+
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model(FLAGS.model_name),
+        checkpoint_path=FLAGS.checkpoint,
+        export_dir=FLAGS.saved_model_dir,
+        image_shape=image_shape,
+        moving_average_decay=FLAGS.moving_average_decay)
+    logging.info('Wrote SavedModel to %s', FLAGS.saved_model_dir)
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required([
+      'checkpoint',
+      'examples',
+      'saved_model_dir',
+  ])
+  tf.compat.v1.app.run()
@@ -37,14 +37,18 @@ that implies three total alternate alleles.
 
 This library tries to resolve overlapping variant calls into consistent
 haplotypes by using the most likely configuration based on individual call
-probabilities that is a valid set of two haplotypes. In rare cases where this
-is not possible, the haplotypes are left unmodified.
+probabilities that is a valid set of two haplotypes. The configurations are
+searched with dynamic programming over the variants in coordinate order, so the
+cost is linear in the number of overlapping variants. In rare cases where the
+most likely configuration disagrees with the marginal likelihoods of the
+variants, the haplotypes are left unmodified.
 """
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import copy
 import itertools
 from absl import flags
@@ -60,11 +64,6 @@ flags.DEFINE_bool(
     'disable_haplotype_resolution', False,
     'If True, makes `maybe_resolve_conflicting_variants` a no-op.')
 
-# The maximum number of overlapping variants to try to resolve into compatible
-# haplotypes. This corresponds to generating 3^12 (= 531,441) possible variant
-# configurations for diploid individuals.
-_MAX_OVERLAPPING_VARIANTS_TO_RESOLVE = 12
-
 
 def maybe_resolve_conflicting_variants(sorted_variants):
   """Yields Variant protos in sorted order after fixing conflicting haplotypes.
@@ -72,8 +71,7 @@ def maybe_resolve_conflicting_variants(sorted_variants):
   The input is an iterable of Variants in chromosome and position sorted order,
   with potential incompatibilies as described in this module's docstring. This
   function tries to resolve variants into valid haplotypes, though is not
-  guaranteed to do so if the variant composition is not amenable to this or it
-  would be computationally intractable.
+  guaranteed to do so if the variant composition is not amenable to this.
 
   Args:
     sorted_variants: Iterable of Variant protos. Sorted in coordinate order, but
@@ -131,8 +129,8 @@ def _maybe_resolve_mixed_calls(overlapping_candidates):
   We often tune DeepVariant to be highly sensitive. Consequently, there can be
   many candidate calls that are predicted as reference. Since those do not
   contribute to potential incompatibilities, we split them out from variants
-  predicted to contain non-reference genotypes since the computation of
-  compatible haplotypes is exponential in the number of inputs.
+  predicted to contain non-reference genotypes to keep the computation of
+  compatible haplotypes small.
 
   Args:
     overlapping_candidates: list(Variant). A non-empty list of Variant protos in
@@ -306,20 +304,6 @@ def _resolve_overlapping_variants(overlapping_variants):
       yield variant
     return
 
-  # The actual genotype calls produce an inconsistent haplotype. If the number
-  # of affected variants is "too large", avoid processing since this is an
-  # exponential process.
-  if len(overlapping_variants) > _MAX_OVERLAPPING_VARIANTS_TO_RESOLVE:
-    logging.vlog(
-        2,
-        'Overlapping variants are not naturally compatible, and there are too '
-        'many to exhaustively search (%s). Returning variants without '
-        'modification, beginning with %s.', len(overlapping_variants),
-        overlapping_variants[0])
-    for variant in overlapping_variants:
-      yield variant
-    return
-
   # Otherwise, the actual genotype calls are incompatible. Since the genotype
   # likelihoods are generally well-calibrated, we examine all configurations of
   # genotypes that create compatible haplotypes and retain the single
@@ -362,6 +346,202 @@ def _resolve_overlapping_variants(overlapping_variants):
   #   indel and a het SNP. Since the two calculations agree, we use this
   #   genotype call and modified likelihoods.
   #
+  # The configurations are not enumerated, as their number is exponential in the
+  # number of variants. See _most_likely_configuration_and_marginals for how
+  # both calculations are done in linear time.
+  (most_likely_allele_indices_config,
+   likelihood_aggregators) = _most_likely_configuration_and_marginals(
+       overlapping_variants)
+
+  marginal_allele_indices_config = tuple(
+      agg.most_likely_allele_indices() for agg in likelihood_aggregators)
+  if marginal_allele_indices_config == most_likely_allele_indices_config:
+    logging.vlog(
+        2,
+        'Overlapping variants are not naturally compatible, but the genotype '
+        'configuration with the most likely joint likelihood is the same as '
+        'that from the scaled marginal likelihoods: %s',
+        overlapping_variants[0])
+    # Collapse the probabilities of all configurations to a single GL for each
+    # allele, independently for each variant.
+    scaled_gls = [agg.scaled_likelihoods() for agg in likelihood_aggregators]
+
+    for variant, allele_indices, gls in zip(overlapping_variants,
+                                            most_likely_allele_indices_config,
+                                            scaled_gls):
+      newvariant = copy.deepcopy(variant)
+      call = variant_utils.only_call(newvariant)
+      call.genotype[:] = allele_indices
+      call.genotype_likelihood[:] = gls
+      yield newvariant
+  else:
+    logging.vlog(
+        2,
+        'Overlapping variants are not naturally compatible, and the genotype '
+        'configuration with the most likely joint likelihood is different from '
+        'that using the scaled marginal likelihoods: %s',
+        overlapping_variants[0])
+    # redacted
+    for variant in overlapping_variants:
+      yield variant
+
+
+def _nonref_count_transitions(active_ends, variant, ploidy=2):
+  """Yields the compatible non-reference counts of variant given active_ends.
+
+  Args:
+    active_ends: tuple(int). The sorted end of each non-reference allele of the
+      preceding variants, repeated once per allele.
+    variant: Variant. The next variant, starting at or after the start of every
+      preceding variant.
+    ploidy: int. The ploidy of the individual.
+
+  Yields:
+    (nonref_count, next_active_ends) tuples for each non-reference count of
+    variant that keeps at most ploidy non-reference alleles at every position,
+    where next_active_ends are the active ends once variant has nonref_count
+    non-reference alleles.
+  """
+  # Alleles ending at or before the variant's start can't overlap it, or any
+  # later variant since those start no earlier.
+  overlapping_ends = tuple(end for end in active_ends if end > variant.start)
+  for nonref_count in range(ploidy + 1):
+    if variant.end > variant.start:
+      next_active_ends = tuple(
+          sorted(overlapping_ends + (variant.end,) * nonref_count))
+    else:
+      next_active_ends = overlapping_ends
+    if len(next_active_ends) <= ploidy:
+      yield nonref_count, next_active_ends
+
+
+def _most_likely_configuration_and_marginals(overlapping_variants, ploidy=2):
+  """Returns the most likely compatible genotypes and their marginals.
+
+  Variants are compatible if at most ploidy non-reference alleles overlap any
+  position. Scanning the variants in coordinate order, whether the remaining
+  variants can be given non-reference alleles depends only on the ends of the
+  non-reference alleles that are still open, of which there are at most ploidy.
+  Using those ends as the state, a forward and a backward pass compute the
+  summed likelihood of all compatible configurations of the variants before
+  and after each state, and a max-product backward pass the likelihood of the
+  most likely one after each state. The cost is linear in the number of
+  variants rather than exponential as for
+  _most_likely_configuration_and_marginals_by_enumeration, which computes the
+  same values.
+
+  Args:
+    overlapping_variants: list(Variant). A non-empty list of Variant protos in
+      coordinate-sorted order.
+    ploidy: int. The ploidy of the individual.
+
+  Returns:
+    A (most_likely_allele_indices_config, likelihood_aggregators) tuple. The
+    first element holds the allele indices of each variant in the compatible
+    configuration with the highest joint likelihood, and the second a
+    _LikelihoodAggregator per variant holding the likelihood of each of its
+    genotypes summed over all compatible configurations.
+  """
+  # The (allele_indices, likelihood) of each genotype of each variant, by
+  # non-reference count, and the summed and largest likelihood of each count.
+  genotypes, summed, largest = [], [], []
+  for variant in overlapping_variants:
+    call = variant_utils.only_call(variant)
+    by_count = []
+    for nonref_count in range(ploidy + 1):
+      by_count.append([
+          (allele_indices,
+           variant_utils.genotype_likelihood(call, allele_indices))
+          for allele_indices in variant_utils.allele_indices_with_num_alts(
+              variant, nonref_count, ploidy=ploidy)
+      ])
+    genotypes.append(by_count)
+    summed.append([
+        genomics_math.log10sumexp([gl for _, gl in gls]) for gls in by_count
+    ])
+    largest.append([max(gl for _, gl in gls) for gls in by_count])
+
+  def transitions(i, active_ends):
+    return _nonref_count_transitions(active_ends, overlapping_variants[i],
+                                     ploidy)
+
+  # forward[i] maps the active ends before variant i to the summed likelihood
+  # of the configurations of the variants before i that lead to them.
+  n_variants = len(overlapping_variants)
+  forward = [{(): 0.0}]
+  for i in range(n_variants):
+    next_likelihoods = collections.defaultdict(list)
+    for active_ends, likelihood in forward[i].items():
+      for nonref_count, next_active_ends in transitions(i, active_ends):
+        next_likelihoods[next_active_ends].append(likelihood +
+                                                  summed[i][nonref_count])
+    forward.append({
+        active_ends: genomics_math.log10sumexp(likelihoods)
+        for active_ends, likelihoods in next_likelihoods.items()
+    })
+
+  # backward[i] and best[i] map the active ends before variant i to the summed
+  # and the largest likelihood of the compatible configurations of variant i
+  # onwards.
+  backward = [None] * n_variants + [{k: 0.0 for k in forward[n_variants]}]
+  best = backward[:]
+  for i in reversed(range(n_variants)):
+    backward[i], best[i] = {}, {}
+    for active_ends in forward[i]:
+      summed_after, largest_after = [], []
+      for nonref_count, next_active_ends in transitions(i, active_ends):
+        summed_after.append(summed[i][nonref_count] +
+                            backward[i + 1][next_active_ends])
+        largest_after.append(largest[i][nonref_count] +
+                             best[i + 1][next_active_ends])
+      backward[i][active_ends] = genomics_math.log10sumexp(summed_after)
+      best[i][active_ends] = max(largest_after)
+
+  likelihood_aggregators = []
+  for i, variant in enumerate(overlapping_variants):
+    aggregator = _LikelihoodAggregator(len(variant.alternate_bases))
+    for active_ends, likelihood in forward[i].items():
+      for nonref_count, next_active_ends in transitions(i, active_ends):
+        for allele_indices, gl in genotypes[i][nonref_count]:
+          aggregator.add(allele_indices,
+                         likelihood + gl + backward[i + 1][next_active_ends])
+    likelihood_aggregators.append(aggregator)
+
+  # Trace back the most likely configuration. Taking the first count and
+  # genotype that attain the best likelihood breaks ties in the order
+  # itertools.product enumerates the configurations.
+  most_likely_allele_indices_config = []
+  active_ends = ()
+  for i in range(n_variants):
+    for nonref_count, next_active_ends in transitions(i, active_ends):
+      if (largest[i][nonref_count] + best[i + 1][next_active_ends] ==
+          best[i][active_ends]):
+        most_likely_allele_indices_config.append(
+            next(allele_indices
+                 for allele_indices, gl in genotypes[i][nonref_count]
+                 if gl == largest[i][nonref_count]))
+        active_ends = next_active_ends
+        break
+
+  return tuple(most_likely_allele_indices_config), likelihood_aggregators
+
+
+def _most_likely_configuration_and_marginals_by_enumeration(
+    overlapping_variants):
+  """Returns the same as _most_likely_configuration_and_marginals.
+
+  This enumerates every configuration of genotypes, so its cost is exponential
+  in the number of variants. It is kept as a reference for testing and
+  benchmarking _most_likely_configuration_and_marginals.
+
+  Args:
+    overlapping_variants: list(Variant). A non-empty list of Variant protos in
+      coordinate-sorted order.
+
+  Returns:
+    A (most_likely_allele_indices_config, likelihood_aggregators) tuple, as
+    returned by _most_likely_configuration_and_marginals.
+  """
   # First, we find all non-reference count configurations that are compatible.
   # This represents each variant solely based on its number of non-reference
   # genotypes, and assumes that variants are compatible if the total number of
@@ -371,6 +551,7 @@ def _resolve_overlapping_variants(overlapping_variants):
   # alleles has three allele configurations that are homozygous alternate
   # [1/1, 1/2, 2/2] and either all or none of them will be valid depending on
   # the variants it interacts with).
+  calculator = _VariantCompatibilityCalculator(overlapping_variants)
   valid_nonref_count_configurations = [
       conf
       for conf in itertools.product([0, 1, 2], repeat=len(overlapping_variants))
@@ -399,37 +580,7 @@ def _resolve_overlapping_variants(overlapping_variants):
                                             allele_indices_config):
         aggregator.add(allele_indices, config_likelihood)
 
-  marginal_allele_indices_config = tuple(
-      agg.most_likely_allele_indices() for agg in likelihood_aggregators)
-  if marginal_allele_indices_config == most_likely_allele_indices_config:
-    logging.vlog(
-        2,
-        'Overlapping variants are not naturally compatible, but the genotype '
-        'configuration with the most likely joint likelihood is the same as '
-        'that from the scaled marginal likelihoods: %s',
-        overlapping_variants[0])
-    # Collapse the probabilities of all configurations to a single GL for each
-    # allele, independently for each variant.
-    scaled_gls = [agg.scaled_likelihoods() for agg in likelihood_aggregators]
-
-    for variant, allele_indices, gls in zip(overlapping_variants,
-                                            most_likely_allele_indices_config,
-                                            scaled_gls):
-      newvariant = copy.deepcopy(variant)
-      call = variant_utils.only_call(newvariant)
-      call.genotype[:] = allele_indices
-      call.genotype_likelihood[:] = gls
-      yield newvariant
-  else:
-    logging.vlog(
-        2,
-        'Overlapping variants are not naturally compatible, and the genotype '
-        'configuration with the most likely joint likelihood is different from '
-        'that using the scaled marginal likelihoods: %s',
-        overlapping_variants[0])
-    # redacted
-    for variant in overlapping_variants:
-      yield variant
+  return most_likely_allele_indices_config, likelihood_aggregators
 
 
 def _get_all_allele_indices_configurations(variants,
@@ -0,0 +1,151 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Benchmarks the resolution of conflicting haplotypes by cluster size.
+
+For each number of variants we simulate clusters of overlapping variants with
+random genotype likelihoods, as found in segmental duplications and STRs, and
+report the average time to find the most likely compatible configuration and
+the marginal likelihoods of the variants with the dynamic programming search
+used by haplotypes.py and with the exhaustive enumeration it replaced. The
+enumeration is exponential in the number of variants, so it is only timed up to
+--max_enumerated_variants.
+
+Example usage:
+
+  haplotypes_benchmark --n_variants=2,5,10,20,30 --n_clusters=20
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import timeit
+
+from absl import app
+from absl import flags
+
+from third_party.nucleus.testing import test_utils
+from deepvariant import haplotypes
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('n_variants', ['2', '4', '6', '8', '10', '12', '15', '20',
+                                 '25', '30'],
+                  'Numbers of variants per cluster to benchmark.')
+flags.DEFINE_integer('n_clusters', 10,
+                     'Number of clusters simulated per number of variants.')
+flags.DEFINE_integer('cluster_size', 50,
+                     'Width in bp of the region holding each cluster.')
+flags.DEFINE_integer('max_variant_length', 10,
+                     'Maximum length in bp of each simulated variant.')
+flags.DEFINE_integer(
+    'max_enumerated_variants', 10,
+    'Largest number of variants per cluster for which the enumeration is '
+    'timed.')
+flags.DEFINE_integer('repeats', 3, 'Number of timing repeats.')
+flags.DEFINE_integer('random_seed', 12345, 'Seed for the simulated data.')
+
+
+def simulate_cluster(n_variants, rng):
+  """Returns n_variants coordinate-sorted variants overlapping one another.
+
+  Each variant is biallelic or, with probability 1/4, triallelic, and called
+  with the genotype of its most likely random genotype likelihood, so the
+  calls are frequently incompatible.
+
+  Args:
+    n_variants: int. The number of variants in the cluster.
+    rng: random.Random used to simulate the variants.
+
+  Returns:
+    A list of nucleus.genomics.v1.Variant protos.
+  """
+  variants = []
+  for start in sorted(
+      rng.randrange(FLAGS.cluster_size) for _ in range(n_variants)):
+    length = rng.randint(1, FLAGS.max_variant_length)
+    alts = ['C', 'G'] if rng.random() < 0.25 else ['C']
+    n_likelihoods = (len(alts) + 1) * (len(alts) + 2) // 2
+    gls = [-3 * rng.random() for _ in range(n_likelihoods)]
+    # Genotypes in genotype likelihood order, for up to two alts.
+    genotypes = [[0, 0], [0, 1], [1, 1], [0, 2], [1, 2], [2, 2]]
+    variants.append(
+        test_utils.make_variant(
+            start=start,
+            alleles=['A' * length] + alts,
+            gt=genotypes[gls.index(max(gls))],
+            gls=gls))
+  return variants
+
+
+def benchmark_n_variants(n_variants, rng):
+  """Returns the times in ms per cluster of (search, enumeration or None)."""
+  clusters = [
+      simulate_cluster(n_variants, rng) for _ in range(FLAGS.n_clusters)
+  ]
+
+  def search():
+    for cluster in clusters:
+      haplotypes._most_likely_configuration_and_marginals(cluster)  # pylint: disable=protected-access
+
+  def enumeration():
+    for cluster in clusters:
+      haplotypes._most_likely_configuration_and_marginals_by_enumeration(  # pylint: disable=protected-access
+          cluster)
+
+  def time_per_cluster_ms(fn):
+    seconds = min(timeit.repeat(fn, number=1, repeat=FLAGS.repeats))
+    return 1e3 * seconds / FLAGS.n_clusters
+
+  search_ms = time_per_cluster_ms(search)
+  enumeration_ms = None
+  if n_variants <= FLAGS.max_enumerated_variants:
+    enumeration_ms = time_per_cluster_ms(enumeration)
+  return search_ms, enumeration_ms
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  rng = random.Random(FLAGS.random_seed)
+  print('n_variants\tsearch_ms_per_cluster\tenumeration_ms_per_cluster'
+        '\tspeedup')
+  for n_variants in FLAGS.n_variants:
+    search_ms, enumeration_ms = benchmark_n_variants(int(n_variants), rng)
+    if enumeration_ms is None:
+      print('{}\t{:.3f}\t-\t-'.format(n_variants, search_ms))
+    else:
+      print('{}\t{:.3f}\t{:.3f}\t{:.1f}x'.format(n_variants, search_ms,
+                                                 enumeration_ms,
+                                                 enumeration_ms / search_ms))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -455,15 +455,15 @@ class ResolveOverlappingVariantsTest(parameterized.TestCase):
                       -0.638272163982407
                   ])
           ]),
-      # Too many variants to resolve.
+      # Too many variants to enumerate their configurations, but not to
+      # resolve them.
       dict(
           variants=[
               _var(
                   start=1,
                   end=30,
                   genotype=[0, 1],
-                  # Not a real likelihood -- if we weren't just punting
-                  # this would get rescaled to sum to 1.
+                  # Not a real likelihood; it is rescaled to sum to 1.
                   likelihoods=[-2, -1, -3])
           ] + [
               _var(start=i, genotype=[1, 1], likelihoods=[-3, -2, -1])
@@ -473,19 +473,52 @@ class ResolveOverlappingVariantsTest(parameterized.TestCase):
               _var(
                   start=1,
                   end=30,
-                  genotype=[0, 1],
-                  # Not a real likelihood -- if we weren't just punting
-                  # this would get rescaled to sum to 1.
-                  likelihoods=[-2, -1, -3])
+                  genotype=[0, 0],
+                  likelihoods=[0.0, -21.08646645982553, -45.99710553330647])
           ] + [
-              _var(start=i, genotype=[1, 1], likelihoods=[-3, -2, -1])
-              for i in range(3, 25)
+              _var(
+                  start=i,
+                  genotype=[1, 1],
+                  likelihoods=[
+                      -2.0453229787866576, -1.0453229787866576,
+                      -0.045322978786657586
+                  ]) for i in range(3, 25)
           ]),
   )
   def test_resolve_overlapping_variants(self, variants, expected):
     actual = haplotypes._resolve_overlapping_variants(variants)
     self._assert_generator_of_variants_equals_expected(actual, expected)
 
+  @parameterized.parameters(range(10))
+  def test_configuration_search_matches_enumeration(self, seed):
+    rng = np.random.RandomState(seed)
+    variants = []
+    start = 10
+    for _ in range(rng.randint(2, 7)):
+      start += rng.randint(0, 4)
+      alts = ['C', 'G'][:rng.randint(1, 3)]
+      n_likelihoods = (len(alts) + 1) * (len(alts) + 2) // 2
+      variants.append(
+          _var(
+              start=start,
+              end=start + rng.randint(1, 7),
+              alt=alts,
+              genotype=[1, 1],
+              likelihoods=list(-3 * rng.random_sample(n_likelihoods))))
+
+    expected_config, expected_aggregators = (
+        haplotypes._most_likely_configuration_and_marginals_by_enumeration(
+            variants))
+    actual_config, actual_aggregators = (
+        haplotypes._most_likely_configuration_and_marginals(variants))
+    self.assertEqual(actual_config, expected_config)
+    for actual, expected in zip(actual_aggregators, expected_aggregators):
+      np.testing.assert_allclose(
+          actual.scaled_likelihoods(),
+          expected.scaled_likelihoods(),
+          rtol=1e-10,
+          atol=1e-12)
+
   @parameterized.parameters(
       dict(variants=[], expected=[]),
       dict(
@@ -37,6 +37,8 @@ if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
 
 
 import collections
+import heapq
+import multiprocessing
 import time
 
 
@@ -159,7 +161,30 @@ flags.DEFINE_string(
     '(Only used when --variant_caller=vcf_candidate_importer.) '
     'Tabix-indexed VCF file containing the proposed positions and alts for '
     '`vcf_candidate_importer`. The GTs will be ignored.')
+flags.DEFINE_integer(
+    'proposed_variants_padding', 100,
+    'In calling mode without --gvcf, only process the bases within this '
+    'distance of a variant in --proposed_variants. Must be >= 0.')
 flags.DEFINE_integer('task', 0, 'Task ID of this task')
+flags.DEFINE_integer(
+    'n_cores', 1,
+    'Number of worker processes to use for processing regions in this task. '
+    'Each worker opens its own readers and realigner and pulls regions from a '
+    'shared queue; outputs are written in the same order as with n_cores=1.')
+flags.DEFINE_enum(
+    'region_cost_model', 'none', ['none', 'length', 'prior_timings'],
+    'How to estimate the cost of each partition when assigning partitions to '
+    'tasks. "none" deals partitions out to tasks round-robin. "length" uses '
+    'the number of calling-region bases in each partition. "prior_timings" '
+    'uses the per-region timings of a prior run given by '
+    '--prior_region_timings. With a cost model, costly partitions are split '
+    'and tasks are packed to balance their total estimated cost. The union of '
+    'the regions processed by all tasks is the same in all modes.')
+flags.DEFINE_string(
+    'prior_region_timings', '',
+    'Path to a TSV file whose first two columns are a region literal and the '
+    'seconds spent processing it in a prior run. Lines starting with "#" are '
+    'ignored. Required with --region_cost_model=prior_timings.')
 flags.DEFINE_integer(
     'partition_size', 1000,
     'The maximum number of basepairs we will allow in a region before splitting'
@@ -175,10 +200,24 @@ flags.DEFINE_bool(
     'realign_reads', True,
     'If True, locally realign reads before calling variants. '
     'Reads longer than 500 bp are never realigned.')
+flags.DEFINE_bool(
+    'skip_regions_without_candidates', False,
+    'If True, count the alleles in the original alignments of the reads of '
+    'each region before realigning them, and skip the rest of the processing '
+    'of regions where the variant caller finds no candidates. Realignment can '
+    'occasionally reveal a candidate that is absent from the original '
+    'alignments, such as an indel in soft clipped bases, so this trades a few '
+    'candidates for speed. Ignored in training mode, or if --gvcf is set.')
 flags.DEFINE_bool(
     'write_run_info', False,
     'If True, write out a MakeExamplesRunInfo proto besides our examples in '
     'text_format.')
+flags.DEFINE_string(
+    'region_timings', '',
+    'Optional. Path where we should write a TSV file with the time spent in '
+    'each stage for every region processed. Can be sharded like --examples. '
+    'The first two columns (region and seconds) can be passed to '
+    '--prior_region_timings of a later run.')
 flags.DEFINE_enum(
     'alt_aligned_pileup', 'none',
     ['none', 'base_channels', 'diff_channels', 'rows'],
@@ -311,6 +350,17 @@ flags.DEFINE_bool(
     'If True, add another channel for pileup images to represent allele '
     'frequency information gathered from population callsets.')
 
+# Names of the stages timed while processing each region, in processing order.
+# PROCESS_REGION_STAGE is the total time spent in RegionProcessor.process and
+# WRITE_OUTPUTS_STAGE the time spent writing the outputs of a region.
+PROCESS_REGION_STAGE = 'process_region'
+WRITE_OUTPUTS_STAGE = 'write_outputs'
+REGION_STAGES = (('query_reads', 'candidate_prescreen') +
+                 realigner.REALIGNER_STAGES + (
+    'allele_counting', 'candidate_calling', 'allele_frequency', 'labeling',
+    'alt_alignment', 'pileup_images', 'example_serialization',
+    PROCESS_REGION_STAGE, WRITE_OUTPUTS_STAGE))
+
 # ---------------------------------------------------------------------------
 # Selecting variants of specific types (e.g., SNPs)
 # ---------------------------------------------------------------------------
@@ -480,6 +530,7 @@ def default_options(add_flags=True, flags_obj=None):
       options.truth_variants_filename = flags_obj.truth_variants
     if flags_obj.proposed_variants:
       options.proposed_variants_filename = flags_obj.proposed_variants
+    options.proposed_variants_padding = flags_obj.proposed_variants_padding
     if flags_obj.sequencing_type:
       options.pic_options.sequencing_type = parse_proto_enum_flag(
           deepvariant_pb2.PileupImageOptions.SequencingType,
@@ -515,16 +566,27 @@ def default_options(add_flags=True, flags_obj=None):
               .format(svt, ', '.join(_VARIANT_TYPE_SELECTORS)),
               errors.CommandLineError)
 
-    num_shards, examples, candidates, gvcf = (
+    num_shards, examples, candidates, gvcf, region_timings = (
         sharded_file_utils.resolve_filespecs(flags_obj.task,
                                              flags_obj.examples or '',
                                              flags_obj.candidates or '',
-                                             flags_obj.gvcf or ''))
+                                             flags_obj.gvcf or '',
+                                             flags_obj.region_timings or ''))
     options.examples_filename = examples
     options.candidates_filename = candidates
     options.gvcf_filename = gvcf
+    options.region_timings_filename = region_timings
     options.task_id = flags_obj.task
     options.num_shards = num_shards
+    options.n_cores = flags_obj.n_cores
+    options.region_cost_model = flags_obj.region_cost_model
+    if flags_obj.prior_region_timings:
+      options.prior_region_timings_filename = flags_obj.prior_region_timings
+    if (options.region_cost_model == 'prior_timings' and
+        not options.prior_region_timings_filename):
+      errors.log_and_raise(
+          '--region_cost_model=prior_timings requires --prior_region_timings.',
+          errors.CommandLineError)
     if flags_obj.use_original_quality_scores and not flags_obj.parse_sam_aux_fields:
       errors.log_and_raise(
           'If use_original_quality_scores is set then parse_sam_aux_fields '
@@ -555,6 +617,8 @@ def default_options(add_flags=True, flags_obj=None):
         parse_regions_flag(flags_obj.exclude_regions))
 
     options.realigner_enabled = flags_obj.realign_reads
+    options.skip_regions_without_candidates = (
+        flags_obj.skip_regions_without_candidates)
     options.realigner_options.CopyFrom(realigner.realigner_config(flags_obj))
 
     options.max_reads_per_partition = flags_obj.max_reads_per_partition
@@ -904,14 +968,60 @@ def find_matching_allele_frequency(variant,
   dict_allele_frequency = match_candidate_and_cohort_haplotypes(
       candidate_haps, cohort_haps)
 
-  if dict_allele_frequency:
-    v = variant
-    logging.info('%s:%d-%d, %s > %s', v.reference_name, v.start, v.end,
-                 v.reference_bases, dict_allele_frequency)
-
   return dict_allele_frequency
 
 
+def prefetch_allele_frequency_inputs(variants, population_vcf_reader,
+                                     ref_reader):
+  """Reads everything find_matching_allele_frequency needs for variants.
+
+  Rather than querying population_vcf_reader and ref_reader once for each of
+  variants, this fetches the cohort variants overlapping the span of variants
+  on each contig with a single query and the reference bases under them with
+  another, and returns in-memory readers over those. Passing them to
+  find_matching_allele_frequency for any of variants gives the same result as
+  passing the original readers.
+
+  Args:
+    variants: list of Variant protos we want allele frequencies for.
+    population_vcf_reader: A VcfReader object for the population VCF.
+    ref_reader: A IndexedFastaReader object that reads the reference FASTA.
+
+  Returns:
+    A tuple of a vcf.InMemoryVcfReader and a fasta.InMemoryFastaReader.
+
+  Raises:
+    ValueError: if variants is empty.
+  """
+  spans = collections.OrderedDict()
+  for variant in variants:
+    start, end = spans.get(variant.reference_name,
+                           (variant.start, variant.end))
+    spans[variant.reference_name] = (min(start, variant.start),
+                                     max(end, variant.end))
+  if not spans:
+    raise ValueError('variants must not be empty')
+
+  cohort_variants = []
+  chromosomes = []
+  for contig, (start, end) in spans.items():
+    contig_variants = list(
+        population_vcf_reader.query(ranges.make_range(contig, start, end)))
+    cohort_variants.extend(contig_variants)
+    # get_ref_haplotype_and_offset queries the reference from the smallest
+    # start to the largest end of a variant and its cohort variants.
+    ref_start = min([start] + [v.start for v in contig_variants])
+    ref_end = max([end] + [v.end for v in contig_variants])
+    ref_end = min(ref_end, ref_reader.contig(contig).n_bases)
+    if ref_start < ref_end:
+      chromosomes.append((contig, ref_start,
+                          ref_reader.query(
+                              ranges.make_range(contig, ref_start, ref_end))))
+
+  return (vcf.InMemoryVcfReader(cohort_variants),
+          fasta.InMemoryFastaReader(chromosomes))
+
+
 # ---------------------------------------------------------------------------
 # Region processing
 # ---------------------------------------------------------------------------
@@ -1078,7 +1188,8 @@ def regions_to_process(contigs,
                        partition_size,
                        calling_regions=None,
                        task_id=None,
-                       num_shards=None):
+                       num_shards=None,
+                       region_cost_fn=None):
   """Determines the regions to process and partitions them into pieces.
 
   This function divides the genomes into regions we should process by
@@ -1111,6 +1222,10 @@ def regions_to_process(contigs,
     num_shards: int >= 0 or None. The number of shards (i.e., the total number
       of tasks) we are running in parallel. Together with task_id determines the
       subset of regions we want to process.
+    region_cost_fn: None or a function from a nucleus.genomics.v1.Range to its
+      estimated processing cost. If None, partitions are assigned to tasks
+      round-robin. Otherwise they are assigned with assign_regions_to_shards,
+      which may further split costly partitions.
 
   Returns:
     An iterable of nucleus.genomics.v1.Range objects.
@@ -1133,12 +1248,200 @@ def regions_to_process(contigs,
     regions = regions.intersection(calling_regions)
   partitioned = regions.partition(partition_size)
 
-  if num_shards:
+  if num_shards and region_cost_fn is not None:
+    return assign_regions_to_shards(partitioned, num_shards,
+                                    region_cost_fn)[task_id]
+  elif num_shards:
     return (r for i, r in enumerate(partitioned) if i % num_shards == task_id)
   else:
     return partitioned
 
 
+# A region whose estimated cost is more than this fraction of the average cost
+# per shard is split in halves, so that no single region dominates a shard.
+_MAX_REGION_FRACTION_OF_SHARD_COST = 0.05
+
+# Regions are never split into pieces smaller than this many basepairs.
+_MIN_SPLIT_REGION_SIZE = 100
+
+
+def split_costly_regions(regions, region_cost_fn, max_cost,
+                         min_size=_MIN_SPLIT_REGION_SIZE):
+  """Splits regions until their estimated cost is at most max_cost.
+
+  Each region whose cost exceeds max_cost is recursively split in half, unless
+  the halves would be smaller than min_size basepairs. The returned pieces
+  span exactly the same bases as regions.
+
+  Args:
+    regions: Iterable of nucleus.genomics.v1.Range protos.
+    region_cost_fn: Function from a Range to its estimated cost.
+    max_cost: float. The cost above which a region is split.
+    min_size: int. The minimum size in basepairs of a split piece.
+
+  Returns:
+    A list of (Range, cost) tuples, in the order of regions.
+  """
+  pieces = []
+  for region in regions:
+    stack = [(region, region_cost_fn(region))]
+    while stack:
+      piece, cost = stack.pop()
+      if cost > max_cost and ranges.length(piece) >= 2 * min_size:
+        mid = piece.start + ranges.length(piece) // 2
+        right = ranges.make_range(piece.reference_name, mid, piece.end)
+        left = ranges.make_range(piece.reference_name, piece.start, mid)
+        # Push right first so pieces come off the stack in genomic order.
+        stack.append((right, region_cost_fn(right)))
+        stack.append((left, region_cost_fn(left)))
+      else:
+        pieces.append((piece, cost))
+  return pieces
+
+
+def assign_regions_to_shards(regions, num_shards, region_cost_fn):
+  """Assigns regions to num_shards shards, balancing their estimated cost.
+
+  Regions that are costly relative to the average cost per shard are first
+  split with split_costly_regions. The pieces are then packed greedily, most
+  costly first, into the shard with the lowest total cost so far. The
+  assignment is deterministic, so every task computes the same one, and every
+  base of regions is assigned to exactly one shard.
+
+  Args:
+    regions: Iterable of nucleus.genomics.v1.Range protos, in genomic order.
+    num_shards: int > 0. The number of shards.
+    region_cost_fn: Function from a Range to its estimated cost.
+
+  Returns:
+    A list of num_shards lists of Range protos. Each list is in the order of
+    regions.
+  """
+  regions = list(regions)
+  total_cost = sum(region_cost_fn(r) for r in regions)
+  max_cost = _MAX_REGION_FRACTION_OF_SHARD_COST * total_cost / num_shards
+  pieces = split_costly_regions(regions, region_cost_fn, max_cost)
+
+  # Entries are (total cost, number of regions, shard index). Including the
+  # number of regions spreads zero-cost regions across shards.
+  shard_heap = [(0.0, 0, i) for i in range(num_shards)]
+  assigned = [[] for _ in range(num_shards)]
+  by_cost = sorted(range(len(pieces)), key=lambda i: (-pieces[i][1], i))
+  for piece_index in by_cost:
+    shard_cost, n_regions, shard = heapq.heappop(shard_heap)
+    assigned[shard].append(piece_index)
+    heapq.heappush(shard_heap,
+                   (shard_cost + pieces[piece_index][1], n_regions + 1, shard))
+  return [[pieces[i][0] for i in sorted(indices)] for indices in assigned]
+
+
+class PriorRegionTimings(object):
+  """Estimates the cost of regions from the region timings of a prior run.
+
+  The cost of a region is the time spent on the prior regions it overlaps,
+  weighted by the fraction of each prior region that is overlapped. Bases not
+  covered by any prior region are charged the average seconds per basepair
+  over all prior regions.
+  """
+
+  def __init__(self, timed_regions):
+    """Creates a new PriorRegionTimings.
+
+    Args:
+      timed_regions: Iterable of (nucleus.genomics.v1.Range, seconds) tuples.
+        The regions should not overlap each other.
+    """
+    timed_regions = list(timed_regions)
+    total_seconds = sum(seconds for _, seconds in timed_regions)
+    total_bp = sum(ranges.length(region) for region, _ in timed_regions)
+    self._default_seconds_per_bp = total_seconds / total_bp if total_bp else 1.0
+    self._index = ranges.SortedIntervalIndex(timed_regions)
+
+  @classmethod
+  def from_tsv(cls, path):
+    """Reads timings from a TSV file of region literals and seconds."""
+    timed_regions = []
+    with tf.io.gfile.GFile(path) as f:
+      for line in f:
+        if not line.strip() or line.startswith('#'):
+          continue
+        fields = line.rstrip('\n').split('\t')
+        timed_regions.append(
+            (ranges.parse_literal(fields[0]), float(fields[1])))
+    return cls(timed_regions)
+
+  def cost(self, region):
+    """Returns the estimated cost in seconds of processing region."""
+    seconds, covered_bp = 0.0, 0
+    for start, end, prior_seconds in self._index.query(region):
+      overlap = min(end, region.end) - max(start, region.start)
+      if overlap > 0:
+        covered_bp += overlap
+        seconds += prior_seconds * overlap / (end - start)
+    uncovered_bp = max(ranges.length(region) - covered_bp, 0)
+    return seconds + uncovered_bp * self._default_seconds_per_bp
+
+
+def region_cost_fn_from_options(options):
+  """Returns the region cost function selected by options, or None.
+
+  Args:
+    options: deepvariant.DeepVariantOptions proto.
+
+  Returns:
+    None if options.region_cost_model is empty or "none", so regions are
+    assigned to shards round-robin. For "length", a function returning the
+    length of a region; since regions are intersected with the calling regions
+    before partitioning this is the number of calling-region basepairs. For
+    "prior_timings", the cost function of a PriorRegionTimings read from
+    options.prior_region_timings_filename.
+
+  Raises:
+    ValueError: if options.region_cost_model is not recognized.
+  """
+  if options.region_cost_model in ('', 'none'):
+    return None
+  elif options.region_cost_model == 'length':
+    return ranges.length
+  elif options.region_cost_model == 'prior_timings':
+    return PriorRegionTimings.from_tsv(
+        options.prior_region_timings_filename).cost
+  else:
+    raise ValueError('Unexpected region_cost_model', options.region_cost_model)
+
+
+def proposed_variants_windows(vcf_filename, calling_regions, padding):
+  """Returns the calling regions within padding bp of a variant in a VCF.
+
+  The VCF is queried through its tabix index for each calling region, so only
+  the records within the calling regions are read.
+
+  Args:
+    vcf_filename: Path to a tabix-indexed VCF of proposed variants.
+    calling_regions: RangeSet of the regions we would process otherwise.
+    padding: int >= 0. The number of bases to keep on each side of a variant.
+
+  Returns:
+    A RangeSet of the bases of calling_regions that are at most padding bp from
+    a variant in vcf_filename starting within calling_regions.
+  """
+  windows = []
+  with vcf.VcfReader(vcf_filename) as vcf_reader:
+    vcf_contigs = set(contig.name for contig in vcf_reader.header.contigs)
+    for calling_region in calling_regions:
+      # Querying a contig missing from the VCF header is an error.
+      if calling_region.reference_name not in vcf_contigs:
+        continue
+      for variant in vcf_reader.query(calling_region):
+        if variant.start < calling_region.start:
+          continue
+        windows.append(
+            ranges.make_range(variant.reference_name,
+                              max(variant.start - padding, 0),
+                              variant.end + padding))
+  return calling_regions.intersection(ranges.RangeSet(windows, quiet=True))
+
+
 def filter_regions_by_vcf(regions, variant_positions):
   """Filter a list of regions to only those that contain variants.
 
@@ -1275,6 +1578,15 @@ class RegionProcessor(object):
     self.variant_caller = None
     self.samples = []
     self.population_vcf_readers = None
+    # Records the time spent in each of REGION_STAGES for the last region.
+    self.stage_timer = resources.StageTimer()
+    # (region, AlleleCounter) counted by region_reads for region, for
+    # candidates_in_region to use instead of counting the reads again. With the
+    # realigner enabled only the realigned reads are recounted.
+    self._region_allele_counter = None
+    # True if the last region was skipped because it had no candidates. See
+    # options.skip_regions_without_candidates.
+    self.region_skipped = False
 
   def _make_allele_counter_for_region(self, region):
     return allelecounter.AlleleCounter(self.ref_reader.c_reader, region,
@@ -1368,7 +1680,8 @@ class RegionProcessor(object):
       self.realigner = realigner.Realigner(
           self.options.realigner_options,
           self.ref_reader,
-          shared_header=input_bam_header)
+          shared_header=input_bam_header,
+          stage_timer=self.stage_timer)
 
     # Organize sam readers into samples to enable generalizing to N samples.
     sample = make_examples_utils.Sample(
@@ -1464,12 +1777,19 @@ class RegionProcessor(object):
       reference sites, if gvcf generation is enabled, otherwise returns [].
     """
     region_timer = timer.TimerStart()
+    self.stage_timer.start_unit()
 
     # Print some basic information about what we are doing.
     if not self.initialized:
       self._initialize()
 
-    self.in_memory_sam_reader.replace_reads(self.region_reads(region))
+    reads = self.region_reads(region)
+    if self.region_skipped:
+      region_timer.Stop()
+      self.stage_timer.add(PROCESS_REGION_STAGE, region_timer.GetDuration())
+      return [], [], []
+
+    self.in_memory_sam_reader.replace_reads(reads)
     candidates, gvcfs = self.candidates_in_region(region)
 
     if self.options.select_variant_types:
@@ -1487,15 +1807,18 @@ class RegionProcessor(object):
       else:
         population_vcf_reader = self.population_vcf_readers.get(
             region.reference_name, None)
-      candidates = list(
-          self.add_allele_frequencies_to_candidates(candidates,
-                                                    population_vcf_reader))
+      with self.stage_timer.time('allele_frequency'):
+        candidates = list(
+            self.add_allele_frequencies_to_candidates(candidates,
+                                                      population_vcf_reader))
 
     # pylint: disable=g-complex-comprehension
     if in_training_mode(self.options):
+      with self.stage_timer.time('labeling'):
+        labeled_candidates = list(self.label_candidates(candidates, region))
       examples = [
           self.add_label_to_example(example, label)
-          for candidate, label in self.label_candidates(candidates, region)
+          for candidate, label in labeled_candidates
           for example in self.create_pileup_examples(candidate)
       ]
     else:
@@ -1504,16 +1827,23 @@ class RegionProcessor(object):
           for example in self.create_pileup_examples(candidate)
       ]
     # pylint: enable=g-complex-comprehension
+    region_timer.Stop()
+    self.stage_timer.add(PROCESS_REGION_STAGE, region_timer.GetDuration())
     logging.vlog(2, 'Found %s candidates in %s [%d bp] [%0.2fs elapsed]',
                  len(examples), ranges.to_literal(region),
-                 ranges.length(region), region_timer.Stop())
+                 ranges.length(region), region_timer.GetDuration())
     return candidates, examples, gvcfs
 
   def region_reads(self, region):
     """Update in_memory_sam_reader with read alignments overlapping the region.
 
     If self.options.realigner_enabled is set, uses realigned reads, otherwise
-    original reads are returned.
+    original reads are returned. If the region is skipped because it has no
+    candidates, sets self.region_skipped and returns [] without realigning.
+
+    With the realigner enabled, the alleles of the original reads are counted
+    before realignment and only the reads realigned by it are recounted, leaving
+    the counts in self._region_allele_counter for candidates_in_region.
 
     Args:
       region: A nucleus.genomics.v1.Range object specifying the region we want
@@ -1522,6 +1852,141 @@ class RegionProcessor(object):
     Returns:
       [genomics.deepvariant.core.genomics.Read], reads overlapping the region.
     """
+    self._region_allele_counter = None
+    self.region_skipped = False
+    with self.stage_timer.time('query_reads'):
+      reads = self._query_reads(region)
+    if self._should_prescreen_candidates():
+      with self.stage_timer.time('candidate_prescreen'):
+        self.region_skipped = not self._has_candidates(region, reads)
+      if self.region_skipped:
+        return []
+    if self.options.realigner_enabled:
+      if self._region_allele_counter is None:
+        with self.stage_timer.time('allele_counting'):
+          self._region_allele_counter = (region,
+                                         self._count_alleles(region, reads))
+      original_reads = reads
+      max_read_length_to_realign = 500
+      if max_read_length_to_realign > 0:
+        long_reads = [
+            read for read in reads
+            if len(read.aligned_sequence) > max_read_length_to_realign
+        ]
+
+        short_reads = [
+            read for read in reads
+            if len(read.aligned_sequence) <= max_read_length_to_realign
+        ]
+
+        _, realigned_short_reads = self.realigner.realign_reads(
+            short_reads, region)
+
+        # Long reads will be listed before short reads when both are present.
+        # Examples with only short or only long reads will be unaffected.
+        reads = long_reads + realigned_short_reads
+      else:
+        _, reads = self.realigner.realign_reads(reads, region)
+
+      with self.stage_timer.time('allele_counting'):
+        self._recount_realigned_reads(region, original_reads, reads)
+    return reads
+
+  def _should_prescreen_candidates(self):
+    """Returns True if regions without candidates can be skipped early.
+
+    Skipping requires that a region without candidates has no outputs at all,
+    which isn't true with gVCF output, or in training where the labeler must
+    see the truth variants of every region. It also requires that finding the
+    candidates twice gives the same result, which isn't true when reference
+    sites are emitted at random.
+    """
+    vc_options = self.options.variant_caller_options
+    return (self.options.skip_regions_without_candidates and
+            not in_training_mode(self.options) and
+            not gvcf_output_enabled(self.options) and
+            vc_options.fraction_reference_sites_to_emit <= 0)
+
+  def _has_candidates(self, region, reads):
+    """Returns True if the variant caller finds candidates in reads.
+
+    The alleles are counted in the original alignments of reads, so this is a
+    cheap estimate of whether region has candidates after realignment. The
+    counts are left in self._region_allele_counter, where region_reads updates
+    them for the realigned reads.
+
+    Args:
+      region: A nucleus.genomics.v1.Range proto. The region being processed.
+      reads: list of nucleus.genomics.v1.Read overlapping region.
+
+    Returns:
+      bool.
+    """
+    if not reads:
+      return False
+    allele_counter = self._count_alleles(region, reads)
+    self._region_allele_counter = (region, allele_counter)
+    return bool(self.variant_caller.get_candidates(allele_counter))
+
+  def _count_alleles(self, region, reads):
+    """Returns an AlleleCounter for region with the reads overlapping it added.
+
+    Only the reads overlapping region are counted, as these are the reads that
+    in_memory_sam_reader returns to candidates_in_region.
+
+    Args:
+      region: A nucleus.genomics.v1.Range proto. The region being processed.
+      reads: iterable of nucleus.genomics.v1.Read.
+
+    Returns:
+      An allelecounter.AlleleCounter.
+    """
+    sample_name = self.options.variant_caller_options.sample_name
+    allele_counter = self._make_allele_counter_for_region(region)
+    for read in reads:
+      if ranges.ranges_overlap(utils.read_range(read), region):
+        allele_counter.add(read, sample_name)
+    return allele_counter
+
+  def _recount_realigned_reads(self, region, original_reads, reads):
+    """Updates self._region_allele_counter for the realigned reads.
+
+    The counter holds the counts of original_reads. The realigner returns the
+    reads it leaves untouched as the same objects, so only the original reads
+    missing from reads are removed and only the reads not in original_reads are
+    added, giving the same counts as counting reads from scratch.
+
+    Args:
+      region: A nucleus.genomics.v1.Range proto. The region being processed.
+      original_reads: list of nucleus.genomics.v1.Read. The reads counted in
+        self._region_allele_counter.
+      reads: list of nucleus.genomics.v1.Read. The reads after realignment.
+    """
+    sample_name = self.options.variant_caller_options.sample_name
+    _, allele_counter = self._region_allele_counter
+    realigned_ids = set(id(read) for read in reads)
+    original_ids = set(id(read) for read in original_reads)
+    for read in original_reads:
+      if (id(read) not in realigned_ids and
+          ranges.ranges_overlap(utils.read_range(read), region)):
+        allele_counter.remove(read, sample_name)
+    for read in reads:
+      if (id(read) not in original_ids and
+          ranges.ranges_overlap(utils.read_range(read), region)):
+        allele_counter.add(read, sample_name)
+
+  def _take_region_allele_counter(self, region):
+    """Returns the AlleleCounter counted by region_reads for region, or None."""
+    if self._region_allele_counter is None:
+      return None
+    counted_region, allele_counter = self._region_allele_counter
+    self._region_allele_counter = None
+    if counted_region != region:
+      return None
+    return allele_counter
+
+  def _query_reads(self, region):
+    """Returns the (possibly downsampled) reads overlapping region."""
     reads = []
     if self.sam_readers is not None:
       for sam_reader_index, sam_reader in enumerate(self.sam_readers):
@@ -1556,29 +2021,7 @@ class RegionProcessor(object):
       reads = utils.reservoir_sample(reads,
                                      self.options.max_reads_per_partition,
                                      random_for_region)
-    reads = list(reads)
-    if self.options.realigner_enabled:
-      max_read_length_to_realign = 500
-      if max_read_length_to_realign > 0:
-        long_reads = [
-            read for read in reads
-            if len(read.aligned_sequence) > max_read_length_to_realign
-        ]
-
-        short_reads = [
-            read for read in reads
-            if len(read.aligned_sequence) <= max_read_length_to_realign
-        ]
-
-        _, realigned_short_reads = self.realigner.realign_reads(
-            short_reads, region)
-
-        # Long reads will be listed before short reads when both are present.
-        # Examples with only short or only long reads will be unaffected.
-        return long_reads + realigned_short_reads
-
-      _, reads = self.realigner.realign_reads(reads, region)
-    return reads
+    return list(reads)
 
   def candidates_in_region(self, region):
     """Finds candidate DeepVariantCall protos in region.
@@ -1599,12 +2042,17 @@ class RegionProcessor(object):
       # we need to return the gVCF records calculated by the caller below.
       return [], []
 
-    allele_counter = self._make_allele_counter_for_region(region)
-    for read in reads:
-      allele_counter.add(read, self.options.variant_caller_options.sample_name)
-
-    candidates, gvcfs = self.variant_caller.calls_and_gvcfs(
-        allele_counter, gvcf_output_enabled(self.options))
+    with self.stage_timer.time('allele_counting'):
+      allele_counter = self._take_region_allele_counter(region)
+      if allele_counter is None:
+        allele_counter = self._make_allele_counter_for_region(region)
+        for read in reads:
+          allele_counter.add(read,
+                             self.options.variant_caller_options.sample_name)
+
+    with self.stage_timer.time('candidate_calling'):
+      candidates, gvcfs = self.variant_caller.calls_and_gvcfs(
+          allele_counter, gvcf_output_enabled(self.options))
     return candidates, gvcfs
 
   def align_to_all_haplotypes(self, variant, reads):
@@ -1695,12 +2143,19 @@ class RegionProcessor(object):
       DeepVariantCall protos. The same set of input candidates, with field
         allele_frequency filled.
     """
+    candidates = list(candidates)
+    if population_vcf_reader and candidates:
+      # Read the population VCF and the reference once for all candidates.
+      population_vcf_reader, ref_reader = prefetch_allele_frequency_inputs(
+          [candidate.variant for candidate in candidates],
+          population_vcf_reader, self.ref_reader)
+
     for candidate in candidates:
       if population_vcf_reader:
         dict_allele_frequency = find_matching_allele_frequency(
             variant=candidate.variant,
             population_vcf_reader=population_vcf_reader,
-            ref_reader=self.ref_reader)
+            ref_reader=ref_reader)
       else:
         # Set ALT frequencies to 0 if population_vcf_reader is None.
         dict_allele_frequency = {}
@@ -1727,11 +2182,12 @@ class RegionProcessor(object):
     Returns:
       A list of tf.Example protos.
     """
-    reads_for_samples = [
-        self.pic.get_reads(
-            dv_call.variant, sam_reader=sample.in_memory_sam_reader)
-        for sample in self.samples
-    ]
+    with self.stage_timer.time('pileup_images'):
+      reads_for_samples = [
+          self.pic.get_reads(
+              dv_call.variant, sam_reader=sample.in_memory_sam_reader)
+          for sample in self.samples
+      ]
     logging.vlog(
         3, 'create_pileup_examples for variant: {}:{}_{}'.format(
             dv_call.variant.reference_name, dv_call.variant.start,
@@ -1750,10 +2206,11 @@ class RegionProcessor(object):
     if alt_align_this_variant:
       # Align the reads against each alternate allele, saving the sequences of
       # those alleles along with the alignments for pileup images.
-      alt_info_for_samples = [
-          self.align_to_all_haplotypes(dv_call.variant, reads)
-          for reads in reads_for_samples
-      ]
+      with self.stage_timer.time('alt_alignment'):
+        alt_info_for_samples = [
+            self.align_to_all_haplotypes(dv_call.variant, reads)
+            for reads in reads_for_samples
+        ]
       # Each sample has different reads and thus different alt-alignments.
       haplotype_alignments_for_samples = [
           sample['alt_alignments'] for sample in alt_info_for_samples
@@ -1761,11 +2218,12 @@ class RegionProcessor(object):
       # All samples share the same alt sequences, so select the first one.
       haplotype_sequences = alt_info_for_samples[0]['alt_sequences']
 
-    pileup_images = self.pic.create_pileup_images(
-        dv_call=dv_call,
-        reads_for_samples=reads_for_samples,
-        haplotype_alignments_for_samples=haplotype_alignments_for_samples,
-        haplotype_sequences=haplotype_sequences)
+    with self.stage_timer.time('pileup_images'):
+      pileup_images = self.pic.create_pileup_images(
+          dv_call=dv_call,
+          reads_for_samples=reads_for_samples,
+          haplotype_alignments_for_samples=haplotype_alignments_for_samples,
+          haplotype_sequences=haplotype_sequences)
 
     if pileup_images is None:
       # We cannot build a PileupImage for dv_call, issue a warning.
@@ -1774,16 +2232,17 @@ class RegionProcessor(object):
       return []
 
     examples = []
-    for alt_alleles, image_tensor in pileup_images:
-      encoded_tensor, shape, tensor_format = self._encode_tensor(image_tensor)
-      examples.append(
-          tf_utils.make_example(
-              dv_call.variant,
-              alt_alleles,
-              encoded_tensor,
-              shape=shape,
-              image_format=tensor_format,
-              sequencing_type=self.options.pic_options.sequencing_type))
+    with self.stage_timer.time('example_serialization'):
+      for alt_alleles, image_tensor in pileup_images:
+        encoded_tensor, shape, tensor_format = self._encode_tensor(image_tensor)
+        examples.append(
+            tf_utils.make_example(
+                dv_call.variant,
+                alt_alleles,
+                encoded_tensor,
+                shape=shape,
+                image_format=tensor_format,
+                sequencing_type=self.options.pic_options.sequencing_type))
     return examples
 
   def label_candidates(self, candidates, region):
@@ -1883,27 +2342,43 @@ def processing_regions_from_options(options):
                      'resulting in set of empty region to process. This also '
                      'happens if you use "chr20" for a BAM where contig names '
                      'don\'t have "chr"s (or vice versa).')
+  # Only the bases around the proposed variants can yield candidates, so we
+  # don't need to process anything else unless we are writing a gVCF.
+  if (not in_training_mode(options) and options.proposed_variants_filename and
+      not gvcf_output_enabled(options)):
+    before = time.time()
+    n_bases_before = sum(ranges.length(r) for r in calling_regions)
+    calling_regions = proposed_variants_windows(
+        options.proposed_variants_filename, calling_regions,
+        options.proposed_variants_padding)
+    logging_with_options(
+        options, 'Restricting the regions to process to the bases within {} '
+        'bp of the variants in --proposed_variants reduced them from {} to {} '
+        'bp in {} seconds.'.format(
+            options.proposed_variants_padding, n_bases_before,
+            sum(ranges.length(r) for r in calling_regions),
+            round(time.time() - before, 2)))
+    if not calling_regions:
+      # regions_to_process treats empty calling regions as the whole genome.
+      return []
   regions = regions_to_process(
       contigs=contigs,
       partition_size=options.allele_counter_options.partition_size,
       calling_regions=calling_regions,
       task_id=options.task_id,
-      num_shards=options.num_shards)
+      num_shards=options.num_shards,
+      region_cost_fn=region_cost_fn_from_options(options))
 
   region_list = list(regions)
   # When processing many regions, check for a VCF to narrow down the regions.
-  if not gvcf_output_enabled(options) and len(region_list) > 10000:
-    if in_training_mode(options):
-      filter_vcf = options.truth_variants_filename
-      logging_with_options(
-          options, 'Reading VCF to see if we can skip processing some regions '
-          'without variants in the --truth_variants VCF.')
-    else:
-      filter_vcf = options.proposed_variants_filename
-      if filter_vcf:
-        logging_with_options(
-            options, 'Reading VCF to skip processing some regions without '
-            'variants in the --proposed_variants VCF.')
+  # In calling mode, the regions are already narrowed down to the proposed
+  # variants above.
+  if (not gvcf_output_enabled(options) and len(region_list) > 10000 and
+      in_training_mode(options)):
+    filter_vcf = options.truth_variants_filename
+    logging_with_options(
+        options, 'Reading VCF to see if we can skip processing some regions '
+        'without variants in the --truth_variants VCF.')
     if filter_vcf:
       before = time.time()
       variant_positions = []
@@ -1973,8 +2448,154 @@ class OutputsWriter(object):
   def _write(self, writer_name, *protos):
     writer = self._writers[writer_name]
     if writer:
-      for proto in protos:
-        writer.write(proto)
+      writer.write_many(protos)
+
+
+# ---------------------------------------------------------------------------
+# Processing regions in a pool of worker processes
+# ---------------------------------------------------------------------------
+
+# The RegionProcessor owned by the current worker process. It is created by
+# _initialize_worker after the worker is forked, so each worker lazily opens
+# its own readers, realigner, etc. the first time it processes a region.
+_worker_region_processor = None
+
+
+def _initialize_worker(options):
+  global _worker_region_processor
+  _worker_region_processor = RegionProcessor(options)
+
+
+# The outputs of processing a single region. candidates, examples and gvcfs are
+# those returned by RegionProcessor.process. labeling_metrics is a
+# LabelingMetrics proto holding the metrics accumulated while labeling just
+# this region, or None if they aren't tracked separately per region.
+# stage_seconds is a dict from stage name to the seconds spent in that stage.
+# skipped is True if the region was skipped because it had no candidates.
+RegionOutputs = collections.namedtuple('RegionOutputs', [
+    'region', 'candidates', 'examples', 'gvcfs', 'labeling_metrics',
+    'stage_seconds', 'skipped'
+])
+
+
+def _process_region_in_worker(region):
+  """Processes region with this worker's RegionProcessor.
+
+  Args:
+    region: A nucleus.genomics.v1.Range proto to process.
+
+  Returns:
+    A RegionOutputs. Its labeling_metrics is None if we aren't labeling or the
+    labeler doesn't collect metrics.
+  """
+  candidates, examples, gvcfs = _worker_region_processor.process(region)
+  labeler = _worker_region_processor.labeler
+  labeling_metrics = None
+  if labeler is not None and labeler.metrics is not None:
+    # Hand back only the metrics for this region, so the parent process can
+    # sum them up no matter which worker processed which region.
+    labeling_metrics = deepvariant_pb2.LabelingMetrics()
+    labeling_metrics.CopyFrom(labeler.metrics)
+    labeler.metrics.Clear()
+  return RegionOutputs(region, candidates, examples, gvcfs, labeling_metrics,
+                       _worker_region_processor.stage_timer.unit_seconds(),
+                       _worker_region_processor.region_skipped)
+
+
+def add_labeling_metrics(total, delta):
+  """Adds the counts in LabelingMetrics delta into total, in place."""
+  for field, value in delta.ListFields():
+    setattr(total, field.name, getattr(total, field.name) + value)
+
+
+def process_regions(options, regions, region_processor):
+  """Yields the outputs of processing each region, in the order of regions.
+
+  With options.n_cores == 1 the regions are processed by region_processor in
+  this process. Otherwise a pool of options.n_cores worker processes is
+  forked, each with its own RegionProcessor, which pull regions from a shared
+  queue. Results are yielded in the order of regions either way, so the
+  outputs are identical to a single-core run.
+
+  Args:
+    options: deepvariant.DeepVariantOptions proto.
+    regions: Iterable of nucleus.genomics.v1.Range protos to process.
+    region_processor: RegionProcessor used when options.n_cores == 1.
+
+  Yields:
+    A RegionOutputs for each region. labeling_metrics is always None when
+    n_cores == 1, since the labeler of region_processor then holds the metrics
+    for the entire run.
+  """
+  if options.n_cores == 1:
+    for region in regions:
+      candidates, examples, gvcfs = region_processor.process(region)
+      yield RegionOutputs(region, candidates, examples, gvcfs, None,
+                          region_processor.stage_timer.unit_seconds(),
+                          region_processor.region_skipped)
+    return
+
+  logging_with_options(options,
+                       'Processing regions with %d workers' % options.n_cores)
+  pool = multiprocessing.get_context('fork').Pool(
+      processes=options.n_cores,
+      initializer=_initialize_worker,
+      initargs=(options,))
+  try:
+    # imap hands out regions one at a time from a shared task queue and
+    # returns results in submission order.
+    for result in pool.imap(_process_region_in_worker, regions, chunksize=1):
+      yield result
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
+class RegionTimingsWriter(object):
+  """Writes the time spent in each stage for every region as a TSV file.
+
+  The first two columns are the region literal and the total seconds spent on
+  the region, so the file can be read by PriorRegionTimings.from_tsv. They are
+  followed by the number of candidates and examples and the seconds spent in
+  each of REGION_STAGES.
+  """
+
+  def __init__(self, path):
+    self._path = path
+    self._writer = None
+
+  def __enter__(self):
+    if self._path:
+      self._writer = tf.io.gfile.GFile(self._path, mode='w')
+      self._writer.write('\t'.join(
+          ('#region', 'seconds', 'n_candidates', 'n_examples') +
+          REGION_STAGES) + '\n')
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    if self._writer is not None:
+      self._writer.close()
+
+  def write(self, region_outputs):
+    """Writes a row for a RegionOutputs."""
+    if self._writer is None:
+      return
+    stage_seconds = region_outputs.stage_seconds
+    total_seconds = (
+        stage_seconds.get(PROCESS_REGION_STAGE, 0.0) +
+        stage_seconds.get(WRITE_OUTPUTS_STAGE, 0.0))
+    row = [
+        ranges.to_literal(region_outputs.region),
+        '{:.6f}'.format(total_seconds),
+        str(len(region_outputs.candidates)),
+        str(len(region_outputs.examples))
+    ]
+    row.extend('{:.6f}'.format(stage_seconds.get(stage, 0.0))
+               for stage in REGION_STAGES)
+    self._writer.write('\t'.join(row) + '\n')
 
 
 def make_examples_runner(options):
@@ -1985,6 +2606,9 @@ def make_examples_runner(options):
 
   # Create a processor to create candidates and examples for each region.
   region_processor = RegionProcessor(options)
+  labeling_metrics = deepvariant_pb2.LabelingMetrics()
+  has_labeling_metrics = False
+  stage_timings = resources.StageTimingHistograms()
 
   logging_with_options(options,
                        'Writing examples to %s' % options.examples_filename)
@@ -1994,17 +2618,29 @@ def make_examples_runner(options):
   if options.gvcf_filename:
     logging_with_options(options,
                          'Writing gvcf records to %s' % options.gvcf_filename)
+  if options.region_timings_filename:
+    logging_with_options(
+        options,
+        'Writing region timings to %s' % options.region_timings_filename)
 
-  n_regions, n_candidates, n_examples = 0, 0, 0
+  n_regions, n_skipped_regions, n_candidates, n_examples = 0, 0, 0, 0
   last_reported = 0
-  with OutputsWriter(options) as writer:
+  with OutputsWriter(options) as writer, RegionTimingsWriter(
+      options.region_timings_filename) as region_timings_writer:
     running_timer = timer.TimerStart()
-    for region in regions:
-      candidates, examples, gvcfs = region_processor.process(region)
+    for region_outputs in process_regions(options, regions, region_processor):
+      candidates = region_outputs.candidates
+      examples = region_outputs.examples
+      gvcfs = region_outputs.gvcfs
+      if region_outputs.labeling_metrics is not None:
+        add_labeling_metrics(labeling_metrics, region_outputs.labeling_metrics)
+        has_labeling_metrics = True
       n_candidates += len(candidates)
       n_examples += len(examples)
       n_regions += 1
+      n_skipped_regions += int(region_outputs.skipped)
 
+      write_timer = timer.TimerStart()
       writer.write_candidates(*candidates)
 
       # If we have any gvcf records, write them out. This if also serves to
@@ -2014,6 +2650,9 @@ def make_examples_runner(options):
       if gvcfs:
         writer.write_gvcfs(*gvcfs)
       writer.write_examples(*examples)
+      region_outputs.stage_seconds[WRITE_OUTPUTS_STAGE] = write_timer.Stop()
+      stage_timings.add(region_outputs.stage_seconds)
+      region_timings_writer.write(region_outputs)
 
       # Output timing for every N candidates.
       # redacted
@@ -2027,8 +2666,20 @@ def make_examples_runner(options):
   # Construct and then write out our MakeExamplesRunInfo proto.
   if options.run_info_filename:
     run_info = deepvariant_pb2.MakeExamplesRunInfo(
-        options=options, resource_metrics=resource_monitor.metrics())
-    if in_training_mode(options):
+        options=options,
+        resource_metrics=resource_monitor.metrics(),
+        stage_timings=stage_timings.metrics(),
+        n_regions=n_regions,
+        n_skipped_regions=n_skipped_regions)
+    if in_training_mode(options) and options.n_cores > 1:
+      if has_labeling_metrics:
+        run_info.labeling_metrics.CopyFrom(labeling_metrics)
+      else:
+        logging.warning(
+            'Labeling metrics requested but the selected labeling '
+            'algorithm %s does not collect metrics; skipping.',
+            options.labeler_algorithm)
+    elif in_training_mode(options):
       if region_processor.labeler.metrics is not None:
         run_info.labeling_metrics.CopyFrom(region_processor.labeler.metrics)
       else:
@@ -2041,6 +2692,10 @@ def make_examples_runner(options):
         'Writing MakeExamplesRunInfo to %s' % options.run_info_filename)
     write_make_examples_run_info(run_info, path=options.run_info_filename)
 
+  if options.skip_regions_without_candidates:
+    logging_with_options(
+        options, 'Skipped %s of %s regions without candidates' %
+        (n_skipped_regions, n_regions))
   logging_with_options(options, 'Found %s candidate variants' % n_candidates)
   logging_with_options(options, 'Created %s examples' % n_examples)
 
@@ -2071,10 +2726,14 @@ def main(argv=()):
     if not options.examples_filename:
       errors.log_and_raise('examples argument is required.',
                            errors.CommandLineError)
-    if options.n_cores != 1:
+    if options.proposed_variants_padding < 0:
+      errors.log_and_raise(
+          'proposed_variants_padding must be >= 0 but got {}.'.format(
+              options.proposed_variants_padding), errors.CommandLineError)
+    if options.n_cores < 1:
       errors.log_and_raise(
-          'Currently only supports n_cores == 1 but got {}.'.format(
-              options.n_cores), errors.CommandLineError)
+          'n_cores must be >= 1 but got {}.'.format(options.n_cores),
+          errors.CommandLineError)
 
     # Check for argument issues specific to different modes.
     if in_training_mode(options):
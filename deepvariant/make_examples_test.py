@@ -198,6 +198,15 @@ class MakeExamplesEnd2EndTest(parameterized.TestCase):
           num_shards=0,
           test_condition=TestConditions.USE_MULTI_BAMS,
           labeler_algorithm='haplotype_labeler'),
+      # The following tests process regions with a pool of workers and should
+      # produce exactly the same outputs as a single-core run:
+      dict(mode='calling', num_shards=0, n_cores=3),
+      dict(mode='calling', num_shards=3, n_cores=2),
+      dict(
+          mode='training',
+          num_shards=0,
+          labeler_algorithm='haplotype_labeler',
+          n_cores=3),
   )
   @flagsaver.FlagSaver
   def test_make_examples_end2end(self,
@@ -205,7 +214,8 @@ class MakeExamplesEnd2EndTest(parameterized.TestCase):
                                  num_shards,
                                  test_condition=TestConditions.USE_BAM,
                                  labeler_algorithm=None,
-                                 use_fast_pass_aligner=True):
+                                 use_fast_pass_aligner=True,
+                                 n_cores=1):
     self.assertIn(mode, {'calling', 'training'})
     region = ranges.parse_literal('chr20:10,000,000-10,010,000')
     FLAGS.write_run_info = True
@@ -222,11 +232,14 @@ class MakeExamplesEnd2EndTest(parameterized.TestCase):
         _sharded('vsc.tfrecord', num_shards))
     FLAGS.examples = test_utils.test_tmpfile(
         _sharded('examples.tfrecord', num_shards))
+    FLAGS.region_timings = test_utils.test_tmpfile(
+        _sharded('region_timings.tsv', num_shards))
     FLAGS.regions = [ranges.to_literal(region)]
     FLAGS.partition_size = 1000
     FLAGS.mode = mode
     FLAGS.gvcf_gq_binsize = 5
     FLAGS.use_fast_pass_aligner = use_fast_pass_aligner
+    FLAGS.n_cores = n_cores
     if labeler_algorithm is not None:
       FLAGS.labeler_algorithm = labeler_algorithm
 
@@ -250,6 +263,18 @@ class MakeExamplesEnd2EndTest(parameterized.TestCase):
       # (b) run_info.resource_metrics is present and contains our hostname.
       self.assertTrue(run_info.HasField('resource_metrics'))
       self.assertEqual(run_info.resource_metrics.host_name, platform.node())
+      # (c) run_info.stage_timings has one process_region entry per region,
+      # which also is one row of the region timings file.
+      with gfile.Open(options.region_timings_filename) as f:
+        timing_rows = [l for l in f if not l.startswith('#')]
+      stage_timings = {t.stage: t for t in run_info.stage_timings}
+      self.assertContainsSubset(stage_timings, make_examples.REGION_STAGES)
+      self.assertEqual(stage_timings['process_region'].count, len(timing_rows))
+      self.assertEqual(
+          sum(stage_timings['process_region'].bucket_counts), len(timing_rows))
+      # (d) run_info.n_regions counts the regions, none of which were skipped.
+      self.assertEqual(run_info.n_regions, len(timing_rows))
+      self.assertEqual(run_info.n_skipped_regions, 0)
 
     # Test that our candidates are reasonable, calling specific helper functions
     # to check lots of properties of the output.
@@ -1123,6 +1148,87 @@ class MakeExamplesUnitTest(parameterized.TestCase):
       sharded_regions.extend(task_regions)
     six.assertCountEqual(self, unsharded_regions, sharded_regions)
 
+  @parameterized.parameters([2, 3, 7, 50])
+  def test_regions_to_process_sharding_with_cost_fn(self, num_shards):
+    """Cost-balanced sharding still covers exactly the unsharded bases."""
+    contigs = _make_contigs([('z', 1000), ('a', 3000), ('n', 500)])
+
+    def cost_fn(region):
+      # Make the bases of contig 'a' 100x more costly than the rest.
+      return ranges.length(region) * (100 if region.reference_name == 'a' else
+                                      1)
+
+    unsharded = list(
+        make_examples.regions_to_process(contigs=contigs, partition_size=500))
+    sharded = []
+    for task_id in range(num_shards):
+      task_regions = list(
+          make_examples.regions_to_process(
+              contigs=contigs,
+              partition_size=500,
+              task_id=task_id,
+              num_shards=num_shards,
+              region_cost_fn=cost_fn))
+      # Regions within each task are in genomic order.
+      self.assertEqual(task_regions,
+                       ranges.sorted_ranges(task_regions, contigs))
+      sharded.extend(task_regions)
+    # No base is processed twice, and together the tasks cover every base.
+    self.assertEqual(
+        sum(ranges.length(r) for r in sharded),
+        sum(ranges.length(r) for r in unsharded))
+    self.assertEqual(
+        list(ranges.RangeSet(sharded, contigs=contigs)),
+        list(ranges.RangeSet(unsharded, contigs=contigs)))
+
+  def test_assign_regions_to_shards_balances_cost(self):
+    regions = [ranges.make_range('1', i * 100, (i + 1) * 100) for i in range(8)]
+    # The first region costs as much as the other seven together.
+    costs = {r.start: 7 if r.start == 0 else 1 for r in regions}
+    shards = make_examples.assign_regions_to_shards(
+        regions, 2, lambda r: costs.get(r.start, 1) * ranges.length(r) / 100)
+    self.assertEqual(
+        sorted(shards, key=len),
+        [[ranges.make_range('1', 0, 100)],
+         [ranges.make_range('1', i * 100, (i + 1) * 100) for i in range(1, 8)]])
+
+  def test_split_costly_regions(self):
+    region = ranges.make_range('1', 0, 1000)
+    pieces = make_examples.split_costly_regions([region],
+                                                ranges.length,
+                                                max_cost=300,
+                                                min_size=100)
+    self.assertEqual([(ranges.make_range('1', 0, 250), 250),
+                      (ranges.make_range('1', 250, 500), 250),
+                      (ranges.make_range('1', 500, 750), 250),
+                      (ranges.make_range('1', 750, 1000), 250)], pieces)
+    # Pieces are never split below min_size.
+    pieces = make_examples.split_costly_regions([region],
+                                                ranges.length,
+                                                max_cost=1,
+                                                min_size=400)
+    self.assertEqual([(ranges.make_range('1', 0, 500), 500),
+                      (ranges.make_range('1', 500, 1000), 500)], pieces)
+
+  @parameterized.parameters(
+      # Fully covered by a single prior region.
+      ('1:11-20', 1.0),
+      # Half of two prior regions.
+      ('1:16-25', 0.5 + 2.0),
+      # Uncovered bases cost the average of 5s / 20bp.
+      ('1:31-40', 2.5),
+      ('2:1-4', 1.0),
+      # Partially covered.
+      ('1:26-35', 2.0 + 1.25),
+  )
+  def test_prior_region_timings(self, region_literal, expected_cost):
+    path = test_utils.test_tmpfile(
+        'prior_region_timings.tsv',
+        '#region\tseconds\n1:11-20\t1.0\n1:21-30\t4.0\n')
+    timings = make_examples.PriorRegionTimings.from_tsv(path)
+    self.assertAlmostEqual(
+        timings.cost(ranges.parse_literal(region_literal)), expected_cost)
+
   @parameterized.parameters(
       # Providing one of task id and num_shards but not the other is bad.
       (None, 0),
@@ -1204,6 +1310,62 @@ class MakeExamplesUnitTest(parameterized.TestCase):
         'confident_regions is required when in training mode.')
     mock_exit.assert_called_once_with(errno.ENOENT)
 
+  @flagsaver.FlagSaver
+  def test_catches_bad_n_cores(self):
+    FLAGS.ref = testdata.CHR20_FASTA
+    FLAGS.reads = testdata.CHR20_BAM
+    FLAGS.examples = test_utils.test_tmpfile('examples.tfrecord')
+    FLAGS.mode = 'calling'
+    FLAGS.n_cores = 0
+
+    with mock.patch.object(logging, 'error') as mock_logging,\
+        mock.patch.object(sys, 'exit') as mock_exit:
+      make_examples.main(['make_examples.py'])
+    mock_logging.assert_called_once_with('n_cores must be >= 1 but got 0.')
+    mock_exit.assert_called_once_with(errno.ENOENT)
+
+  def test_region_timings_writer(self):
+    path = test_utils.test_tmpfile('region_timings_writer.tsv')
+    region = ranges.parse_literal('chr20:11-20')
+    with make_examples.RegionTimingsWriter(path) as writer:
+      writer.write(
+          make_examples.RegionOutputs(
+              region=region,
+              candidates=['c1', 'c2'],
+              examples=['e1'],
+              gvcfs=[],
+              labeling_metrics=None,
+              stage_seconds={
+                  'query_reads': 0.25,
+                  'process_region': 1.0,
+                  'write_outputs': 0.5
+              },
+              skipped=False))
+    with gfile.Open(path) as f:
+      header, row = [line.rstrip('\n').split('\t') for line in f]
+    self.assertEqual(header[:4],
+                     ['#region', 'seconds', 'n_candidates', 'n_examples'])
+    self.assertEqual(header[4:], list(make_examples.REGION_STAGES))
+    self.assertEqual(row[:4], ['chr20:11-20', '1.500000', '2', '1'])
+    self.assertEqual(
+        dict(zip(header[4:], row[4:]))['query_reads'], '0.250000')
+    # The region timings can be read back as prior timings.
+    self.assertAlmostEqual(
+        make_examples.PriorRegionTimings.from_tsv(path).cost(region), 1.5)
+
+  def test_add_labeling_metrics(self):
+    total = deepvariant_pb2.LabelingMetrics(
+        n_truth_variant_sites=2, n_true_positive_sites=1)
+    make_examples.add_labeling_metrics(
+        total,
+        deepvariant_pb2.LabelingMetrics(
+            n_truth_variant_sites=3, n_false_negative_sites=4))
+    self.assertEqual(
+        deepvariant_pb2.LabelingMetrics(
+            n_truth_variant_sites=5,
+            n_true_positive_sites=1,
+            n_false_negative_sites=4), total)
+
   @parameterized.parameters(
       dict(
           ref_names=['1', '2', '3'],
@@ -1294,6 +1456,57 @@ class MakeExamplesUnitTest(parameterized.TestCase):
         _from_literals_list(
             ['chr20:10,000,000-10,009,999', 'chr20:10,100,001-11,000,000']))
 
+  @parameterized.parameters(0, 10, 100)
+  def test_proposed_variants_windows(self, padding):
+    calling_regions = ranges.RangeSet(
+        [ranges.parse_literal('chr20:59,777,000-60,000,000')])
+    # The expected windows, computed by reading the entire VCF.
+    windows = []
+    with vcf.VcfReader(testdata.VCF_CANDIDATE_IMPORTER_VARIANTS) as reader:
+      for variant in reader:
+        if calling_regions.overlaps(variant.reference_name, variant.start):
+          windows.append(
+              ranges.make_range(variant.reference_name,
+                                variant.start - padding,
+                                variant.end + padding))
+    self.assertNotEmpty(windows)
+    expected = calling_regions.intersection(ranges.RangeSet(windows))
+
+    actual = make_examples.proposed_variants_windows(
+        testdata.VCF_CANDIDATE_IMPORTER_VARIANTS, calling_regions, padding)
+    self.assertCountEqual(list(actual), list(expected))
+
+  def test_proposed_variants_windows_skips_contigs_missing_from_vcf(self):
+    calling_regions = ranges.RangeSet(
+        [ranges.parse_literal('not_a_contig:1-1000')])
+    self.assertEmpty(
+        make_examples.proposed_variants_windows(
+            testdata.VCF_CANDIDATE_IMPORTER_VARIANTS, calling_regions, 10))
+
+  @flagsaver.FlagSaver
+  def test_processing_regions_with_proposed_variants(self):
+    FLAGS.mode = 'calling'
+    FLAGS.ref = testdata.CHR20_FASTA
+    FLAGS.reads = testdata.CHR20_BAM
+    FLAGS.regions = 'chr20:59,777,000-60,000,000'
+    FLAGS.examples = 'examples.tfrecord'
+    FLAGS.variant_caller = 'vcf_candidate_importer'
+    FLAGS.proposed_variants = testdata.VCF_CANDIDATE_IMPORTER_VARIANTS
+    FLAGS.proposed_variants_padding = 20
+
+    options = make_examples.default_options(add_flags=True)
+    regions = ranges.RangeSet(
+        make_examples.processing_regions_from_options(options))
+    region = ranges.parse_literal(FLAGS.regions)
+    with vcf.VcfReader(testdata.VCF_CANDIDATE_IMPORTER_VARIANTS) as reader:
+      variants = [v for v in reader.query(region) if v.start >= region.start]
+    # Every proposed variant is still processed, but far fewer bases are.
+    for variant in variants:
+      self.assertTrue(regions.overlaps(variant.reference_name, variant.start))
+    self.assertLessEqual(
+        sum(ranges.length(r) for r in regions),
+        sum(ranges.length(v) + 40 for v in variants))
+
   @flagsaver.FlagSaver
   def test_incorrect_empty_regions(self):
     FLAGS.mode = 'calling'
@@ -1645,6 +1858,63 @@ class MakeExamplesUnitTest(parameterized.TestCase):
 
   # pylint: enable=unused-argument
 
+  def test_prefetch_allele_frequency_inputs(self):
+    variants = [
+        variants_pb2.Variant(
+            reference_name='chr20',
+            start=60168,
+            end=60169,
+            reference_bases='C',
+            alternate_bases=['T', 'A']),
+        variants_pb2.Variant(
+            reference_name='chr20',
+            start=60279,
+            end=60285,
+            reference_bases='TTTCCA',
+            alternate_bases=['T', 'TTTCCATTCCA']),
+        variants_pb2.Variant(
+            reference_name='chr20',
+            start=60284,
+            end=60291,
+            reference_bases='ATTCCAG',
+            alternate_bases=['AT']),
+        variants_pb2.Variant(
+            reference_name='chr20',
+            start=61065,
+            end=61066,
+            reference_bases='T',
+            alternate_bases=['C']),
+        # Has no cohort variants.
+        variants_pb2.Variant(
+            reference_name='chr20',
+            start=61500,
+            end=61501,
+            reference_bases='A',
+            alternate_bases=['G']),
+    ]
+    ref_reader = fasta.IndexedFastaReader(testdata.CHR20_GRCH38_FASTA)
+    vcf_reader = vcf.VcfReader(testdata.VCF_WITH_ALLELE_FREQUENCIES)
+
+    with mock.patch.object(
+        vcf_reader, 'query', wraps=vcf_reader.query) as mock_query:
+      prefetched_vcf_reader, prefetched_ref_reader = (
+          make_examples.prefetch_allele_frequency_inputs(
+              variants, vcf_reader, ref_reader))
+    # The population VCF is queried once over the span of all variants.
+    mock_query.assert_called_once_with(
+        ranges.make_range('chr20', 60168, 61501))
+
+    for variant in variants:
+      self.assertEqual(
+          make_examples.find_matching_allele_frequency(
+              variant, prefetched_vcf_reader, prefetched_ref_reader),
+          make_examples.find_matching_allele_frequency(variant, vcf_reader,
+                                                       ref_reader))
+
+  def test_prefetch_allele_frequency_inputs_requires_variants(self):
+    with six.assertRaisesRegex(self, ValueError, 'must not be empty'):
+      make_examples.prefetch_allele_frequency_inputs([], None, None)
+
 
 class RegionProcessorTest(parameterized.TestCase):
 
@@ -1804,6 +2074,7 @@ class RegionProcessorTest(parameterized.TestCase):
     self.processor.sam_readers = [mock.Mock()]
     self.processor.sam_readers[0].query.return_value = []
     self.processor.in_memory_sam_reader = mock.Mock()
+    self.add_mock('_make_allele_counter_for_region')
 
     c1, c2 = mock.Mock(), mock.Mock()
     e1, e2, e3 = mock.Mock(), mock.Mock(), mock.Mock()
@@ -1822,6 +2093,132 @@ class RegionProcessorTest(parameterized.TestCase):
     self.assertEqual([mock.call(c1), mock.call(c2)], mock_cpe.call_args_list)
     test_utils.assert_not_called_workaround(mock_lc)
 
+  def test_region_reads_recounts_only_realigned_reads(self):
+    self.processor.options.realigner_enabled = True
+    self.processor.ref_reader = self.ref_reader
+    start = self.region.start
+    quals = [30] * 10
+    unchanged = test_utils.make_read(
+        'ACGTACGTAC', start=start, cigar='10M', quals=quals, chrom='chr20')
+    shifted = test_utils.make_read(
+        'TTTTTGGGGG', start=start + 5, cigar='10M', quals=quals, chrom='chr20')
+    moved_out = test_utils.make_read(
+        'CCCCCAAAAA', start=start + 20, cigar='10M', quals=quals, chrom='chr20')
+    self.add_mock('_query_reads', retval=[unchanged, shifted, moved_out])
+    realigned_shifted = copy.deepcopy(shifted)
+    realigned_shifted.alignment.position.position = start + 6
+    realigned_moved_out = copy.deepcopy(moved_out)
+    realigned_moved_out.alignment.position.position = self.region.end + 10
+    realigned_reads = [unchanged, realigned_shifted, realigned_moved_out]
+    self.processor.realigner = mock.Mock()
+    self.processor.realigner.realign_reads.return_value = [], realigned_reads
+
+    self.assertEqual(realigned_reads, self.processor.region_reads(self.region))
+
+    # The counts match those of counting the realigned reads from scratch.
+    allele_counter = self.processor._take_region_allele_counter(self.region)
+    expected = self.processor._count_alleles(self.region, realigned_reads)
+    self.assertEqual(2, allele_counter.n_counted_reads())
+    self.assertEqual(expected.counts(), allele_counter.counts())
+
+  def test_candidates_in_region_uses_region_allele_counter(self):
+    self.processor.in_memory_sam_reader = mock.Mock()
+    self.processor.in_memory_sam_reader.query.return_value = ['read1']
+    mock_ac = mock.Mock()
+    self.processor._region_allele_counter = (self.region, mock_ac)
+    mock_make_ac = self.add_mock('_make_allele_counter_for_region')
+    mock_vc = mock.Mock()
+    mock_vc.calls_and_gvcfs.return_value = (['variant'], [])
+    self.processor.variant_caller = mock_vc
+
+    self.assertEqual((['variant'], []),
+                     self.processor.candidates_in_region(self.region))
+
+    # The reads were already counted, so they aren't added again.
+    test_utils.assert_not_called_workaround(mock_make_ac)
+    test_utils.assert_not_called_workaround(mock_ac.add)
+    mock_vc.calls_and_gvcfs.assert_called_once_with(mock_ac, False)
+    self.assertIsNone(self.processor._region_allele_counter)
+
+  @parameterized.parameters(True, False)
+  def test_process_skips_region_without_candidates(self, realigner_enabled):
+    self.processor.options.mode = deepvariant_pb2.DeepVariantOptions.CALLING
+    self.processor.options.skip_regions_without_candidates = True
+    self.processor.options.realigner_enabled = realigner_enabled
+    self.processor.realigner = mock.Mock()
+    self.processor.in_memory_sam_reader = mock.Mock()
+    self.add_mock('_query_reads', retval=['read'])
+    mock_hc = self.add_mock('_has_candidates', retval=False)
+    mock_cir = self.add_mock('candidates_in_region')
+
+    self.assertEqual(([], [], []), self.processor.process(self.region))
+    self.assertTrue(self.processor.region_skipped)
+    mock_hc.assert_called_once_with(self.region, ['read'])
+    test_utils.assert_not_called_workaround(
+        self.processor.realigner.realign_reads)
+    test_utils.assert_not_called_workaround(
+        self.processor.in_memory_sam_reader.replace_reads)
+    test_utils.assert_not_called_workaround(mock_cir)
+    self.assertIn('process_region', self.processor.stage_timer.unit_seconds())
+
+  @parameterized.parameters(
+      dict(skip=True, training=False, gvcf='', fraction_ref=0.0, expected=True),
+      dict(
+          skip=False, training=False, gvcf='', fraction_ref=0.0,
+          expected=False),
+      # The labeler must see the truth variants of every region.
+      dict(skip=True, training=True, gvcf='', fraction_ref=0.0, expected=False),
+      dict(
+          skip=True, training=False, gvcf='foo.vcf', fraction_ref=0.0,
+          expected=False),
+      dict(
+          skip=True, training=False, gvcf='', fraction_ref=0.1,
+          expected=False),
+  )
+  def test_should_prescreen_candidates(self, skip, training, gvcf,
+                                       fraction_ref, expected):
+    self.options.mode = (
+        deepvariant_pb2.DeepVariantOptions.TRAINING
+        if training else deepvariant_pb2.DeepVariantOptions.CALLING)
+    self.options.skip_regions_without_candidates = skip
+    self.options.gvcf_filename = gvcf
+    self.options.variant_caller_options.fraction_reference_sites_to_emit = (
+        fraction_ref)
+    self.assertEqual(expected, self.processor._should_prescreen_candidates())
+
+  @parameterized.parameters(
+      dict(candidates=[], expected=False),
+      dict(candidates=['c1'], expected=True),
+  )
+  def test_has_candidates(self, candidates, expected):
+    mock_ac = mock.Mock()
+    self.add_mock('_make_allele_counter_for_region', retval=mock_ac)
+    self.processor.variant_caller = mock.Mock()
+    self.processor.variant_caller.get_candidates.return_value = candidates
+    reads = [
+        test_utils.make_read(
+            'ACGT', start=self.region.start + i, cigar='4M', chrom='chr20')
+        for i in range(2)
+    ]
+    outside = test_utils.make_read(
+        'ACGT', start=self.region.end, cigar='4M', chrom='chr20')
+
+    self.assertEqual(
+        expected, self.processor._has_candidates(self.region,
+                                                 reads + [outside]))
+    self.assertEqual([mock.call(r, 'sample_id') for r in reads],
+                     mock_ac.add.call_args_list)
+    self.processor.variant_caller.get_candidates.assert_called_once_with(
+        mock_ac)
+    # The counts are left for region_reads and candidates_in_region.
+    self.assertEqual((self.region, mock_ac),
+                     self.processor._region_allele_counter)
+
+  def test_has_candidates_no_reads(self):
+    mock_make_ac = self.add_mock('_make_allele_counter_for_region')
+    self.assertFalse(self.processor._has_candidates(self.region, []))
+    test_utils.assert_not_called_workaround(mock_make_ac)
+
   def test_candidates_in_region_no_reads(self):
     self.processor.in_memory_sam_reader = mock.Mock()
     self.processor.in_memory_sam_reader.query.return_value = []
@@ -40,7 +40,6 @@ import numpy as np
 
 from third_party.nucleus.protos import reads_pb2
 from third_party.nucleus.util import ranges
-from third_party.nucleus.util import utils
 from deepvariant import dv_constants
 from deepvariant.protos import deepvariant_pb2
 from deepvariant.python import pileup_image_native
@@ -304,7 +303,9 @@ class PileupImageCreator(object):
         third_party.nucleus.protos.Read objects that we'll use
         to encode the read information supporting our call. Assumes each read is
         aligned and is well-formed (e.g., has bases and quality scores, cigar).
-        Rows of the image are encoded in the same order as reads.
+        If a sample has more reads than rows, a deterministic random subset is
+        used. Read rows are sorted by alignment position (and by haplotype if
+        options.sort_by_haplotypes is set).
       alt_alleles: A collection of alternative_bases from dv_call.variant that
         we are treating as "alt" when constructing this pileup image. A read
         will be considered supporting the "alt" allele if it occurs in the
@@ -316,6 +317,47 @@ class PileupImageCreator(object):
       A uint8 Tensor image of shape
         [self.width, <sum of sample pileup heights>, DEFAULT_NUM_CHANNEL]
 
+    Raises:
+      ValueError: if any arguments are invalid.
+    """
+    return self.build_pileups(
+        dv_call=dv_call,
+        refbases=refbases,
+        reads_for_samples=reads_for_samples,
+        alt_allele_combinations=[alt_alleles],
+        custom_ref=custom_ref)[0]
+
+  def build_pileups(self,
+                    dv_call,
+                    refbases,
+                    reads_for_samples,
+                    alt_allele_combinations,
+                    custom_ref=False):
+    """Creates a pileup tensor for dv_call for each combination of alt alleles.
+
+    This is equivalent to calling build_pileup() once per element of
+    alt_allele_combinations, but each read is only encoded once: only the
+    channels that depend on the alt alleles differ between the images.
+
+    Args:
+      dv_call: learning.genomics.deepvariant.DeepVariantCall object with
+        information on our candidate call and allele support information.
+      refbases: A string options.width in length containing the reference base
+        sequence to encode. The middle base of this string should be at the
+        start of the variant in dv_call.
+      reads_for_samples: list by sample of Iterable of
+        third_party.nucleus.protos.Read objects. See build_pileup().
+      alt_allele_combinations: A list of collections of alternative_bases from
+        dv_call.variant, with one image built for each. See the alt_alleles
+        argument of build_pileup().
+      custom_ref: True if refbases should not be checked for matching against
+        variant's reference_bases.
+
+    Returns:
+      A list with, for each element of alt_allele_combinations, a uint8 Tensor
+      image of shape
+        [self.width, <sum of sample pileup heights>, DEFAULT_NUM_CHANNEL]
+
     Raises:
       ValueError: if any arguments are invalid.
     """
@@ -323,12 +365,15 @@ class PileupImageCreator(object):
       raise ValueError('refbases is {} long but width is {}'.format(
           len(refbases), self.width))
 
-    if not alt_alleles:
-      raise ValueError('alt_alleles cannot be empty')
-    if any(alt not in dv_call.variant.alternate_bases for alt in alt_alleles):
-      raise ValueError(
-          'all elements of alt_alleles must be the alternate bases'
-          ' of dv_call.variant', alt_alleles, dv_call.variant)
+    if not alt_allele_combinations:
+      raise ValueError('alt_allele_combinations cannot be empty')
+    for alt_alleles in alt_allele_combinations:
+      if not alt_alleles:
+        raise ValueError('alt_alleles cannot be empty')
+      if any(alt not in dv_call.variant.alternate_bases for alt in alt_alleles):
+        raise ValueError(
+            'all elements of alt_alleles must be the alternate bases'
+            ' of dv_call.variant', alt_alleles, dv_call.variant)
     if len(self._samples) != len(reads_for_samples):
       raise ValueError(
           'The number of self._samples ({}) must be the same as the number of '
@@ -344,85 +389,37 @@ class PileupImageCreator(object):
                            refbases[self.half_width], self.half_width,
                            dv_call.variant.reference_bases))
 
-    def build_pileup_for_one_sample(reads, sample):
-      """Create read pileup image section for one sample."""
-      # We start with n copies of our encoded reference bases.
-      rows = ([self._encoder.encode_reference(refbases)] *
-              self.reference_band_height)
-
-      def _update_hap_index(read, sort_by_haplotypes_sample_hp_tag):
-        default_hap_idx = 0  # By default, reads with no HP is set to 0.
-        if 'HP' not in read.info:
-          return default_hap_idx
-        hp_field = next(iter(read.info.get('HP').values))
-        if not hp_field.HasField('int_value'):
-          return default_hap_idx
-        hp_value = hp_field.int_value
-        if (sort_by_haplotypes_sample_hp_tag > 0 and
-            hp_value == sort_by_haplotypes_sample_hp_tag):
-          # For the target HP tag, set it to -1 so it will be sorted on
-          # top of the pileup image.
-          return -1
-        elif hp_value < 0:
-          return 0  # For reads with HP < 0, assume it is not tagged.
-        else:
-          return hp_value
-
-      # A generator that yields tuples of the form (haplotype, position, row),
-      # if the read can be encoded as a valid row to be used in the pileup
-      # image.
-      def _row_generator():
-        """A generator that yields tuples of (haplotype, position, row)."""
-        for read in reads:
-          read_row = self._encoder.encode_read(dv_call, refbases, read,
-                                               image_start_pos, alt_alleles)
-          if read_row is None:
-            continue
-          hap_idx = 0  # By default, reads with no HP is set to 0.
-          if self._options.sort_by_haplotypes:
-            hap_idx = _update_hap_index(
-                read, self._options.sort_by_haplotypes_sample_hp_tag)
-          yield hap_idx, read.alignment.position.position, read_row
-
-      # We add a row for each read in order, down-sampling if the number of
-      # reads is greater than the max reads for each sample. Sort the reads by
-      # their alignment position.
-      random_for_image = np.random.RandomState(self._options.random_seed)
-
+    sample_heights = []
+    for sample in self._samples:
       # Use sample height or default to pic height.
       if sample.pileup_height is not None:
         pileup_height = sample.pileup_height
       else:
         pileup_height = self.height
-
-      max_reads = pileup_height - self.reference_band_height
-      pileup_of_reads = sorted(
-          utils.reservoir_sample(
-              _row_generator(), max_reads, random=random_for_image),
-          key=lambda x: (x[0], x[1]))
-
-      rows += [read_row for _, _, read_row in pileup_of_reads]
-
-      # Finally, fill in any missing rows to bring our image to pileup_height
-      # rows with empty (all black) pixels.
-      n_missing_rows = pileup_height - len(rows)
-      if n_missing_rows > 0:
-        # Add values to rows to fill it out with zeros.
-        rows += [self._empty_image_row()] * n_missing_rows
-      return rows
-
-    sample_sections = []
-    for i, sample in enumerate(self._samples):
-      sample_sections.extend(
-          build_pileup_for_one_sample(reads_for_samples[i], sample))
-
-    # Vertically stack the image rows to create a single
-    # h x w x DEFAULT_NUM_CHANNEL image.
-    return np.vstack(sample_sections)
-
-  def _empty_image_row(self):
-    """Creates an empty image row as an uint8 np.array."""
-    return np.zeros((1, self.width, self.num_channels), dtype=np.uint8)
+      if pileup_height < self.reference_band_height:
+        raise ValueError(
+            'pileup_height ({}) must be at least reference_band_height '
+            '({}).'.format(pileup_height, self.reference_band_height))
+      sample_heights.append(pileup_height)
+
+    # Each sample's section is encoded directly into these buffers: the
+    # reference band, up to pileup_height - reference_band_height
+    # down-sampled reads sorted by haplotype and alignment position, and empty
+    # (all black) rows for whatever is left.
+    image_shape = (sum(sample_heights), self.width, self.num_channels)
+    images = [
+        np.empty(image_shape, dtype=np.uint8) for _ in alt_allele_combinations
+    ]
+    alt_allele_combinations = [
+        list(alt_alleles) for alt_alleles in alt_allele_combinations
+    ]
+    row_offset = 0
+    for reads, pileup_height in zip(reads_for_samples, sample_heights):
+      self._encoder.encode_pileups(dv_call, refbases, list(reads),
+                                   image_start_pos, alt_allele_combinations,
+                                   row_offset, pileup_height, images)
+      row_offset += pileup_height
+    return images
 
   def create_pileup_images(self,
                            dv_call,
@@ -456,59 +453,72 @@ class PileupImageCreator(object):
       return None
 
     alt_aligned_representation = self._options.alt_aligned_pileup
-
-    def _pileup_for_pair_of_alts(alt_alleles):
-      """Create pileup image for one combination of alt alleles."""
-      # Always create the ref-aligned pileup image.
-      ref_image = self.build_pileup(
-          dv_call=dv_call,
-          refbases=ref_bases,
-          reads_for_samples=reads_for_samples,
-          alt_alleles=alt_alleles)
-      # Optionally also create pileup images with reads aligned to alts.
-      if alt_aligned_representation != 'none':
-        if haplotype_alignments_for_samples is None or haplotype_sequences is None:
-          # Use sample height or default to pic height.
-          sample_heights = [sample.pileup_height for sample in self._samples]
-          if None not in sample_heights:
-            pileup_height = sum(sample_heights)
-          else:
-            pileup_height = self.height
-          pileup_shape = (pileup_height, self.width, self.num_channels)
-          alt_images = [
-              np.zeros(pileup_shape, dtype=np.uint8) for alt in alt_alleles
-          ]
-        else:
-          alt_images = []
-          for alt in alt_alleles:
-            if len(haplotype_sequences[alt]) != self.width:
-              logging.warning(
-                  'haplotype_sequences[alt] is %d long but pileup '
-                  'image width is %d. Giving up on this image',
-                  len(haplotype_sequences[alt]), self.width)
-              return None
-            alt_image = self.build_pileup(
-                dv_call=dv_call,
-                refbases=haplotype_sequences[alt],
-                reads_for_samples=[
-                    sample[alt] for sample in haplotype_alignments_for_samples
-                ],
-                alt_alleles=alt_alleles,
-                custom_ref=True)
-            alt_images.append(alt_image)
-        composite_image = _represent_alt_aligned_pileups(
-            alt_aligned_representation, ref_image, alt_images)
-        return composite_image
+    alt_allele_combinations = list(self._alt_allele_combinations(variant))
+
+    # Always create the ref-aligned pileup images. Reads are encoded once and
+    # shared by the images of all combinations of alt alleles.
+    ref_images = self.build_pileups(
+        dv_call=dv_call,
+        refbases=ref_bases,
+        reads_for_samples=reads_for_samples,
+        alt_allele_combinations=alt_allele_combinations)
+    if alt_aligned_representation == 'none':
+      return list(zip(alt_allele_combinations, ref_images))
+
+    # Optionally also create pileup images with reads aligned to alts.
+    if haplotype_alignments_for_samples is None or haplotype_sequences is None:
+      # Use sample height or default to pic height.
+      sample_heights = [sample.pileup_height for sample in self._samples]
+      if None not in sample_heights:
+        pileup_height = sum(sample_heights)
       else:
-        return ref_image
-
-    retval = []
-    for alts in self._alt_allele_combinations(variant):
-      pileup = _pileup_for_pair_of_alts(alts)
-      # If the pileup is None, this can mean that we're near the edge of the
-      # contig, so one pileup width is invalid.
-      # Return None to indicate we couldn't process this variant.
-      if pileup is None:
-        return None
-      retval.append((alts, pileup))
-    return retval
+        pileup_height = self.height
+      pileup_shape = (pileup_height, self.width, self.num_channels)
+      alt_images_for_combinations = [[
+          np.zeros(pileup_shape, dtype=np.uint8) for alt in alt_alleles
+      ] for alt_alleles in alt_allele_combinations]
+    else:
+      alts = []
+      for alt_alleles in alt_allele_combinations:
+        alts.extend(alt for alt in alt_alleles if alt not in alts)
+      for alt in alts:
+        if len(haplotype_sequences[alt]) != self.width:
+          # This can mean that we're near the edge of the contig, so one pileup
+          # width is invalid. Return None to indicate we couldn't process this
+          # variant.
+          logging.warning(
+              'haplotype_sequences[alt] is %d long but pileup '
+              'image width is %d. Giving up on this image',
+              len(haplotype_sequences[alt]), self.width)
+          return None
+
+      # The reads aligned to each alt are encoded once for all combinations
+      # that include that alt.
+      alt_image_for_combination_and_alt = {}
+      for alt in alts:
+        indices = [
+            i for i, alt_alleles in enumerate(alt_allele_combinations)
+            if alt in alt_alleles
+        ]
+        alt_images = self.build_pileups(
+            dv_call=dv_call,
+            refbases=haplotype_sequences[alt],
+            reads_for_samples=[
+                sample[alt] for sample in haplotype_alignments_for_samples
+            ],
+            alt_allele_combinations=[
+                alt_allele_combinations[i] for i in indices
+            ],
+            custom_ref=True)
+        for i, alt_image in zip(indices, alt_images):
+          alt_image_for_combination_and_alt[i, alt] = alt_image
+      alt_images_for_combinations = [[
+          alt_image_for_combination_and_alt[i, alt] for alt in alt_alleles
+      ] for i, alt_alleles in enumerate(alt_allele_combinations)]
+
+    return [(alt_alleles,
+             _represent_alt_aligned_pileups(alt_aligned_representation,
+                                            ref_image, alt_images))
+            for alt_alleles, ref_image, alt_images in zip(
+                alt_allele_combinations, ref_images,
+                alt_images_for_combinations)]
@@ -34,15 +34,18 @@
 #include <math.h>
 
 #include <algorithm>
+#include <cstring>
 #include <functional>
 #include <iterator>
 #include <memory>
+#include <random>
 #include <string>
 #include <vector>
 
 #include "third_party/nucleus/protos/cigar.pb.h"
 #include "third_party/nucleus/protos/position.pb.h"
 #include "third_party/nucleus/protos/reads.pb.h"
+#include "third_party/nucleus/protos/struct.pb.h"
 #include "third_party/nucleus/protos/variants.pb.h"
 #include "tensorflow/core/platform/logging.h"
 
@@ -56,10 +59,49 @@ namespace learning {
 namespace genomics {
 namespace deepvariant {
 
+using tensorflow::int64;
+using tensorflow::uint32;
 using tensorflow::uint8;
 
 namespace {
 
+// Offsets of each channel within an interleaved pixel.
+constexpr int kBaseChannel = 0;
+constexpr int kBaseQualityChannel = 1;
+constexpr int kMappingQualityChannel = 2;
+constexpr int kStrandChannel = 3;
+constexpr int kSupportsAltChannel = 4;
+constexpr int kMatchesRefChannel = 5;
+constexpr int kAlleleFrequencyChannel = 6;
+
+// Returns a uniformly distributed integer in [0, max_value], consuming random
+// numbers exactly as np.random.RandomState.randint(0, max_value + 1) does:
+// draws are masked to the smallest enclosing power of two and rejected until
+// one falls in range.
+uint32 NumpyCompatibleRandInt(uint32 max_value, std::mt19937* random) {
+  if (max_value == 0) return 0;
+  uint32 mask = max_value;
+  mask |= mask >> 1;
+  mask |= mask >> 2;
+  mask |= mask >> 4;
+  mask |= mask >> 8;
+  mask |= mask >> 16;
+  uint32 value;
+  while ((value = (*random)() & mask) > max_value) {
+  }
+  return value;
+}
+
+// A read row that was kept by reservoir sampling, with its sort keys and the
+// columns of the row the read was drawn in.
+struct SampledRow {
+  const Read* read;
+  int haplotype;
+  int64 position;
+  std::vector<unsigned char> pixels;
+  std::vector<int> columns;
+};
+
 // Does this read support ref, one of the alternative alleles, or an allele we
 // aren't considering?
 inline int ReadSupportsAlt(const DeepVariantCall& dv_call, const Read& read,
@@ -244,15 +286,51 @@ int PileupImageEncoderNative::StrandColor(bool on_positive_strand) const {
           options_.negative_strand_color());
 }
 
+int PileupImageEncoderNative::NumPixelChannels() const {
+  return options_.use_allele_frequency() ? kAlleleFrequencyChannel + 1
+                                         : kAlleleFrequencyChannel;
+}
+
+std::unique_ptr<ImageRow> PileupImageEncoderNative::ToImageRow(
+    const vector<unsigned char>& row, int width) const {
+  std::unique_ptr<ImageRow> img_row(new ImageRow(
+      width, options_.num_channels(), options_.use_allele_frequency()));
+  const int channels = NumPixelChannels();
+  for (int col = 0; col < width; ++col) {
+    const unsigned char* pixel = row.data() + col * channels;
+    img_row->base[col]               = pixel[kBaseChannel];
+    img_row->base_quality[col]       = pixel[kBaseQualityChannel];
+    img_row->mapping_quality[col]    = pixel[kMappingQualityChannel];
+    img_row->on_positive_strand[col] = pixel[kStrandChannel];
+    img_row->supports_alt[col]       = pixel[kSupportsAltChannel];
+    img_row->matches_ref[col]        = pixel[kMatchesRefChannel];
+    if (img_row->use_allele_frequency) {
+      img_row->allele_frequency[col] = pixel[kAlleleFrequencyChannel];
+    }
+  }
+  return img_row;
+}
+
 std::unique_ptr<ImageRow>
 PileupImageEncoderNative::EncodeRead(const DeepVariantCall& dv_call,
                                      const string& ref_bases,
                                      const Read& read,
                                      int image_start_pos,
                                      const vector<string>& alt_alleles) {
-  ImageRow img_row(ref_bases.size(),
-                   options_.num_channels(),
-                   options_.use_allele_frequency());
+  vector<unsigned char> row(ref_bases.size() * NumPixelChannels(), 0);
+  if (!EncodeReadToRow(dv_call, ref_bases, read, image_start_pos, alt_alleles,
+                       row.data(), nullptr)) {
+    return nullptr;
+  }
+  return ToImageRow(row, ref_bases.size());
+}
+
+bool PileupImageEncoderNative::EncodeReadToRow(
+    const DeepVariantCall& dv_call, const string& ref_bases, const Read& read,
+    int image_start_pos, const vector<string>& alt_alleles,
+    unsigned char* row, vector<int>* columns) const {
+  const int channels = NumPixelChannels();
+  const bool use_allele_frequency = options_.use_allele_frequency();
   const int supports_alt = ReadSupportsAlt(dv_call, read, alt_alleles);
   const int mapping_quality = read.alignment().mapping_quality();
   const bool is_forward_strand = !read.alignment().position().reverse_strand();
@@ -269,15 +347,15 @@ PileupImageEncoderNative::EncodeRead(const DeepVariantCall& dv_call,
 
   // Bail early if this read's mapping quality is too low.
   if (mapping_quality < min_mapping_quality) {
-    return nullptr;
+    return false;
   }
 
   // Handler for each component of the CIGAR string, as subdivided
   // according the rules below.
-  // Side effect: draws in img_row
+  // Side effect: draws in row, and records the column in columns
   // Return value: true on normal exit; false if we determine that we
-  // have a low quality base at the call position (in which case we
-  // should return null) from EncodeRead.
+  // have a low quality base at the call position (in which case the
+  // read is not used in the pileup).
   std::function<bool(int, int, const CigarUnit::Operation&)>
   action_per_cigar_unit = [&](int ref_i,
                               int read_i,
@@ -305,14 +383,18 @@ PileupImageEncoderNative::EncodeRead(const DeepVariantCall& dv_call,
       bool matches_ref = (read_base == ref_bases[col]);
 
       // Draw the pixel
-      img_row.base[col]               = BaseColor(read_base);
-      img_row.base_quality[col]       = BaseQualityColor(base_quality);
-      img_row.mapping_quality[col]    = mapping_color;
-      img_row.on_positive_strand[col] = strand_color;
-      img_row.supports_alt[col]       = alt_color;
-      img_row.matches_ref[col]        = MatchesRefColor(matches_ref);
-      if (img_row.use_allele_frequency) {
-        img_row.allele_frequency[col] = allele_frequency_color;
+      unsigned char* pixel = row + col * channels;
+      pixel[kBaseChannel]           = BaseColor(read_base);
+      pixel[kBaseQualityChannel]    = BaseQualityColor(base_quality);
+      pixel[kMappingQualityChannel] = mapping_color;
+      pixel[kStrandChannel]         = strand_color;
+      pixel[kSupportsAltChannel]    = alt_color;
+      pixel[kMatchesRefChannel]     = MatchesRefColor(matches_ref);
+      if (use_allele_frequency) {
+        pixel[kAlleleFrequencyChannel] = allele_frequency_color;
+      }
+      if (columns != nullptr) {
+        columns->push_back(col);
       }
     }
     return true;
@@ -397,16 +479,25 @@ PileupImageEncoderNative::EncodeRead(const DeepVariantCall& dv_call,
     // Bail out if we found this read had a low-quality base at the
     // call site.
     if (!ok) {
-      return nullptr;
+      return false;
     }
   }
 
-  return std::unique_ptr<ImageRow>(new ImageRow(img_row));
+  return true;
 }
 
 
 std::unique_ptr<ImageRow>
 PileupImageEncoderNative::EncodeReference(const string& ref_bases) {
+  vector<unsigned char> row(ref_bases.size() * NumPixelChannels(), 0);
+  EncodeReferenceToRow(ref_bases, row.data());
+  return ToImageRow(row, ref_bases.size());
+}
+
+void PileupImageEncoderNative::EncodeReferenceToRow(const string& ref_bases,
+                                                    unsigned char* row) const {
+  const int channels = NumPixelChannels();
+  const bool use_allele_frequency = options_.use_allele_frequency();
   int ref_qual = options_.reference_base_quality();
   uint8 base_quality_color = BaseQualityColor(ref_qual);
   uint8 mapping_quality_color = MappingQualityColor(ref_qual);
@@ -416,22 +507,160 @@ PileupImageEncoderNative::EncodeReference(const string& ref_bases) {
   uint8 ref_color = MatchesRefColor(true);
   uint8 allele_frequency_color = AlleleFrequencyColor(0);
 
-  ImageRow img_row(ref_bases.size(),
-                   options_.num_channels(),
-                   options_.use_allele_frequency());
   for (size_t i = 0; i < ref_bases.size(); ++i) {
-    img_row.base[i]               = BaseColor(ref_bases[i]);
-    img_row.base_quality[i]       = base_quality_color;
-    img_row.mapping_quality[i]    = mapping_quality_color;
-    img_row.on_positive_strand[i] = strand_color;
-    img_row.supports_alt[i]       = alt_color;
-    img_row.matches_ref[i]        = ref_color;
-    if (img_row.use_allele_frequency){
-      img_row.allele_frequency[i] = allele_frequency_color;
+    unsigned char* pixel = row + i * channels;
+    pixel[kBaseChannel]           = BaseColor(ref_bases[i]);
+    pixel[kBaseQualityChannel]    = base_quality_color;
+    pixel[kMappingQualityChannel] = mapping_quality_color;
+    pixel[kStrandChannel]         = strand_color;
+    pixel[kSupportsAltChannel]    = alt_color;
+    pixel[kMatchesRefChannel]     = ref_color;
+    if (use_allele_frequency) {
+      pixel[kAlleleFrequencyChannel] = allele_frequency_color;
     }
   }
+}
 
-  return std::unique_ptr<ImageRow>(new ImageRow(img_row));
+int PileupImageEncoderNative::HaplotypeSortKey(const Read& read) const {
+  // By default, reads with no HP tag are set to 0.
+  if (!options_.sort_by_haplotypes()) return 0;
+  const auto it = read.info().find("HP");
+  if (it == read.info().end() || it->second.values_size() == 0) return 0;
+  const nucleus::genomics::v1::Value& hp_field = it->second.values(0);
+  if (hp_field.kind_case() != nucleus::genomics::v1::Value::kIntValue) {
+    return 0;
+  }
+  const int hp_value = hp_field.int_value();
+  const int target_hp = options_.sort_by_haplotypes_sample_hp_tag();
+  if (target_hp > 0 && hp_value == target_hp) {
+    // Reads with the target HP tag are sorted on top of the pileup image.
+    return -1;
+  }
+  // Reads with HP < 0 are assumed not to be tagged.
+  return hp_value < 0 ? 0 : hp_value;
+}
+
+int PileupImageEncoderNative::EncodePileups(
+    const DeepVariantCall& dv_call, const string& ref_bases,
+    const vector<const Read*>& reads, int image_start_pos,
+    const vector<vector<string>>& alt_allele_combinations, int row_offset,
+    int pileup_height, const vector<PileupBuffer>& buffers) {
+  const int channels = NumPixelChannels();
+  const int reference_band_height = options_.reference_band_height();
+  CHECK(!alt_allele_combinations.empty())
+      << "alt_allele_combinations must not be empty";
+  CHECK_EQ(alt_allele_combinations.size(), buffers.size())
+      << "There must be one buffer per combination of alt alleles";
+  CHECK_GE(pileup_height, reference_band_height)
+      << "pileup_height must fit the reference band";
+  for (const PileupBuffer& buffer : buffers) {
+    CHECK(buffer.data != nullptr) << "buffer must not be empty";
+    CHECK_EQ(static_cast<size_t>(buffer.width), ref_bases.size())
+        << "buffer width must match the number of reference bases";
+    CHECK_EQ(buffer.num_channels, channels)
+        << "buffer has the wrong number of channels";
+    CHECK(row_offset >= 0 && row_offset + pileup_height <= buffer.height)
+        << "rows [" << row_offset << ", " << row_offset + pileup_height
+        << ") do not fit in a buffer of height " << buffer.height;
+  }
+
+  const size_t row_size = static_cast<size_t>(ref_bases.size()) * channels;
+  unsigned char* section = buffers[0].data + row_offset * row_size;
+  const vector<string>& first_alt_alleles = alt_allele_combinations[0];
+
+  // We start with n copies of our encoded reference bases.
+  if (reference_band_height > 0) {
+    std::memset(section, 0, row_size);
+    EncodeReferenceToRow(ref_bases, section);
+    for (int i = 1; i < reference_band_height; ++i) {
+      std::memcpy(section + i * row_size, section, row_size);
+    }
+  }
+
+  // Reservoir sample (Algorithm R) the reads that can be encoded into the
+  // remaining rows. Reads are drawn into a scratch row that is swapped into
+  // the reservoir when kept, so each kept row is written only once.
+  const int max_reads = pileup_height - reference_band_height;
+  std::mt19937 random(options_.random_seed());
+  vector<SampledRow> sampled;
+  sampled.reserve(std::min(static_cast<size_t>(max_reads), reads.size()));
+  vector<unsigned char> scratch;
+  vector<int> scratch_columns;
+  uint32 n_encoded = 0;
+  for (const Read* read : reads) {
+    scratch.assign(row_size, 0);
+    scratch_columns.clear();
+    if (!EncodeReadToRow(dv_call, ref_bases, *read, image_start_pos,
+                         first_alt_alleles, scratch.data(),
+                         &scratch_columns)) {
+      continue;
+    }
+    size_t slot;
+    if (n_encoded < static_cast<uint32>(max_reads)) {
+      slot = sampled.size();
+      sampled.emplace_back();
+    } else {
+      slot = NumpyCompatibleRandInt(n_encoded, &random);
+    }
+    ++n_encoded;
+    if (slot < sampled.size()) {
+      SampledRow& sampled_row = sampled[slot];
+      sampled_row.read = read;
+      sampled_row.haplotype = HaplotypeSortKey(*read);
+      sampled_row.position = read->alignment().position().position();
+      sampled_row.pixels.swap(scratch);
+      sampled_row.columns.swap(scratch_columns);
+    }
+  }
+
+  // Sort the reads by haplotype and then by their alignment position.
+  std::stable_sort(sampled.begin(), sampled.end(),
+                   [](const SampledRow& a, const SampledRow& b) {
+                     if (a.haplotype != b.haplotype) {
+                       return a.haplotype < b.haplotype;
+                     }
+                     return a.position < b.position;
+                   });
+  unsigned char* cur = section + reference_band_height * row_size;
+  for (const SampledRow& sampled_row : sampled) {
+    std::memcpy(cur, sampled_row.pixels.data(), row_size);
+    cur += row_size;
+  }
+
+  // Finally, fill in any missing rows with empty (all black) pixels.
+  const int n_missing_rows = max_reads - static_cast<int>(sampled.size());
+  if (n_missing_rows > 0) {
+    std::memset(cur, 0, n_missing_rows * row_size);
+  }
+
+  // Which reads are drawn, and where, doesn't depend on the alt alleles, so
+  // the other combinations copy the section and only redraw the channels that
+  // do: whether each read supports the alts and the alts' allele frequency.
+  const bool use_allele_frequency = options_.use_allele_frequency();
+  for (size_t i = 1; i < buffers.size(); ++i) {
+    const vector<string>& alt_alleles = alt_allele_combinations[i];
+    unsigned char* other_section = buffers[i].data + row_offset * row_size;
+    std::memcpy(other_section, section, pileup_height * row_size);
+    unsigned char* row = other_section + reference_band_height * row_size;
+    for (const SampledRow& sampled_row : sampled) {
+      const uint8 alt_color = SupportsAltColor(
+          ReadSupportsAlt(dv_call, *sampled_row.read, alt_alleles));
+      const uint8 allele_frequency_color =
+          use_allele_frequency
+              ? AlleleFrequencyColor(ReadAlleleFrequency(
+                    dv_call, *sampled_row.read, alt_alleles))
+              : 0;
+      for (int col : sampled_row.columns) {
+        unsigned char* pixel = row + col * channels;
+        pixel[kSupportsAltChannel] = alt_color;
+        if (use_allele_frequency) {
+          pixel[kAlleleFrequencyChannel] = allele_frequency_color;
+        }
+      }
+      row += row_size;
+    }
+  }
+  return sampled.size();
 }
 
 
@@ -67,6 +67,16 @@ struct ImageRow {
                     bool use_allele_frequency);
 };
 
+// A caller-owned, C-contiguous uint8 image of shape
+// height x width x num_channels that pileups are encoded directly into. The
+// memory is not owned by this struct.
+struct PileupBuffer {
+  unsigned char* data = nullptr;
+  int height = 0;
+  int width = 0;
+  int num_channels = 0;
+};
+
 class PileupImageEncoderNative {
  public:
   // Essential API methods.
@@ -96,6 +106,56 @@ class PileupImageEncoderNative {
   // Encode the reference bases into a single row of pixels.
   std::unique_ptr<ImageRow> EncodeReference(const string& ref_bases);
 
+  // Encode the complete pileup of one sample, once for each combination of
+  // alt alleles, into rows [row_offset, row_offset + pileup_height) of the
+  // corresponding buffer.
+  //
+  // The section starts with reference_band_height rows of encoded reference
+  // bases. Each read that can be encoded is then considered for the remaining
+  // pileup_height - reference_band_height rows using reservoir sampling seeded
+  // with options.random_seed; the sampled rows are sorted by (haplotype,
+  // alignment start) and any rows left over are filled with zeros. The random
+  // draws match np.random.RandomState(random_seed).randint, so the sampled
+  // reads are the same as those chosen by nucleus' utils.reservoir_sample.
+  //
+  // Reads are only encoded once: the sections for all but the first
+  // combination are copies in which only the alt-dependent channels are
+  // redrawn.
+  //
+  // Returns the number of read rows written.
+  int EncodePileups(
+      const learning::genomics::deepvariant::DeepVariantCall& dv_call,
+      const string& ref_bases,
+      const std::vector<const nucleus::genomics::v1::Read*>& reads,
+      int image_start_pos,
+      const std::vector<std::vector<string>>& alt_allele_combinations,
+      int row_offset, int pileup_height,
+      const std::vector<PileupBuffer>& buffers);
+
+  // Simple wrapper around EncodePileups that unwraps the ConstProtoPtr objects
+  // passed in from Python.
+  int EncodePileupsPython(
+      const nucleus::ConstProtoPtr<
+          const learning::genomics::deepvariant::DeepVariantCall>&
+          wrapped_dv_call,
+      const string& ref_bases,
+      const std::vector<
+          nucleus::ConstProtoPtr<const ::nucleus::genomics::v1::Read>>&
+          wrapped_reads,
+      int image_start_pos,
+      const std::vector<std::vector<string>>& alt_allele_combinations,
+      int row_offset, int pileup_height,
+      const std::vector<PileupBuffer>& buffers) {
+    std::vector<const nucleus::genomics::v1::Read*> reads;
+    reads.reserve(wrapped_reads.size());
+    for (const auto& wrapped_read : wrapped_reads) {
+      reads.push_back(wrapped_read.p_);
+    }
+    return EncodePileups(*(wrapped_dv_call.p_), ref_bases, reads,
+                         image_start_pos, alt_allele_combinations, row_offset,
+                         pileup_height, buffers);
+  }
+
  public:
   // Get the pixel color (int) for a base.
   int BaseColor(char base) const;
@@ -115,6 +175,30 @@ class PileupImageEncoderNative {
   int MappingQualityColor(int mapping_qual) const;
 
  private:
+  // Number of interleaved channels written for each pixel.
+  int NumPixelChannels() const;
+
+  // Draws read into row, an interleaved width x NumPixelChannels() array of
+  // zeros, and appends the columns drawn to columns if it isn't null. Returns
+  // false if the read cannot be used in the pileup, in which case the content
+  // of row is undefined.
+  bool EncodeReadToRow(
+      const learning::genomics::deepvariant::DeepVariantCall& dv_call,
+      const string& ref_bases, const nucleus::genomics::v1::Read& read,
+      int image_start_pos, const std::vector<string>& alt_alleles,
+      unsigned char* row, std::vector<int>* columns) const;
+
+  // Draws the reference bases into row, laid out as in EncodeReadToRow.
+  void EncodeReferenceToRow(const string& ref_bases, unsigned char* row) const;
+
+  // Unpacks an interleaved row into a newly allocated ImageRow.
+  std::unique_ptr<ImageRow> ToImageRow(const std::vector<unsigned char>& row,
+                                       int width) const;
+
+  // The haplotype key used to sort read rows when sort_by_haplotypes is set;
+  // 0 otherwise.
+  int HaplotypeSortKey(const nucleus::genomics::v1::Read& read) const;
+
   const PileupImageOptions options_;
 };
 
@@ -51,6 +51,7 @@ from third_party.nucleus.protos import reads_pb2
 from third_party.nucleus.protos import variants_pb2
 from third_party.nucleus.testing import test_utils
 from third_party.nucleus.util import ranges
+from third_party.nucleus.util import utils
 
 from deepvariant import make_examples_utils
 from deepvariant import pileup_image
@@ -611,6 +612,21 @@ class PileupImageEncoderTest(parameterized.TestCase):
         pie.allele_frequency_color(allele_frequency), expected_color)
 
 
+def _make_window_read(name, start, mapq=50, base='A', hp=None):
+  """Makes a read spanning [start, 12), covering the 3bp test image window."""
+  length = 12 - start
+  read = test_utils.make_read(
+      base * length,
+      start=start,
+      cigar='{}M'.format(length),
+      quals=[30] * length,
+      mapq=mapq,
+      name=name)
+  if hp is not None:
+    read.info['HP'].values.add().int_value = hp
+  return read
+
+
 class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
   """Tests of PileupImageCreator build_pileup routine."""
 
@@ -618,59 +634,39 @@ class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
     super(PileupImageCreatorEncodePileupTest, self).setUp()
     self.alt_allele = 'C'
     self.dv_call = _make_dv_call(ref_bases='G', alt_bases=self.alt_allele)
-    samples = [make_examples_utils.Sample()]
+    self.samples = [make_examples_utils.Sample()]
     self.pic = _make_image_creator(
         ref_reader=None,
-        samples=samples,
+        samples=self.samples,
         width=3,
         height=4,
         reference_band_height=2)
     self.ref = 'AGC'
-    self.read1 = test_utils.make_read('AGC', start=0, cigar='3M', name='read1')
-    self.read2 = test_utils.make_read('AGC', start=1, cigar='3M', name='read2')
-    self.read3 = test_utils.make_read('AGC', start=2, cigar='3M', name='read3')
-    self.read4 = test_utils.make_read('AGC', start=3, cigar='3M', name='read4')
+    # Each read gets its own mapping quality so that its row is distinct.
+    self.read1 = _make_window_read('read1', start=0, mapq=20)
+    self.read2 = _make_window_read('read2', start=1, mapq=30)
+    # Read3 has a mapping quality below the minimum so it can't be encoded.
+    self.read3 = _make_window_read('read3', start=2, mapq=5)
+    self.read4 = _make_window_read('read4', start=3, mapq=40)
 
     self.expected_rows = {
-        'ref':
-            np.asarray(range(0, 3 * self.pic.num_channels),
-                       np.uint8).reshape(1, 3, self.pic.num_channels),
-        'empty':
-            np.zeros((1, 3, self.pic.num_channels), dtype=np.uint8),
-        'read1':
-            np.full((1, 3, self.pic.num_channels), 1, dtype=np.uint8),
-        'read2':
-            np.full((1, 3, self.pic.num_channels), 2, dtype=np.uint8),
-        'read3':
-            None,
-        'read4':
-            np.full((1, 3, self.pic.num_channels), 3, dtype=np.uint8),
-        'read5':
-            np.full((1, 3, self.pic.num_channels), 3, dtype=np.uint8),
-        'read6':
-            np.full((1, 3, self.pic.num_channels), 3, dtype=np.uint8),
+        'ref': self.pic._encoder.encode_reference(self.ref),
+        'empty': np.zeros((1, 3, self.pic.num_channels), dtype=np.uint8),
     }
+    for read in [self.read1, self.read2, self.read4]:
+      self.add_expected_row(read)
 
-    # Setup our shared mocks.
-    mock_encoder = mock.Mock(spec=['encode_read', 'encode_reference'])
-    mock_encoder.encode_reference.return_value = self.expected_rows['ref']
-
-    # pylint: disable=unused-argument
-    def get_read_row(dv_call, refbases, read, pos, alt_allele):
-      return self.expected_rows[read.fragment_name]
-
-    mock_encoder.encode_read.side_effect = get_read_row
-
-    self.mock_enc_ref = mock_encoder.encode_reference
-    self.mock_enc_read = mock_encoder.encode_read
-
-    self.pic._encoder = mock_encoder
+  def add_expected_row(self, read, name=None):
+    """Encodes read on its own as the expected row for name."""
+    row = self.pic._encoder.encode_read(self.dv_call, self.ref, read, 9,
+                                        [self.alt_allele])
+    self.assertIsNotNone(row)
+    self.expected_rows[name or read.fragment_name] = row
 
   def assertImageMatches(self, actual_image, *row_names):
     """Checks that actual_image matches an image from constructed row_names."""
-    self.assertEqual(actual_image.shape,
-                     (self.pic.height, self.pic.width, self.pic.num_channels))
     expected_image = np.vstack([self.expected_rows[name] for name in row_names])
+    self.assertEqual(actual_image.shape, expected_image.shape)
     npt.assert_equal(actual_image, expected_image)
 
   def test_image_no_reads(self):
@@ -683,8 +679,6 @@ class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
         refbases=self.ref,
         reads_for_samples=[[]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_once_with(self.ref)
-    test_utils.assert_not_called_workaround(self.mock_enc_read)
     self.assertImageMatches(image, 'ref', 'ref', 'empty', 'empty')
 
   def test_image_one_read(self):
@@ -694,9 +688,6 @@ class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
         refbases=self.ref,
         reads_for_samples=[[self.read1]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_once_with(self.ref)
-    self.mock_enc_read.assert_called_once_with(self.dv_call, self.ref,
-                                               self.read1, 9, {self.alt_allele})
     self.assertImageMatches(image, 'ref', 'ref', 'read1', 'empty')
 
   def test_image_creation_with_more_reads_than_rows(self):
@@ -707,31 +698,19 @@ class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
         refbases=self.ref,
         reads_for_samples=[[self.read1, self.read2, self.read4]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_once_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4, 9, {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read2', 'read4')
 
   def test_image_creation_with_bad_read(self):
-    # Read 3 is bad (return value is None) so it should be skipped.
+    # Read 3 is bad (it can't be encoded) so it should be skipped.
     image = self.pic.build_pileup(
         dv_call=self.dv_call,
         refbases=self.ref,
         reads_for_samples=[[self.read1, self.read3, self.read2]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_once_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read1', 'read2')
 
   def test_image_creation_with_all_reads_in_new_order(self):
-    # Read 3 is bad (return value is None) so it should be skipped. Read2 should
+    # Read 3 is bad (it can't be encoded) so it should be skipped. Read2 should
     # also be dropped because there's only space for Read1 and Read4. If there
     # are more reads than rows, a deterministic random subset is used.
     image = self.pic.build_pileup(
@@ -739,15 +718,106 @@ class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
         refbases=self.ref,
         reads_for_samples=[[self.read2, self.read3, self.read4, self.read1]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_once_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read1', 'read4')
 
+  def test_downsampling_matches_reservoir_sample(self):
+    # The encoder's sampling must pick the same reads as
+    # utils.reservoir_sample with the same seed, so that images don't change
+    # depending on where they are built.
+    pic = _make_image_creator(
+        ref_reader=None,
+        samples=self.samples,
+        width=3,
+        height=7,
+        reference_band_height=2)
+    reads = [
+        _make_window_read('read_{}'.format(i), start=i % 9, mapq=11 + i)
+        for i in range(40)
+    ]
+    for read in reads:
+      self.add_expected_row(read)
+    sampled = utils.reservoir_sample(
+        reads, 5, random=np.random.RandomState(pic.random_seed))
+    sampled.sort(key=lambda read: read.alignment.position.position)
+
+    image = pic.build_pileup(
+        dv_call=self.dv_call,
+        refbases=self.ref,
+        reads_for_samples=[reads],
+        alt_alleles={self.alt_allele})
+    self.assertImageMatches(image, 'ref', 'ref',
+                            *[read.fragment_name for read in sampled])
+
+  @parameterized.parameters(False, True)
+  def test_build_pileups_matches_build_pileup(self, use_allele_frequency):
+    # Images built together for several combinations of alt alleles must be
+    # the same as images built one combination at a time.
+    dv_call = deepvariant_pb2.DeepVariantCall(
+        variant=variants_pb2.Variant(
+            reference_name='chr1',
+            start=10,
+            end=11,
+            reference_bases='G',
+            alternate_bases=['C', 'T']),
+        allele_support={
+            'C': _supporting_reads('read1/1'),
+            'T': _supporting_reads('read2/1', 'read4/1')
+        },
+        allele_frequency={
+            'G': 0.89,
+            'C': 0.1,
+            'T': 0.01
+        })
+    pic = _make_image_creator(
+        ref_reader=None,
+        samples=self.samples,
+        width=3,
+        height=6,
+        reference_band_height=2,
+        use_allele_frequency=use_allele_frequency,
+        num_channels=7 if use_allele_frequency else 6)
+    reads = [self.read1, self.read2, self.read3, self.read4]
+    combinations = [['C'], ['T'], ['C', 'T']]
+
+    images = pic.build_pileups(
+        dv_call=dv_call,
+        refbases=self.ref,
+        reads_for_samples=[reads],
+        alt_allele_combinations=combinations)
+    self.assertLen(images, len(combinations))
+    for alt_alleles, image in zip(combinations, images):
+      npt.assert_equal(
+          image,
+          pic.build_pileup(
+              dv_call=dv_call,
+              refbases=self.ref,
+              reads_for_samples=[reads],
+              alt_alleles=alt_alleles))
+    # Only the alt-dependent channels differ between the combinations.
+    self.assertFalse(np.array_equal(images[0][:, :, 4], images[1][:, :, 4]))
+    npt.assert_equal(images[0][:, :, :4], images[1][:, :, :4])
+
+  def test_build_pileups_requires_alt_allele_combinations(self):
+    with self.assertRaisesRegex(ValueError, 'alt_allele_combinations'):
+      self.pic.build_pileups(
+          dv_call=self.dv_call,
+          refbases=self.ref,
+          reads_for_samples=[[self.read1]],
+          alt_allele_combinations=[])
+
+  def test_image_creation_with_pileup_height_below_reference_band(self):
+    pic = _make_image_creator(
+        ref_reader=None,
+        samples=[make_examples_utils.Sample(pileup_height=1)],
+        width=3,
+        reference_band_height=2)
+    with self.assertRaisesRegex(ValueError, 'reference_band_height'):
+      pic.build_pileup(
+          dv_call=self.dv_call,
+          refbases=self.ref,
+          reads_for_samples=[[self.read1]],
+          alt_alleles={self.alt_allele})
+
   @parameterized.parameters(
       (False, 0, ['ref', 'ref', 'read1', 'read6', 'read2', 'read4', 'read5']),
       (True, 0, ['ref', 'ref', 'read6', 'read2', 'read4', 'read1', 'read5']),
@@ -758,42 +828,30 @@ class PileupImageCreatorEncodePileupTest(parameterized.TestCase):
       self, sort_by_haplotypes, sort_by_haplotypes_sample_hp_tag,
       expected_reads_layout):
     # There are 5 reads. They are expected to be sorted by HP tag.
-    read1 = test_utils.make_read('AGC', start=0, cigar='3M', name='read1')
-    read1.info['HP'].values.add().int_value = 2
-    read2 = test_utils.make_read('AGC', start=2, cigar='3M', name='read2')
-    read2.info['HP'].values.add().int_value = 1
-    read4 = test_utils.make_read('AGC', start=4, cigar='3M', name='read4')
-    read4.info['HP'].values.add().int_value = 1
-    read5 = test_utils.make_read('AGC', start=5, cigar='3M', name='read5')
-    read5.info['HP'].values.add().int_value = 2
-    read6 = test_utils.make_read('AGC', start=1, cigar='3M', name='read6')
-    read6.info['HP'].values.add().int_value = 0
-
-    # Change height to 7 so that we have at least 5 rows for reads to test
+    read1 = _make_window_read('read1', start=0, mapq=20, hp=2)
+    read2 = _make_window_read('read2', start=2, mapq=25, hp=1)
+    read4 = _make_window_read('read4', start=4, mapq=30, hp=1)
+    read5 = _make_window_read('read5', start=5, mapq=35, hp=2)
+    read6 = _make_window_read('read6', start=1, mapq=40, hp=0)
+    for read in [read1, read2, read4, read5, read6]:
+      self.add_expected_row(read)
+
+    # Use a height of 7 so that we have at least 5 rows for reads to test
     # sorting by haplotypes.
-    self.pic.height = 7
-    # Change options to set sort_by_haplotypes flag.
-    self.pic._options.sort_by_haplotypes = sort_by_haplotypes
-    self.pic._options.sort_by_haplotypes_sample_hp_tag = sort_by_haplotypes_sample_hp_tag
-    image = self.pic.build_pileup(
+    pic = _make_image_creator(
+        ref_reader=None,
+        samples=self.samples,
+        width=3,
+        height=7,
+        reference_band_height=2,
+        sort_by_haplotypes=sort_by_haplotypes,
+        sort_by_haplotypes_sample_hp_tag=sort_by_haplotypes_sample_hp_tag)
+    image = pic.build_pileup(
         dv_call=self.dv_call,
         refbases=self.ref,
         reads_for_samples=[[read1, read2, read4, read5, read6]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_once_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, read4, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, read5, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, read6, 9, {self.alt_allele}),
-    ])
-
-    self.assertEqual(image.shape,
-                     (self.pic.height, self.pic.width, self.pic.num_channels))
-    expected_image = np.vstack(
-        [self.expected_rows[name] for name in expected_reads_layout])
-    npt.assert_equal(image, expected_image)
+    self.assertImageMatches(image, *expected_reads_layout)
 
 
 class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
@@ -817,75 +875,31 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
         sequencing_type=deepvariant_pb2.PileupImageOptions.TRIO)
     self.ref = 'AGC'
 
-    self.read1 = test_utils.make_read('AGC', start=0, cigar='3M', name='read1')
-    self.read2 = test_utils.make_read('AGC', start=1, cigar='3M', name='read2')
-    self.read3 = test_utils.make_read('AGC', start=2, cigar='3M', name='read3')
-    self.read4 = test_utils.make_read('AGC', start=3, cigar='3M', name='read4')
-
-    self.read1_parent1 = test_utils.make_read(
-        'TGC', start=0, cigar='3M', name='read1')
-    self.read2_parent1 = test_utils.make_read(
-        'TGC', start=1, cigar='3M', name='read2')
-    self.read3_parent1 = test_utils.make_read(
-        'AGC', start=2, cigar='3M', name='read3')
-    self.read4_parent1 = test_utils.make_read(
-        'AGC', start=3, cigar='3M', name='read4')
-
-    self.read1_parent2 = test_utils.make_read(
-        'AGC', start=0, cigar='3M', name='read1')
-    self.read2_parent2 = test_utils.make_read(
-        'AGC', start=1, cigar='3M', name='read2')
-    self.read3_parent2 = test_utils.make_read(
-        'AGC', start=2, cigar='3M', name='read3')
-    self.read4_parent2 = test_utils.make_read(
-        'AGC', start=3, cigar='3M', name='read4')
-
-    self.expected_rows = {
-        'ref':
-            np.asarray(range(0, 3 * self.pic.num_channels),
-                       np.uint8).reshape(1, 3, self.pic.num_channels),
-        'empty':
-            np.zeros((1, 3, self.pic.num_channels), dtype=np.uint8),
-        'read1_parent1':
-            np.full((1, 3, self.pic.num_channels), 1, dtype=np.uint8),
-        'read2_parent1':
-            np.full((1, 3, self.pic.num_channels), 2, dtype=np.uint8),
-        'read3_parent1':
-            None,
-        'read4_parent1':
-            np.full((1, 3, self.pic.num_channels), 3, dtype=np.uint8),
-        'read1':
-            np.full((1, 3, self.pic.num_channels), 1, dtype=np.uint8),
-        'read2':
-            np.full((1, 3, self.pic.num_channels), 2, dtype=np.uint8),
-        'read3':
-            None,
-        'read4':
-            np.full((1, 3, self.pic.num_channels), 3, dtype=np.uint8),
-        'read1_parent2':
-            np.full((1, 3, self.pic.num_channels), 1, dtype=np.uint8),
-        'read2_parent2':
-            np.full((1, 3, self.pic.num_channels), 2, dtype=np.uint8),
-        'read3_parent2':
-            None,
-        'read4_parent2':
-            np.full((1, 3, self.pic.num_channels), 3, dtype=np.uint8),
-    }
-
-    # Setup our shared mocks.
-    mock_encoder = mock.Mock(spec=['encode_read', 'encode_reference'])
-    mock_encoder.encode_reference.return_value = self.expected_rows['ref']
+    # Reads of each sample use a different base so that their rows differ.
+    self.read1 = _make_window_read('read1', start=0, mapq=20)
+    self.read2 = _make_window_read('read2', start=1, mapq=30)
+    self.read3 = _make_window_read('read3', start=2, mapq=5)
+    self.read4 = _make_window_read('read4', start=3, mapq=40)
 
-    # pylint: disable=unused-argument
-    def get_read_row(dv_call, refbases, read, pos, alt_allele):
-      return self.expected_rows[read.fragment_name]
+    self.read1_parent1 = _make_window_read('read1', 0, mapq=20, base='T')
+    self.read2_parent1 = _make_window_read('read2', 1, mapq=30, base='T')
+    self.read3_parent1 = _make_window_read('read3', 2, mapq=5, base='T')
+    self.read4_parent1 = _make_window_read('read4', 3, mapq=40, base='T')
 
-    mock_encoder.encode_read.side_effect = get_read_row
+    self.read1_parent2 = _make_window_read('read1', 0, mapq=20, base='G')
+    self.read2_parent2 = _make_window_read('read2', 1, mapq=30, base='G')
+    self.read3_parent2 = _make_window_read('read3', 2, mapq=5, base='G')
+    self.read4_parent2 = _make_window_read('read4', 3, mapq=40, base='G')
 
-    self.mock_enc_ref = mock_encoder.encode_reference
-    self.mock_enc_read = mock_encoder.encode_read
-
-    self.pic._encoder = mock_encoder
+    self.expected_rows = {
+        'ref': self.pic._encoder.encode_reference(self.ref),
+        'empty': np.zeros((1, 3, self.pic.num_channels), dtype=np.uint8),
+    }
+    for suffix in ['', '_parent1', '_parent2']:
+      for name in ['read1', 'read2', 'read4']:
+        name += suffix
+        self.expected_rows[name] = self.pic._encoder.encode_read(
+            self.dv_call, self.ref, getattr(self, name), 9, [self.alt_allele])
 
   def assertImageMatches(self, actual_image, *row_names):
     """Checks that actual_image matches an image from constructed row_names."""
@@ -903,15 +917,12 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
         refbases=self.ref,
         reads_for_samples=[[], [], []],
         alt_alleles={self.alt_allele})
-    test_utils.assert_not_called_workaround(self.mock_enc_read)
     self.assertImageMatches(image, 'ref', 'ref', 'empty', 'empty', 'ref', 'ref',
                             'empty', 'empty', 'ref', 'ref', 'empty', 'empty')
 
   def test_image_no_reads_for_one_parent(self):
-    # This image is created just from reference and no reads. Checks that the
-    # function is listening to all of our image creation parameters (e.g.,
-    # reference_band_height, width, height, etc) and is filling the image with
-    # empty rows when it runs out of reads.
+    # One of the parents has no reads, so its section is only the reference
+    # band followed by empty rows.
     image = self.pic.build_pileup(
         dv_call=self.dv_call,
         refbases=self.ref,
@@ -946,32 +957,12 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
             [self.read1_parent2, self.read2_parent2, self.read4_parent2]
         ],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read1_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4_parent2, 9,
-                  {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read2_parent1',
                             'read4_parent1', 'ref', 'ref', 'read2', 'read4',
                             'ref', 'ref', 'read2_parent2', 'read4_parent2')
 
   def test_image_creation_with_bad_read(self):
-    # Read 3 is bad (return value is None) so it should be skipped.
+    # Read 3 is bad (it can't be encoded) so it should be skipped.
     image = self.pic.build_pileup(
         dv_call=self.dv_call,
         refbases=self.ref,
@@ -981,32 +972,12 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
             [self.read1_parent2, self.read3_parent2, self.read2_parent2]
         ],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read1_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent2, 9,
-                  {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read1_parent1',
                             'read2_parent1', 'ref', 'ref', 'read1', 'read2',
                             'ref', 'ref', 'read1_parent2', 'read2_parent2')
 
   def test_image_creation_with_all_reads_in_new_order(self):
-    # Read 3 is bad (return value is None) so it should be skipped. Read2 should
+    # Read 3 is bad (it can't be encoded) so it should be skipped. Read2 should
     # also be dropped because there's only space for Read1 and Read4. If there
     # are more reads than rows, a deterministic random subset is used.
     image = self.pic.build_pileup(
@@ -1021,31 +992,6 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
                                self.read4_parent2, self.read1_parent2
                            ]],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read2_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read3_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1_parent2, 9,
-                  {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read1_parent1',
                             'read4_parent1', 'ref', 'ref', 'read1', 'read4',
                             'ref', 'ref', 'read1_parent2', 'read4_parent2')
@@ -1066,7 +1012,6 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
         width=3,
         reference_band_height=2,
         sequencing_type=deepvariant_pb2.PileupImageOptions.TRIO)
-    self.custom_pic._encoder = self.pic._encoder
 
     image = self.custom_pic.build_pileup(
         dv_call=self.dv_call,
@@ -1077,26 +1022,6 @@ class PileupImageForTrioCreatorEncodePileupTest(parameterized.TestCase):
             [self.read1_parent2, self.read2_parent2, self.read4_parent2]
         ],
         alt_alleles={self.alt_allele})
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.mock_enc_ref.assert_called_with(self.ref)
-    self.assertEqual(self.mock_enc_read.call_args_list, [
-        mock.call(self.dv_call, self.ref, self.read1_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4_parent1, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4, 9, {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read1_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read2_parent2, 9,
-                  {self.alt_allele}),
-        mock.call(self.dv_call, self.ref, self.read4_parent2, 9,
-                  {self.alt_allele}),
-    ])
     self.assertImageMatches(image, 'ref', 'ref', 'read2_parent1', 'ref', 'ref',
                             'read2', 'read4', 'ref', 'ref', 'read2_parent2')
 
@@ -1186,8 +1111,8 @@ class PileupImageCreatorTest(parameterized.TestCase):
     self.dv_call.variant.alternate_bases[:] = ['C', 'T']
 
     with mock.patch.object(
-        self.pic, 'build_pileup', autospec=True) as mock_encoder:
-      mock_encoder.side_effect = ['mi1', 'mi2', 'mi3']
+        self.pic, 'build_pileups', autospec=True) as mock_encoder:
+      mock_encoder.return_value = ['mi1', 'mi2', 'mi3']
 
       output = self.pic.create_pileup_images(
           dv_call=self.dv_call, reads_for_samples=self.reads_for_samples)
@@ -1197,19 +1122,12 @@ class PileupImageCreatorTest(parameterized.TestCase):
           (['C', 'T'], 'mi3'),
       ], output)
 
-      def _expected_call(alts):
-        return mock.call(
-            dv_call=self.dv_call,
-            refbases=self.mock_ref_reader.query.return_value,
-            reads_for_samples=[self.mock_sam_reader.query.return_value],
-            alt_alleles=alts)
-
-      self.assertEqual(mock_encoder.call_count, 3)
-      mock_encoder.assert_has_calls([
-          _expected_call(['C']),
-          _expected_call(['T']),
-          _expected_call(['C', 'T']),
-      ])
+      # All of the images are built by a single call.
+      mock_encoder.assert_called_once_with(
+          dv_call=self.dv_call,
+          refbases=self.mock_ref_reader.query.return_value,
+          reads_for_samples=[self.mock_sam_reader.query.return_value],
+          alt_allele_combinations=[['C'], ['T'], ['C', 'T']])
 
   def test_create_pileup_images_with_alt_align(self):
     self.dv_call.variant.alternate_bases[:] = ['C', 'T']
@@ -1218,13 +1136,17 @@ class PileupImageCreatorTest(parameterized.TestCase):
     haplotype_sequences = {'C': seq_for_c, 'T': seq_for_t}
     haplotype_alignments = {'C': 'reads for C', 'T': 'reads for T'}
 
-    with mock.patch.object(
-        self.pic, 'build_pileup', autospec=True) as mock_encoder:
+    def _fake_build_pileups(dv_call, refbases, reads_for_samples,
+                            alt_allele_combinations, custom_ref=False):
       # The represent_alt_aligned_pileups function checks for shape of the
-      # arrays, so mock with actual numpy arrays here.
-      arr = np.zeros((100, 221, 6))
+      # arrays, so return actual numpy arrays here.
+      del dv_call, refbases, reads_for_samples, custom_ref  # Unused.
+      return [np.zeros((100, 221, 6)) for _ in alt_allele_combinations]
+
+    with mock.patch.object(
+        self.pic, 'build_pileups', autospec=True) as mock_encoder:
+      mock_encoder.side_effect = _fake_build_pileups
       final_pileup = np.zeros((300, 221, 6))
-      mock_encoder.side_effect = [arr] * 9
       self.pic._options.alt_aligned_pileup = 'rows'
 
       output = self.pic.create_pileup_images(
@@ -1238,36 +1160,27 @@ class PileupImageCreatorTest(parameterized.TestCase):
       self.assertEqual([x[1].shape for x in output],
                        [x[1].shape for x in expected_output])
 
-      def _expected_ref_based_call(alts):
-        return mock.call(
-            dv_call=self.dv_call,
-            refbases=self.mock_ref_reader.query.return_value,
-            reads_for_samples=[self.mock_sam_reader.query.return_value],
-            alt_alleles=alts)
-
-      def _expected_alt_based_call(alts, refbases, reads):
+      def _expected_alt_based_call(alt_allele_combinations, refbases, reads):
         return mock.call(
             dv_call=self.dv_call,
             refbases=refbases,
             reads_for_samples=[reads],
-            alt_alleles=alts,
+            alt_allele_combinations=alt_allele_combinations,
             custom_ref=True)
 
-      self.assertEqual(mock_encoder.call_count, 7)
-      mock_encoder.assert_has_calls(
-          [
-              # Pileup for 'C':
-              _expected_ref_based_call(['C']),
-              _expected_alt_based_call(['C'], seq_for_c, 'reads for C'),
-              # Pileup for 'T':
-              _expected_ref_based_call(['T']),
-              _expected_alt_based_call(['T'], seq_for_t, 'reads for T'),
-              # Pileup for 'C/T':
-              _expected_ref_based_call(['C', 'T']),
-              _expected_alt_based_call(['C', 'T'], seq_for_c, 'reads for C'),
-              _expected_alt_based_call(['C', 'T'], seq_for_t, 'reads for T'),
-          ],
-          any_order=True)
+      # One call for the ref-aligned images, and one per alt for the images
+      # of the reads aligned to that alt.
+      self.assertEqual(mock_encoder.call_args_list, [
+          mock.call(
+              dv_call=self.dv_call,
+              refbases=self.mock_ref_reader.query.return_value,
+              reads_for_samples=[self.mock_sam_reader.query.return_value],
+              alt_allele_combinations=[['C'], ['T'], ['C', 'T']]),
+          _expected_alt_based_call([['C'], ['C', 'T']], seq_for_c,
+                                   'reads for C'),
+          _expected_alt_based_call([['T'], ['C', 'T']], seq_for_t,
+                                   'reads for T'),
+      ])
 
   def test_create_pileup_images_with_mismatched_alt_ref(self):
     self.dv_call.variant.alternate_bases[:] = ['T']
@@ -1275,7 +1188,7 @@ class PileupImageCreatorTest(parameterized.TestCase):
     haplotype_sequences = {'T': 'T' * (self.pic.width + 1)}
     haplotype_alignments = {'T': 'reads for T'}
     with mock.patch.object(
-        self.pic, 'build_pileup', autospec=True) as mock_encoder:
+        self.pic, 'build_pileups', autospec=True) as mock_encoder:
       self.pic._options.alt_aligned_pileup = 'rows'
       output = self.pic.create_pileup_images(
           dv_call=self.dv_call,
@@ -31,7 +31,13 @@
 
 #include "deepvariant/postprocess_variants.h"
 
+#include <map>
+#include <memory>
+#include <queue>
+
 #include "deepvariant/protos/deepvariant.pb.h"
+#include "absl/memory/memory.h"
+#include "absl/strings/str_cat.h"
 #include "third_party/nucleus/protos/reference.pb.h"
 #include "third_party/nucleus/protos/variants.pb.h"
 #include "third_party/nucleus/util/utils.h"
@@ -48,15 +54,8 @@ namespace deepvariant {
 namespace {
 
 void SortSingleSiteCalls(
-    const std::vector<nucleus::genomics::v1::ContigInfo>& contigs,
+    const std::map<string, int>& contig_name_to_pos_in_fasta,
     std::vector<CallVariantsOutput>* calls) {
-  std::vector<CallVariantsOutput> output;
-  if (calls->empty()) {
-    return;
-  }
-  //   Create the mapping from from contig to pos_in_fasta.
-  std::map<string, int> contig_name_to_pos_in_fasta =
-      nucleus::MapContigNameToPosInFasta(contigs);
   std::stable_sort(calls->begin(), calls->end(),
             [&contig_name_to_pos_in_fasta](const CallVariantsOutput& a,
                                            const CallVariantsOutput& b) {
@@ -65,62 +64,170 @@ void SortSingleSiteCalls(
             });
 }
 
-}  // namespace
+// Writes `calls` as a TFRecord to `path`.
+void WriteSingleSiteCalls(const std::vector<CallVariantsOutput>& calls,
+                          const string& path) {
+  std::unique_ptr<tensorflow::WritableFile> output_file;
+  TF_CHECK_OK(tensorflow::Env::Default()->NewWritableFile(path, &output_file));
+  tensorflow::io::RecordWriter output_writer(output_file.get());
+  for (const auto& single_site_call : calls) {
+    tensorflow::Status writer_status =
+        output_writer.WriteRecord(single_site_call.SerializeAsString());
+    QCHECK(writer_status.ok())
+        << "Failed to write serialized proto to output_writer. "
+        << "Status = " << writer_status.error_message();
+  }
+  TF_CHECK_OK(output_writer.Flush()) << "Failed to flush the output writer.";
+  TF_CHECK_OK(output_file->Close()) << "Failed to close " << path;
+}
 
-void ProcessSingleSiteCallTfRecords(
-    const std::vector<nucleus::genomics::v1::ContigInfo>& contigs,
-    const std::vector<string>& tfrecord_paths,
-    const string& output_tfrecord_path) {
-  std::vector<CallVariantsOutput> single_site_calls;
-  tensorflow::Env* env = tensorflow::Env::Default();
-  for (const string& tfrecord_path : tfrecord_paths) {
-    std::unique_ptr<tensorflow::RandomAccessFile> read_file;
-    TF_CHECK_OK(env->NewRandomAccessFile(tfrecord_path, &read_file));
-    const char* const option = nucleus::EndsWith(tfrecord_path, ".gz")
+// Sequential reader of the CallVariantsOutput protos in one TFRecord file.
+class SingleSiteCallReader {
+ public:
+  explicit SingleSiteCallReader(const string& path) {
+    TF_CHECK_OK(tensorflow::Env::Default()->NewRandomAccessFile(path, &file_));
+    const char* const option = nucleus::EndsWith(path, ".gz")
                                    ? tensorflow::io::compression::kGzip
                                    : tensorflow::io::compression::kNone;
-    tensorflow::io::RecordReader reader(
-        read_file.get(),
+    reader_ = absl::make_unique<tensorflow::io::RecordReader>(
+        file_.get(),
         tensorflow::io::RecordReaderOptions::CreateRecordReaderOptions(option));
+  }
 
-    uint64 offset = 0;
-    tensorflow::tstring data;
-    LOG(INFO) << "Read from: " << tfrecord_path;
-    while (reader.ReadRecord(&offset, &data).ok()) {
-      CallVariantsOutput single_site_call;
-      QCHECK(single_site_call.ParseFromArray(data.data(), data.length()))
-          << "Failed to parse CallVariantsOutput";
-      // Here we assume each variant has only 1 call.
-      QCHECK_EQ(single_site_call.variant().calls_size(), 1);
-      single_site_calls.push_back(single_site_call);
+  // Reads the next call into `call`, returning false at the end of the file.
+  bool Next(CallVariantsOutput* call) {
+    if (!reader_->ReadRecord(&offset_, &data_).ok()) {
+      return false;
     }
-    if (tfrecord_paths.size() > 1) {
-      LOG(INFO) << "Done reading: " << tfrecord_path
-                << ". #entries in single_site_calls = "
-                << single_site_calls.size();
+    QCHECK(call->ParseFromArray(data_.data(), data_.length()))
+        << "Failed to parse CallVariantsOutput";
+    // Here we assume each variant has only 1 call.
+    QCHECK_EQ(call->variant().calls_size(), 1);
+    return true;
+  }
+
+ private:
+  std::unique_ptr<tensorflow::RandomAccessFile> file_;
+  std::unique_ptr<tensorflow::io::RecordReader> reader_;
+  uint64 offset_ = 0;
+  tensorflow::tstring data_;
+};
+
+// Merges the sorted runs in `run_paths` into `output_tfrecord_path`. Calls
+// comparing equal are written in the order of their runs, so merging stable
+// sorted runs of consecutive input records is itself a stable sort.
+void MergeSortedRuns(const std::map<string, int>& contig_name_to_pos_in_fasta,
+                     const std::vector<string>& run_paths,
+                     const string& output_tfrecord_path) {
+  std::vector<std::unique_ptr<SingleSiteCallReader>> readers;
+  std::vector<CallVariantsOutput> heads(run_paths.size());
+  // Min-heap of the indices of the runs that still have calls, ordered by
+  // their head call and then by run index.
+  auto comes_after = [&contig_name_to_pos_in_fasta, &heads](int a, int b) {
+    if (nucleus::CompareVariants(heads[b].variant(), heads[a].variant(),
+                                 contig_name_to_pos_in_fasta)) {
+      return true;
+    }
+    if (nucleus::CompareVariants(heads[a].variant(), heads[b].variant(),
+                                 contig_name_to_pos_in_fasta)) {
+      return false;
+    }
+    return a > b;
+  };
+  std::priority_queue<int, std::vector<int>, decltype(comes_after)> runs(
+      comes_after);
+  for (int i = 0; i < run_paths.size(); ++i) {
+    readers.push_back(absl::make_unique<SingleSiteCallReader>(run_paths[i]));
+    if (readers[i]->Next(&heads[i])) {
+      runs.push(i);
     }
   }
-  LOG(INFO) << "Total #entries in single_site_calls = "
-            << single_site_calls.size();
-  VLOG(3) << "Start SortSingleSiteCalls";
-  SortSingleSiteCalls(contigs, &single_site_calls);
-  VLOG(3) << "Done SortSingleSiteCalls";
 
-  // Write sorted calls to output_tfrecord_path.
   std::unique_ptr<tensorflow::WritableFile> output_file;
   TF_CHECK_OK(tensorflow::Env::Default()->NewWritableFile(output_tfrecord_path,
                                                           &output_file));
   tensorflow::io::RecordWriter output_writer(output_file.get());
-  for (const auto& single_site_call : single_site_calls) {
+  while (!runs.empty()) {
+    const int i = runs.top();
+    runs.pop();
     tensorflow::Status writer_status =
-        output_writer.WriteRecord(single_site_call.SerializeAsString());
+        output_writer.WriteRecord(heads[i].SerializeAsString());
     QCHECK(writer_status.ok())
         << "Failed to write serialized proto to output_writer. "
         << "Status = " << writer_status.error_message();
+    if (readers[i]->Next(&heads[i])) {
+      runs.push(i);
+    }
   }
   TF_CHECK_OK(output_writer.Flush()) << "Failed to flush the output writer.";
 }
 
+}  // namespace
+
+int ProcessSingleSiteCallTfRecords(
+    const std::vector<nucleus::genomics::v1::ContigInfo>& contigs,
+    const std::vector<string>& tfrecord_paths,
+    const string& output_tfrecord_path, uint64 max_memory_bytes) {
+  //   Create the mapping from from contig to pos_in_fasta.
+  const std::map<string, int> contig_name_to_pos_in_fasta =
+      nucleus::MapContigNameToPosInFasta(contigs);
+  std::vector<CallVariantsOutput> single_site_calls;
+  std::vector<string> run_paths;
+  uint64 total_calls = 0;
+  uint64 memory_bytes = 0;
+  auto spill_run = [&]() {
+    const string run_path = absl::StrCat(output_tfrecord_path, ".run-",
+                                         run_paths.size());
+    VLOG(3) << "Spilling " << single_site_calls.size() << " calls to "
+            << run_path;
+    SortSingleSiteCalls(contig_name_to_pos_in_fasta, &single_site_calls);
+    WriteSingleSiteCalls(single_site_calls, run_path);
+    run_paths.push_back(run_path);
+    // Release the memory of the run rather than only clearing it.
+    std::vector<CallVariantsOutput>().swap(single_site_calls);
+    memory_bytes = 0;
+  };
+
+  for (const string& tfrecord_path : tfrecord_paths) {
+    SingleSiteCallReader reader(tfrecord_path);
+    LOG(INFO) << "Read from: " << tfrecord_path;
+    CallVariantsOutput single_site_call;
+    while (reader.Next(&single_site_call)) {
+      memory_bytes += single_site_call.SpaceUsedLong();
+      single_site_calls.push_back(std::move(single_site_call));
+      ++total_calls;
+      if (max_memory_bytes > 0 && memory_bytes >= max_memory_bytes) {
+        spill_run();
+      }
+    }
+    if (tfrecord_paths.size() > 1) {
+      LOG(INFO) << "Done reading: " << tfrecord_path
+                << ". #entries in single_site_calls = " << total_calls;
+    }
+  }
+  LOG(INFO) << "Total #entries in single_site_calls = " << total_calls;
+
+  if (run_paths.empty()) {
+    VLOG(3) << "Start SortSingleSiteCalls";
+    SortSingleSiteCalls(contig_name_to_pos_in_fasta, &single_site_calls);
+    VLOG(3) << "Done SortSingleSiteCalls";
+    WriteSingleSiteCalls(single_site_calls, output_tfrecord_path);
+    return 0;
+  }
+
+  if (!single_site_calls.empty()) {
+    spill_run();
+  }
+  LOG(INFO) << "Merging " << run_paths.size() << " sorted runs spilled to "
+            << "stay within " << max_memory_bytes << " bytes.";
+  MergeSortedRuns(contig_name_to_pos_in_fasta, run_paths,
+                  output_tfrecord_path);
+  for (const string& run_path : run_paths) {
+    TF_CHECK_OK(tensorflow::Env::Default()->DeleteFile(run_path));
+  }
+  return run_paths.size();
+}
+
 }  // namespace deepvariant
 }  // namespace genomics
 }  // namespace learning
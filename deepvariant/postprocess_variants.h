@@ -52,10 +52,17 @@ using tensorflow::StringPiece;
 // on the mapping of chromosome names to positions in FASTA in `contigs`,
 // and then outputs the sorted TFRecord of CallVariantsOutput protos to
 // `output_tfrecord_path`.
-void ProcessSingleSiteCallTfRecords(
+//
+// If `max_memory_bytes` is positive, at most about that many bytes of protos
+// are held in memory: each time the limit is reached, the calls read so far
+// are sorted and spilled as a run to a temporary file next to
+// `output_tfrecord_path`, and the runs are then merged into the output.
+// Returns the number of runs spilled, which is 0 if all of the calls fit in
+// memory.
+int ProcessSingleSiteCallTfRecords(
     const std::vector<nucleus::genomics::v1::ContigInfo>& contigs,
     const std::vector<string>& tfrecord_paths,
-    const string& output_tfrecord_path);
+    const string& output_tfrecord_path, uint64 max_memory_bytes);
 
 }  // namespace deepvariant
 }  // namespace genomics
@@ -36,10 +36,14 @@ if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
   del sys.modules['google']
 
 
+import bisect
 import collections
-import copy
+import contextlib
+import functools
 import itertools
+import multiprocessing
 import os
+import shutil
 import tempfile
 import time
 
@@ -50,11 +54,11 @@ import numpy as np
 import tensorflow as tf
 
 from third_party.nucleus.io import fasta
+from third_party.nucleus.io import genomics_writer
 from third_party.nucleus.io import sharded_file_utils
 from third_party.nucleus.io import tabix
 from third_party.nucleus.io import tfrecord
 from third_party.nucleus.io import vcf
-from third_party.nucleus.protos import struct_pb2
 from third_party.nucleus.protos import variants_pb2
 from third_party.nucleus.util import errors
 from third_party.nucleus.util import genomics_math
@@ -121,6 +125,23 @@ flags.DEFINE_boolean(
     'If True, use a specialized model for genotype resolution of multiallelic '
     'cases with two alts.')
 flags.DEFINE_boolean('only_keep_pass', False, 'If True, only keep PASS calls.')
+flags.DEFINE_integer(
+    'num_workers', 1,
+    'Optional. If greater than 1, the sorted calls are split into partitions at '
+    'positions no variant overlaps (at contig boundaries when writing a gVCF), '
+    'which are converted to VCF and gVCF records in this many processes. The '
+    'outputs of the partitions are written next to --outfile and concatenated '
+    'in order.')
+flags.DEFINE_integer(
+    'max_memory_mb', 0,
+    'Optional. If positive, the approximate limit in MB on the memory used to '
+    'sort the CallVariantsOutput protos of --infile. Protos exceeding it are '
+    'sorted in runs that are spilled to local temporary files and then merged. '
+    'If 0, all of the protos are sorted in memory.')
+flags.DEFINE_integer(
+    'compression_threads', 0,
+    'Optional. The number of additional threads used to compress each .gz '
+    'output. If 0, the outputs are compressed on the writing thread.')
 
 
 # Some format fields are indexed by alt allele, such as AD (depth by allele).
@@ -138,9 +159,34 @@ _GVCF_ALT_ALLELE_GL = -99
 # FASTA cache size. Span 300 Mb so that we query each chromosome at most once.
 _FASTA_CACHE_SIZE = 300000000
 
+# The number of reference bases read at a time when truncating the non-variant
+# sites that overlap variants in the gVCF merge.
+_REFERENCE_WINDOW_SIZE = 65536
+
 # When this was set, it's about 20 seconds per log.
 _LOG_EVERY_N = 100000
 
+# The number of sites the multiallelic model is run on at once, and the
+# maximum number of variants buffered while waiting for a full batch.
+_MULTIALLELIC_MODEL_BATCH_SIZE = 512
+_MAX_PENDING_VARIANTS = 100000
+
+# With --num_workers, the sorted calls are split into this many partitions per
+# worker so that a slow partition doesn't leave the other workers idle.
+_PARTITIONS_PER_WORKER = 4
+
+# The empty BGZF block that htslib writes at the end of every BGZF file.
+_BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000')
+# The number of bytes copied at a time when concatenating the worker outputs.
+_COPY_BUFFER_SIZE = 1 << 20
+
+# The inputs and outputs of the postprocessing of one partition. The VCF and
+# gVCF paths are written without their header, BGZF compressed if the final
+# output is, and gvcf_path and nonvariant_path are None unless writing a gVCF.
+_Partition = collections.namedtuple(
+    '_Partition', ['cvo_path', 'nonvariant_path', 'vcf_path', 'gvcf_path'])
+
 
 def _extract_single_sample_name(record):
   """Returns the name of the single sample within the CallVariantsOutput file.
@@ -669,6 +715,34 @@ def merge_predictions(call_variants_outputs,
                       qual_filter=None,
                       multiallelic_model=None):
   """Merges the predictions from the multi-allelic calls."""
+  canonical_variant, predictions, multiallelic_probs = _merge_predictions(
+      call_variants_outputs,
+      qual_filter=qual_filter,
+      use_multiallelic_model=multiallelic_model is not None)
+  if multiallelic_probs is not None:
+    predictions = multiallelic_model(multiallelic_probs).numpy().tolist()[0]
+  return canonical_variant, predictions
+
+
+def _merge_predictions(call_variants_outputs, qual_filter,
+                       use_multiallelic_model):
+  """Merges the predictions from the multi-allelic calls.
+
+  Args:
+    call_variants_outputs: list of CallVariantsOutput protos of one site.
+    qual_filter: double. The qual value below which to filter alt alleles.
+    use_multiallelic_model: bool. Whether the predictions of sites with two
+      alts after pruning are computed by the multiallelic model.
+
+  Returns:
+    A tuple (canonical_variant, predictions, multiallelic_probs). If the
+    multiallelic model is to be run on the site, predictions is None and
+    multiallelic_probs is its input of shape (1, 9), as returned by
+    get_multiallelic_distributions. Otherwise multiallelic_probs is None.
+
+  Raises:
+    ValueError: if call_variants_outputs are empty or inconsistent.
+  """
   # See the logic described in the class PileupImageCreator pileup_image.py
   #
   # Because of the logic above, this function expects all cases above to have
@@ -684,7 +758,7 @@ def merge_predictions(call_variants_outputs,
   if not other_calls:
     canonical_variant = variant_utils.simplify_variant_alleles(
         canonical_variant)
-    return canonical_variant, first_call.genotype_probabilities
+    return canonical_variant, first_call.genotype_probabilities, None
 
   alt_alleles_to_remove = get_alt_alleles_to_remove(call_variants_outputs,
                                                     qual_filter)
@@ -696,11 +770,12 @@ def merge_predictions(call_variants_outputs,
   canonical_variant = prune_alleles(canonical_variant, alt_alleles_to_remove)
   # Run alternate model for multiallelic cases.
   num_alts = len(canonical_variant.alternate_bases)
-  if num_alts == 2 and multiallelic_model is not None:
+  multiallelic_probs = None
+  normalized_predictions = None
+  if num_alts == 2 and use_multiallelic_model:
     # We have 3 CVOs for 2 alts. In this case, there are 6 possible genotypes.
-    cvo_probs = get_multiallelic_distributions(call_variants_outputs,
-                                               alt_alleles_to_remove)
-    normalized_predictions = multiallelic_model(cvo_probs).numpy().tolist()[0]
+    multiallelic_probs = get_multiallelic_distributions(
+        call_variants_outputs, alt_alleles_to_remove)
   else:
     predictions = [
         min(flattened_probs_dict[(m, n)]) for _, _, m, n in
@@ -714,29 +789,44 @@ def merge_predictions(call_variants_outputs,
   # calculation above. flattened_probs_dict is indexed by alt allele, and
   # simplify can change those alleles so we cannot simplify until afterwards.
   canonical_variant = variant_utils.simplify_variant_alleles(canonical_variant)
-  return canonical_variant, normalized_predictions
+  return canonical_variant, normalized_predictions, multiallelic_probs
 
 
-def write_variants_to_vcf(variant_iterable, output_vcf_path, header):
+def write_variants_to_vcf(variant_iterable,
+                          output_vcf_path,
+                          header,
+                          vcf_stats_accumulator=None,
+                          **writer_options):
   """Writes Variant protos to a VCF file.
 
   Args:
     variant_iterable: iterable. An iterable of sorted Variant protos.
     output_vcf_path: str. Output file in VCF format.
     header: VcfHeader proto. The VCF header to use for writing the variants.
+    vcf_stats_accumulator: VcfStatsAccumulator or None. If not None, the
+      variants written are added to it.
+    **writer_options: Additional keyword arguments for vcf.VcfWriter, as
+      returned by _vcf_writer_options.
   """
   logging.info('Writing output to VCF file: %s', output_vcf_path)
-  with vcf.VcfWriter(
-      output_vcf_path, header=header, round_qualities=True) as writer:
+
+  def variants_to_write(writer):
     count = 0
     for variant in variant_iterable:
       if (not FLAGS.only_keep_pass or
           variant.filter == [dv_vcf_constants.DEEP_VARIANT_PASS]):
         count += 1
-        writer.write(variant)
+        if vcf_stats_accumulator is not None:
+          vcf_stats_accumulator.add(variant, writer)
+        yield variant
         logging.log_every_n(logging.INFO, '%s variants written.', _LOG_EVERY_N,
                             count)
 
+  with vcf.VcfWriter(
+      output_vcf_path, header=header, round_qualities=True,
+      **writer_options) as writer:
+    writer.write_many(variants_to_write(writer))
+
 
 def _zero_scale_gl(variant):
   """Zero-scales GL to mimic write-then-read.
@@ -776,6 +866,10 @@ def _transform_call_variants_output_to_variants(input_sorted_tfrecord_path,
   individual alleles whose qualities are lower than the
   `multi_allelic_qual_filter` threshold.
 
+  With use_multiallelic_model, the multiallelic model is run on batches of up
+  to _MULTIALLELIC_MODEL_BATCH_SIZE sites with two alts, so the variants from
+  the first such site on are yielded once its batch has been evaluated.
+
   Args:
     input_sorted_tfrecord_path: str. TFRecord format file containing sorted
       CallVariantsOutput protos.
@@ -796,20 +890,50 @@ def _transform_call_variants_output_to_variants(input_sorted_tfrecord_path,
   group_fn = None
   if group_variants:
     group_fn = lambda x: variant_utils.variant_range(x.variant)
+  # Sites needing the multiallelic model are buffered, along with the sites
+  # after them, until a batch of model inputs is ready.
+  pending = []
+  pending_probs = []
+
+  def flush_pending():
+    if pending_probs:
+      batch_predictions = iter(
+          multiallelic_model(np.concatenate(pending_probs)).numpy().tolist())
+    for canonical_variant, predictions in pending:
+      if predictions is None:
+        predictions = next(batch_predictions)
+      yield add_call_to_variant(
+          canonical_variant,
+          predictions,
+          qual_filter=qual_filter,
+          sample_name=sample_name)
+    del pending[:]
+    del pending_probs[:]
+
   for _, group in itertools.groupby(
       tfrecord.read_tfrecords(
           input_sorted_tfrecord_path, proto=deepvariant_pb2.CallVariantsOutput),
       group_fn):
     outputs = _sort_grouped_variants(group)
-    canonical_variant, predictions = merge_predictions(
+    canonical_variant, predictions, multiallelic_probs = _merge_predictions(
         outputs,
         multi_allelic_qual_filter,
-        multiallelic_model=multiallelic_model)
-    variant = add_call_to_variant(
-        canonical_variant,
-        predictions,
-        qual_filter=qual_filter,
-        sample_name=sample_name)
+        use_multiallelic_model=multiallelic_model is not None)
+    if multiallelic_probs is not None:
+      pending_probs.append(multiallelic_probs)
+    elif not pending:
+      yield add_call_to_variant(
+          canonical_variant,
+          predictions,
+          qual_filter=qual_filter,
+          sample_name=sample_name)
+      continue
+    pending.append((canonical_variant, predictions))
+    if (len(pending_probs) >= _MULTIALLELIC_MODEL_BATCH_SIZE or
+        len(pending) >= _MAX_PENDING_VARIANTS):
+      for variant in flush_pending():
+        yield variant
+  for variant in flush_pending():
     yield variant
 
 
@@ -866,30 +990,34 @@ def _get_contig_based_lessthan(contigs):
   return lessthanfn
 
 
-def _create_record_from_template(template, start, end, fasta_reader):
-  """Returns a copy of the template variant with the new start and end.
+class _ReferenceBaseCache(object):
+  """Returns single reference bases, reading the reference a window at a time.
 
-  Updates to the start position cause a different reference base to be set.
-
-  Args:
-    template: third_party.nucleus.protos.Variant. The template variant whose
-      non-location and reference base information to use.
-    start: int. The desired new start location.
-    end: int. The desired new end location.
-    fasta_reader: GenomeReferenceFai object. The reader used to determine the
-      correct start base to use for the updated variant.
-
-  Returns:
-    An updated third_party.nucleus.protos.Variant with the proper start, end,
-    and reference base set and all other fields inherited from the template.
+  Consecutive lookups of nearby positions, such as the starts of the sorted
+  non-variant blocks truncated by the gVCF merge, are served from the last
+  window read rather than by a query of the reference each.
   """
-  retval = copy.deepcopy(template)
-  retval.start = start
-  retval.end = end
-  if start != template.start:
-    retval.reference_bases = fasta_reader.query(
-        ranges.make_range(retval.reference_name, start, start + 1))
-  return retval
+
+  def __init__(self, fasta_reader, window_size=_REFERENCE_WINDOW_SIZE):
+    self._fasta_reader = fasta_reader
+    self._window_size = window_size
+    self._contig_name = None
+    self._start = 0
+    self._bases = ''
+
+  def base(self, contig_name, position):
+    """Returns the reference base at position of contig_name."""
+    offset = position - self._start
+    if (contig_name != self._contig_name or offset < 0 or
+        offset >= len(self._bases)):
+      n_bases = self._fasta_reader.contig(contig_name).n_bases
+      self._bases = self._fasta_reader.query(
+          ranges.make_range(contig_name, position,
+                            min(position + self._window_size, n_bases)))
+      self._contig_name = contig_name
+      self._start = position
+      offset = 0
+    return self._bases[offset]
 
 
 def _transform_to_gvcf_record(variant):
@@ -910,17 +1038,41 @@ def _transform_to_gvcf_record(variant):
     call = variant_utils.only_call(variant)
     call.genotype_likelihood.extend([_GVCF_ALT_ALLELE_GL] * num_new_gls)
     if call.info and 'AD' in call.info:
-      call.info['AD'].values.extend([struct_pb2.Value(int_value=0)])
+      call.info['AD'].values.add(int_value=0)
     if call.info and 'VAF' in call.info:
-      call.info['VAF'].values.extend([struct_pb2.Value(number_value=0)])
+      call.info['VAF'].values.add(number_value=0)
 
   return variant
 
 
+class _BatchingWriter(object):
+  """Writes protos to a writer in batches with write_many.
+
+  The protos are only written when their batch is flushed, so they must not be
+  modified after being passed to write.
+  """
+
+  def __init__(self, writer, batch_size=genomics_writer.WRITE_MANY_BATCH_SIZE):
+    self._writer = writer
+    self._batch_size = batch_size
+    self._batch = []
+
+  def write(self, proto):
+    self._batch.append(proto)
+    if len(self._batch) >= self._batch_size:
+      self.flush()
+
+  def flush(self):
+    if self._batch:
+      self._writer.write_many(self._batch)
+      self._batch = []
+
+
 def merge_and_write_variants_and_nonvariants(variant_iterable,
                                              nonvariant_iterable, lessthan,
                                              fasta_reader, vcf_writer,
-                                             gvcf_writer):
+                                             gvcf_writer,
+                                             vcf_stats_accumulator=None):
   """Writes records consisting of the merging of variant and non-variant sites.
 
   The merging strategy used for single-sample records is to emit variants
@@ -941,6 +1093,8 @@ def merge_and_write_variants_and_nonvariants(variant_iterable,
       ensure gVCF records have the correct reference base.
     vcf_writer: VcfWriter. Writes variants to VCF.
     gvcf_writer: VcfWriter. Writes merged variants and nonvariants to gVCF.
+    vcf_stats_accumulator: VcfStatsAccumulator or None. If not None, the
+      variants written to VCF are added to it.
   """
 
   def next_or_none(iterable):
@@ -949,16 +1103,26 @@ def merge_and_write_variants_and_nonvariants(variant_iterable,
     except StopIteration:
       return None
 
+  # The writers only write each record when its batch is flushed, so records
+  # that are modified after being written are copied first.
+  vcf_field_access = vcf_writer
+  vcf_writer = _BatchingWriter(vcf_writer)
+  gvcf_writer = _BatchingWriter(gvcf_writer)
+  reference = _ReferenceBaseCache(fasta_reader)
   variant = next_or_none(variant_iterable)
   nonvariant = next_or_none(nonvariant_iterable)
 
   while variant is not None or nonvariant is not None:
     if lessthan(variant, nonvariant):
+      gvcf_variant = variant
       if (not FLAGS.only_keep_pass or
           variant.filter == [dv_vcf_constants.DEEP_VARIANT_PASS]):
         vcf_writer.write(variant)
-      gvcf_variant = _transform_to_gvcf_record(_zero_scale_gl(variant))
-      gvcf_writer.write(gvcf_variant)
+        if vcf_stats_accumulator is not None:
+          vcf_stats_accumulator.add(variant, vcf_field_access)
+        gvcf_variant = variants_pb2.Variant()
+        gvcf_variant.CopyFrom(variant)
+      gvcf_writer.write(_transform_to_gvcf_record(_zero_scale_gl(gvcf_variant)))
       variant = next_or_none(variant_iterable)
       continue
     elif lessthan(nonvariant, variant):
@@ -971,17 +1135,21 @@ def merge_and_write_variants_and_nonvariants(variant_iterable,
           variant.end, nonvariant.end), '{} and {}'.format(variant, nonvariant)
       if nonvariant.start < variant.start:
         # Write a non-variant region up to the start of the variant.
-        v = _create_record_from_template(nonvariant, nonvariant.start,
-                                         variant.start, fasta_reader)
-        gvcf_writer.write(v)
+        truncated_nonvariant = variants_pb2.Variant()
+        truncated_nonvariant.CopyFrom(nonvariant)
+        truncated_nonvariant.end = variant.start
+        gvcf_writer.write(truncated_nonvariant)
       if nonvariant.end > variant.end:
         # There is an overhang of the non-variant site after the variant is
         # finished, so update the non-variant to point to that.
-        nonvariant = _create_record_from_template(nonvariant, variant.end,
-                                                  nonvariant.end, fasta_reader)
+        nonvariant.start = variant.end
+        nonvariant.reference_bases = reference.base(nonvariant.reference_name,
+                                                    variant.end)
       else:
         # This non-variant site is subsumed by a Variant. Ignore it.
         nonvariant = next_or_none(nonvariant_iterable)
+  vcf_writer.flush()
+  gvcf_writer.flush()
 
 
 def _get_base_path(input_vcf):
@@ -1032,6 +1200,297 @@ def build_index(vcf_file, csi=False):
     tabix.build_index(vcf_file)
 
 
+def _vcf_writer_options(output_path):
+  """Returns the vcf.VcfWriter options to write output_path with.
+
+  Args:
+    output_path: str. Path of the VCF to be written.
+
+  Returns:
+    A dict of keyword arguments for vcf.VcfWriter.
+  """
+  if not output_path.endswith('.gz'):
+    return {}
+  return dict(compression_threads=FLAGS.compression_threads)
+
+
+def _maybe_build_index(output_path, csi=False):
+  """Indexes output_path if it is compressed."""
+  if output_path.endswith('.gz'):
+    build_index(output_path, csi)
+
+
+def _partition_call_variants_outputs(sorted_tfrecord_path, contigs,
+                                     num_partitions, split_contigs,
+                                     output_dir):
+  """Splits sorted CallVariantsOutput protos into consecutive partitions.
+
+  Partitions hold about the same number of bytes of protos. They only start at
+  a new contig or, if split_contigs is True, at a call that doesn't overlap any
+  previous call on its contig, so that the calls grouped into one variant and
+  the variants whose haplotypes are resolved together are never split.
+
+  Args:
+    sorted_tfrecord_path: str. TFRecord of sorted CallVariantsOutput protos.
+    contigs: list(ContigInfo). The contigs in sorted order.
+    num_partitions: int. The desired number of partitions.
+    split_contigs: bool. Whether partitions may start within a contig.
+    output_dir: str. Directory in which to write the partitions.
+
+  Returns:
+    A tuple (paths, first_keys). paths are the TFRecord files of each
+    partition, and first_keys the (contig index, position) at which each
+    partition starts, which is position 0 for partitions starting at a contig.
+  """
+  keyfn = _get_contig_based_variant_sort_keyfn(contigs)
+  target_size = max(
+      1,
+      tf.io.gfile.stat(sorted_tfrecord_path).length // num_partitions)
+  paths, first_keys = [], []
+  size, prev_contig, max_end = 0, None, -1
+  with contextlib.ExitStack() as stack:
+    writer = None
+    for cvo in tfrecord.read_tfrecords(
+        sorted_tfrecord_path, proto=deepvariant_pb2.CallVariantsOutput):
+      variant = cvo.variant
+      new_contig = variant.reference_name != prev_contig
+      can_split = new_contig or (split_contigs and variant.start >= max_end)
+      if writer is None or (size >= target_size and can_split):
+        stack.close()
+        paths.append(
+            os.path.join(output_dir,
+                         'partition-{:05d}.tfrecord'.format(len(paths))))
+        writer = stack.enter_context(tfrecord.Writer(paths[-1]))
+        contig_index, start = keyfn(variant)
+        first_keys.append((contig_index, 0 if new_contig else start))
+        size = 0
+      if new_contig:
+        prev_contig, max_end = variant.reference_name, variant.end
+      else:
+        max_end = max(max_end, variant.end)
+      writer.write(cvo)
+      size += cvo.ByteSize()
+  return paths, first_keys
+
+
+def _partition_nonvariants(nonvariants, contigs, first_keys, output_dir):
+  """Writes each sorted non-variant site to the partition it falls into.
+
+  Args:
+    nonvariants: iterable of sorted Variant protos.
+    contigs: list(ContigInfo). The contigs in sorted order.
+    first_keys: list of the (contig index, position) at which each partition
+      starts, as returned by _partition_call_variants_outputs. Sites before
+      the first partition are written to it.
+    output_dir: str. Directory in which to write the partitions.
+
+  Returns:
+    The list of TFRecord files of the non-variant sites of each partition.
+  """
+  keyfn = _get_contig_based_variant_sort_keyfn(contigs)
+  paths = [
+      os.path.join(output_dir, 'partition-{:05d}.nonvariant.tfrecord'.format(i))
+      for i in range(len(first_keys))
+  ]
+  with contextlib.ExitStack() as stack:
+    writers = [stack.enter_context(tfrecord.Writer(path)) for path in paths]
+    for nonvariant in nonvariants:
+      i = max(0, bisect.bisect_right(first_keys, keyfn(nonvariant)) - 1)
+      writers[i].write(nonvariant)
+  return paths
+
+
+def _postprocess_partition(partition, contigs, header, sample_name):
+  """Writes the headerless VCF and gVCF of one partition.
+
+  Returns:
+    The VcfStatsAccumulator of the variants written to VCF if
+    --vcf_stats_report is set, and None otherwise.
+  """
+  vcf_stats_accumulator = None
+  if FLAGS.vcf_stats_report:
+    vcf_stats_accumulator = vcf_stats.VcfStatsAccumulator(
+        header=header, round_qualities=True)
+  independent_variants = _transform_call_variants_output_to_variants(
+      input_sorted_tfrecord_path=partition.cvo_path,
+      qual_filter=FLAGS.qual_filter,
+      multi_allelic_qual_filter=FLAGS.multi_allelic_qual_filter,
+      sample_name=sample_name,
+      group_variants=FLAGS.group_variants,
+      use_multiallelic_model=FLAGS.use_multiallelic_model)
+  variant_generator = haplotypes.maybe_resolve_conflicting_variants(
+      independent_variants)
+  if partition.nonvariant_path is None:
+    write_variants_to_vcf(
+        variant_iterable=variant_generator,
+        output_vcf_path=partition.vcf_path,
+        header=header,
+        vcf_stats_accumulator=vcf_stats_accumulator,
+        exclude_header=True,
+        **_vcf_writer_options(partition.vcf_path))
+  else:
+    fasta_reader = fasta.IndexedFastaReader(
+        FLAGS.ref, cache_size=_FASTA_CACHE_SIZE)
+    with vcf.VcfWriter(
+        partition.vcf_path, header=header, round_qualities=True,
+        exclude_header=True,
+        **_vcf_writer_options(partition.vcf_path)) as vcf_writer, \
+        vcf.VcfWriter(
+            partition.gvcf_path, header=header, round_qualities=True,
+            exclude_header=True,
+            **_vcf_writer_options(partition.gvcf_path)) as gvcf_writer:
+      merge_and_write_variants_and_nonvariants(
+          variant_generator,
+          tfrecord.read_tfrecords(
+              partition.nonvariant_path, proto=variants_pb2.Variant),
+          _get_contig_based_lessthan(contigs), fasta_reader, vcf_writer,
+          gvcf_writer, vcf_stats_accumulator)
+  return vcf_stats_accumulator
+
+
+def _copy_vcf_part(path, output, strip_bgzf_eof):
+  """Copies the file at path to output.
+
+  Args:
+    path: str. Path of the file to copy.
+    output: A writable file object.
+    strip_bgzf_eof: bool. If True and the file ends with the BGZF EOF block,
+      the block isn't copied, so that the next file can be appended.
+  """
+  size = os.path.getsize(path)
+  with open(path, 'rb') as part:
+    if strip_bgzf_eof and size >= len(_BGZF_EOF):
+      part.seek(size - len(_BGZF_EOF))
+      if part.read() == _BGZF_EOF:
+        size -= len(_BGZF_EOF)
+      part.seek(0)
+    while size > 0:
+      data = part.read(min(size, _COPY_BUFFER_SIZE))
+      if not data:
+        break
+      output.write(data)
+      size -= len(data)
+
+
+def _concatenate_vcf_bodies(header, body_paths, output_path, temp_dir):
+  """Writes a VCF with header followed by the records of body_paths.
+
+  Args:
+    header: VcfHeader proto. The header of the output.
+    body_paths: list(str). Headerless VCFs, BGZF compressed if output_path is.
+    output_path: str. Path of the VCF to write.
+    temp_dir: str. Directory in which the header is written.
+  """
+  compress = output_path.endswith('.gz')
+  header_path = os.path.join(temp_dir,
+                             'header.vcf' + ('.gz' if compress else ''))
+  with vcf.VcfWriter(header_path, header=header, round_qualities=True):
+    pass
+  # Each compressed part ends with its own EOF block, so only the last one is
+  # kept.
+  with tf.io.gfile.GFile(output_path, 'wb') as output:
+    for path in [header_path] + body_paths:
+      _copy_vcf_part(path, output, strip_bgzf_eof=compress)
+    if compress:
+      output.write(_BGZF_EOF)
+
+
+def _temp_dir_parent(output_path):
+  """Returns the directory to create temporary files for output_path in.
+
+  These are put next to output_path, which must have room for the output
+  anyway, unless output_path isn't a local file, in which case None is returned
+  to use the default temporary directory.
+  """
+  if '://' in output_path:
+    return None
+  return os.path.dirname(os.path.abspath(output_path))
+
+
+def postprocess_in_workers(sorted_tfrecord_path, contigs, header, sample_name,
+                           num_workers):
+  """Writes the VCF and optional gVCF outputs using num_workers processes.
+
+  The sorted calls are split into partitions that are postprocessed
+  independently by a pool of processes, each writing the records of its
+  partition as a headerless VCF, BGZF compressed if the output is. These are
+  then concatenated in order after the header, so the outputs have the same
+  decompressed content as those written by a single process. The temporary
+  files are written next to --outfile.
+
+  Args:
+    sorted_tfrecord_path: str. TFRecord of sorted CallVariantsOutput protos.
+    contigs: list(ContigInfo). The contigs in sorted order.
+    header: VcfHeader proto. The header of the outputs.
+    sample_name: str. Sample name to write to the outputs.
+    num_workers: int. The number of processes to use.
+
+  Returns:
+    The VcfStatsAccumulator of all the variants written to VCF if
+    --vcf_stats_report is set, and None otherwise.
+  """
+  write_gvcf = bool(FLAGS.nonvariant_site_tfrecord_path)
+  temp_dir = tempfile.mkdtemp(
+      prefix='postprocess_variants.', dir=_temp_dir_parent(FLAGS.outfile))
+  try:
+    cvo_paths, first_keys = _partition_call_variants_outputs(
+        sorted_tfrecord_path,
+        contigs,
+        num_partitions=num_workers * _PARTITIONS_PER_WORKER,
+        split_contigs=not write_gvcf,
+        output_dir=temp_dir)
+    if write_gvcf:
+      nonvariant_paths = _partition_nonvariants(
+          tfrecord.read_shard_sorted_tfrecords(
+              FLAGS.nonvariant_site_tfrecord_path,
+              key=_get_contig_based_variant_sort_keyfn(contigs),
+              proto=variants_pb2.Variant), contigs, first_keys, temp_dir)
+    else:
+      nonvariant_paths = [None] * len(cvo_paths)
+    # The partitions are compressed like the outputs they are concatenated to.
+    vcf_suffix = '.vcf.gz' if FLAGS.outfile.endswith('.gz') else '.vcf'
+    gvcf_suffix = '.g.vcf.gz' if write_gvcf and FLAGS.gvcf_outfile.endswith(
+        '.gz') else '.g.vcf'
+    partitions = []
+    for i, (cvo_path, nonvariant_path) in enumerate(
+        zip(cvo_paths, nonvariant_paths)):
+      base_path = os.path.join(temp_dir, 'partition-{:05d}'.format(i))
+      partitions.append(
+          _Partition(
+              cvo_path=cvo_path,
+              nonvariant_path=nonvariant_path,
+              vcf_path=base_path + vcf_suffix,
+              gvcf_path=base_path + gvcf_suffix if write_gvcf else None))
+    logging.info('Postprocessing %d partitions with %d workers.',
+                 len(partitions), num_workers)
+
+    with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+      partition_stats = pool.map(
+          functools.partial(
+              _postprocess_partition,
+              contigs=contigs,
+              header=header,
+              sample_name=sample_name),
+          partitions,
+          chunksize=1)
+
+    _concatenate_vcf_bodies(header, [p.vcf_path for p in partitions],
+                            FLAGS.outfile, temp_dir)
+    if write_gvcf:
+      _concatenate_vcf_bodies(header, [p.gvcf_path for p in partitions],
+                              FLAGS.gvcf_outfile, temp_dir)
+  finally:
+    shutil.rmtree(temp_dir)
+
+  vcf_stats_accumulator = None
+  for accumulator in partition_stats:
+    if vcf_stats_accumulator is None:
+      vcf_stats_accumulator = accumulator
+    elif accumulator is not None:
+      vcf_stats_accumulator.merge(accumulator)
+  return vcf_stats_accumulator
+
+
 def main(argv=()):
   with errors.clean_commandline_error_exit():
     if len(argv) > 1:
@@ -1045,6 +1504,12 @@ def main(argv=()):
       errors.log_and_raise(
           'gVCF creation requires both nonvariant_site_tfrecord_path and '
           'gvcf_outfile flags to be set.', errors.CommandLineError)
+    if FLAGS.num_workers < 1:
+      errors.log_and_raise('--num_workers must be at least 1.',
+                           errors.CommandLineError)
+    if FLAGS.max_memory_mb < 0:
+      errors.log_and_raise('--max_memory_mb must be non-negative.',
+                           errors.CommandLineError)
 
     proto_utils.uses_fast_cpp_protos_or_die()
 
@@ -1073,10 +1538,13 @@ def main(argv=()):
       sample_name = _extract_single_sample_name(record)
       temp = tempfile.NamedTemporaryFile()
       start_time = time.time()
-      postprocess_variants_lib.process_single_sites_tfrecords(
-          contigs, paths, temp.name)
+      n_spilled_runs = postprocess_variants_lib.process_single_sites_tfrecords(
+          contigs, paths, temp.name, FLAGS.max_memory_mb * 1024 * 1024)
       logging.info('CVO sorting took %s minutes',
                    (time.time() - start_time) / 60)
+      if n_spilled_runs:
+        logging.info('Spilled %d sorted runs to stay within --max_memory_mb=%d.',
+                     n_spilled_runs, FLAGS.max_memory_mb)
 
       logging.info('Transforming call_variants_output to variants.')
       independent_variants = _transform_call_variants_output_to_variants(
@@ -1093,25 +1561,50 @@ def main(argv=()):
         contigs=contigs, sample_names=[sample_name])
     use_csi = _decide_to_use_csi(contigs)
 
+    # The stats of the report are computed on the variants as they are written,
+    # rather than by reading the VCF back.
+    vcf_stats_accumulator = None
+    if FLAGS.vcf_stats_report:
+      vcf_stats_accumulator = vcf_stats.VcfStatsAccumulator(
+          header=header, round_qualities=True)
+
     start_time = time.time()
-    if not FLAGS.nonvariant_site_tfrecord_path:
+    if record is not None and FLAGS.num_workers > 1:
+      logging.info('Writing variants with %d workers.', FLAGS.num_workers)
+      vcf_stats_accumulator = postprocess_in_workers(
+          sorted_tfrecord_path=temp.name,
+          contigs=contigs,
+          header=header,
+          sample_name=sample_name,
+          num_workers=FLAGS.num_workers)
+      for path in (FLAGS.outfile, FLAGS.gvcf_outfile):
+        if path and path.endswith('.gz'):
+          build_index(path, use_csi)
+      logging.info('Finished writing outputs in %s minutes.',
+                   (time.time() - start_time) / 60)
+    elif not FLAGS.nonvariant_site_tfrecord_path:
       logging.info('Writing variants to VCF.')
+      vcf_options = _vcf_writer_options(FLAGS.outfile)
       write_variants_to_vcf(
           variant_iterable=variant_generator,
           output_vcf_path=FLAGS.outfile,
-          header=header)
-      if FLAGS.outfile.endswith('.gz'):
-        build_index(FLAGS.outfile, use_csi)
+          header=header,
+          vcf_stats_accumulator=vcf_stats_accumulator,
+          **vcf_options)
+      _maybe_build_index(FLAGS.outfile, use_csi)
       logging.info('VCF creation took %s minutes',
                    (time.time() - start_time) / 60)
     else:
       logging.info('Merging and writing variants to VCF and gVCF.')
       lessthanfn = _get_contig_based_lessthan(contigs)
+      vcf_options = _vcf_writer_options(FLAGS.outfile)
+      gvcf_options = _vcf_writer_options(FLAGS.gvcf_outfile)
       with vcf.VcfWriter(
-          FLAGS.outfile, header=header, round_qualities=True) as vcf_writer, \
+          FLAGS.outfile, header=header, round_qualities=True,
+          **vcf_options) as vcf_writer, \
           vcf.VcfWriter(
-              FLAGS.gvcf_outfile, header=header, round_qualities=True) \
-          as gvcf_writer:
+              FLAGS.gvcf_outfile, header=header, round_qualities=True,
+              **gvcf_options) as gvcf_writer:
         nonvariant_generator = tfrecord.read_shard_sorted_tfrecords(
             FLAGS.nonvariant_site_tfrecord_path,
             key=_get_contig_based_variant_sort_keyfn(contigs),
@@ -1119,21 +1612,17 @@ def main(argv=()):
         merge_and_write_variants_and_nonvariants(variant_generator,
                                                  nonvariant_generator,
                                                  lessthanfn, fasta_reader,
-                                                 vcf_writer, gvcf_writer)
-      if FLAGS.outfile.endswith('.gz'):
-        build_index(FLAGS.outfile, use_csi)
-      if FLAGS.gvcf_outfile.endswith('.gz'):
-        build_index(FLAGS.gvcf_outfile, use_csi)
+                                                 vcf_writer, gvcf_writer,
+                                                 vcf_stats_accumulator)
+      _maybe_build_index(FLAGS.outfile, use_csi)
+      _maybe_build_index(FLAGS.gvcf_outfile, use_csi)
       logging.info('Finished writing VCF and gVCF in %s minutes.',
                    (time.time() - start_time) / 60)
-    if FLAGS.vcf_stats_report:
-      outfile_base = _get_base_path(FLAGS.outfile)
-      with vcf.VcfReader(FLAGS.outfile) as reader:
-        vcf_stats.create_vcf_report(
-            variants=reader.iterate(),
-            output_basename=outfile_base,
-            sample_name=sample_name,
-            vcf_reader=reader)
+    if vcf_stats_accumulator is not None:
+      vcf_stats.create_vcf_report_from_accumulator(
+          vcf_stats_accumulator,
+          output_basename=_get_base_path(FLAGS.outfile),
+          sample_name=sample_name)
     if record:
       temp.close()
 
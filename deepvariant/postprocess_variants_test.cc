@@ -34,7 +34,9 @@
 #include "third_party/nucleus/protos/reference.pb.h"
 #include "third_party/nucleus/protos/variants.pb.h"
 #include "third_party/nucleus/testing/test_utils.h"
+#include "absl/strings/str_cat.h"
 #include "tensorflow/core/lib/core/stringpiece.h"
+#include "tensorflow/core/platform/env.h"
 
 #include <gmock/gmock-generated-matchers.h>
 #include <gmock/gmock-matchers.h>
@@ -70,9 +72,9 @@ CallVariantsOutput CreateSingleSiteCalls(StringPiece reference_name, int start,
   return single_site_call;
 }
 
-}  // namespace
-
-TEST(ProcessSingleSiteCallTfRecords, BasicCase) {
+// Sorts a fixed set of calls with the given memory limit, checks the sorted
+// output, and returns the number of spilled runs.
+int ProcessBasicCase(StringPiece test_name, uint64 max_memory_bytes) {
   std::vector<nucleus::genomics::v1::ContigInfo> contigs =
       nucleus::CreateContigInfos({"chr1", "chr10"}, {0, 1000});
   std::vector<CallVariantsOutput> single_site_calls;
@@ -81,14 +83,14 @@ TEST(ProcessSingleSiteCallTfRecords, BasicCase) {
   single_site_calls.push_back(CreateSingleSiteCalls("chr1", 1, 2));
   single_site_calls.push_back(CreateSingleSiteCalls("chr10", 2000, 2002, 0.9));
   single_site_calls.push_back(CreateSingleSiteCalls("chr10", 2000, 2002, 0.7));
-  const string& input_tfrecord_path = nucleus::MakeTempFile(
-      "ProessSingleSiteCallTfRecordsBasicCase.in.tfrecord");
-  const string& output_tfrecord_path = nucleus::MakeTempFile(
-      "ProessSingleSiteCallTfRecordsBasicCase.out.tfrecord");
+  const string& input_tfrecord_path =
+      nucleus::MakeTempFile(absl::StrCat(test_name, ".in.tfrecord"));
+  const string& output_tfrecord_path =
+      nucleus::MakeTempFile(absl::StrCat(test_name, ".out.tfrecord"));
   nucleus::WriteProtosToTFRecord(single_site_calls, input_tfrecord_path);
 
-  ProcessSingleSiteCallTfRecords(contigs, {input_tfrecord_path},
-                                 output_tfrecord_path);
+  const int n_runs = ProcessSingleSiteCallTfRecords(
+      contigs, {input_tfrecord_path}, output_tfrecord_path, max_memory_bytes);
   std::vector<CallVariantsOutput> output =
       nucleus::ReadProtosFromTFRecord<CallVariantsOutput>(output_tfrecord_path);
 
@@ -111,6 +113,30 @@ TEST(ProcessSingleSiteCallTfRecords, BasicCase) {
   // Order of calls with the same reference, start, end should be preserved.
   EXPECT_EQ(output[3].variant().quality(), 0.9);
   EXPECT_EQ(output[4].variant().quality(), 0.7);
+  // Spilled runs are deleted once merged.
+  for (int i = 0; i < n_runs; ++i) {
+    EXPECT_FALSE(tensorflow::Env::Default()
+                     ->FileExists(absl::StrCat(output_tfrecord_path, ".run-", i))
+                     .ok());
+  }
+  return n_runs;
+}
+
+}  // namespace
+
+TEST(ProcessSingleSiteCallTfRecords, BasicCase) {
+  EXPECT_EQ(ProcessBasicCase("ProessSingleSiteCallTfRecordsBasicCase", 0), 0);
+}
+
+TEST(ProcessSingleSiteCallTfRecords, FitsInMemoryLimit) {
+  EXPECT_EQ(ProcessBasicCase("ProessSingleSiteCallTfRecordsFitsInMemoryLimit",
+                             1 << 30),
+            0);
+}
+
+TEST(ProcessSingleSiteCallTfRecords, SpillsRunsOverMemoryLimit) {
+  // With a limit of 1 byte every call is spilled to its own run.
+  EXPECT_EQ(ProcessBasicCase("ProessSingleSiteCallTfRecordsSpillsRuns", 1), 5);
 }
 
 }  // namespace deepvariant
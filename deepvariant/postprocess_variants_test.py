@@ -63,12 +63,14 @@ from third_party.nucleus.protos import struct_pb2
 from third_party.nucleus.protos import variants_pb2
 from third_party.nucleus.testing import test_utils
 from third_party.nucleus.util import genomics_math
+from third_party.nucleus.util import ranges
 from third_party.nucleus.util import variant_utils
 from third_party.nucleus.util import vcf_constants
 from deepvariant import dv_constants
 from deepvariant import dv_vcf_constants
 from deepvariant import postprocess_variants
 from deepvariant import testdata
+from deepvariant import vcf_stats
 from deepvariant.protos import deepvariant_pb2
 from deepvariant.testing import flagsaver
 
@@ -104,6 +106,9 @@ class MockVcfWriter(object):
   def write(self, proto):
     self.variants_written.append(copy.deepcopy(proto))
 
+  def write_many(self, protos):
+    self.variants_written.extend(copy.deepcopy(proto) for proto in protos)
+
 
 def _create_variant(ref_name, start, ref_base, alt_bases, qual, filter_field,
                     genotype, gq, likelihoods):
@@ -332,6 +337,194 @@ class PostprocessVariantsTest(parameterized.TestCase):
       self.assertTrue(tf.io.gfile.exists(FLAGS.outfile + '.tbi'))
       self.assertTrue(tf.io.gfile.exists(FLAGS.gvcf_outfile + '.tbi'))
 
+  @parameterized.parameters((compressed_outputs, write_gvcf)
+                            for compressed_outputs in [False, True]
+                            for write_gvcf in [False, True])
+  @flagsaver.FlagSaver
+  def test_call_end2end_with_num_workers(self, compressed_outputs, write_gvcf):
+    FLAGS.infile = make_golden_dataset()
+    FLAGS.ref = testdata.CHR20_FASTA
+    FLAGS.outfile = create_outfile(
+        'calls.num_workers{}.vcf'.format(int(write_gvcf)), compressed_outputs)
+    if write_gvcf:
+      FLAGS.nonvariant_site_tfrecord_path = (
+          testdata.GOLDEN_POSTPROCESS_GVCF_INPUT)
+      FLAGS.gvcf_outfile = create_outfile('gvcf_calls.num_workers.vcf',
+                                          compressed_outputs)
+    FLAGS.num_workers = 3
+    postprocess_variants.main(['postprocess_variants.py'])
+
+    self.assertEqual(
+        _read_contents(FLAGS.outfile, compressed_outputs),
+        _read_contents(testdata.GOLDEN_POSTPROCESS_OUTPUT))
+    if write_gvcf:
+      self.assertEqual(
+          _read_contents(FLAGS.gvcf_outfile, compressed_outputs),
+          _read_contents(testdata.GOLDEN_POSTPROCESS_GVCF_OUTPUT))
+    if compressed_outputs:
+      self.assertTrue(tf.io.gfile.exists(FLAGS.outfile + '.tbi'))
+
+  @parameterized.parameters(
+      dict(split_contigs=True, expected_first_keys=[(0, 0), (0, 10), (1, 0),
+                                                    (1, 2)]),
+      dict(split_contigs=False, expected_first_keys=[(0, 0), (1, 0)]),
+  )
+  def test_partition_call_variants_outputs(self, split_contigs,
+                                           expected_first_keys):
+    contigs = [
+        reference_pb2.ContigInfo(name='chr1', n_bases=100),
+        reference_pb2.ContigInfo(name='chr2', n_bases=100)
+    ]
+    cvos = []
+    for contig, start, end in [('chr1', 0, 5), ('chr1', 3, 4),
+                               ('chr1', 10, 11), ('chr2', 1, 2),
+                               ('chr2', 2, 3)]:
+      cvo = _create_call_variants_output(indices=[0], ref='A' * (end - start),
+                                         alts=['C'])
+      cvo.variant.reference_name = contig
+      cvo.variant.start = start
+      cvo.variant.end = end
+      cvos.append(cvo)
+    sorted_path = test_utils.test_tmpfile(
+        'partition_input{}.tfrecord'.format(int(split_contigs)))
+    tfrecord.write_tfrecords(cvos, sorted_path)
+    output_dir = test_utils.test_tmpfile(
+        'partitions{}'.format(int(split_contigs)))
+    os.makedirs(output_dir)
+
+    # With many more partitions than calls, every allowed split is made.
+    paths, first_keys = postprocess_variants._partition_call_variants_outputs(
+        sorted_path,
+        contigs,
+        num_partitions=100,
+        split_contigs=split_contigs,
+        output_dir=output_dir)
+
+    self.assertEqual(first_keys, expected_first_keys)
+    self.assertEqual([
+        cvo for path in paths for cvo in tfrecord.read_tfrecords(
+            path, proto=deepvariant_pb2.CallVariantsOutput)
+    ], cvos)
+
+  @parameterized.parameters(
+      dict(batch_size=512, expected_batch_sizes=[3]),
+      dict(batch_size=2, expected_batch_sizes=[2, 1]),
+  )
+  def test_transform_batches_multiallelic_model(self, batch_size,
+                                                expected_batch_sizes):
+
+    class FakeMultiallelicModel(object):
+      """Normalizes the first 6 inputs, recording the size of each batch."""
+
+      def __init__(self):
+        self.batch_sizes = []
+
+      def __call__(self, probs):
+        self.batch_sizes.append(len(probs))
+        predictions = probs[:, :6] / probs[:, :6].sum(axis=1, keepdims=True)
+        return mock.Mock(numpy=lambda: predictions)
+
+    def make_site(start, alts, probabilities):
+      variant = _create_variant_with_alleles(ref='A', alts=alts, start=start)
+      variant.reference_name = 'chr20'
+      variant.end = start + 1
+      return [
+          _create_call_variants_output(
+              indices=indices, probabilities=probs, variant=variant)
+          for indices, probs in probabilities
+      ]
+
+    two_alts = [([0], [0.19, 0.75, 0.06]), ([1], [0.03, 0.93, 0.04]),
+                ([0, 1], [0.03, 0.92, 0.05])]
+    sites = [
+        make_site(10, ['C', 'T'], two_alts),
+        make_site(20, ['C'], [([0], [0.1, 0.8, 0.1])]),
+        make_site(30, ['C', 'G'], two_alts),
+        make_site(40, ['C'], [([0], [0.9, 0.05, 0.05])]),
+        make_site(50, ['G', 'T'], two_alts),
+    ]
+    path = test_utils.test_tmpfile(
+        'batched_multiallelic{}.tfrecord'.format(batch_size))
+    tfrecord.write_tfrecords([cvo for site in sites for cvo in site], path)
+
+    model = FakeMultiallelicModel()
+    expected = []
+    for site in sites:
+      canonical_variant, predictions = postprocess_variants.merge_predictions(
+          site, qual_filter=0, multiallelic_model=model)
+      expected.append(
+          postprocess_variants.add_call_to_variant(
+              canonical_variant, predictions, sample_name='sample'))
+    model.batch_sizes = []
+
+    with mock.patch.object(
+        postprocess_variants, 'get_multiallelic_model',
+        return_value=model), mock.patch.object(
+            postprocess_variants, '_MULTIALLELIC_MODEL_BATCH_SIZE',
+            batch_size):
+      variants = list(
+          postprocess_variants._transform_call_variants_output_to_variants(
+              input_sorted_tfrecord_path=path,
+              qual_filter=0,
+              multi_allelic_qual_filter=0,
+              sample_name='sample',
+              group_variants=True,
+              use_multiallelic_model=True))
+
+    self.assertEqual(variants, expected)
+    self.assertEqual(model.batch_sizes, expected_batch_sizes)
+
+  @parameterized.parameters(False, True)
+  def test_concatenate_vcf_bodies(self, compressed):
+    suffix = '.vcf.gz' if compressed else '.vcf'
+    with vcf.VcfReader(testdata.GOLDEN_POSTPROCESS_OUTPUT) as reader:
+      header = reader.header
+      variants = list(reader)
+    temp_dir = os.path.join(absltest.get_default_test_tmpdir(),
+                            'concatenate{}'.format(int(compressed)))
+    tf.io.gfile.makedirs(temp_dir)
+    body_paths = []
+    for i, part in enumerate([variants[:3], [], variants[3:]]):
+      body_paths.append(os.path.join(temp_dir, 'part{}{}'.format(i, suffix)))
+      with vcf.VcfWriter(
+          body_paths[-1], header=header, round_qualities=True,
+          exclude_header=True) as writer:
+        writer.write_many(part)
+    output_path = test_utils.test_tmpfile('concatenated' + suffix)
+    expected_path = test_utils.test_tmpfile('expected' + suffix)
+    with vcf.VcfWriter(
+        expected_path, header=header, round_qualities=True) as writer:
+      writer.write_many(variants)
+
+    postprocess_variants._concatenate_vcf_bodies(header, body_paths,
+                                                 output_path, temp_dir)
+
+    self.assertEqual(
+        _read_contents(output_path, compressed),
+        _read_contents(expected_path, compressed))
+    if compressed:
+      # Only the EOF block of the last part is kept.
+      contents = _read_contents(output_path)
+      self.assertEqual(1, contents.count(postprocess_variants._BGZF_EOF))
+      self.assertTrue(contents.endswith(postprocess_variants._BGZF_EOF))
+
+  @flagsaver.FlagSaver
+  def test_call_end2end_with_max_memory_mb(self):
+    FLAGS.infile = make_golden_dataset()
+    FLAGS.ref = testdata.CHR20_FASTA
+    FLAGS.outfile = create_outfile('calls.max_memory_mb.vcf')
+    FLAGS.max_memory_mb = 1
+    with mock.patch.object(
+        postprocess_variants.postprocess_variants_lib,
+        'process_single_sites_tfrecords',
+        side_effect=postprocess_variants.postprocess_variants_lib
+        .process_single_sites_tfrecords) as mock_sort:
+      postprocess_variants.main(['postprocess_variants.py'])
+    self.assertEqual(mock_sort.call_args[0][3], 1024 * 1024)
+    self.assertEqual(
+        _read_contents(FLAGS.outfile), _read_contents(
+            testdata.GOLDEN_POSTPROCESS_OUTPUT))
+
   @flagsaver.FlagSaver
   def test_group_variants(self):
     FLAGS.infile = testdata.GOLDEN_VCF_CANDIDATE_IMPORTER_POSTPROCESS_INPUT
@@ -364,6 +557,19 @@ class PostprocessVariantsTest(parameterized.TestCase):
       self.assertFalse(tf.io.gfile.exists(vcf_file_gz + '.csi'))
       self.assertTrue(tf.io.gfile.exists(vcf_file_gz + '.tbi'))
 
+  @flagsaver.FlagSaver
+  def test_call_end2end_with_compression_threads(self):
+    FLAGS.infile = make_golden_dataset()
+    FLAGS.ref = testdata.CHR20_FASTA
+    FLAGS.outfile = create_outfile(
+        'calls.threads.vcf', compressed_outputs=True)
+    FLAGS.compression_threads = 2
+    postprocess_variants.main(['postprocess_variants.py'])
+    self.assertEqual(
+        _read_contents(FLAGS.outfile, decompress=True),
+        _read_contents(testdata.GOLDEN_POSTPROCESS_OUTPUT))
+    self.assertTrue(tf.io.gfile.exists(FLAGS.outfile + '.tbi'))
+
   @flagsaver.FlagSaver
   def test_reading_sharded_input_with_empty_shards_does_not_crash(self):
     valid_variants = tfrecord.read_tfrecords(
@@ -1245,17 +1451,16 @@ class MergeVcfAndGvcfTest(parameterized.TestCase):
     self.assertEqual(lessthan(variant1, None), True)
     self.assertEqual(lessthan(None, variant1), False)
 
-  @parameterized.parameters(
-      (_create_nonvariant('1', 10, 15,
-                          'G'), 10, 12, _create_nonvariant('1', 10, 12, 'G')),
-      (_create_nonvariant('2', 1, 9,
-                          'C'), 3, 4, _create_nonvariant('2', 3, 4, 'G')),
-  )
-  def test_create_record_from_template(self, template, start, end, expected):
+  @parameterized.parameters(1, 3, 100)
+  def test_reference_base_cache(self, window_size):
     reader = dummy_reference_reader()
-    actual = postprocess_variants._create_record_from_template(
-        template, start, end, reader)
-    self.assertEqual(actual, expected)
+    cache = postprocess_variants._ReferenceBaseCache(reader, window_size)
+    positions = [('1', 0), ('1', 2), ('1', 3), ('1', 31), ('2', 3), ('2', 3),
+                 ('2', 30), ('2', 1), ('1', 10)]
+    for contig_name, position in positions:
+      self.assertEqual(
+          cache.base(contig_name, position),
+          reader.query(ranges.make_range(contig_name, position, position + 1)))
 
   @parameterized.parameters(
       dict(input_vcf='/tmp/test.vcf', expected_base_path='/tmp/test'),
@@ -1398,14 +1603,18 @@ class MergeVcfAndGvcfTest(parameterized.TestCase):
 
     mock_vcf_writer = MockVcfWriter()
     mock_gvcf_writer = MockVcfWriter()
+    accumulator = vcf_stats.VcfStatsAccumulator()
 
     postprocess_variants.merge_and_write_variants_and_nonvariants(
-        viter, nonviter, lessthan, reader, mock_vcf_writer, mock_gvcf_writer)
+        viter, nonviter, lessthan, reader, mock_vcf_writer, mock_gvcf_writer,
+        accumulator)
 
     vcf_expected = [_simple_variant(*v) for v in variants]
 
     self.assertEqual(mock_vcf_writer.variants_written, vcf_expected)
     self.assertEqual(mock_gvcf_writer.variants_written, expected)
+    self.assertEqual(
+        sum(accumulator.variant_type_counts().values()), len(vcf_expected))
 
   # redacted
   def test_sort_grouped_variants(self):
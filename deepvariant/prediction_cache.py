@@ -0,0 +1,183 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""An on-disk cache of genotype probabilities keyed by pileup image.
+
+call_variants can reuse the probabilities computed for an identical pileup
+image by the same model, e.g. when re-calling overlapping regions or re-running
+after changing only postprocess_variants flags. The cache is a single .npy file
+holding a structured array sorted by key, which is memory mapped for lookups
+and rewritten with the new entries merged in by PredictionCache.save.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+
+import numpy as np
+
+from deepvariant import dv_constants
+
+_KEY_SIZE = 16
+
+_ENTRY_DTYPE = np.dtype([
+    ('key', 'S{}'.format(_KEY_SIZE)),
+    ('probabilities', '<f8', (dv_constants.NUM_CLASSES,)),
+])
+
+
+def model_fingerprint(model_path):
+  """Returns bytes identifying the weights of an exported model.
+
+  Args:
+    model_path: str. A SavedModel directory written by export_model, or a
+      model file such as the .tflite file written by quantize_model.
+
+  Returns:
+    bytes. A digest of the files defining the model. For a SavedModel, these
+    are the graph and the variables index, which holds a checksum of every
+    variable.
+  """
+  if os.path.isdir(model_path):
+    paths = [
+        os.path.join(model_path, 'saved_model.pb'),
+        os.path.join(model_path, 'variables', 'variables.index')
+    ]
+  else:
+    paths = [model_path]
+  digest = hashlib.blake2b(digest_size=_KEY_SIZE)
+  for path in paths:
+    if os.path.exists(path):
+      with open(path, 'rb') as f:
+        digest.update(f.read())
+  return digest.digest()
+
+
+class PredictionCache(object):
+  """Genotype probabilities of previously seen images for one model.
+
+  Attributes:
+    n_lookups: int. The number of images looked up so far.
+    n_hits: int. How many of those were in the cache.
+  """
+
+  def __init__(self, path, fingerprint):
+    """Opens the cache in path, which doesn't need to exist yet.
+
+    Args:
+      path: str. Local path of the cache file.
+      fingerprint: bytes. Identifies the model, as from model_fingerprint.
+        Entries of other models in the same file are never returned.
+    """
+    self._path = path
+    self._fingerprint = fingerprint
+    if os.path.exists(path):
+      self._entries = np.load(path, mmap_mode='r')
+    else:
+      self._entries = np.zeros(0, dtype=_ENTRY_DTYPE)
+    self._new_keys = []
+    self._new_probabilities = []
+    self.n_lookups = 0
+    self.n_hits = 0
+
+  @property
+  def hit_rate(self):
+    return float(self.n_hits) / self.n_lookups if self.n_lookups else 0.0
+
+  def keys(self, images):
+    """Returns the cache key of each of a batch of images.
+
+    Args:
+      images: np.array of uint8 of shape [batch_size, height, width, channels].
+
+    Returns:
+      A list of bytes.
+    """
+    keys = []
+    for image in images:
+      digest = hashlib.blake2b(self._fingerprint, digest_size=_KEY_SIZE)
+      digest.update(image.tobytes())
+      # NumPy strips trailing null bytes from fixed-width bytes, so make sure
+      # the last byte isn't one.
+      keys.append(digest.digest()[:-1] + b'\x01')
+    return keys
+
+  def lookup(self, keys):
+    """Returns the cached probabilities of keys.
+
+    Args:
+      keys: list of bytes, from keys().
+
+    Returns:
+      A tuple (probabilities, hits). probabilities is a np.array of float64 of
+      shape [len(keys), dv_constants.NUM_CLASSES] whose rows for misses are
+      NaN, and hits is a np.array of bools.
+    """
+    probabilities = np.full((len(keys), dv_constants.NUM_CLASSES), np.nan)
+    hits = np.zeros(len(keys), dtype=bool)
+    if len(keys) and len(self._entries):
+      query = np.array(keys, dtype=_ENTRY_DTYPE['key'])
+      indices = np.searchsorted(self._entries['key'], query)
+      in_range = indices < len(self._entries)
+      hits[in_range] = (
+          self._entries['key'][indices[in_range]] == query[in_range])
+      probabilities[hits] = self._entries['probabilities'][indices[hits]]
+    self.n_lookups += len(keys)
+    self.n_hits += int(hits.sum())
+    return probabilities, hits
+
+  def add(self, keys, probabilities):
+    """Adds the probabilities computed for keys, to be written by save()."""
+    self._new_keys.extend(keys)
+    self._new_probabilities.extend(probabilities)
+
+  def save(self):
+    """Writes the cache with all of the added entries merged in.
+
+    The file is replaced atomically, so an interrupted save leaves the
+    previous cache intact.
+    """
+    if not self._new_keys:
+      return
+    new_entries = np.zeros(len(self._new_keys), dtype=_ENTRY_DTYPE)
+    new_entries['key'] = self._new_keys
+    new_entries['probabilities'] = self._new_probabilities
+    entries = np.concatenate([np.asarray(self._entries), new_entries])
+    _, unique_indices = np.unique(entries['key'], return_index=True)
+    entries = entries[unique_indices]
+
+    tmp_path = self._path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.save(f, entries)
+    os.replace(tmp_path, self._path)
+    self._entries = np.load(self._path, mmap_mode='r')
+    self._new_keys = []
+    self._new_probabilities = []
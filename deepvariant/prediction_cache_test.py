@@ -0,0 +1,128 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Tests for deepvariant.prediction_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from absl.testing import absltest
+import numpy as np
+
+from third_party.nucleus.testing import test_utils
+from deepvariant import dv_constants
+from deepvariant import prediction_cache
+
+_IMAGE_SHAPE = (10, 20, 6)
+
+
+def _random_images(n, seed=0):
+  return np.random.RandomState(seed).randint(
+      0, 255, size=(n,) + _IMAGE_SHAPE).astype(np.uint8)
+
+
+def _random_probabilities(n, seed=0):
+  probabilities = np.random.RandomState(seed).rand(n,
+                                                   dv_constants.NUM_CLASSES)
+  return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+class PredictionCacheTest(absltest.TestCase):
+
+  def test_empty_cache_misses(self):
+    cache = prediction_cache.PredictionCache(
+        test_utils.test_tmpfile('empty_cache.npy'), b'model')
+    probabilities, hits = cache.lookup(cache.keys(_random_images(3)))
+    self.assertFalse(hits.any())
+    self.assertTrue(np.isnan(probabilities).all())
+    self.assertEqual(cache.n_lookups, 3)
+    self.assertEqual(cache.hit_rate, 0.0)
+
+  def test_round_trip(self):
+    path = test_utils.test_tmpfile('round_trip_cache.npy')
+    images = _random_images(8)
+    expected = _random_probabilities(8)
+    cache = prediction_cache.PredictionCache(path, b'model')
+    cache.add(cache.keys(images[:5]), expected[:5])
+    cache.save()
+
+    cache = prediction_cache.PredictionCache(path, b'model')
+    probabilities, hits = cache.lookup(cache.keys(images))
+    np.testing.assert_array_equal(hits, [True] * 5 + [False] * 3)
+    np.testing.assert_array_equal(probabilities[:5], expected[:5])
+    self.assertTrue(np.isnan(probabilities[5:]).all())
+    self.assertAlmostEqual(cache.hit_rate, 5 / 8)
+
+  def test_save_merges_and_deduplicates(self):
+    path = test_utils.test_tmpfile('merged_cache.npy')
+    images = _random_images(6)
+    expected = _random_probabilities(6)
+    cache = prediction_cache.PredictionCache(path, b'model')
+    cache.add(cache.keys(images[:4]), expected[:4])
+    cache.save()
+    cache.add(cache.keys(images[2:]), expected[2:])
+    cache.save()
+
+    self.assertLen(np.load(path), 6)
+    self.assertFalse(os.path.exists(path + '.tmp'))
+    probabilities, hits = cache.lookup(cache.keys(images))
+    self.assertTrue(hits.all())
+    np.testing.assert_array_equal(probabilities, expected)
+
+  def test_models_do_not_share_entries(self):
+    path = test_utils.test_tmpfile('two_model_cache.npy')
+    images = _random_images(2)
+    cache = prediction_cache.PredictionCache(path, b'model_a')
+    cache.add(cache.keys(images), _random_probabilities(2))
+    cache.save()
+
+    other_cache = prediction_cache.PredictionCache(path, b'model_b')
+    _, hits = other_cache.lookup(other_cache.keys(images))
+    self.assertFalse(hits.any())
+
+  def test_model_fingerprint(self):
+    model_dir = test_utils.test_tmpfile('fingerprinted_model')
+    os.makedirs(os.path.join(model_dir, 'variables'))
+    for name in ('saved_model.pb', 'variables/variables.index'):
+      with open(os.path.join(model_dir, name), 'wb') as f:
+        f.write(name.encode())
+    fingerprint = prediction_cache.model_fingerprint(model_dir)
+    self.assertEqual(prediction_cache.model_fingerprint(model_dir),
+                     fingerprint)
+
+    with open(os.path.join(model_dir, 'variables/variables.index'), 'wb') as f:
+      f.write(b'retrained')
+    self.assertNotEqual(
+        prediction_cache.model_fingerprint(model_dir), fingerprint)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -68,6 +68,23 @@ class WrapAlleleCounterTest(absltest.TestCase):
     counts = allele_counter.counts()
     self.assertLen(counts, size)
 
+  def test_remove(self):
+    ref = fasta.IndexedFastaReader(testdata.CHR20_FASTA)
+    sam_reader = sam.SamReader(testdata.CHR20_BAM)
+    region = ranges.make_range('chr20', 10000000, 10000100)
+    options = deepvariant_pb2.AlleleCounterOptions(partition_size=100)
+    allele_counter = _allelecounter.AlleleCounter(ref.c_reader, region, options)
+    reads = list(sam_reader.query(region))
+    for read in reads:
+      allele_counter.add(read, 'sample_id')
+    allele_counter.remove(reads[0], 'sample_id')
+
+    expected = _allelecounter.AlleleCounter(ref.c_reader, region, options)
+    for read in reads[1:]:
+      expected.add(read, 'sample_id')
+    self.assertEqual(allele_counter.n_counted_reads(), len(reads) - 1)
+    self.assertEqual(allele_counter.counts(), expected.counts())
+
 
 if __name__ == '__main__':
   absltest.main()
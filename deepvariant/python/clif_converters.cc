@@ -88,6 +88,29 @@ PyObject* Clif_PyObjFrom(std::unique_ptr<ImageRow> img_row,
   return PyArray_Return(res);
 }
 
+bool Clif_PyObjAs(PyObject* py, PileupBuffer* c) {
+  CHECK(c != nullptr);
+  // Initialize numpy C array API if needed.
+  std::call_once(import_array_flag, call_import_array);
+  if (!PyArray_Check(py)) {
+    PyErr_SetString(PyExc_TypeError, "buffer must be a numpy array");
+    return false;
+  }
+  PyArrayObject* array = reinterpret_cast<PyArrayObject*>(py);
+  if (PyArray_NDIM(array) != 3 || PyArray_TYPE(array) != NPY_UINT8 ||
+      !PyArray_IS_C_CONTIGUOUS(array) || !PyArray_ISWRITEABLE(array)) {
+    PyErr_SetString(PyExc_ValueError,
+                    "buffer must be a writable, C-contiguous, 3D uint8 array");
+    return false;
+  }
+  const npy_intp* dims = PyArray_DIMS(array);
+  c->data = reinterpret_cast<unsigned char*>(PyArray_DATA(array));
+  c->height = dims[0];
+  c->width = dims[1];
+  c->num_channels = dims[2];
+  return true;
+}
+
 }  // namespace deepvariant
 }  // namespace genomics
 }  // namespace learning
@@ -42,11 +42,16 @@ namespace genomics {
 namespace deepvariant {
 
 // CLIF use `::learning::genomics::deepvariant::ImageRow` as ImageRow
+// CLIF use `::learning::genomics::deepvariant::PileupBuffer` as PileupBuffer
 
 // Convert an ImageRow to a numpy 3D array (adds a leading dimension 1).
 PyObject* Clif_PyObjFrom(std::unique_ptr<ImageRow> img_row,
                          const ::clif::py::PostConv& pc);
 
+// Wrap a writable, C-contiguous 3D uint8 numpy array as a PileupBuffer. No
+// data is copied; the array must outlive the PileupBuffer.
+bool Clif_PyObjAs(PyObject* py, PileupBuffer* c);
+
 }  // namespace deepvariant
 }  // namespace genomics
 }  // namespace learning
@@ -0,0 +1,136 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+r"""Converts a DeepVariant SavedModel into an int8 model for CPU inference.
+
+The input is a SavedModel written by export_model. The quantized model can be
+passed to call_variants with --quantized_model. If --examples is given, both
+models are run on those examples and their genotype disagreement rate and
+relative speed are logged. Example usage:
+
+quantize_model \
+  --saved_model /tmp/saved_model \
+  --outfile /tmp/model.int8.tflite \
+  --examples held_out.tfrecord.gz
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
+  del sys.modules['google']
+
+
+from absl import flags
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+from third_party.nucleus.io import tfrecord
+from third_party.nucleus.util import errors
+from deepvariant import logging_level
+from deepvariant import saved_model_utils
+from deepvariant import tf_utils
+
+tf.compat.v1.disable_eager_execution()
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'saved_model', None,
+    'Required. Path to the SavedModel written by export_model to quantize.')
+flags.DEFINE_string('outfile', None,
+                    'Required. Path of the quantized .tflite model to write.')
+flags.DEFINE_string(
+    'examples', None,
+    'Optional. Held-out tf.Example protos in TFRecord format, as emitted by '
+    'make_examples, used to compare the quantized model to --saved_model. '
+    'Can be a sharded file spec, such as examples.tfrecord@10.gz.')
+flags.DEFINE_integer(
+    'max_examples', 10000,
+    'The maximum number of --examples to compare the models on.')
+flags.DEFINE_integer('batch_size', 512,
+                     'Number of examples to run through the models at once.')
+
+
+def _image_batches(examples, image_shape, batch_size):
+  """Yields np.arrays of at most batch_size images decoded from examples."""
+  images = []
+  for example in examples:
+    images.append(
+        np.frombuffer(tf_utils.example_encoded_image(example),
+                      dtype=np.uint8).reshape(image_shape))
+    if len(images) == batch_size:
+      yield np.stack(images)
+      images = []
+  if images:
+    yield np.stack(images)
+
+
+def main(argv=()):
+  with errors.clean_commandline_error_exit():
+    if len(argv) > 1:
+      errors.log_and_raise(
+          'Command line parsing failure: quantize_model does not accept '
+          'positional arguments but some are present on the command line: '
+          '"{}".'.format(str(argv)), errors.CommandLineError)
+    del argv  # Unused.
+    if FLAGS.batch_size <= 0 or FLAGS.max_examples <= 0:
+      errors.log_and_raise(
+          '--batch_size and --max_examples must be positive.',
+          errors.CommandLineError)
+
+    logging_level.set_from_flag()
+
+    model_size = saved_model_utils.quantize_saved_model(
+        FLAGS.saved_model, FLAGS.outfile)
+    logging.info('Wrote %d byte quantized model to %s', model_size,
+                 FLAGS.outfile)
+    if not FLAGS.examples:
+      return
+
+    examples = tfrecord.read_tfrecords(
+        FLAGS.examples, max_records=FLAGS.max_examples)
+    reference = saved_model_utils.SavedModelPredictor(FLAGS.saved_model)
+    candidate = saved_model_utils.TFLitePredictor(FLAGS.outfile)
+    with reference, candidate:
+      stats = saved_model_utils.compare_predictors(
+          reference, candidate,
+          _image_batches(examples, reference.image_shape, FLAGS.batch_size))
+    logging.info(
+        'Quantized model disagrees with %s on the most likely genotype of %d '
+        'of %d examples (%.4f%%); inference took %.2fs instead of %.2fs '
+        '(%.2fx speedup).', FLAGS.saved_model, stats.n_disagreements,
+        stats.n_examples, 100 * stats.disagreement_rate,
+        stats.candidate_seconds, stats.reference_seconds, stats.speedup)
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required(['saved_model', 'outfile'])
+  tf.compat.v1.app.run()
@@ -37,6 +37,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import contextlib
 import copy
 import csv
 import os
@@ -58,6 +59,13 @@ from third_party.nucleus.util import utils
 
 _UNSET_WS_INT_FLAG = -1
 
+# Names of the stages of realign_reads recorded by Realigner.stage_timer.
+STAGE_WINDOW_SELECTION = 'realign_window_selection'
+STAGE_DEBRUIJN_GRAPH = 'realign_debruijn_graph'
+STAGE_FAST_PASS_ALIGNER = 'realign_fast_pass_aligner'
+REALIGNER_STAGES = (STAGE_WINDOW_SELECTION, STAGE_DEBRUIJN_GRAPH,
+                    STAGE_FAST_PASS_ALIGNER)
+
 flags.DEFINE_bool('ws_use_window_selector_model', False,
                   'Activate the use of window selector models.')
 flags.DEFINE_string(
@@ -453,18 +461,32 @@ class Realigner(object):
   the read's alignment.
   """
 
-  def __init__(self, config, ref_reader, shared_header=None):
+  def __init__(self, config, ref_reader, shared_header=None,
+               stage_timer=None):
     """Creates a new Realigner.
 
     Args:
       config: realigner_pb2.RealignerOptions protobuf.
       ref_reader: GenomeReferenceFai, indexed reference genome to query bases.
       shared_header: header info from the input bam file
+      stage_timer: Optional resources.StageTimer. If provided, the time spent
+        in window selection, de-Bruijn graph assembly and read alignment by
+        realign_reads is recorded under the stages in REALIGNER_STAGES.
     """
     self.config = config
     self.ref_reader = ref_reader
     self.diagnostic_logger = DiagnosticLogger(self.config.diagnostics)
     self.shared_header = shared_header
+    self.stage_timer = stage_timer
+
+  @contextlib.contextmanager
+  def _time_stage(self, stage):
+    """Records the time spent in the body under stage, if we have a timer."""
+    if self.stage_timer is None:
+      yield
+    else:
+      with self.stage_timer.time(stage):
+        yield
 
   def call_debruijn_graph(self, windows, reads):
     """Helper function to call debruijn_graph module."""
@@ -573,12 +595,13 @@ class Realigner(object):
         ORDER AS BEFORE.
     """
     # Compute the windows where we need to assemble in the region.
-    candidate_windows = window_selector.select_windows(self.config.ws_config,
-                                                       self.ref_reader, reads,
-                                                       region)
+    with self._time_stage(STAGE_WINDOW_SELECTION):
+      candidate_windows = window_selector.select_windows(
+          self.config.ws_config, self.ref_reader, reads, region)
 
     # Assemble each of those regions.
-    candidate_haplotypes = self.call_debruijn_graph(candidate_windows, reads)
+    with self._time_stage(STAGE_DEBRUIJN_GRAPH):
+      candidate_haplotypes = self.call_debruijn_graph(candidate_windows, reads)
     # Create our simple container to store candidate / read mappings.
     assembled_regions = [AssemblyRegion(ch) for ch in candidate_haplotypes]
 
@@ -590,7 +613,8 @@ class Realigner(object):
     # our realigned_reads.
     for assembled_region in assembled_regions:
       if flags.FLAGS.use_fast_pass_aligner:
-        realigned_reads_copy = self.call_fast_pass_aligner(assembled_region)
+        with self._time_stage(STAGE_FAST_PASS_ALIGNER):
+          realigned_reads_copy = self.call_fast_pass_aligner(assembled_region)
       else:
         raise ValueError('--use_fast_pass_aligner is always true. '
                          'The older implementation is deprecated and removed.')
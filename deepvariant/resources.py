@@ -35,12 +35,27 @@ something like:
   with ResourceMonitor() as monitor:
     ... do work ...
     metrics = monitor.metrics()
+
+It also exposes StageTimer and StageTimingHistograms, which break the wall time
+of repeated units of work (e.g., regions) down by named stage:
+
+  timer = StageTimer()
+  histograms = StageTimingHistograms()
+  for region in regions:
+    timer.start_unit()
+    with timer.time('query_reads'):
+      ... do work ...
+    histograms.add(timer.unit_seconds())
+  metrics = histograms.metrics()
 """
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import bisect
+import collections
+import contextlib
 import platform
 import resource
 import time
@@ -128,6 +143,70 @@ class ResourceMonitor(object):
     return self.metrics_pb
 
 
+# Default upper bounds in seconds of the StageTimingHistograms buckets.
+_DEFAULT_STAGE_BUCKET_UPPER_BOUNDS = (0.001, 0.01, 0.1, 1.0, 10.0, 100.0)
+
+
+class StageTimer(object):
+  """Records the wall time spent in named stages of a single unit of work."""
+
+  def __init__(self):
+    self._unit_seconds = collections.OrderedDict()
+
+  def start_unit(self):
+    """Starts a new unit of work, forgetting the times of the previous one."""
+    self._unit_seconds = collections.OrderedDict()
+
+  @contextlib.contextmanager
+  def time(self, stage):
+    """Context manager adding the time spent in its body to stage."""
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.add(stage, time.time() - start)
+
+  def add(self, stage, seconds):
+    """Adds seconds to the time spent in stage by the current unit of work."""
+    self._unit_seconds[stage] = self._unit_seconds.get(stage, 0.0) + seconds
+
+  def unit_seconds(self):
+    """Returns an OrderedDict from stage to seconds for the current unit."""
+    return collections.OrderedDict(self._unit_seconds)
+
+
+class StageTimingHistograms(object):
+  """Accumulates per-unit stage times into StageTimingMetrics protos."""
+
+  def __init__(self, bucket_upper_bounds=_DEFAULT_STAGE_BUCKET_UPPER_BOUNDS):
+    self._bucket_upper_bounds = list(bucket_upper_bounds)
+    self._metrics = collections.OrderedDict()
+
+  def add(self, unit_seconds):
+    """Adds the stage times of one unit of work.
+
+    Args:
+      unit_seconds: dict from stage name to the seconds spent in that stage,
+        as returned by StageTimer.unit_seconds().
+    """
+    for stage, seconds in unit_seconds.items():
+      if stage not in self._metrics:
+        self._metrics[stage] = resources_pb2.StageTimingMetrics(
+            stage=stage,
+            bucket_upper_bounds_seconds=self._bucket_upper_bounds,
+            bucket_counts=[0] * (len(self._bucket_upper_bounds) + 1))
+      metrics = self._metrics[stage]
+      metrics.total_seconds += seconds
+      metrics.count += 1
+      metrics.max_seconds = max(metrics.max_seconds, seconds)
+      metrics.bucket_counts[bisect.bisect_right(self._bucket_upper_bounds,
+                                                seconds)] += 1
+
+  def metrics(self):
+    """Returns a list of StageTimingMetrics, in order of first appearance."""
+    return list(self._metrics.values())
+
+
 # ------------------------------------------------------------------------------
 # Simple functions for getting host_name, cpu count, etc. Isolated here to make
 # them mockable.
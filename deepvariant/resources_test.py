@@ -153,5 +153,42 @@ class ResourcesTest(absltest.TestCase):
         self.assertEqual(monitor.metrics().physical_core_count, 0)
 
 
+class StageTimerTest(absltest.TestCase):
+
+  def test_stage_timer(self):
+    stage_timer = resources.StageTimer()
+    with mock.patch.object(resources.time, 'time', side_effect=[1.0, 3.0]):
+      with stage_timer.time('a'):
+        pass
+    stage_timer.add('b', 0.5)
+    stage_timer.add('a', 1.0)
+    self.assertEqual(list(stage_timer.unit_seconds().items()), [('a', 3.0),
+                                                                ('b', 0.5)])
+    stage_timer.start_unit()
+    self.assertEqual(stage_timer.unit_seconds(), {})
+
+  def test_stage_timer_records_time_on_exception(self):
+    stage_timer = resources.StageTimer()
+    with self.assertRaises(ValueError):
+      with stage_timer.time('a'):
+        raise ValueError()
+    self.assertIn('a', stage_timer.unit_seconds())
+
+  def test_stage_timing_histograms(self):
+    histograms = resources.StageTimingHistograms(bucket_upper_bounds=[1, 10])
+    histograms.add({'a': 0.5, 'b': 20.0})
+    histograms.add({'a': 5.0})
+    histograms.add({'a': 0.25})
+    a, b = histograms.metrics()
+    self.assertEqual(a.stage, 'a')
+    self.assertAlmostEqual(a.total_seconds, 5.75)
+    self.assertEqual(a.count, 3)
+    self.assertEqual(a.max_seconds, 5.0)
+    self.assertEqual(list(a.bucket_upper_bounds_seconds), [1, 10])
+    self.assertEqual(list(a.bucket_counts), [2, 1, 0])
+    self.assertEqual(b.stage, 'b')
+    self.assertEqual(list(b.bucket_counts), [0, 0, 1])
+
+
 if __name__ == '__main__':
   absltest.main()
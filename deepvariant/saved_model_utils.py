@@ -0,0 +1,302 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Exports DeepVariant models as SavedModels and runs inference on them.
+
+The exported graph contains only the inference path of the model with the
+exponential moving average weights already loaded into its variables, so
+call_variants can restore it in a single step and feed it batches of raw
+uint8 pileup images directly, without building an Estimator.
+
+A SavedModel can further be converted into an int8 TensorFlow Lite model for
+faster inference on CPUs; compare_predictors measures how much the reduced
+precision changes the calls.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from deepvariant import dv_constants
+
+# The key of the SavedModel signature used for genotype likelihood inference.
+SIGNATURE_KEY = 'predict_genotype_probabilities'
+# The input and output names of SIGNATURE_KEY.
+IMAGES_KEY = 'images'
+PROBABILITIES_KEY = 'probabilities'
+
+
+def export_saved_model(model,
+                       checkpoint_path,
+                       export_dir,
+                       image_shape,
+                       moving_average_decay=0.9999):
+  """Writes the inference graph of model as a SavedModel to export_dir.
+
+  Args:
+    model: DeepVariantModel. The model architecture stored in checkpoint_path.
+    checkpoint_path: str or None. Path to the checkpoint to export. The
+      exponential moving averages of the trainable variables are exported in
+      place of their raw values, as done by modeling.PredictEMAHook. If None,
+      the variables are left at their initial values, which is only useful
+      for testing.
+    export_dir: str. Directory to write the SavedModel to. Must not exist.
+    image_shape: tuple of three ints. The (height, width, channels) of the
+      pileup images the model will be run on.
+    moving_average_decay: float. The decay used to create the moving averages
+      at training time.
+
+  Returns:
+    The export_dir, as returned by the SavedModel builder.
+  """
+  with tf.Graph().as_default() as graph:
+    images = tf.compat.v1.placeholder(
+        tf.uint8, shape=(None,) + tuple(image_shape), name=IMAGES_KEY)
+    endpoints = model.create(
+        images=model.preprocess_images(images),
+        num_classes=dv_constants.NUM_CLASSES,
+        is_training=False)
+    # The dummy models only emit Predictions; everything else mirrors the
+    # probabilities computed by the model_fn used in Estimator.predict.
+    if 'Logits' in endpoints:
+      probabilities = tf.nn.softmax(endpoints['Logits'])
+    else:
+      probabilities = endpoints['Predictions']
+    probabilities = tf.identity(probabilities, name=PROBABILITIES_KEY)
+
+    with tf.compat.v1.Session(graph=graph) as sess:
+      sess.run(
+          tf.group(tf.compat.v1.global_variables_initializer(),
+                   tf.compat.v1.local_variables_initializer()))
+      if checkpoint_path is not None:
+        ema = tf.train.ExponentialMovingAverage(moving_average_decay)
+        variables_to_restore = ema.variables_to_restore()
+        if variables_to_restore:
+          tf.compat.v1.train.Saver(variables_to_restore).restore(
+              sess, checkpoint_path)
+
+      signature = tf.compat.v1.saved_model.predict_signature_def(
+          inputs={IMAGES_KEY: images},
+          outputs={PROBABILITIES_KEY: probabilities})
+      builder = tf.compat.v1.saved_model.Builder(export_dir)
+      builder.add_meta_graph_and_variables(
+          sess, [tf.compat.v1.saved_model.tag_constants.SERVING],
+          signature_def_map={SIGNATURE_KEY: signature},
+          strip_default_attrs=True)
+      return builder.save()
+
+
+class SavedModelPredictor(object):
+  """Computes genotype probabilities with a SavedModel from export_saved_model.
+
+  The model is loaded into its own graph and session once, and each call to
+  predict() is a single session.run over a whole batch of images.
+  """
+
+  def __init__(self, export_dir, session_config=None):
+    """Loads the SavedModel in export_dir.
+
+    Args:
+      export_dir: str. Directory written by export_saved_model.
+      session_config: tf.compat.v1.ConfigProto or None. Configuration of the
+        session running the model, e.g. its intra- and inter-op thread counts.
+
+    Raises:
+      ValueError: if the SavedModel doesn't have the expected signature.
+    """
+    self._graph = tf.Graph()
+    self._session = tf.compat.v1.Session(
+        graph=self._graph, config=session_config)
+    meta_graph = tf.compat.v1.saved_model.loader.load(
+        self._session, [tf.compat.v1.saved_model.tag_constants.SERVING],
+        export_dir)
+    if SIGNATURE_KEY not in meta_graph.signature_def:
+      self.close()
+      raise ValueError('SavedModel in {} has no {} signature; was it written '
+                       'by export_model?'.format(export_dir, SIGNATURE_KEY))
+    signature = meta_graph.signature_def[SIGNATURE_KEY]
+    self._images = self._graph.get_tensor_by_name(
+        signature.inputs[IMAGES_KEY].name)
+    self._probabilities = self._graph.get_tensor_by_name(
+        signature.outputs[PROBABILITIES_KEY].name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    self._session.close()
+
+  @property
+  def image_shape(self):
+    """The (height, width, channels) of the images the model was exported for.
+    """
+    return tuple(self._images.shape.as_list()[1:])
+
+  def predict(self, images):
+    """Returns the genotype probabilities of a batch of images.
+
+    Args:
+      images: np.array of uint8 with shape [batch_size] + image_shape.
+
+    Returns:
+      np.array of floats with shape [batch_size, dv_constants.NUM_CLASSES].
+    """
+    return self._session.run(self._probabilities, {self._images: images})
+
+
+def quantize_saved_model(export_dir, output_path):
+  """Converts a SavedModel from export_saved_model into an int8 TFLite model.
+
+  The weights are stored as int8 and the convolutions run with int8 kernels,
+  quantizing the activations dynamically, so no calibration data is needed.
+
+  Args:
+    export_dir: str. Directory written by export_saved_model.
+    output_path: str. Path of the .tflite file to write.
+
+  Returns:
+    The size in bytes of the quantized model.
+  """
+  converter = tf.compat.v1.lite.TFLiteConverter.from_saved_model(
+      export_dir, signature_key=SIGNATURE_KEY)
+  converter.optimizations = [tf.lite.Optimize.DEFAULT]
+  tflite_model = converter.convert()
+  with tf.io.gfile.GFile(output_path, 'wb') as f:
+    f.write(tflite_model)
+  return len(tflite_model)
+
+
+class TFLitePredictor(object):
+  """Computes genotype probabilities with a model from quantize_saved_model.
+
+  This has the same interface as SavedModelPredictor.
+  """
+
+  def __init__(self, model_path):
+    """Loads the TFLite model in model_path.
+
+    Args:
+      model_path: str. Path to a .tflite file written by quantize_saved_model.
+    """
+    self._interpreter = tf.lite.Interpreter(model_path=model_path)
+    self._input = self._interpreter.get_input_details()[0]
+    self._output = self._interpreter.get_output_details()[0]
+    self._batch_size = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    self._interpreter = None
+
+  @property
+  def image_shape(self):
+    """The (height, width, channels) of the images the model was exported for.
+    """
+    return tuple(int(d) for d in self._input['shape'][1:])
+
+  def predict(self, images):
+    """Returns the genotype probabilities of a batch of images.
+
+    Args:
+      images: np.array of uint8 with shape [batch_size] + image_shape.
+
+    Returns:
+      np.array of floats with shape [batch_size, dv_constants.NUM_CLASSES].
+    """
+    # The interpreter only reallocates its buffers when the batch size
+    # changes, which in call_variants only happens for the last batch.
+    if len(images) != self._batch_size:
+      self._interpreter.resize_tensor_input(self._input['index'],
+                                            (len(images),) + self.image_shape)
+      self._interpreter.allocate_tensors()
+      self._batch_size = len(images)
+    self._interpreter.set_tensor(self._input['index'], images)
+    self._interpreter.invoke()
+    return self._interpreter.get_tensor(self._output['index'])
+
+
+# The result of compare_predictors.
+ConcordanceStats = collections.namedtuple('ConcordanceStats', [
+    'n_examples', 'n_disagreements', 'disagreement_rate', 'reference_seconds',
+    'candidate_seconds', 'speedup'
+])
+
+
+def compare_predictors(reference, candidate, image_batches):
+  """Measures the concordance and relative speed of two predictors.
+
+  Args:
+    reference: A predictor, usually a full precision SavedModelPredictor.
+    candidate: A predictor, usually a reduced precision TFLitePredictor.
+    image_batches: iterable of np.array of uint8 images, each of shape
+      [batch_size] + image_shape.
+
+  Returns:
+    ConcordanceStats. A disagreement is an example whose most likely genotype
+    differs between the two predictors. reference_seconds and
+    candidate_seconds are the total inference times of each predictor, and
+    speedup is their ratio.
+  """
+  n_examples, n_disagreements = 0, 0
+  reference_seconds, candidate_seconds = 0.0, 0.0
+  for images in image_batches:
+    start = time.time()
+    reference_probabilities = reference.predict(images)
+    reference_seconds += time.time() - start
+    start = time.time()
+    candidate_probabilities = candidate.predict(images)
+    candidate_seconds += time.time() - start
+
+    n_examples += len(images)
+    n_disagreements += int(
+        np.sum(
+            np.argmax(reference_probabilities, axis=1) != np.argmax(
+                candidate_probabilities, axis=1)))
+
+  return ConcordanceStats(
+      n_examples=n_examples,
+      n_disagreements=n_disagreements,
+      disagreement_rate=(float(n_disagreements) /
+                         n_examples if n_examples else 0.0),
+      reference_seconds=reference_seconds,
+      candidate_seconds=candidate_seconds,
+      speedup=(reference_seconds /
+               candidate_seconds if candidate_seconds else 0.0))
@@ -0,0 +1,170 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Tests for deepvariant.saved_model_utils."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
+  del sys.modules['google']
+
+
+from absl.testing import absltest
+import numpy as np
+import six
+import tensorflow as tf
+
+from third_party.nucleus.testing import test_utils
+from deepvariant import dv_constants
+from deepvariant import modeling
+from deepvariant import saved_model_utils
+
+tf.compat.v1.disable_eager_execution()
+
+_IMAGE_SHAPE = (100, 221, 6)
+
+
+def _random_images(n, seed=0):
+  return np.random.RandomState(seed).randint(
+      0, 255, size=(n,) + _IMAGE_SHAPE).astype(np.uint8)
+
+
+class SavedModelUtilsTest(absltest.TestCase):
+
+  def test_constant_model_round_trip(self):
+    export_dir = test_utils.test_tmpfile('constant')
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model('constant'),
+        checkpoint_path=None,
+        export_dir=export_dir,
+        image_shape=_IMAGE_SHAPE)
+
+    with saved_model_utils.SavedModelPredictor(export_dir) as predictor:
+      self.assertEqual(predictor.image_shape, _IMAGE_SHAPE)
+      probabilities = predictor.predict(_random_images(3))
+    np.testing.assert_array_equal(probabilities, [[0.0, 1.0, 0.0]] * 3)
+
+  def test_restores_moving_averages(self):
+    model = modeling.get_model('inception_v3')
+    images = _random_images(2)
+    checkpoint_path = test_utils.test_tmpfile('inception_v3/model.ckpt')
+
+    # Write a checkpoint whose moving averages differ from the raw weights,
+    # and compute the probabilities the moving averages should produce.
+    with tf.Graph().as_default():
+      images_placeholder = tf.compat.v1.placeholder(
+          tf.uint8, shape=(None,) + _IMAGE_SHAPE)
+      endpoints = model.create(
+          images=model.preprocess_images(images_placeholder),
+          num_classes=dv_constants.NUM_CLASSES,
+          is_training=False)
+      probabilities = tf.nn.softmax(endpoints['Logits'])
+      ema = tf.train.ExponentialMovingAverage(0.9)
+      trainable_variables = tf.compat.v1.trainable_variables()
+      ema_op = ema.apply(trainable_variables)
+      with tf.compat.v1.Session() as sess:
+        sess.run(tf.compat.v1.global_variables_initializer())
+        sess.run(ema_op)
+        expected = sess.run(probabilities, {images_placeholder: images})
+        # Perturb the raw weights; the export must not pick them up.
+        sess.run([v.assign(v * 2.0) for v in trainable_variables])
+        tf.compat.v1.train.Saver().save(sess, checkpoint_path)
+
+    export_dir = test_utils.test_tmpfile('inception_v3/saved_model')
+    saved_model_utils.export_saved_model(
+        model=model,
+        checkpoint_path=checkpoint_path,
+        export_dir=export_dir,
+        image_shape=_IMAGE_SHAPE,
+        moving_average_decay=0.9)
+
+    with saved_model_utils.SavedModelPredictor(export_dir) as predictor:
+      actual = predictor.predict(images)
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+  def test_quantized_model_round_trip(self):
+    export_dir = test_utils.test_tmpfile('constant_to_quantize')
+    saved_model_utils.export_saved_model(
+        model=modeling.get_model('constant'),
+        checkpoint_path=None,
+        export_dir=export_dir,
+        image_shape=_IMAGE_SHAPE)
+    model_path = test_utils.test_tmpfile('constant.tflite')
+    self.assertGreater(
+        saved_model_utils.quantize_saved_model(export_dir, model_path), 0)
+
+    with saved_model_utils.TFLitePredictor(model_path) as predictor:
+      self.assertEqual(predictor.image_shape, _IMAGE_SHAPE)
+      # Changing the batch size between calls resizes the interpreter.
+      for batch_size in [3, 3, 1]:
+        np.testing.assert_allclose(
+            predictor.predict(_random_images(batch_size)),
+            [[0.0, 1.0, 0.0]] * batch_size)
+
+  def test_compare_predictors(self):
+
+    class FixedPredictor(object):
+
+      def __init__(self, genotypes):
+        self.genotypes = iter(genotypes)
+
+      def predict(self, images):
+        return np.eye(dv_constants.NUM_CLASSES)[[
+            next(self.genotypes) for _ in images
+        ]]
+
+    stats = saved_model_utils.compare_predictors(
+        FixedPredictor([0, 1, 2, 1, 1]), FixedPredictor([0, 1, 1, 1, 2]),
+        [_random_images(3), _random_images(2)])
+    self.assertEqual(stats.n_examples, 5)
+    self.assertEqual(stats.n_disagreements, 2)
+    self.assertAlmostEqual(stats.disagreement_rate, 0.4)
+
+  def test_compare_predictors_without_examples(self):
+    stats = saved_model_utils.compare_predictors(None, None, [])
+    self.assertEqual(stats.n_examples, 0)
+    self.assertEqual(stats.disagreement_rate, 0.0)
+    self.assertEqual(stats.speedup, 0.0)
+
+  def test_rejects_saved_model_without_signature(self):
+    export_dir = test_utils.test_tmpfile('no_signature')
+    with tf.Graph().as_default():
+      tf.constant(1.0)
+      with tf.compat.v1.Session() as sess:
+        builder = tf.compat.v1.saved_model.Builder(export_dir)
+        builder.add_meta_graph_and_variables(
+            sess, [tf.compat.v1.saved_model.tag_constants.SERVING])
+        builder.save()
+    with six.assertRaisesRegex(self, ValueError, 'has no'):
+      saved_model_utils.SavedModelPredictor(export_dir)
+
+
+if __name__ == '__main__':
+  absltest.main()
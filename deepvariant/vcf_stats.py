@@ -26,14 +26,18 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
-r"""Library to produce variant statistics from a VCF file."""
+r"""Library to produce variant statistics from a VCF file.
+
+The statistics are accumulated one variant at a time by VcfStatsAccumulator, in
+memory independent of the number of variants, so they can be computed while the
+variants are written as well as from an existing VCF.
+"""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
 import collections
-import itertools
 import math
 import numpy as np
 
@@ -59,6 +63,17 @@ MULTIALLELIC_DELETION = 'Multiallelic_Deletion'
 MULTIALLELIC_COMPLEX = 'Multiallelic_Complex'
 REFCALL = 'RefCall'
 
+# The genotypes that always have a VAF histogram in the report, empty if no
+# variant has them.
+_REQUIRED_VAF_GENOTYPES = ['[0, 0]', '[0, 1]', '[1, 1]', '[-1, -1]', '[1, 2]']
+
+# The number of bins in the VAF histograms of the report.
+_VAF_NUMBER_OF_BINS = 50
+
+# The number of VAFs buffered per genotype before they are added to its
+# histogram.
+_VAF_BUFFER_SIZE = 4096
+
 
 def _get_variant_type(variant):
   """Returns the type of variant as a string."""
@@ -136,13 +151,6 @@ def _get_variant_stats(variant, vaf_available=False, vcf_reader=None):
       qual=variant.quality)
 
 
-def _single_variant_stats(variants, vaf_available=False, vcf_reader=None):
-  return [
-      _get_variant_stats(v, vaf_available=vaf_available, vcf_reader=vcf_reader)
-      for v in variants
-  ]
-
-
 def _format_histogram_for_vega(counts, bins):
   """Format histogram counts and bins for vega.
 
@@ -171,159 +179,215 @@ def _fraction_histogram(values, number_of_bins=10):
   return _format_histogram_for_vega(counts, bins)
 
 
-def _vaf_histograms_by_genotype(single_stats, number_of_bins=10):
-  """Computes histograms of allele frequency for each genotype.
-
-  Args:
-    single_stats: list of VariantStats objects.
-    number_of_bins: integer, number of bins in allele frequency histogram.
-
-  Returns:
-    A dictionary keyed by genotype where each value is a list of bins.
-  """
-
-  # Group by genotype
-  sorted_by_genotype = sorted(single_stats, key=lambda x: x.genotype)
-  grouped_by_genotype = itertools.groupby(sorted_by_genotype,
-                                          lambda x: x.genotype)
-  # Fill in empty placeholders for genotypes to populate all five charts
-  stats_by_genotype = {}
-  required_genotypes = ['[0, 0]', '[0, 1]', '[1, 1]', '[-1, -1]', '[1, 2]']
-  for genotype in required_genotypes:
-    # Create a few placeholder bins
-    stats_by_genotype[genotype] = _fraction_histogram([], 2)
-  # Count vafs from variants (replacing placeholders)
-  for genotype, group in grouped_by_genotype:
-    # Get VAF for each variant where it is defined
-    vafs = [x.vaf for x in group if x.vaf is not None]
-    stats_by_genotype[genotype] = _fraction_histogram(vafs, number_of_bins)
-
-  return stats_by_genotype
+def _format_integer_counts(counts):
+  """Returns [[num, count], ...] for the non-zero counts, sorted by num."""
+  return [[num, count] for num, count in sorted(counts.items()) if count > 0]
 
 
-def _count_base_changes_and_indel_sizes(single_stats):
-  """Count each base change, such as A->G or C->T, and count the number of indels of each size.
-
-  Args:
-    single_stats: list of VariantStats objects.
+class VcfStatsAccumulator(object):
+  """Accumulates the statistics of the VCF report one variant at a time.
 
-  Returns:
-    base_changes: {(ref, alt): count, ...}
-    indel_sizes: {size: count, ...}
+  Only counts and fixed-size histograms are kept, so the memory used doesn't
+  grow with the number of variants. Accumulators of disjoint sets of variants
+  can be combined with merge.
   """
-  base_changes = collections.defaultdict(int)
-  indel_sizes = collections.defaultdict(int)
-  for v in single_stats:
-    ref = v.reference_bases
-    alts = v.alternate_bases
+
+  def __init__(self, header=None, round_qualities=False,
+               vaf_number_of_bins=_VAF_NUMBER_OF_BINS):
+    """Initializer.
+
+    Args:
+      header: VcfHeader proto or None. The header of the variants. VAF
+        histograms are only computed if it has a VAF format field.
+      round_qualities: bool. If True, QUAL is rounded to one digit past the
+        decimal point, as VcfWriter does with round_qualities.
+      vaf_number_of_bins: int. The number of bins in each VAF histogram.
+    """
+    self.vaf_available = header is not None and 'VAF' in [
+        f.id for f in header.formats
+    ]
+    self._round_qualities = round_qualities
+    self._vaf_number_of_bins = vaf_number_of_bins
+    self._titv_counts = {'Transition': 0, 'Transversion': 0}
+    self._variant_type_counts = collections.defaultdict(int)
+    self._base_changes = collections.defaultdict(int)
+    self._indel_sizes = collections.defaultdict(int)
+    # The VAF histogram counts, and VAFs not yet counted, of each genotype.
+    self._vaf_counts = collections.OrderedDict()
+    self._pending_vafs = collections.defaultdict(list)
+    self._qual_counts = collections.defaultdict(int)
+    self._gq_counts = collections.defaultdict(int)
+    self._depth_counts = collections.defaultdict(int)
+
+  def add(self, variant, vcf_object=None):
+    """Adds the statistics of variant.
+
+    Args:
+      variant: Variant proto.
+      vcf_object: VcfReader or VcfWriter of variant, used to get its VAF.
+    """
+    stats = _get_variant_stats(
+        variant, vaf_available=self.vaf_available, vcf_reader=vcf_object)
+    if self._round_qualities:
+      stats = stats._replace(qual=math.floor(stats.qual * 10 + 0.5) / 10)
+    self._add_titv(stats)
+    self._add_variant_type(stats)
+    self._add_base_change_or_indel_size(stats)
+    self._add_vaf(stats)
+    self._add_qual(stats)
+    self._add_gq(stats)
+    self._add_depth(stats)
+
+  def merge(self, other):
+    """Adds the statistics accumulated by other, another VcfStatsAccumulator."""
+    other_counters = other._counters()  # pylint: disable=protected-access
+    for counts, other_counts in zip(self._counters(), other_counters):
+      for key, count in other_counts.items():
+        # The VAF histogram counts are numpy arrays, which this adds up without
+        # modifying those of other.
+        counts[key] = counts.get(key, 0) + count
+
+  def _counters(self):
+    """Returns the dicts of counts accumulated so far, in a fixed order.
+
+    The buffered VAFs are added to their histograms first.
+    """
+    self._flush_vafs()
+    return [
+        self._titv_counts, self._variant_type_counts, self._base_changes,
+        self._indel_sizes, self._vaf_counts, self._qual_counts,
+        self._gq_counts, self._depth_counts
+    ]
+
+  def _add_titv(self, stats):
+    self._titv_counts['Transition'] += stats.is_transition
+    self._titv_counts['Transversion'] += stats.is_transversion
+
+  def _add_variant_type(self, stats):
+    self._variant_type_counts[stats.variant_type] += 1
+
+  def _add_base_change_or_indel_size(self, stats):
+    ref = stats.reference_bases
+    alts = stats.alternate_bases
     # RefCalls are ignored
-    if v.is_variant:
+    if stats.is_variant:
       # Multiallelic variants ignored here because they have different indel
       # sizes and/or base changes
-      if v.variant_type == BIALLELIC_SNP:
+      if stats.variant_type == BIALLELIC_SNP:
         # SNV: get base change
-        base_changes[(ref, alts[0])] += 1
-      elif v.variant_type in [BIALLELIC_INSERTION, BIALLELIC_DELETION]:
+        self._base_changes[(ref, alts[0])] += 1
+      elif stats.variant_type in [BIALLELIC_INSERTION, BIALLELIC_DELETION]:
         # indel: get size
         # + = insertion
         # - = deletion
         size = len(alts[0]) - len(ref)
-        indel_sizes[size] += 1
-
-  base_changes_for_json = []
-  for key in base_changes:
-    ref, alt = key
-    base_changes_for_json.append([ref, alt, base_changes[key]])
-
-  indel_sizes_for_json = []
-  for key in indel_sizes:
-    indel_sizes_for_json.append([int(key), indel_sizes[key]])
+        self._indel_sizes[size] += 1
 
-  return base_changes_for_json, indel_sizes_for_json
+  def _add_vaf(self, stats):
+    if stats.genotype not in self._vaf_counts:
+      self._vaf_counts[stats.genotype] = np.zeros(
+          self._vaf_number_of_bins, dtype=np.int64)
+    # Get VAF for each variant where it is defined
+    if stats.vaf is not None:
+      pending = self._pending_vafs[stats.genotype]
+      pending.append(stats.vaf)
+      if len(pending) >= _VAF_BUFFER_SIZE:
+        self._flush_vafs()
+
+  def _flush_vafs(self):
+    """Adds the buffered VAFs to the histograms of their genotypes."""
+    for genotype, vafs in self._pending_vafs.items():
+      counts, _ = np.histogram(
+          vafs, bins=self._vaf_number_of_bins, range=(0, 1))
+      self._vaf_counts[genotype] += counts
+    self._pending_vafs.clear()
+
+  def _add_qual(self, stats):
+    # Every histogram bin spans one integer, so only the count of each bin is
+    # kept.
+    self._qual_counts[_round_down(round(stats.qual, 4))] += 1
+
+  def _add_gq(self, stats):
+    if not isinstance(stats.genotype_quality, list):
+      self._gq_counts[stats.genotype_quality] += 1
+
+  def _add_depth(self, stats):
+    if not isinstance(stats.depth, list):
+      self._depth_counts[stats.depth] += 1
+
+  def titv_counts(self):
+    return dict(self._titv_counts)
+
+  def variant_type_counts(self):
+    return collections.defaultdict(int, self._variant_type_counts)
+
+  def base_changes_and_indel_sizes(self):
+    """Returns the counts of each base change and of each indel size.
+
+    The counts are sorted so they don't depend on the order in which the
+    variants were added or merged.
+
+    Returns:
+      base_changes: [[ref, alt, count], ...]
+      indel_sizes: [[size, count], ...]
+    """
+    base_changes_for_json = []
+    for key in sorted(self._base_changes):
+      ref, alt = key
+      base_changes_for_json.append([ref, alt, self._base_changes[key]])
+
+    indel_sizes_for_json = []
+    for key in sorted(self._indel_sizes):
+      indel_sizes_for_json.append([int(key), self._indel_sizes[key]])
+
+    return base_changes_for_json, indel_sizes_for_json
+
+  def vaf_histograms_by_genotype(self):
+    """Returns a dictionary keyed by genotype of lists of VAF bins."""
+    self._flush_vafs()
+    # Fill in empty placeholders for genotypes to populate all five charts
+    stats_by_genotype = {}
+    for genotype in _REQUIRED_VAF_GENOTYPES:
+      # Create a few placeholder bins
+      stats_by_genotype[genotype] = _fraction_histogram([], 2)
+    bins = np.linspace(0, 1, self._vaf_number_of_bins + 1)
+    for genotype, counts in self._vaf_counts.items():
+      stats_by_genotype[genotype] = _format_histogram_for_vega(counts, bins)
+    return stats_by_genotype
+
+  def qual_histogram(self):
+    """Returns the non-empty bins of the histogram of QUAL."""
+    return [{
+        's': float(qual),
+        'e': float(qual + 1),
+        'c': count
+    } for qual, count in sorted(self._qual_counts.items())]
+
+  def gq_histogram(self):
+    return _format_integer_counts(self._gq_counts)
+
+  def depth_histogram(self):
+    return _format_integer_counts(self._depth_counts)
+
+  def vis_data(self):
+    """Returns a dict with the summarized data prepared for charts."""
+    base_changes, indel_sizes = self.base_changes_and_indel_sizes()
+    return {
+        'vaf_histograms_by_genotype': self.vaf_histograms_by_genotype(),
+        'indel_sizes': indel_sizes,
+        'base_changes': base_changes,
+        'qual_histogram': self.qual_histogram(),
+        'gq_histogram': self.gq_histogram(),
+        'variant_type_counts': self.variant_type_counts(),
+        'depth_histogram': self.depth_histogram(),
+        'titv_counts': self.titv_counts()
+    }
 
 
 def _round_down(num):
   return int(math.floor(num))
 
 
-def _round_up(num):
-  return int(math.ceil(num))
-
-
-def _compute_qual_histogram(single_var_stats):
-  """Compute a histogram over variant quality (QUAL column in VCF).
-
-  Args:
-    single_var_stats: list of VariantStats objects.
-
-  Returns:
-    histogram of variant quality scores.
-  """
-  quals = [round(v.qual, 4) for v in single_var_stats]
-
-  if quals:
-    bin_range = (_round_down(min(quals)), _round_up(max(quals) + 1))
-    counts, bins = np.histogram(
-        quals, range=bin_range, bins=bin_range[1] - bin_range[0])
-    hist = _format_histogram_for_vega(counts, bins)
-    return [x for x in hist if x['c'] > 0]
-  else:
-    return []
-
-
-def _get_integer_counts(nums):
-  """Turn a list of integers into a list of counts of those integers.
-
-  Args:
-    nums: a list of numbers (e.g. [1,2,2,4])
-
-  Returns:
-    a list of [num, count] (e.g. [[1,1],[2,2],[4,1]]) for all integers with
-    non-zero counts
-  """
-  bin_counts = np.bincount(nums)
-  non_zero_counts = [[i, x] for i, x in enumerate(bin_counts) if x > 0]
-  return non_zero_counts
-
-
-def _compute_gq_histogram(single_var_stats):
-  """Compute a histogram over genotype quality (GQ sub-column under FORMAT in VCF).
-
-  Args:
-    single_var_stats: list of VariantStats objects.
-
-  Returns:
-    histogram of genotype quality scores.
-  """
-  quals = [
-      v.genotype_quality
-      for v in single_var_stats
-      if not isinstance(v.genotype_quality, list)
-  ]
-  return _get_integer_counts(quals)
-
-
-def _compute_depth_histogram(single_var_stats):
-  """Compute a histogram on the depth, with larger bins as depth increases."""
-  depths = [v.depth for v in single_var_stats if not isinstance(v.depth, list)]
-  return _get_integer_counts(depths)
-
-
-def _count_variant_types(single_stats):
-  count_all_variant_types = collections.defaultdict(int)
-  for v in single_stats:
-    count_all_variant_types[v.variant_type] += 1
-
-  return count_all_variant_types
-
-
-def _count_titv(single_stats):
-  titv_counts = {'Transition': 0, 'Transversion': 0}
-  titv_counts['Transition'] = sum([v.is_transition for v in single_stats])
-  titv_counts['Transversion'] = sum([v.is_transversion for v in single_stats])
-  return titv_counts
-
-
 def _compute_variant_stats_for_charts(variants, vcf_reader=None):
   """Computes variant statistics of each variant.
 
@@ -334,38 +398,11 @@ def _compute_variant_stats_for_charts(variants, vcf_reader=None):
   Returns:
     A dict with summarized data prepared for charts.
   """
-  vaf_available = False
-  if vcf_reader:
-    vcf_columns = [col.id for col in vcf_reader.header.formats]
-    vaf_available = 'VAF' in vcf_columns
-
-  single_var_stats = _single_variant_stats(
-      variants, vaf_available=vaf_available, vcf_reader=vcf_reader)
-
-  titv_counts = _count_titv(single_var_stats)
-  variant_type_counts = _count_variant_types(single_var_stats)
-
-  base_changes, indel_sizes = _count_base_changes_and_indel_sizes(
-      single_var_stats)
-
-  histograms = _vaf_histograms_by_genotype(single_var_stats, number_of_bins=50)
-
-  qual_histogram = _compute_qual_histogram(single_var_stats)
-  gq_hist = _compute_gq_histogram(single_var_stats)
-  depth_histogram = _compute_depth_histogram(single_var_stats)
-
-  vis_data = {
-      'vaf_histograms_by_genotype': histograms,
-      'indel_sizes': indel_sizes,
-      'base_changes': base_changes,
-      'qual_histogram': qual_histogram,
-      'gq_histogram': gq_hist,
-      'variant_type_counts': variant_type_counts,
-      'depth_histogram': depth_histogram,
-      'titv_counts': titv_counts
-  }
-
-  return vis_data
+  accumulator = VcfStatsAccumulator(
+      header=vcf_reader.header if vcf_reader else None)
+  for variant in variants:
+    accumulator.add(variant, vcf_reader)
+  return accumulator.vis_data()
 
 
 def create_vcf_report(variants, output_basename, sample_name, vcf_reader=None):
@@ -373,3 +410,10 @@ def create_vcf_report(variants, output_basename, sample_name, vcf_reader=None):
   vis_data = _compute_variant_stats_for_charts(variants, vcf_reader=vcf_reader)
 
   vcf_stats_vis.create_visual_report(output_basename, vis_data, sample_name)
+
+
+def create_vcf_report_from_accumulator(accumulator, output_basename,
+                                       sample_name):
+  """Creates a visual report of the stats of a VcfStatsAccumulator."""
+  vcf_stats_vis.create_visual_report(output_basename, accumulator.vis_data(),
+                                     sample_name)
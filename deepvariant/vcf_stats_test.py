@@ -36,9 +36,9 @@ if 'google' in sys.modules and 'google.protobuf' not in sys.modules:
   del sys.modules['google']
 
 
-import collections
 import json
 import os
+import pickle
 import tempfile
 
 from absl.testing import absltest
@@ -58,6 +58,14 @@ def setUpModule():
   testdata.init()
 
 
+def _accumulate(variants):
+  """Returns a VcfStatsAccumulator to which variants were added."""
+  accumulator = vcf_stats.VcfStatsAccumulator()
+  for variant in variants:
+    accumulator.add(variant)
+  return accumulator
+
+
 class VcfStatsTest(parameterized.TestCase):
 
   def setUp(self):
@@ -217,19 +225,51 @@ class VcfStatsTest(parameterized.TestCase):
         expected_keys,
         msg='vis_data does not have the right keys')
 
+  def test_accumulator_merge(self):
+    with vcf.VcfReader(testdata.GOLDEN_POSTPROCESS_OUTPUT) as reader:
+      variants = list(reader.iterate())
+      expected = vcf_stats.VcfStatsAccumulator(header=reader.header)
+      first = vcf_stats.VcfStatsAccumulator(header=reader.header)
+      second = vcf_stats.VcfStatsAccumulator(header=reader.header)
+      for i, variant in enumerate(variants):
+        expected.add(variant, reader)
+        (first if i < len(variants) // 2 else second).add(variant, reader)
+    self.assertTrue(expected.vaf_available)
+    # Merging must work after pickling, as the accumulators of the partitions
+    # of postprocess_variants are returned by worker processes.
+    first.merge(pickle.loads(pickle.dumps(second)))
+    self.assertEqual(
+        json.dumps(first.vis_data(), sort_keys=True, default=int),
+        json.dumps(expected.vis_data(), sort_keys=True, default=int))
+
+  @parameterized.parameters(
+      (False, 12.34, 12.0),
+      (False, 12.96, 12.0),
+      (True, 12.96, 13.0),
+  )
+  def test_accumulator_round_qualities(self, round_qualities, qual,
+                                       expected_bin_start):
+    self.variant.quality = qual
+    accumulator = vcf_stats.VcfStatsAccumulator(
+        round_qualities=round_qualities)
+    accumulator.add(self.variant)
+    self.assertEqual(accumulator.qual_histogram(), [{
+        's': expected_bin_start,
+        'e': expected_bin_start + 1,
+        'c': 1
+    }])
+
   def test_vaf_histograms_by_genotype(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite',
-                                                ['genotype', 'vaf'])
-    variant_stats = [
-        variant_stats_lite(genotype='[0, 0]', vaf=0),
-        variant_stats_lite(genotype='[1, 1]', vaf=1),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.5),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.5),
-        variant_stats_lite(genotype='[0, 0]', vaf=0.08),
-        variant_stats_lite(genotype='[0, 0]', vaf=0.19),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.45),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.65)
-    ]
+    with vcf.VcfReader(testdata.GOLDEN_POSTPROCESS_OUTPUT) as reader:
+      accumulator = vcf_stats.VcfStatsAccumulator(
+          header=reader.header, vaf_number_of_bins=10)
+      for gt, vaf in [([0, 0], 0), ([1, 1], 1), ([0, 1], 0.5), ([0, 1], 0.5),
+                      ([0, 0], 0.08), ([0, 0], 0.19), ([0, 1], 0.45),
+                      ([0, 1], 0.65)]:
+        variant = test_utils.make_variant(alleles=['A', 'G'], gt=gt)
+        variantcall_utils.set_format(
+            variant_utils.only_call(variant), 'VAF', [vaf], reader)
+        accumulator.add(variant, reader)
     # s = bin_start, e = bin_end, c = count
     truth_histograms = """
     {
@@ -240,9 +280,8 @@ class VcfStatsTest(parameterized.TestCase):
       "[1, 2]": [{"c": 0, "e": 0.5, "s": 0.0}, {"c": 0, "e": 1.0, "s": 0.5}]
       }
     """
-    self.assertEqual(
-        vcf_stats._vaf_histograms_by_genotype(variant_stats),
-        json.loads(truth_histograms))
+    self.assertEqual(accumulator.vaf_histograms_by_genotype(),
+                     json.loads(truth_histograms))
 
   def test_format_histogram_for_vega(self):
     # s = bin_start, e = bin_end, c = count
@@ -258,73 +297,49 @@ class VcfStatsTest(parameterized.TestCase):
             'c': 2
         }])
 
-  def test_count_titv(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite', ['is_transition', 'is_transversion'])
-    variant_stats = [
-        variant_stats_lite(is_transition=True, is_transversion=False),
-        variant_stats_lite(is_transition=True, is_transversion=False),
-        variant_stats_lite(is_transition=True, is_transversion=False),
-        variant_stats_lite(is_transition=False, is_transversion=True),
-        variant_stats_lite(is_transition=False, is_transversion=True),
-        variant_stats_lite(is_transition=False, is_transversion=False)
-    ]
+  def test_titv_counts(self):
+    accumulator = _accumulate([
+        test_utils.make_variant(alleles=alleles, gt=[0, 1])
+        for alleles in [['A', 'G'], ['C', 'T'], ['G', 'A'], ['A', 'C'],
+                        ['A', 'T'], ['A', 'AG']]
+    ])
     truth_counts = {'Transition': 3, 'Transversion': 2}
-    self.assertEqual(vcf_stats._count_titv(variant_stats), truth_counts)
+    self.assertEqual(accumulator.titv_counts(), truth_counts)
 
-  def test_count_variant_types(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite',
-                                                ['variant_type'])
-    variant_stats = [
-        variant_stats_lite(variant_type='A'),
-        variant_stats_lite(variant_type='B'),
-        variant_stats_lite(variant_type='C'),
-        variant_stats_lite(variant_type='A'),
-        variant_stats_lite(variant_type='B')
-    ]
-    truth_counts = {'A': 2, 'B': 2, 'C': 1}
-    self.assertEqual(
-        vcf_stats._count_variant_types(variant_stats), truth_counts)
+  def test_variant_type_counts(self):
+    accumulator = _accumulate([
+        test_utils.make_variant(alleles=alleles, gt=[0, 1])
+        for alleles in [['A', 'G'], ['A', 'AG'], ['AG', 'A'], ['C', 'T'],
+                        ['A', 'ACG']]
+    ])
+    truth_counts = {
+        vcf_stats.BIALLELIC_SNP: 2,
+        vcf_stats.BIALLELIC_INSERTION: 2,
+        vcf_stats.BIALLELIC_DELETION: 1
+    }
+    self.assertEqual(accumulator.variant_type_counts(), truth_counts)
 
-  def test_count_base_changes_and_indel_sizes(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite',
-        ['reference_bases', 'alternate_bases', 'is_variant', 'variant_type'])
-    variant_stats = [
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['G'],
-            is_variant=True,
-            variant_type=vcf_stats.BIALLELIC_SNP),
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['AGGG'],
-            is_variant=True,
-            variant_type=vcf_stats.BIALLELIC_INSERTION),
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['G'],
-            is_variant=False,
-            variant_type=vcf_stats.REFCALL),
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['G', 'T'],
-            is_variant=True,
-            variant_type=vcf_stats.MULTIALLELIC_COMPLEX)
-    ]
+  def test_base_changes_and_indel_sizes(self):
+    accumulator = _accumulate([
+        test_utils.make_variant(alleles=['A', 'G'], gt=[0, 1]),
+        test_utils.make_variant(alleles=['A', 'AGGG'], gt=[0, 1]),
+        # RefCalls and multiallelic variants are not counted.
+        test_utils.make_variant(alleles=['A', 'G'], gt=[0, 0]),
+        test_utils.make_variant(alleles=['A', 'G', 'T'], gt=[1, 2]),
+    ])
     truth_base_changes = [['A', 'G', 1]]
     truth_indel_sizes = [[3, 1]]
-    base_changes, indel_sizes = vcf_stats._count_base_changes_and_indel_sizes(
-        variant_stats)
+    base_changes, indel_sizes = accumulator.base_changes_and_indel_sizes()
     self.assertEqual(base_changes, truth_base_changes)
     self.assertEqual(indel_sizes, truth_indel_sizes)
 
-  def test_compute_qual_histogram(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite', ['qual'])
-    variant_stats = [variant_stats_lite(qual=100), variant_stats_lite(qual=49)]
-    hist = vcf_stats._compute_qual_histogram(variant_stats)
+  def test_qual_histogram(self):
+    accumulator = _accumulate([
+        test_utils.make_variant(qual=100, gt=[0, 1]),
+        test_utils.make_variant(qual=49, gt=[0, 1])
+    ])
     # s = bin_start, e = bin_end, c = count
-    self.assertEqual(hist, [{
+    self.assertEqual(accumulator.qual_histogram(), [{
         'c': 1,
         's': 49.0,
         'e': 50.0
@@ -334,30 +349,21 @@ class VcfStatsTest(parameterized.TestCase):
         'e': 101.0
     }])
 
-  def test_get_integer_counts(self):
-    self.assertEqual(
-        vcf_stats._get_integer_counts([1, 2, 2, 4]), [[1, 1], [2, 2], [4, 1]])
-
-  def test_compute_gq_histogram(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite',
-                                                ['genotype_quality'])
-    variant_stats = [
-        variant_stats_lite(genotype_quality=100),
-        variant_stats_lite(genotype_quality=100),
-        variant_stats_lite(genotype_quality=49)
-    ]
-    hist = vcf_stats._compute_gq_histogram(variant_stats)
-    self.assertEqual(hist, [[49, 1], [100, 2]])
+  def test_gq_histogram(self):
+    accumulator = _accumulate([
+        test_utils.make_variant(gt=[0, 1], gq=gq) for gq in [100, 100, 49]
+    ])
+    self.assertEqual(accumulator.gq_histogram(), [[49, 1], [100, 2]])
 
-  def test_compute_depth_histogram(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite', ['depth'])
-    variant_stats = [
-        variant_stats_lite(depth=100),
-        variant_stats_lite(depth=30),
-        variant_stats_lite(depth=30)
-    ]
-    hist = vcf_stats._compute_depth_histogram(variant_stats)
-    self.assertEqual(hist, [[30, 2], [100, 1]])
+  def test_depth_histogram(self):
+    variants = []
+    for depth in [100, 30, 30]:
+      variant = test_utils.make_variant(gt=[0, 1])
+      variantcall_utils.set_format(
+          variant_utils.only_call(variant), 'DP', depth)
+      variants.append(variant)
+    accumulator = _accumulate(variants)
+    self.assertEqual(accumulator.depth_histogram(), [[30, 2], [100, 1]])
 
   def test_create_vcf_report(self):
     base_dir = tempfile.mkdtemp()
@@ -371,6 +377,19 @@ class VcfStatsTest(parameterized.TestCase):
           vcf_reader=reader)
     self.assertTrue(tf.io.gfile.exists(outfile_base + '.visual_report.html'))
 
+  def test_create_vcf_report_from_accumulator(self):
+    base_dir = tempfile.mkdtemp()
+    outfile_base = os.path.join(base_dir, 'stats_test')
+    with vcf.VcfReader(testdata.GOLDEN_POSTPROCESS_OUTPUT) as reader:
+      accumulator = vcf_stats.VcfStatsAccumulator(header=reader.header)
+      for variant in reader.iterate():
+        accumulator.add(variant, reader)
+    vcf_stats.create_vcf_report_from_accumulator(
+        accumulator,
+        output_basename=outfile_base,
+        sample_name='test_sample_name')
+    self.assertTrue(tf.io.gfile.exists(outfile_base + '.visual_report.html'))
+
 
 if __name__ == '__main__':
   absltest.main()
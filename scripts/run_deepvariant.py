@@ -84,6 +84,12 @@ flags.DEFINE_string(
 # Optional flags for make_examples.
 flags.DEFINE_integer('num_shards', 1,
                      'Optional. Number of shards for make_examples step.')
+flags.DEFINE_boolean(
+    'stream_examples', False,
+    'Optional. If true, run make_examples and call_variants concurrently, '
+    'with the make_examples shards streaming uncompressed examples to '
+    'call_variants through named pipes in --intermediate_results_dir '
+    'instead of writing them to disk.')
 flags.DEFINE_string(
     'regions', None,
     'Optional. Space-separated list of regions we want to process. Elements '
@@ -218,12 +224,18 @@ def make_examples_command(ref, reads, examples, extra_args, **kwargs):
   return ' '.join(command)
 
 
-def call_variants_command(outfile, examples, model_ckpt, extra_args):
+def call_variants_command(outfile,
+                          examples,
+                          model_ckpt,
+                          extra_args,
+                          stream_examples=False):
   """Returns a call_variants command for subprocess.check_call."""
   command = ['time', '/opt/deepvariant/bin/call_variants']
   command.extend(['--outfile', '"{}"'.format(outfile)])
   command.extend(['--examples', '"{}"'.format(examples)])
   command.extend(['--checkpoint', '"{}"'.format(model_ckpt)])
+  if stream_examples:
+    command.extend(['--stream_examples'])
   # Extend the command with all items in extra_args.
   command = _extend_command_by_args_dict(command,
                                          _extra_args_to_dict(extra_args))
@@ -260,6 +272,43 @@ def postprocess_variants_command(ref,
   return ' '.join(command)
 
 
+def create_example_pipes(examples):
+  """Creates the named pipes for each shard of the examples filespec."""
+  basename, num_shards = examples.rsplit('@', 1)
+  num_shards = int(num_shards)
+  width = max(5, len(str(num_shards)))
+  for i in range(num_shards):
+    path = '{0}-{1:0{3}}-of-{2:0{3}}'.format(basename, i, num_shards, width)
+    if os.path.exists(path):
+      os.remove(path)
+    os.mkfifo(path)
+
+
+def streaming_command(make_examples, call_variants):
+  """Returns a command running make_examples and call_variants concurrently.
+
+  Both run in the background, each in its own process group, so that either
+  one can be stopped when the other fails. Otherwise call_variants would wait
+  forever on pipes that a failed make_examples never opened, and make_examples
+  would block on pipes that a failed call_variants no longer reads. The command
+  fails if either of them fails.
+
+  Args:
+    make_examples: The make_examples command, writing into named pipes.
+    call_variants: The call_variants command, reading from those pipes.
+
+  Returns:
+    (string) A command to run.
+  """
+  return ('set -m; '
+          '{{ {}; }} & make_examples_pid=$!; '
+          '{{ {} || {{ status=$?; kill -- -$make_examples_pid 2>/dev/null; '
+          'exit $status; }}; }} & call_variants_pid=$!; '
+          'wait $make_examples_pid || {{ status=$?; '
+          'kill -- -$call_variants_pid 2>/dev/null; exit $status; }}; '
+          'wait $call_variants_pid').format(make_examples, call_variants)
+
+
 def check_or_create_intermediate_results_dir(intermediate_results_dir):
   """Checks or creates the path to the directory for intermediate results."""
   if intermediate_results_dir is None:
@@ -292,7 +341,17 @@ def get_model_ckpt(model_type, customized_model):
 
 
 def create_all_commands(intermediate_results_dir):
-  """Creates 3 commands to be executed later."""
+  """Creates 3 commands to be executed later.
+
+  With --stream_examples, make_examples and call_variants are combined into a
+  single command, so only 2 are returned.
+
+  Args:
+    intermediate_results_dir: Directory for the intermediate outputs.
+
+  Returns:
+    A list of commands to run in order.
+  """
   commands = []
   # make_examples
   nonvariant_site_tfrecord_path = None
@@ -301,9 +360,16 @@ def create_all_commands(intermediate_results_dir):
         intermediate_results_dir,
         'gvcf.tfrecord@{}.gz'.format(FLAGS.num_shards))
 
-  examples = os.path.join(
-      intermediate_results_dir,
-      'make_examples.tfrecord@{}.gz'.format(FLAGS.num_shards))
+  if FLAGS.stream_examples:
+    # Streamed examples go through named pipes, uncompressed.
+    examples = os.path.join(
+        intermediate_results_dir,
+        'make_examples.tfrecord@{}'.format(FLAGS.num_shards))
+    create_example_pipes(examples)
+  else:
+    examples = os.path.join(
+        intermediate_results_dir,
+        'make_examples.tfrecord@{}.gz'.format(FLAGS.num_shards))
 
   commands.append(
       make_examples_command(
@@ -320,8 +386,14 @@ def create_all_commands(intermediate_results_dir):
                                       'call_variants_output.tfrecord.gz')
   model_ckpt = get_model_ckpt(FLAGS.model_type, FLAGS.customized_model)
   commands.append(
-      call_variants_command(call_variants_output, examples, model_ckpt,
-                            FLAGS.call_variants_extra_args))
+      call_variants_command(
+          call_variants_output,
+          examples,
+          model_ckpt,
+          FLAGS.call_variants_extra_args,
+          stream_examples=FLAGS.stream_examples))
+  if FLAGS.stream_examples:
+    commands[-2:] = [streaming_command(*commands[-2:])]
 
   # postprocess_variants
   commands.append(
@@ -0,0 +1,135 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+"""Tests for scripts.run_deepvariant."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import stat
+import subprocess
+import tempfile
+
+from absl import flags
+from absl.testing import absltest
+from absl.testing import flagsaver
+from absl.testing import parameterized
+
+from scripts import run_deepvariant
+
+FLAGS = flags.FLAGS
+
+# Seconds after which a streaming command is considered to hang.
+_TIMEOUT_SECONDS = 60
+
+
+class RunDeepVariantStreamingTest(parameterized.TestCase):
+
+  def test_create_example_pipes(self):
+    output_dir = tempfile.mkdtemp()
+    run_deepvariant.create_example_pipes(
+        os.path.join(output_dir, 'make_examples.tfrecord@3'))
+    expected_paths = [
+        os.path.join(output_dir,
+                     'make_examples.tfrecord-{:05d}-of-00003'.format(i))
+        for i in range(3)
+    ]
+    self.assertCountEqual(
+        [os.path.join(output_dir, name) for name in os.listdir(output_dir)],
+        expected_paths)
+    for path in expected_paths:
+      self.assertTrue(stat.S_ISFIFO(os.stat(path).st_mode))
+
+  @parameterized.parameters(
+      # Both succeed.
+      ('echo examples > {pipe}', 'cat {pipe}', True),
+      # make_examples fails before opening the pipe, as with bad --regions.
+      ('sh -c "exit 3"', 'cat {pipe}', False),
+      # call_variants fails before opening the pipe.
+      ('echo examples > {pipe}', 'sh -c "exit 4"', False),
+      # make_examples fails after writing its examples.
+      ('echo examples > {pipe}; sh -c "exit 5"', 'cat {pipe}', False),
+      # call_variants fails after reading the examples.
+      ('echo examples > {pipe}', 'cat {pipe} && sh -c "exit 6"', False),
+  )
+  def test_streaming_command(self, make_examples, call_variants, succeeds):
+    pipe = os.path.join(tempfile.mkdtemp(), 'examples')
+    os.mkfifo(pipe)
+    command = run_deepvariant.streaming_command(
+        make_examples.format(pipe=pipe), call_variants.format(pipe=pipe))
+    process = subprocess.Popen(command, shell=True, executable='/bin/bash')
+    # A hanging command raises subprocess.TimeoutExpired.
+    status = process.wait(timeout=_TIMEOUT_SECONDS)
+    self.assertEqual(status == 0, succeeds)
+
+  @flagsaver.flagsaver
+  def test_create_all_commands_with_stream_examples(self):
+    intermediate_results_dir = tempfile.mkdtemp()
+    FLAGS.model_type = 'WGS'
+    FLAGS.ref = 'ref.fa'
+    FLAGS.reads = 'reads.bam'
+    FLAGS.output_vcf = 'output.vcf.gz'
+    FLAGS.num_shards = 2
+    FLAGS.stream_examples = True
+    commands = run_deepvariant.create_all_commands(intermediate_results_dir)
+
+    # make_examples and call_variants are combined into one command.
+    self.assertLen(commands, 2)
+    examples = os.path.join(intermediate_results_dir,
+                            'make_examples.tfrecord@2')
+    self.assertIn('--examples "{}"'.format(examples), commands[0])
+    self.assertIn('/opt/deepvariant/bin/make_examples', commands[0])
+    self.assertIn('/opt/deepvariant/bin/call_variants', commands[0])
+    self.assertIn('--stream_examples', commands[0])
+    self.assertNotIn('.tfrecord@2.gz', commands[0])
+    self.assertIn('/opt/deepvariant/bin/postprocess_variants', commands[1])
+    for i in range(2):
+      path = os.path.join(intermediate_results_dir,
+                          'make_examples.tfrecord-{:05d}-of-00002'.format(i))
+      self.assertTrue(stat.S_ISFIFO(os.stat(path).st_mode))
+
+  @flagsaver.flagsaver
+  def test_create_all_commands_without_stream_examples(self):
+    intermediate_results_dir = tempfile.mkdtemp()
+    FLAGS.model_type = 'WGS'
+    FLAGS.ref = 'ref.fa'
+    FLAGS.reads = 'reads.bam'
+    FLAGS.output_vcf = 'output.vcf.gz'
+    FLAGS.num_shards = 2
+    FLAGS.stream_examples = False
+    commands = run_deepvariant.create_all_commands(intermediate_results_dir)
+
+    self.assertLen(commands, 3)
+    self.assertIn('make_examples.tfrecord@2.gz', commands[0])
+    self.assertNotIn('--stream_examples', commands[1])
+    self.assertEqual(os.listdir(intermediate_results_dir), [])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -65,17 +65,32 @@ from __future__ import print_function
 
 import abc
 import errno
+import itertools
 
 from absl import logging
 
 from third_party.nucleus.io.python import tfrecord_writer
 
+# The number of records passed to the native writer in each call by write_many.
+WRITE_MANY_BATCH_SIZE = 1024
+
+
+def batches(iterable, batch_size=WRITE_MANY_BATCH_SIZE):
+  """Yields the elements of iterable in lists of up to batch_size elements."""
+  iterator = iter(iterable)
+  while True:
+    batch = list(itertools.islice(iterator, batch_size))
+    if not batch:
+      return
+    yield batch
+
 
 class GenomicsWriter(object):
   """Abstract base class for writing genomics data.
 
-  A GenomicsWriter only has one method, write, which writes a single
-  protocol buffer to a file.
+  A GenomicsWriter has one abstract method, write, which writes a single
+  protocol buffer to a file. write_many writes an iterable of them, which
+  subclasses override to write them in batches rather than one at a time.
   """
 
   __metaclass__ = abc.ABCMeta
@@ -88,6 +103,15 @@ class GenomicsWriter(object):
       proto:  A protocol buffer.
     """
 
+  def write_many(self, protos):
+    """Writes each of protos to the file, in order.
+
+    Args:
+      protos: An iterable of protocol buffers.
+    """
+    for proto in protos:
+      self.write(proto)
+
   def __enter__(self):
     """Enter a `with` block."""
     return self
@@ -139,6 +163,20 @@ class TFRecordWriter(GenomicsWriter):
     """Writes the proto to the TFRecord file."""
     self._writer.write(proto.SerializeToString())
 
+  def write_many(self, protos):
+    """Writes each of protos to the TFRecord file, in batches."""
+    self.write_serialized(proto.SerializeToString() for proto in protos)
+
+  def write_serialized(self, serialized_records):
+    """Writes already serialized protos to the TFRecord file.
+
+    Args:
+      serialized_records: iterable of bytes. Each element is written as one
+        record, as is.
+    """
+    for batch in batches(serialized_records):
+      self._writer.write_records(batch)
+
   def __exit__(self, exit_type, exit_value, exit_traceback):
     self._writer.close()
 
@@ -187,6 +225,18 @@ class DispatchingGenomicsWriter(GenomicsWriter):
   def write(self, proto):
     self._writer.write(proto)
 
+  def write_many(self, protos):
+    self._writer.write_many(protos)
+
+  def write_serialized(self, serialized_records):
+    """Writes already serialized protos to the output.
+
+    Args:
+      serialized_records: iterable of bytes. Each element is one serialized
+        protocol buffer of the type written by this writer.
+    """
+    self._writer.write_serialized(serialized_records)
+
   def __exit__(self, exit_type, exit_value, exit_traceback):
     self._writer.__exit__(exit_type, exit_value, exit_traceback)
 
@@ -285,6 +285,24 @@ class NativeSamWriter(genomics_writer.GenomicsWriter):
   def write(self, proto):
     self._writer.write(proto)
 
+  def write_many(self, protos):
+    """Writes Read protos, passing each batch to the native writer."""
+    for batch in genomics_writer.batches(protos):
+      self._writer.write_many(batch)
+
+  def write_serialized(self, serialized_records):
+    """Writes serialized Read protos, parsing each batch natively.
+
+    Only use this if the records are already serialized; write_many is faster
+    than serializing them for this.
+
+    Args:
+      serialized_records: iterable of bytes. Each element is one serialized
+        Read proto.
+    """
+    for batch in genomics_writer.batches(serialized_records):
+      self._writer.write_serialized(batch)
+
   def __exit__(self, exit_type, exit_value, exit_traceback):
     self._writer.__exit__(exit_type, exit_value, exit_traceback)
 
@@ -299,6 +317,9 @@ class SamWriter(genomics_writer.DispatchingGenomicsWriter):
 class InMemorySamReader(object):
   """Python interface class for in-memory SAM/BAM/CRAM reader.
 
+  The reads are indexed with a ranges.SortedIntervalIndex when they are set, so
+  query() runs a binary search instead of scanning every read.
+
   Attributes:
     reads: list[nucleus.genomics.v1.Read]. The list of in-memory reads.
     is_sorted: bool, True if reads are sorted.
@@ -309,8 +330,18 @@ class InMemorySamReader(object):
 
   def replace_reads(self, reads, is_sorted=False):
     """Replace the reads stored by this reader."""
-    self.reads = reads
+    self.reads = list(reads)
     self.is_sorted = is_sorted
+    self._index = ranges.SortedIntervalIndex(self._read_intervals(self.reads))
+
+  @staticmethod
+  def _read_intervals(reads):
+    """Yields the alignment range of each read and its position in reads."""
+    for i, read in enumerate(reads):
+      read_range = utils.read_range(read)
+      # Unaligned reads never overlap a query region, so don't index them.
+      if read_range.reference_name:
+        yield read_range, i
 
   def iterate(self):
     """Iterate over all records in the reads.
@@ -323,12 +354,13 @@ class InMemorySamReader(object):
   def query(self, region):
     """Returns an iterator for going through the reads in the region.
 
+    Reads are returned in the order they were given to replace_reads.
+
     Args:
       region: nucleus.genomics.v1.Range. The query region.
 
     Returns:
       An iterator over nucleus.genomics.v1.Read protos.
     """
-    # redacted
-    return (
-        read for read in self.reads if utils.read_overlaps_region(read, region))
+    overlapping = sorted(i for _, _, i in self._index.query(region))
+    return (self.reads[i] for i in overlapping)
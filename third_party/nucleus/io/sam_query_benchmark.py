@@ -0,0 +1,153 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Benchmarks InMemorySamReader.query() against a linear scan of the reads.
+
+This mimics how make_examples looks up the reads for each candidate: a single
+partition of reads is loaded into an InMemorySamReader, and the reads
+overlapping a small window around each candidate are queried. For each depth
+we report the average cost of one such lookup with the indexed query() and
+with a linear scan calling utils.read_overlaps_region on every read.
+
+Example usage:
+
+  sam_query_benchmark --depths=30,60,200 --n_candidates=50
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import timeit
+
+from absl import app
+from absl import flags
+
+from third_party.nucleus.io import sam
+from third_party.nucleus.testing import test_utils
+from third_party.nucleus.util import ranges
+from third_party.nucleus.util import utils
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('depths', ['30', '60', '120', '200', '400'],
+                  'Read depths to benchmark.')
+flags.DEFINE_integer('partition_size', 1000,
+                     'Size in bp of the partition holding the reads.')
+flags.DEFINE_integer('read_length', 150, 'Length of each simulated read.')
+flags.DEFINE_integer('n_candidates', 50,
+                     'Number of candidates to query per partition.')
+flags.DEFINE_integer('window_size', 221,
+                     'Width in bp of the window queried for each candidate.')
+flags.DEFINE_integer('repeats', 5, 'Number of timing repeats per depth.')
+flags.DEFINE_integer('random_seed', 12345, 'Seed for the simulated data.')
+
+_CONTIG = 'chr1'
+
+
+def simulate_reads(depth, partition_size, read_length, rng):
+  """Returns reads covering [read_length, read_length + partition_size).
+
+  Read starts are uniform over [0, read_length + partition_size), so every base
+  of the partition is covered by about depth reads.
+
+  Args:
+    depth: int. The desired read depth over the partition.
+    partition_size: int. The size of the partition in bp.
+    read_length: int. The length of each read.
+    rng: random.Random used to place the reads.
+
+  Returns:
+    A list of nucleus.genomics.v1.Read protos.
+  """
+  span = partition_size + read_length
+  n_reads = depth * span // read_length
+  bases = 'A' * read_length
+  cigar = '{}M'.format(read_length)
+  return [
+      test_utils.make_read(
+          bases, start=rng.randrange(span), cigar=cigar, chrom=_CONTIG)
+      for _ in range(n_reads)
+  ]
+
+
+def candidate_regions(n_candidates, partition_size, read_length, window_size,
+                      rng):
+  """Returns the windows queried around n_candidates positions in partition."""
+  half_width = window_size // 2
+  regions = []
+  for _ in range(n_candidates):
+    pos = read_length + rng.randrange(partition_size)
+    regions.append(
+        ranges.make_range(_CONTIG, pos - half_width, pos + half_width + 1))
+  return regions
+
+
+def linear_scan_query(reads, region):
+  return [read for read in reads if utils.read_overlaps_region(read, region)]
+
+
+def benchmark_depth(depth, rng):
+  """Returns per-candidate lookup times in us (indexed, linear) and n_reads."""
+  reads = simulate_reads(depth, FLAGS.partition_size, FLAGS.read_length, rng)
+  regions = candidate_regions(FLAGS.n_candidates, FLAGS.partition_size,
+                              FLAGS.read_length, FLAGS.window_size, rng)
+
+  # The indexed timing includes building the index, as make_examples does
+  # once per partition in replace_reads.
+  def indexed():
+    reader = sam.InMemorySamReader(reads)
+    for region in regions:
+      list(reader.query(region))
+
+  def linear():
+    for region in regions:
+      linear_scan_query(reads, region)
+
+  n_lookups = FLAGS.n_candidates
+  indexed_s = min(timeit.repeat(indexed, number=1, repeat=FLAGS.repeats))
+  linear_s = min(timeit.repeat(linear, number=1, repeat=FLAGS.repeats))
+  return 1e6 * indexed_s / n_lookups, 1e6 * linear_s / n_lookups, len(reads)
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  rng = random.Random(FLAGS.random_seed)
+  print('depth\tn_reads\tindexed_us_per_candidate\tlinear_us_per_candidate'
+        '\tspeedup')
+  for depth in FLAGS.depths:
+    indexed_us, linear_us, n_reads = benchmark_depth(int(depth), rng)
+    print('{}\t{}\t{:.1f}\t{:.1f}\t{:.1f}x'.format(depth, n_reads, indexed_us,
+                                                 linear_us,
+                                                 linear_us / indexed_us))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -50,6 +50,7 @@ from third_party.nucleus.protos import reads_pb2
 from third_party.nucleus.protos import reference_pb2
 from third_party.nucleus.testing import test_utils
 from third_party.nucleus.util import ranges
+from third_party.nucleus.util import utils
 
 
 class SamReaderTests(parameterized.TestCase):
@@ -355,6 +356,18 @@ class ReadWriterTests(parameterized.TestCase):
     with sam.SamReader(output_path) as new_reader:
       self.assertEqual(original_records, list(new_reader.iterate()))
 
+  @parameterized.parameters('test.bam', 'test.sam', 'test.tfrecord')
+  def test_roundtrip_write_many(self, filename):
+    output_path = test_utils.test_tmpfile('write_many.' + filename)
+    original_reader = sam.SamReader(test_utils.genomics_core_testdata('test.bam'))
+    original_records = list(original_reader.iterate())
+    with sam.SamWriter(output_path, header=original_reader.header) as writer:
+      writer.write_many(original_records[:2])
+      writer.write_serialized(
+          read.SerializeToString() for read in original_records[2:])
+    with sam.SamReader(output_path) as new_reader:
+      self.assertEqual(original_records, list(new_reader.iterate()))
+
   @parameterized.parameters(
       dict(
           filename='test_cram.embed_ref_0_version_3.0.cram',
@@ -382,5 +395,55 @@ class ReadWriterTests(parameterized.TestCase):
       self.assertEqual(original_records, list(new_reader.iterate()))
 
 
+class InMemorySamReaderTests(parameterized.TestCase):
+  """Tests for the indexed query() of sam.InMemorySamReader."""
+
+  def _make_reads(self):
+    return [
+        test_utils.make_read('ACGT', start=10, cigar='4M', chrom='chr1'),
+        test_utils.make_read('A' * 20, start=0, cigar='20M', chrom='chr1'),
+        test_utils.make_read('ACG', start=5, cigar='1M10D2M', chrom='chr1'),
+        test_utils.make_read('ACGT', start=12, cigar='4M', chrom='chr2'),
+        test_utils.make_read('ACGTA', start=30, cigar='5M', chrom='chr1'),
+        test_utils.make_read('ACGT', start=10, cigar='4M', chrom='chr1'),
+    ]
+
+  @parameterized.parameters(
+      ('chr1:1-1', [1]),
+      ('chr1:11-11', [0, 1, 2, 5]),
+      ('chr1:15-30', [1, 2]),
+      ('chr1:15-31', [1, 2, 4]),
+      ('chr1:21-30', []),
+      ('chr1:1-100', [0, 1, 2, 4, 5]),
+      ('chr2:1-100', [3]),
+      ('chr3:1-100', []),
+  )
+  def test_query(self, region_literal, expected_indices):
+    reads = self._make_reads()
+    reader = sam.InMemorySamReader(reads)
+    region = ranges.parse_literal(region_literal)
+    self.assertEqual(
+        list(reader.query(region)), [reads[i] for i in expected_indices])
+
+  @parameterized.parameters(
+      'chr1:1-1', 'chr1:11-11', 'chr1:15-31', 'chr1:21-30', 'chr2:5-15',
+      'chr1:14-15', 'chr1:31-35')
+  def test_query_matches_linear_scan(self, region_literal):
+    reads = self._make_reads()
+    region = ranges.parse_literal(region_literal)
+    expected = [r for r in reads if utils.read_overlaps_region(r, region)]
+    self.assertEqual(
+        list(sam.InMemorySamReader(reads).query(region)), expected)
+
+  def test_replace_reads(self):
+    reads = self._make_reads()
+    reader = sam.InMemorySamReader(reads[:2])
+    region = ranges.parse_literal('chr2:1-100')
+    self.assertEqual(list(reader.query(region)), [])
+    reader.replace_reads(iter(reads))
+    self.assertEqual(reader.iterate(), reads)
+    self.assertEqual(list(reader.query(region)), [reads[3]])
+
+
 if __name__ == '__main__':
   absltest.main()
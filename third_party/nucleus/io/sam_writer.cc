@@ -636,4 +636,24 @@ tf::Status SamWriter::Write(const Read& read) {
   return tf::Status::OK();
 }
 
+tf::Status SamWriter::WriteMany(
+    const std::vector<ConstProtoPtr<const Read>>& reads) {
+  for (const auto& read : reads) {
+    TF_RETURN_IF_ERROR(Write(*(read.p_)));
+  }
+  return tf::Status::OK();
+}
+
+tf::Status SamWriter::WriteSerialized(
+    const std::vector<string>& serialized_reads) {
+  Read read;
+  for (const string& serialized : serialized_reads) {
+    if (!read.ParseFromString(serialized)) {
+      return tf::errors::InvalidArgument("Failed to parse a serialized Read");
+    }
+    TF_RETURN_IF_ERROR(Write(read));
+  }
+  return tf::Status::OK();
+}
+
 }  // namespace nucleus
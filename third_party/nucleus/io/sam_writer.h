@@ -34,6 +34,7 @@
 
 #include <memory>
 #include <string>
+#include <vector>
 
 #include "htslib/hts.h"
 #include "htslib/sam.h"
@@ -94,6 +95,18 @@ class SamWriter {
     return Write(*(wrapped.p_));
   }
 
+  // Writes each of reads, in order. This writes a batch of reads with a single
+  // call from Python, without serializing them.
+  tensorflow::Status WriteMany(
+      const std::vector<ConstProtoPtr<const nucleus::genomics::v1::Read>>&
+          reads);
+
+  // Writes each of serialized_reads, serialized Read protos, in order. This is
+  // for callers that already hold the serialized protos; otherwise WriteMany
+  // avoids serializing and parsing each read.
+  tensorflow::Status WriteSerialized(
+      const std::vector<string>& serialized_reads);
+
   // Close the underlying resource descriptors. Returns Status::OK() if the
   // close was successful; otherwise the status provides information about what
   // error occurred.
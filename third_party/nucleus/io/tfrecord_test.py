@@ -56,6 +56,25 @@ class IOTest(parameterized.TestCase):
     tfrecord.write_tfrecords(protos, path)
     return protos, path
 
+  @parameterized.parameters('foo.tfrecord', 'foo.tfrecord.gz')
+  def test_write_serialized(self, filename):
+    protos = [reference_pb2.ContigInfo(name=str(i)) for i in range(10)]
+    path = test_utils.test_tmpfile(filename)
+    with tfrecord.Writer(path) as writer:
+      writer.write(protos[0])
+      writer.write_serialized(p.SerializeToString() for p in protos[1:])
+    self.assertEqual(
+        protos, list(tfrecord.read_tfrecords(path, reference_pb2.ContigInfo)))
+
+  @parameterized.parameters('foo.tfrecord', 'foo.tfrecord.gz')
+  def test_write_many(self, filename):
+    protos = [reference_pb2.ContigInfo(name=str(i)) for i in range(2500)]
+    path = test_utils.test_tmpfile('write_many.' + filename)
+    with tfrecord.Writer(path) as writer:
+      writer.write_many(iter(protos))
+    self.assertEqual(
+        protos, list(tfrecord.read_tfrecords(path, reference_pb2.ContigInfo)))
+
   @parameterized.parameters('foo.tfrecord', 'foo@2.tfrecord', 'foo@3.tfrecord')
   def test_read_write_tfrecords(self, filename):
     protos, path = self.write_test_protos(filename)
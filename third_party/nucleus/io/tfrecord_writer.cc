@@ -70,6 +70,18 @@ bool TFRecordWriter::WriteRecord(const std::string& record) {
   return s.ok();
 }
 
+bool TFRecordWriter::WriteRecords(const std::vector<std::string>& records) {
+  if (writer_ == nullptr) {
+    return false;
+  }
+  for (const std::string& record : records) {
+    if (!writer_->WriteRecord(record).ok()) {
+      return false;
+    }
+  }
+  return true;
+}
+
 bool TFRecordWriter::Flush() {
   if (writer_ == nullptr) {
     return false;
@@ -35,6 +35,7 @@
 
 #include <memory>
 #include <string>
+#include <vector>
 
 namespace tensorflow {
 class WritableFile;
@@ -62,6 +63,9 @@ class TFRecordWriter {
   // Returns true on success, false on error.
   bool WriteRecord(const std::string& record);
 
+  // Writes each of records in order. Returns true on success, false on error.
+  bool WriteRecords(const std::vector<std::string>& records);
+
   // Returns true on success, false on error.
   bool Flush();
 
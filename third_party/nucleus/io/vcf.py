@@ -82,7 +82,6 @@ from third_party.nucleus.io.python import vcf_reader
 from third_party.nucleus.io.python import vcf_writer
 from third_party.nucleus.protos import variants_pb2
 from third_party.nucleus.util import ranges
-from third_party.nucleus.util import variant_utils
 from third_party.nucleus.util import vcf_constants
 
 
@@ -253,7 +252,8 @@ class NativeVcfWriter(genomics_writer.GenomicsWriter):
                excluded_info_fields=None,
                excluded_format_fields=None,
                retrieve_gl_and_pl_from_info_map=False,
-               exclude_header=False):
+               exclude_header=False,
+               compression_threads=0):
     """Initializer for NativeVcfWriter.
 
     Args:
@@ -272,6 +272,9 @@ class NativeVcfWriter(genomics_writer.GenomicsWriter):
         fields are retrieved from the VariantCall.info map rather than from the
         top-level value in the VariantCall.genotype_likelihood field.
       exclude_header: bool. If True, write a headerless VCF.
+      compression_threads: int. The number of additional threads used to
+        compress a BGZF output_path. If 0, it is compressed on the writing
+        thread.
     """
     super(NativeVcfWriter, self).__init__()
 
@@ -283,6 +286,7 @@ class NativeVcfWriter(genomics_writer.GenomicsWriter):
         excluded_format_fields=excluded_format_fields,
         retrieve_gl_and_pl_from_info_map=retrieve_gl_and_pl_from_info_map,
         exclude_header=exclude_header,
+        compression_threads=compression_threads,
     )
     self._writer = vcf_writer.VcfWriter.to_file(output_path, header,
                                                 writer_options)
@@ -291,6 +295,24 @@ class NativeVcfWriter(genomics_writer.GenomicsWriter):
   def write(self, proto):
     self._writer.write(proto)
 
+  def write_many(self, protos):
+    """Writes Variant protos, passing each batch to the native writer."""
+    for batch in genomics_writer.batches(protos):
+      self._writer.write_many(batch)
+
+  def write_serialized(self, serialized_records):
+    """Writes serialized Variant protos, parsing each batch natively.
+
+    Only use this if the records are already serialized; write_many is faster
+    than serializing them for this.
+
+    Args:
+      serialized_records: iterable of bytes. Each element is one serialized
+        Variant proto.
+    """
+    for batch in genomics_writer.batches(serialized_records):
+      self._writer.write_serialized(batch)
+
   def __exit__(self, exit_type, exit_value, exit_traceback):
     self._writer.__exit__(exit_type, exit_value, exit_traceback)
 
@@ -305,7 +327,8 @@ class VcfWriter(genomics_writer.DispatchingGenomicsWriter):
                      excluded_info_fields=None,
                      excluded_format_fields=None,
                      retrieve_gl_and_pl_from_info_map=False,
-                     exclude_header=False):
+                     exclude_header=False,
+                     compression_threads=0):
     return NativeVcfWriter(
         output_path,
         header=header,
@@ -313,7 +336,8 @@ class VcfWriter(genomics_writer.DispatchingGenomicsWriter):
         excluded_info_fields=excluded_info_fields,
         excluded_format_fields=excluded_format_fields,
         retrieve_gl_and_pl_from_info_map=retrieve_gl_and_pl_from_info_map,
-        exclude_header=exclude_header)
+        exclude_header=exclude_header,
+        compression_threads=compression_threads)
 
   def _post_init_hook(self):
     # Initialize field_access_cache.  If we are dispatching to a
@@ -352,16 +376,10 @@ class InMemoryVcfReader(genomics_reader.GenomicsReader):
   by their ends.
 
   Implementation note:
-    The current implementation will be very slow for query() if the provided
-    cache of variants is large, as we do a O(n) search to collect all of the
-    overlapping variants for each query. There are several straightforward
-    optimizations to do if we need/want to scale this up. (a) sort the variants
-    and use a binary search to find overlapping variants (b) partition the
-    variants by contig, so we have dict[contig] => [variants on contig], which
-    allows us to completely avoid considering any variants on any other contigs.
-    Neither of these optimizations are worth it if len(variants) is small, but
-    it may be worth considering if we want to use this functionality with a
-    large number of variants.
+    The variants are indexed with a ranges.SortedIntervalIndex when the reader
+    is created, so query() runs a binary search instead of scanning every
+    variant. The variants must therefore not be modified after creating the
+    reader.
   """
 
   def __init__(self, variants, header=None):
@@ -377,12 +395,23 @@ class InMemoryVcfReader(genomics_reader.GenomicsReader):
     super(InMemoryVcfReader, self).__init__()
     self.variants = list(variants)
     self.header = header
+    # Maps each variant to its position in self.variants.
+    self._index = ranges.SortedIntervalIndex(
+        (variant, i) for i, variant in enumerate(self.variants))
 
   def iterate(self):
     return iter(self.variants)
 
   def query(self, region):
-    return iter(
-        variant for variant in self.variants
-        if ranges.ranges_overlap(variant_utils.variant_range(variant), region)
-    )
+    """Returns an iterator over the variants overlapping region.
+
+    Variants are returned in the order they were given to the constructor.
+
+    Args:
+      region: nucleus.genomics.v1.Range. The query region.
+
+    Returns:
+      An iterator over nucleus.genomics.v1.Variant protos.
+    """
+    overlapping = sorted(i for _, _, i in self._index.query(region))
+    return (self.variants[i] for i in overlapping)
@@ -327,6 +327,51 @@ class VcfWriterHeaderlessTests(absltest.TestCase):
         self.assertEqual(expected_variants, list(actual_reader))
 
 
+class VcfWriterWriteManyTests(parameterized.TestCase):
+  """Tests for VcfWriter.write_many and VcfWriter.write_serialized."""
+
+  @parameterized.parameters('output.vcf', 'output.vcf.gz', 'output.tfrecord')
+  def test_write_many(self, filename):
+    test_vcf = test_utils.genomics_core_testdata('test_sites.vcf')
+    output_path = test_utils.test_tmpfile('write_many.' + filename)
+    with vcf.VcfReader(test_vcf) as reader:
+      expected_variants = list(reader)
+      with vcf.VcfWriter(output_path, header=reader.header) as writer:
+        writer.write_many(expected_variants[:2])
+        writer.write_serialized(
+            v.SerializeToString() for v in expected_variants[2:])
+
+    with vcf.VcfReader(output_path, header=reader.header) as actual_reader:
+      self.assertEqual(expected_variants, list(actual_reader))
+
+  def test_write_serialized_fails_on_invalid_records(self):
+    test_vcf = test_utils.genomics_core_testdata('test_sites.vcf')
+    with vcf.VcfReader(test_vcf) as reader:
+      with vcf.VcfWriter(
+          test_utils.test_tmpfile('invalid.vcf'),
+          header=reader.header) as writer:
+        with self.assertRaisesRegexp(ValueError, 'Failed to parse'):
+          writer.write_serialized([b'not a Variant proto'])
+
+
+class VcfWriterCompressionThreadsTests(absltest.TestCase):
+  """Tests for VcfWriter with compression_threads."""
+
+  def test_write_with_compression_threads(self):
+    test_vcf = test_utils.genomics_core_testdata('test_sites.vcf')
+    output_vcf = test_utils.test_tmpfile('threads.vcf.gz')
+    with vcf.VcfReader(test_vcf) as reader:
+      expected_variants = list(reader)
+      with vcf.VcfWriter(
+          output_vcf, header=reader.header,
+          compression_threads=2) as writer:
+        for record in expected_variants:
+          writer.write(record)
+
+    with vcf.VcfReader(output_vcf) as actual_reader:
+      self.assertEqual(expected_variants, list(actual_reader))
+
+
 class VcfRoundtripTests(parameterized.TestCase):
   """Test the ability to round-trip VCF files."""
 
@@ -483,6 +528,29 @@ class InMemoryVcfReaderTests(parameterized.TestCase):
         list(self.reader.query(range1)),
         [self.variants[i] for i in expected_variant_indices])
 
+  @parameterized.parameters(
+      '1:1-100', '1:12-12', '1:14-20', '1:16-20', '1:21-29', '1:21-30',
+      '2:1-100', '5:1-100')
+  def test_query_matches_linear_scan(self, region_literal):
+    # Unsorted variants of different lengths, including a long deletion that
+    # starts well before the variants it overlaps.
+    variants = [
+        test_utils.make_variant(chrom='1', start=20, alleles=['A', 'C']),
+        test_utils.make_variant(chrom='1', start=5, alleles=['A' * 11, 'A']),
+        test_utils.make_variant(chrom='2', start=25, alleles=['A', 'C']),
+        test_utils.make_variant(chrom='1', start=12, alleles=['AC', 'A']),
+        test_utils.make_variant(chrom='1', start=29, alleles=['A', 'AT']),
+        test_utils.make_variant(chrom='1', start=12, alleles=['A', 'G']),
+    ]
+    region = ranges.parse_literal(region_literal)
+    expected = [
+        v for v in variants
+        if ranges.ranges_overlap(ranges.make_range(
+            v.reference_name, v.start, v.end), region)
+    ]
+    self.assertEqual(
+        list(vcf.InMemoryVcfReader(variants).query(region)), expected)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,122 @@
+# Copyright 2020 Google LLC.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""Benchmarks the ways of writing Variant protos with VcfWriter.
+
+The variants of --input_vcf are repeated to --n_records records and written to
+a temporary VCF with:
+
+  write:             one write(proto) call per variant.
+  write_serialized:  the variants are serialized in Python, and each batch is
+                     parsed back in C++. This is how write_many used to write.
+  write_many:        each batch is passed to C++ as the protos themselves.
+
+Example usage:
+
+  vcf_write_benchmark --input_vcf=calls.vcf.gz --n_records=100000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import os
+import tempfile
+import timeit
+
+from absl import app
+from absl import flags
+
+from third_party.nucleus.io import vcf
+from third_party.nucleus.testing import test_utils
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'input_vcf', None, 'VCF whose variants are written. Defaults to a small '
+    'VCF from the Nucleus test data.')
+flags.DEFINE_integer('n_records', 100000, 'Number of variants to write.')
+flags.DEFINE_list('suffixes', ['.vcf', '.vcf.gz'],
+                  'Output file suffixes to benchmark.')
+flags.DEFINE_integer('repeats', 3, 'Number of timing repeats per method.')
+
+
+def write_each(writer, variants):
+  for variant in variants:
+    writer.write(variant)
+
+
+def write_serialized(writer, variants):
+  writer.write_serialized(variant.SerializeToString() for variant in variants)
+
+
+def write_many(writer, variants):
+  writer.write_many(variants)
+
+
+_METHODS = (('write', write_each), ('write_serialized', write_serialized),
+            ('write_many', write_many))
+
+
+def benchmark(header, variants, output_path, method):
+  """Returns the fastest time in seconds to write variants with method."""
+
+  def run():
+    with vcf.VcfWriter(output_path, header=header) as writer:
+      method(writer, variants)
+
+  return min(timeit.repeat(run, number=1, repeat=FLAGS.repeats))
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  input_vcf = FLAGS.input_vcf or test_utils.genomics_core_testdata(
+      'test_sites.vcf')
+  with vcf.VcfReader(input_vcf) as reader:
+    header = reader.header
+    variants = list(itertools.islice(itertools.cycle(list(reader)),
+                                     FLAGS.n_records))
+
+  output_dir = tempfile.mkdtemp()
+  print('suffix\tmethod\tseconds\tus_per_record\tspeedup_over_write')
+  for suffix in FLAGS.suffixes:
+    output_path = os.path.join(output_dir, 'output' + suffix)
+    baseline_s = None
+    for name, method in _METHODS:
+      seconds = benchmark(header, variants, output_path, method)
+      if baseline_s is None:
+        baseline_s = seconds
+      print('{}\t{}\t{:.3f}\t{:.2f}\t{:.2f}x'.format(
+          suffix, name, seconds, 1e6 * seconds / len(variants),
+          baseline_s / seconds))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -97,6 +97,13 @@ StatusOr<std::unique_ptr<VcfWriter>> VcfWriter::ToFile(
     return tf::errors::Unknown("Could not open variants_path: ", variants_path);
   }
 
+  if (options.compression_threads() > 0 &&
+      hts_set_threads(fp, options.compression_threads()) < 0) {
+    hts_close(fp);
+    return tf::errors::Unknown("Failed to set ", options.compression_threads(),
+                               " compression threads for ", variants_path);
+  }
+
   auto writer = absl::WrapUnique(new VcfWriter(header, options, fp));
   TF_RETURN_IF_ERROR(writer->WriteHeader());
   return std::move(writer);
@@ -159,6 +166,27 @@ tf::Status VcfWriter::Write(const Variant& variant_message) {
   return tf::Status::OK();
 }
 
+tf::Status VcfWriter::WriteMany(
+    const std::vector<ConstProtoPtr<const Variant>>& variants) {
+  for (const auto& variant : variants) {
+    TF_RETURN_IF_ERROR(Write(*(variant.p_)));
+  }
+  return tf::Status::OK();
+}
+
+tf::Status VcfWriter::WriteSerialized(
+    const std::vector<string>& serialized_variants) {
+  Variant variant_message;
+  for (const string& serialized : serialized_variants) {
+    if (!variant_message.ParseFromString(serialized)) {
+      return tf::errors::InvalidArgument(
+          "Failed to parse a serialized Variant");
+    }
+    TF_RETURN_IF_ERROR(Write(variant_message));
+  }
+  return tf::Status::OK();
+}
+
 tf::Status VcfWriter::Close() {
   if (fp_ == nullptr)
     return tf::errors::FailedPrecondition(
@@ -35,6 +35,7 @@
 
 #include <memory>
 #include <string>
+#include <vector>
 
 #include "htslib/hts.h"
 #include "htslib/sam.h"
@@ -77,6 +78,18 @@ class VcfWriter {
     return Write(*(wrapped.p_));
   }
 
+  // Writes each of variants, in order. This writes a batch of variants with a
+  // single call from Python, without serializing them.
+  tensorflow::Status WriteMany(
+      const std::vector<ConstProtoPtr<const nucleus::genomics::v1::Variant>>&
+          variants);
+
+  // Writes each of serialized_variants, serialized Variant protos, in order.
+  // This is for callers that already hold the serialized protos; otherwise
+  // WriteMany avoids serializing and parsing each variant.
+  tensorflow::Status WriteSerialized(
+      const std::vector<string>& serialized_variants);
+
   // Close the underlying resource descriptors. Returns Status::OK() if the
   // close was successful; otherwise the status provides information about what
   // error occurred.
@@ -32,6 +32,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import bisect
 import collections
 import re
 
@@ -364,6 +365,59 @@ class RangeSet(object):
       return any(ov.begin <= start and ov.end >= end for ov in overlap_set)
 
 
+class SortedIntervalIndex(object):
+  """Finds the intervals overlapping a query Range with a binary search.
+
+  The intervals are grouped by contig and sorted by start. Since no interval is
+  longer than the longest one on its contig, max_span, an interval overlapping
+  the query must start after query.start - max_span and before query.end, so a
+  query only scans the intervals starting in that window.
+
+  Unlike RangeSet, the intervals may overlap each other and are not merged, and
+  each one carries a value, such as the position of a record in a list.
+
+  This class is immutable.
+  """
+
+  def __init__(self, intervals):
+    """Creates a SortedIntervalIndex of intervals.
+
+    Args:
+      intervals: iterable of (range, value) tuples. range is a
+        nucleus.genomics.v1.Range proto (or anything with reference_name,
+        start, and end properties following the Range convention), and value
+        is returned by query() when range overlaps the query.
+    """
+    by_contig = collections.defaultdict(list)
+    for range_, value in intervals:
+      by_contig[range_.reference_name].append((range_.start, range_.end, value))
+
+    self._by_contig = {}
+    for contig, entries in by_contig.items():
+      # Intervals with the same start and end keep the order they were given in.
+      entries.sort(key=lambda entry: entry[:2])
+      self._by_contig[contig] = ([start for start, _, _ in entries], entries,
+                                 max(end - start for start, end, _ in entries))
+
+  def query(self, region):
+    """Returns the intervals overlapping region.
+
+    Args:
+      region: nucleus.genomics.v1.Range. The query region.
+
+    Returns:
+      A list of the (start, end, value) tuples of the intervals overlapping
+      region, sorted by start and end.
+    """
+    contig_index = self._by_contig.get(region.reference_name)
+    if contig_index is None:
+      return []
+    starts, entries, max_span = contig_index
+    lo = bisect.bisect_right(starts, region.start - max_span)
+    hi = bisect.bisect_left(starts, region.end)
+    return [entry for entry in entries[lo:hi] if entry[1] > region.start]
+
+
 def make_position(chrom, position, reverse_strand=False):
   """Returns a nucleus.genomics.v1.Position.
 
@@ -207,6 +207,35 @@ class RangesTests(parameterized.TestCase):
     # Other chromosome is not spanned.
     self.assertFalse(range_set.envelops('chr2', start_ix, start_ix + 1))
 
+  @parameterized.parameters(
+      # The long interval starting at 0 overlaps queries far from its start.
+      dict(query=('chr1', 40, 45), expected=['long']),
+      dict(query=('chr1', 4, 6), expected=['long', 'a', 'b']),
+      dict(query=('chr1', 5, 6), expected=['long', 'a', 'b']),
+      # Intervals ending at the query start or starting at its end don't
+      # overlap it.
+      dict(query=('chr1', 10, 12), expected=['long', 'c']),
+      dict(query=('chr1', 1, 5), expected=['long', 'a']),
+      dict(query=('chr2', 0, 100), expected=['d']),
+      dict(query=('chr3', 0, 100), expected=[]),
+  )
+  def test_sorted_interval_index(self, query, expected):
+    index = ranges.SortedIntervalIndex([
+        (ranges.make_range('chr1', 5, 10), 'b'),
+        (ranges.make_range('chr1', 10, 20), 'c'),
+        (ranges.make_range('chr2', 3, 4), 'd'),
+        (ranges.make_range('chr1', 0, 50), 'long'),
+        (ranges.make_range('chr1', 4, 8), 'a'),
+    ])
+    self.assertEqual([value for _, _, value in index.query(
+        ranges.make_range(*query))], expected)
+
+  def test_sorted_interval_index_returns_intervals(self):
+    variant = variants_pb2.Variant(reference_name='chr1', start=10, end=12)
+    index = ranges.SortedIntervalIndex([(variant, 0)])
+    self.assertEqual(
+        index.query(ranges.make_range('chr1', 11, 20)), [(10, 12, 0)])
+
   @parameterized.parameters(
       (ranges.make_range('1', 10, 50), '1', 9, False),
       (ranges.make_range('1', 10, 50), '1', 10, True),